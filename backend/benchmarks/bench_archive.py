@@ -0,0 +1,76 @@
+"""
+Measures the cost of the archive tier for one synthetic session.
+
+Creates a session with the given number of messages, then reports the hot
+table bytes the messages use, the compressed bytes stored in the archive, the
+time to fetch the hot history, and the time to rehydrate it from the archive.
+
+Usage:
+    python -m benchmarks.bench_archive [--messages 200] [--runs 5]
+"""
+
+import argparse
+import statistics
+import time
+import uuid
+
+from langchain_core.messages import AIMessage, HumanMessage
+
+from lib.archive import archive_session, rehydrate_session
+from lib.database import (
+    create_session_if_not_exists,
+    get_chat_history,
+    get_db_connection,
+)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--messages", type=int, default=200)
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+
+    conn = get_db_connection()
+    session_id = str(uuid.uuid4())
+    create_session_if_not_exists(conn, session_id, "Benchmark", "Archive benchmark")
+    history = get_chat_history(conn, session_id)
+    history.add_messages(
+        [
+            HumanMessage(
+                content=f"Question {i} about archiving sessions?", name="Benchmark"
+            )
+            if i % 2 == 0
+            else AIMessage(
+                content=f"Answer {i}: " + "cold sessions compress well. " * 20
+            )
+            for i in range(args.messages)
+        ]
+    )
+
+    fetch, rehydrate = [], []
+    for _ in range(args.runs):
+        start = time.perf_counter()
+        history.messages
+        fetch.append((time.perf_counter() - start) * 1000)
+
+        _, hot_bytes, archived_bytes = archive_session(conn, session_id)
+        start = time.perf_counter()
+        rehydrate_session(conn, session_id)
+        history.messages
+        rehydrate.append((time.perf_counter() - start) * 1000)
+
+    print(f"messages:       {args.messages}")
+    print(f"hot bytes:      {hot_bytes}")
+    print(f"archived bytes: {archived_bytes} ({archived_bytes / hot_bytes:.1%})")
+    print(f"hot fetch:      {statistics.median(fetch):.2f} ms")
+    print(f"rehydrate:      {statistics.median(rehydrate):.2f} ms")
+
+    history.clear()
+    with conn.cursor() as cur:
+        cur.execute("DELETE FROM db_sessions WHERE id = %s", (session_id,))
+    conn.commit()
+    conn.close()
+
+
+if __name__ == "__main__":
+    main()
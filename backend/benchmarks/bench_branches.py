@@ -0,0 +1,141 @@
+"""
+Measures the cost of branching conversations.
+
+Creates a session with the given number of messages, then reports:
+
+- the time to fork it, against copying its messages to a new session;
+- the time of the bootstrap query, which loads the prompt history, for the
+  linear session, the same session after an edit near its end, and the
+  fork, against the bootstrap query from before branches.
+
+Usage:
+    python -m benchmarks.bench_branches [--messages 200] [--runs 50]
+"""
+
+import argparse
+import statistics
+import time
+import uuid
+
+from langchain_core.messages import AIMessage, HumanMessage
+
+from lib.database import get_db_connection, table_name
+from lib.storage import MESSAGE_COLUMNS
+from lib.store import BOOTSTRAP_QUERY, PostgresStore
+
+
+# The bootstrap query before branches, which reads the session's messages in ID order
+LINEAR_BOOTSTRAP_QUERY = f"""
+    SELECT s.id, s.username, s.title,
+        EXISTS (SELECT FROM db_session_archive a WHERE a.session_id = s.id),
+        sm.summary, h.id, h.role, h.name, h.content, h.content_zstd, h.message_id, h.extra
+    FROM db_sessions s
+    LEFT JOIN db_session_summaries sm ON sm.session_id = s.id
+    LEFT JOIN {table_name} h
+        ON h.session_id = s.id AND h.id > coalesce(sm.summarized_until, 0)
+    WHERE s.id = %s
+    ORDER BY h.id
+"""
+
+
+def median_ms(function, runs: int) -> float:
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--messages", type=int, default=200)
+    parser.add_argument("--runs", type=int, default=50)
+    args = parser.parse_args()
+
+    conn = get_db_connection()
+    conn.autocommit = True
+    store = PostgresStore(lambda: conn)
+    linear_id, branched_id = str(uuid.uuid4()), str(uuid.uuid4())
+    messages = [
+        HumanMessage(
+            content=f"Question {i} about branches?", id=f"q{i}", name="Benchmark"
+        )
+        if i % 2 == 0
+        else AIMessage(
+            content=f"Answer {i}: " + "branches share their history. " * 20, id=f"a{i}"
+        )
+        for i in range(args.messages)
+    ]
+    for session_id in (linear_id, branched_id):
+        store.create_session(session_id, "Benchmark", "Branch benchmark")
+        store.add_messages(session_id, messages)
+    last_question = messages[-2].id
+    _, parent_id, _ = store.find_branch_message(branched_id, last_question)
+    store.add_messages(
+        branched_id,
+        [
+            HumanMessage(content="Edited question", id="edit"),
+            AIMessage(content="New answer", id="edit-answer"),
+        ],
+        parent_id,
+    )
+    created = [linear_id, branched_id]
+
+    def fork():
+        fork_id = str(uuid.uuid4())
+        store.fork_session(linear_id, messages[-1].id, fork_id)
+        created.append(fork_id)
+
+    def copy():
+        copy_id = str(uuid.uuid4())
+        with conn.transaction(), conn.cursor() as cur:
+            cur.execute(
+                "INSERT INTO db_sessions (id, username, title) VALUES (%s, %s, %s)",
+                (copy_id, "Benchmark", "Branch benchmark"),
+            )
+            cur.execute(
+                f"""
+                INSERT INTO {table_name} (session_id, {MESSAGE_COLUMNS})
+                SELECT %s, {MESSAGE_COLUMNS} FROM {table_name} WHERE session_id = %s ORDER BY id
+                """,
+                (copy_id, linear_id),
+            )
+        created.append(copy_id)
+
+    def bootstrap(query: str, params):
+        with conn.cursor() as cur:
+            cur.execute(query, params, prepare=True)
+            cur.fetchall()
+
+    fork_ms = median_ms(fork, args.runs)
+    copy_ms = median_ms(copy, args.runs)
+    fork_id = created[2]
+    results = {
+        "before branches": median_ms(
+            lambda: bootstrap(LINEAR_BOOTSTRAP_QUERY, (linear_id,)), args.runs
+        ),
+    }
+    for name, session_id in [
+        ("linear session", linear_id),
+        ("branched session", branched_id),
+        ("fork", fork_id),
+    ]:
+        params = {"session_id": session_id, "until": None}
+        results[name] = median_ms(lambda: bootstrap(BOOTSTRAP_QUERY, params), args.runs)
+
+    print(f"messages: {args.messages}")
+    print(f"fork:     {fork_ms:.2f} ms, 0 messages written")
+    print(f"copy:     {copy_ms:.2f} ms, {args.messages} messages written")
+    print("bootstrap query:")
+    for name, ms in results.items():
+        print(f"  {name:<20} {ms:.2f} ms")
+
+    with conn.cursor() as cur:
+        cur.execute(f"DELETE FROM {table_name} WHERE session_id = ANY(%s)", (created,))
+        cur.execute("DELETE FROM db_sessions WHERE id = ANY(%s)", (created,))
+    conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,149 @@
+"""
+Measures the CPU time and bytes saved by response compression.
+
+For a `/sessions` page, a long `/session` and a streamed answer, reports the
+compressed size and the CPU time per response for gzip and brotli at
+several levels. Streamed answers are compressed token by token, with the
+flush policies of `lib.compression`: a flush after every token, or once a
+number of bytes is pending. No server is needed.
+
+Usage:
+    python -m benchmarks.bench_compression [--runs 50] [--messages 100]
+"""
+
+import argparse
+import json
+import random
+import re
+import statistics
+import time
+import uuid
+
+from lib.compression import BrotliEncoder, GzipEncoder
+
+ENCODERS = {
+    "gzip-1": lambda: GzipEncoder(1),
+    "gzip-6": lambda: GzipEncoder(6),
+    "gzip-9": lambda: GzipEncoder(9),
+    "br-1": lambda: BrotliEncoder(1),
+    "br-4": lambda: BrotliEncoder(4),
+    "br-5": lambda: BrotliEncoder(5),
+    "br-11": lambda: BrotliEncoder(11),
+}
+WORDS = (
+    "the a to of and in is you can use function value list python return data with "
+    "for this that key sorted dictionary example code error file test request model"
+).split()
+
+
+def answer(words: int) -> str:
+    lines = []
+    for _ in range(words // 12):
+        line = " ".join(random.choice(WORDS) for _ in range(12))
+        lines.append(f"- {line}." if random.random() < 0.3 else f"{line.capitalize()}.")
+    return "\n".join(lines)
+
+
+def sessions_page(count: int) -> bytes:
+    sessions = [
+        {
+            "session_id": str(uuid.uuid4()),
+            "title": f"💻 {' '.join(random.choice(WORDS) for _ in range(5)).title()}",
+            "created_at": "2025-06-01T12:00:00",
+            "updated_at": "2025-06-01T12:30:00",
+        }
+        for _ in range(count)
+    ]
+    return json.dumps({"sessions": sessions}).encode()
+
+
+def session(messages: int) -> bytes:
+    return json.dumps(
+        {
+            "messages": [
+                {
+                    "role": "user" if i % 2 == 0 else "assistant",
+                    "content": answer(30 if i % 2 == 0 else 250),
+                    "message_id": str(uuid.uuid4()),
+                }
+                for i in range(messages)
+            ]
+        }
+    ).encode()
+
+
+def compress(make_encoder, body: bytes) -> bytes:
+    encoder = make_encoder()
+    return encoder.compress(body) + encoder.finish()
+
+
+def compress_stream(make_encoder, tokens: list[bytes], flush_bytes: int) -> bytes:
+    encoder = make_encoder()
+    out, pending = [], 0
+    for token in tokens:
+        out.append(encoder.compress(token))
+        pending += len(token)
+        if pending >= flush_bytes:
+            out.append(encoder.flush())
+            pending = 0
+    out.append(encoder.finish())
+    return b"".join(out)
+
+
+def cpu_ms(function, runs: int) -> float:
+    timings = []
+    for _ in range(runs):
+        start = time.process_time()
+        function()
+        timings.append(time.process_time() - start)
+    return statistics.median(timings) * 1000
+
+
+def report(name: str, size: int, results: dict[str, tuple[int, float]]):
+    print(f"\n{name}: {size} bytes")
+    print(f"{'encoding':<22}{'bytes':>10}{'ratio':>8}{'cpu ms':>10}")
+    for encoding, (compressed, ms) in results.items():
+        print(f"{encoding:<22}{compressed:>10}{compressed / size:>8.2f}{ms:>10.3f}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=50)
+    parser.add_argument(
+        "--messages", type=int, default=100, help="messages in the /session payload"
+    )
+    args = parser.parse_args()
+    random.seed(0)
+
+    payloads = {
+        "/sessions (50 sessions)": sessions_page(50),
+        f"/session ({args.messages} messages)": session(args.messages),
+    }
+    for name, body in payloads.items():
+        results = {
+            encoding: (
+                len(compress(make_encoder, body)),
+                cpu_ms(lambda: compress(make_encoder, body), args.runs),
+            )
+            for encoding, make_encoder in ENCODERS.items()
+        }
+        report(name, len(body), results)
+
+    tokens = [token.encode() for token in re.findall(r"\S+\s*", answer(600))]
+    size = sum(len(token) for token in tokens)
+    results = {}
+    for encoding in ("gzip-6", "br-5"):
+        for flush_bytes in (0, 32, 64, 128):
+            policy = "every token" if flush_bytes == 0 else f"{flush_bytes} bytes"
+            results[f"{encoding}, {policy}"] = (
+                len(compress_stream(ENCODERS[encoding], tokens, flush_bytes)),
+                cpu_ms(
+                    lambda: compress_stream(ENCODERS[encoding], tokens, flush_bytes),
+                    args.runs,
+                ),
+            )
+    report(f"/stream ({len(tokens)} tokens)", size, results)
+
+
+if __name__ == "__main__":
+    main()
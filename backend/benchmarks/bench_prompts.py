@@ -0,0 +1,103 @@
+"""
+Measures the per-turn cost of building the chat prompt on long histories.
+
+Compares the previous ways of building a turn's prompt with the compiled
+chat prompt:
+
+- "template": a `ChatPromptTemplate` over the whole history, formatted and
+  converted to text, as `/chat` did.
+- "messages": a new `SystemMessage` wrapping the system prompt followed by
+  the history, converted to text by the LLM client, as `/stream` did.
+- "compiled": `chat_prompt.render`, the system prompt rendered once per
+  process followed by the history as literal messages.
+
+All three produce the same prompt text. No model is called.
+
+Usage:
+    python -m benchmarks.bench_prompts [--runs 200] [--histories 10,100,500]
+"""
+
+import argparse
+import statistics
+import time
+
+from langchain_core.messages import AIMessage, HumanMessage, SystemMessage
+from langchain_core.prompt_values import ChatPromptValue
+from langchain_core.prompts import ChatPromptTemplate
+
+from lib.prompts import chat_prompt, chat_sys_msg
+
+
+def history(turns: int) -> list:
+    messages = []
+    for i in range(turns):
+        messages.append(
+            HumanMessage(
+                content=f"Question {i}: how do I sort a dict by value? " * 4,
+                name="User",
+            )
+        )
+        messages.append(
+            AIMessage(
+                content="Use sorted(d.items(), key=lambda kv: kv[1]). " * 12,
+                name="Assistant",
+            )
+        )
+    return messages
+
+
+def template_prompt(messages: list) -> str:
+    prompt = ChatPromptTemplate.from_messages([chat_sys_msg] + messages)
+    return prompt.invoke({"content": messages[-1].content}).to_string()
+
+
+def messages_prompt(messages: list) -> str:
+    return ChatPromptValue(
+        messages=[SystemMessage(content=chat_sys_msg.content)] + messages
+    ).to_string()
+
+
+def compiled_prompt(messages: list) -> str:
+    return chat_prompt.render(messages)
+
+
+def bench(build, messages: list, runs: int) -> float:
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        build(messages)
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=200)
+    parser.add_argument(
+        "--histories", default="10,100,500", help="history lengths, in turns"
+    )
+    args = parser.parse_args()
+
+    builders = {
+        "template": template_prompt,
+        "messages": messages_prompt,
+        "compiled": compiled_prompt,
+    }
+    print(f"{'turns':<8}" + "".join(f"{name + ' ms':>14}" for name in builders))
+    for turns in (int(value) for value in args.histories.split(",")):
+        messages = history(turns) + [
+            HumanMessage(content="And in {reverse} order?", name="User")
+        ]
+        expected = compiled_prompt(messages)
+        assert all(build(messages) == expected for build in builders.values())
+        print(
+            f"{turns:<8}"
+            + "".join(
+                f"{bench(build, messages, args.runs):>14.3f}"
+                for build in builders.values()
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+"""
+Counts the Postgres round trips and time spent on storage per chat turn.
+
+Compares the previous sequence of a turn (session lookup, create, prompt
+history and message insert on a transactional connection, each followed by
+a commit) with the current one (one bootstrap query, an upsert for new
+sessions and a multi-row insert, prepared, on an autocommit connection),
+for a first turn in a new session and a turn in an existing one.
+
+Usage:
+    python -m benchmarks.bench_roundtrips [--runs 200] [--history 20]
+"""
+
+import argparse
+import statistics
+import time
+import uuid
+
+from langchain_core.messages import AIMessage, HumanMessage
+
+from lib.database import (
+    RoundTripCounter,
+    create_session_if_not_exists,
+    get_chat_history,
+    get_db_connection,
+    get_session_by_id,
+    table_name,
+)
+from lib.store import PostgresStore
+from lib.summary import get_prompt_history
+from lib.utils import generate_message_id
+
+
+def turn(username: str) -> list:
+    return [
+        HumanMessage(
+            content="How do I sort a list in Python?",
+            id=generate_message_id(),
+            name=username,
+        ),
+        AIMessage(
+            content="Use sorted() or list.sort(). " * 10,
+            id=generate_message_id(),
+            name="Assistant",
+        ),
+    ]
+
+
+def previous_turn(conn, session_id: str, username: str):
+    session = get_session_by_id(conn, session_id)
+    if session is None:
+        create_session_if_not_exists(conn, session_id, username, "New Chat")
+    get_prompt_history(conn, table_name, session_id)
+    get_chat_history(conn, session_id).add_messages(turn(username))
+    conn.commit()
+
+
+def current_turn(store: PostgresStore, session_id: str, username: str):
+    session, _, _ = store.bootstrap_session(session_id)
+    if session is None:
+        store.create_session(session_id, username, "New Chat")
+    store.add_messages(session_id, turn(username))
+
+
+def bench(conn, run_turn, runs: int, history: int) -> dict:
+    username = f"Bench {uuid.uuid4().hex[:8]}"
+    existing = str(uuid.uuid4())
+    for _ in range(history // 2):
+        run_turn(existing, username)
+
+    results = {}
+    for case, new_session in (("new session", True), ("existing session", False)):
+        times, round_trips = [], []
+        for _ in range(runs):
+            session_id = str(uuid.uuid4()) if new_session else existing
+            with RoundTripCounter(conn) as counter:
+                start = time.perf_counter()
+                run_turn(session_id, username)
+                times.append((time.perf_counter() - start) * 1000)
+            round_trips.append(counter.count)
+        results[case] = (statistics.median(round_trips), statistics.median(times))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=200)
+    parser.add_argument("--history", type=int, default=20)
+    args = parser.parse_args()
+
+    conn = get_db_connection()
+    previous = bench(
+        conn, lambda s, u: previous_turn(conn, s, u), args.runs, args.history
+    )
+    conn.close()
+
+    conn = get_db_connection()
+    conn.autocommit = True
+    store = PostgresStore(lambda: conn)
+    current = bench(
+        conn, lambda s, u: current_turn(store, s, u), args.runs, args.history
+    )
+    conn.close()
+
+    print(
+        f"{'per turn':<18}{'previous RTs':>14}{'current RTs':>14}{'previous ms':>14}{'current ms':>14}"
+    )
+    for case in previous:
+        print(
+            f"{case:<18}{previous[case][0]:>14}{current[case][0]:>14}"
+            f"{previous[case][1]:>14.2f}{current[case][1]:>14.2f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+"""
+Benchmarks full-text search latency over a large chat history.
+
+Seeds `--messages` synthetic messages spread over `--users` users (skipped if
+they already exist), then times `search_messages_text` for one user.
+
+Usage:
+    python -m benchmarks.bench_search --messages 1000000 --users 1000
+"""
+
+import argparse
+import random
+import statistics
+import time
+import uuid
+
+from lib.database import get_db_connection, table_name
+from lib.search import search_messages_text
+
+WORDS = (
+    "python database index query latency model prompt docker react "
+    "session history token cache stream vector search backend frontend"
+).split()
+
+
+def seed(conn, messages: int, users: int, per_session: int = 20):
+    with conn.cursor() as cur:
+        cur.execute("SELECT COUNT(*) FROM db_sessions WHERE username LIKE 'bench-%%'")
+        if cur.fetchone()[0]:
+            return
+        sessions = [
+            (str(uuid.uuid4()), f"bench-{i % users}")
+            for i in range(messages // per_session)
+        ]
+        with cur.copy("COPY db_sessions (id, username, title) FROM STDIN") as copy:
+            for session_id, username in sessions:
+                copy.write_row((session_id, username, "Benchmark"))
+        with cur.copy(
+            f"COPY {table_name} (session_id, role, content) FROM STDIN"
+        ) as copy:
+            for session_id, _ in sessions:
+                for _ in range(per_session):
+                    content = " ".join(random.choices(WORDS, k=30))
+                    copy.write_row((session_id, "human", content))
+        cur.execute(f"ANALYZE {table_name}")
+        conn.commit()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--messages", type=int, default=100_000)
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--runs", type=int, default=50)
+    args = parser.parse_args()
+
+    conn = get_db_connection()
+    seed(conn, args.messages, args.users)
+
+    timings = []
+    for _ in range(args.runs):
+        query = " ".join(random.sample(WORDS, 2))
+        start = time.perf_counter()
+        search_messages_text(conn, table_name, "bench-7", query, 20)
+        timings.append((time.perf_counter() - start) * 1000)
+        conn.commit()
+
+    timings.sort()
+    print(f"runs: {args.runs}")
+    print(f"p50: {statistics.median(timings):.2f} ms")
+    print(f"p95: {timings[int(len(timings) * 0.95) - 1]:.2f} ms")
+    conn.close()
+
+
+if __name__ == "__main__":
+    main()
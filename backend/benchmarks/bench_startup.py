@@ -0,0 +1,84 @@
+"""
+Profiles backend cold start.
+
+Measures, in fresh interpreters, the time to import `main` and the time for
+the app's lifespan startup (database connection and migrations), then lists
+the slowest imports from `python -X importtime`.
+
+Usage:
+    python -m benchmarks.bench_startup [--runs 5] [--top 15]
+"""
+
+import argparse
+import statistics
+import subprocess
+import sys
+
+IMPORT_SNIPPET = """
+import time
+start = time.perf_counter()
+import main
+print((time.perf_counter() - start) * 1000)
+"""
+
+STARTUP_SNIPPET = """
+import time
+from fastapi.testclient import TestClient
+import main
+start = time.perf_counter()
+with TestClient(main.app):
+    print((time.perf_counter() - start) * 1000)
+"""
+
+
+def run_timed(snippet: str, runs: int) -> list[float]:
+    timings = []
+    for _ in range(runs):
+        output = subprocess.run(
+            [sys.executable, "-c", snippet], capture_output=True, text=True, check=True
+        ).stdout
+        timings.append(float(output.strip().splitlines()[-1]))
+    return timings
+
+
+def slowest_imports(top: int) -> list[tuple[int, str]]:
+    stderr = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import main"],
+        capture_output=True,
+        text=True,
+        check=True,
+    ).stderr
+    imports = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line.split("|")
+        # Only report the direct imports of main, nested imports are included in them
+        depth = len(name) - len(name.lstrip())
+        if depth == 5:
+            imports.append((int(cumulative), name.strip()))
+    return sorted(imports, reverse=True)[:top]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=15)
+    args = parser.parse_args()
+
+    for label, snippet in (
+        ("import main", IMPORT_SNIPPET),
+        ("lifespan startup", STARTUP_SNIPPET),
+    ):
+        timings = run_timed(snippet, args.runs)
+        print(
+            f"{label:>16}: median {statistics.median(timings):7.1f} ms, max {max(timings):7.1f} ms"
+        )
+
+    print("\nslowest direct imports of main (cumulative):")
+    for microseconds, name in slowest_imports(args.top):
+        print(f"{microseconds / 1000:8.1f} ms  {name}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+"""
+Compares the storage backends on the operations of a chat request.
+
+For each backend, creates sessions for one user, then times creating a
+session, appending a turn, loading the prompt history, listing a page of
+sessions and a text search. Postgres is skipped if it is not reachable.
+
+Usage:
+    python -m benchmarks.bench_store [--sessions 200] [--messages 20] [--runs 50] [--sqlite-path bench.db]
+"""
+
+import argparse
+import os
+import statistics
+import tempfile
+import time
+import uuid
+
+import psycopg
+from langchain_core.messages import AIMessage, HumanMessage
+
+from lib.database import get_db_connection
+from lib.store import ChatStore, PostgresStore, SqliteStore
+from lib.utils import generate_message_id
+
+TOPICS = ["python", "databases", "travel", "cooking", "music", "physics", "gardening"]
+
+
+def turn(i: int) -> list:
+    topic = TOPICS[i % len(TOPICS)]
+    return [
+        HumanMessage(
+            content=f"Tell me something about {topic} ({i})",
+            id=generate_message_id(),
+            name="Bench",
+        ),
+        AIMessage(
+            content=f"Here is a fact about {topic}. " * 10,
+            id=generate_message_id(),
+            name="Assistant",
+        ),
+    ]
+
+
+def timed(fn, runs: int) -> float:
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        fn()
+        times.append((time.perf_counter() - start) * 1000)
+    return statistics.median(times)
+
+
+def bench(store: ChatStore, sessions: int, messages: int, runs: int) -> dict:
+    username = f"Bench {uuid.uuid4().hex[:8]}"
+    session_ids = []
+    for i in range(sessions):
+        session_id = str(uuid.uuid4())
+        store.create_session(session_id, username, f"Session {i}")
+        for j in range(messages // 2):
+            store.add_messages(session_id, turn(i + j))
+        session_ids.append(session_id)
+    session_id = session_ids[0]
+
+    return {
+        "create session": timed(
+            lambda: store.create_session(str(uuid.uuid4()), username, "New"), runs
+        ),
+        "append turn": timed(lambda: store.add_messages(session_id, turn(0)), runs),
+        "prompt history": timed(lambda: store.get_prompt_history(session_id), runs),
+        "sessions page": timed(lambda: store.get_sessions_page(username, 50), runs),
+        "text search": timed(
+            lambda: store.search_messages(username, "physics", 20), runs
+        ),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sessions", type=int, default=200)
+    parser.add_argument("--messages", type=int, default=20)
+    parser.add_argument("--runs", type=int, default=50)
+    parser.add_argument("--sqlite-path", help="defaults to a temporary file")
+    args = parser.parse_args()
+
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        store = SqliteStore(args.sqlite_path or os.path.join(tmp, "bench.db"))
+        results["sqlite"] = bench(store, args.sessions, args.messages, args.runs)
+        store.close()
+    try:
+        conn = get_db_connection()
+        results["postgres"] = bench(
+            PostgresStore(lambda: conn), args.sessions, args.messages, args.runs
+        )
+        conn.close()
+    except psycopg.OperationalError as e:
+        print(f"Skipping Postgres: {str(e)}")
+
+    backends = list(results)
+    print(f"{'median ms':<16}" + "".join(f"{backend:>12}" for backend in backends))
+    for operation in results[backends[0]]:
+        print(
+            f"{operation:<16}"
+            + "".join(f"{results[b][operation]:>12.2f}" for b in backends)
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+"""
+Measures the prefill savings of rolling summaries for one session.
+
+Builds the prompt for the session twice, once from the full history and once
+from the summary plus recent messages, and asks Ollama to evaluate each with a
+single generated token. Reports prompt tokens and prompt evaluation time.
+
+Usage:
+    python -m benchmarks.bench_summary <session_id> [--model gemma3:1b] [--summarize]
+"""
+
+import argparse
+import os
+
+import requests
+from langchain_core.messages import SystemMessage
+
+from lib.database import get_chat_history, get_db_connection, table_name
+from lib.prompts import chat_sys_msg
+from lib.summary import get_prompt_history, summarize_session
+
+
+def measure_prefill(messages, model: str) -> tuple[int, float]:
+    response = requests.post(
+        f"{os.getenv('OLLAMA_BASE_URL', 'http://localhost:11434')}/api/chat",
+        json={
+            "model": model,
+            "messages": [
+                {
+                    "role": {"human": "user", "ai": "assistant"}.get(m.type, m.type),
+                    "content": m.content,
+                }
+                for m in messages
+            ],
+            "stream": False,
+            "options": {"num_predict": 1},
+        },
+    )
+    response.raise_for_status()
+    data = response.json()
+    return data.get("prompt_eval_count", 0), data.get("prompt_eval_duration", 0) / 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("session_id")
+    parser.add_argument("--model", default="gemma3:1b")
+    parser.add_argument(
+        "--summarize", action="store_true", help="refresh the summary first"
+    )
+    args = parser.parse_args()
+
+    conn = get_db_connection()
+    if args.summarize:
+        summarize_session(conn, table_name, args.session_id)
+
+    system = [SystemMessage(content=chat_sys_msg.content)]
+    full = get_chat_history(conn, args.session_id).get_messages()
+    summarized, _ = get_prompt_history(conn, table_name, args.session_id)
+
+    for label, history in (("full history", full), ("summary + recent", summarized)):
+        chars = sum(len(m.content) for m in history)
+        # Run twice and keep the second run so model loading is not measured
+        measure_prefill(system + history, args.model)
+        tokens, ms = measure_prefill(system + history, args.model)
+        print(
+            f"{label:>18}: {len(history):4d} messages, {chars:7d} chars, {tokens:6d} prompt tokens, {ms:8.1f} ms prefill"
+        )
+
+    conn.close()
+
+
+if __name__ == "__main__":
+    main()
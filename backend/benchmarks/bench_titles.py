@@ -0,0 +1,93 @@
+"""
+Compares the session title strategies on latency and agreement with LLM titles.
+
+For each prompt, generates the LLM title (the reference), the heuristic title,
+and the answer-derived title from the main model's answer. Reports the time
+each strategy adds before the first token of the answer, and the word overlap
+of the cheap titles with the LLM title. The answer itself is not counted for
+the "answer" strategy, since the request generates it anyway.
+
+Usage:
+    python -m benchmarks.bench_titles [--model gemma3:1b] [--prompts prompts.txt]
+"""
+
+import argparse
+import re
+import statistics
+import time
+
+from lib.ollama import get_llm, get_session_title
+from lib.titles import heuristic_title, title_from_answer
+
+PROMPTS = [
+    "Can you help me write a Python script to rename files in a folder?",
+    "I'm getting a segmentation fault in my C program when freeing a list",
+    "What are some ideas for a birthday party for a 10 year old?",
+    "Explain how photosynthesis works",
+    "Should I learn Rust or Go for backend development?",
+    "Write a short poem about autumn leaves",
+    "Analyze this sales data and tell me which month was best",
+    "Plan a three day trip to Kyoto",
+    "hi",
+    "What's the difference between TCP and UDP?",
+]
+
+
+def words(title: str) -> set[str]:
+    return {word.lower() for word in re.findall(r"\w+", title)}
+
+
+def overlap(title: str, reference: str) -> float:
+    a, b = words(title), words(reference)
+    return len(a & b) / len(a | b) if a | b else 1.0
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--model", default="gemma3:1b", help="the chat model answering")
+    parser.add_argument("--prompts", help="file with one prompt per line")
+    args = parser.parse_args()
+
+    prompts = PROMPTS
+    if args.prompts:
+        with open(args.prompts, encoding="utf-8") as f:
+            prompts = [line.strip() for line in f if line.strip()]
+
+    # Load the models so the first prompt does not measure loading
+    get_session_title("warm up")
+    get_llm(args.model).invoke("warm up")
+
+    timings = {"llm": [], "heuristic": [], "answer": []}
+    scores = {"heuristic": [], "answer": []}
+    for prompt in prompts:
+        start = time.perf_counter()
+        llm_title = get_session_title(prompt)
+        timings["llm"].append((time.perf_counter() - start) * 1000)
+
+        start = time.perf_counter()
+        fast_title = heuristic_title(prompt)
+        timings["heuristic"].append((time.perf_counter() - start) * 1000)
+
+        answer = get_llm(args.model).invoke(prompt)
+        start = time.perf_counter()
+        answer_title = title_from_answer(prompt, answer)
+        timings["answer"].append((time.perf_counter() - start) * 1000)
+
+        scores["heuristic"].append(overlap(fast_title, llm_title))
+        scores["answer"].append(overlap(answer_title, llm_title))
+        print(
+            f"{prompt[:40]!r:44} llm={llm_title!r} heuristic={fast_title!r} answer={answer_title!r}"
+        )
+
+    print()
+    for mode, values in timings.items():
+        line = f"{mode:>10}: {statistics.mean(values):9.2f} ms mean, {max(values):9.2f} ms max added latency"
+        if mode in scores:
+            line += (
+                f", {statistics.mean(scores[mode]):.2f} word overlap with llm titles"
+            )
+        print(line)
+
+
+if __name__ == "__main__":
+    main()
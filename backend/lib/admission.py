@@ -0,0 +1,223 @@
+"""
+This module contains the admission controller for chat requests.
+
+It watches three load signals: generations in flight (including batch items),
+Ollama latency (time to first token, also for `/chat`, which streams
+internally) and database latency (the session lookup and history fetch). Each
+is divided by its configured limit, and the highest ratio is the pressure. As the pressure
+crosses each threshold in `ADMISSION_THRESHOLDS`, requests degrade one more
+step:
+
+1. shrink context: send fewer history messages and no cross-session memory
+2. route to the fallback model (`ADMISSION_FALLBACK_MODEL`)
+3. skip title generation: heuristic titles, no refinement
+4. shed: reject with 503 and Retry-After
+
+The current level, signals and degraded requests are exported as metrics and
+reported by `/admission`.
+"""
+
+import math
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from langchain_core.messages import BaseMessage, SystemMessage
+
+from lib import metrics
+
+ADMISSION_ENABLED = os.getenv("ADMISSION_ENABLED", "true").lower() == "true"
+ADMISSION_MAX_IN_FLIGHT = int(os.getenv("ADMISSION_MAX_IN_FLIGHT", 8))
+ADMISSION_OLLAMA_LATENCY = float(os.getenv("ADMISSION_OLLAMA_LATENCY", 15))
+ADMISSION_DB_LATENCY = float(os.getenv("ADMISSION_DB_LATENCY", 1))
+# Pressure at which each step starts, see the module docstring
+ADMISSION_THRESHOLDS = [
+    float(value)
+    for value in os.getenv("ADMISSION_THRESHOLDS", "0.6,0.75,0.9,1.0").split(",")
+]
+ADMISSION_CONTEXT_MESSAGES = int(os.getenv("ADMISSION_CONTEXT_MESSAGES", 4))
+ADMISSION_FALLBACK_MODEL = os.getenv("ADMISSION_FALLBACK_MODEL", "qwen3:0.6b")
+ADMISSION_RETRY_AFTER = int(os.getenv("ADMISSION_RETRY_AFTER", 10))
+# Latency observations fade over this many seconds, so an idle server recovers
+ADMISSION_LATENCY_DECAY = float(os.getenv("ADMISSION_LATENCY_DECAY", 60))
+ADMISSION_LATENCY_ALPHA = 0.3
+
+SHRINK_CONTEXT, FALLBACK_MODEL, SKIP_TITLES, SHED = 1, 2, 3, 4
+STEP_NAMES = {
+    SHRINK_CONTEXT: "shrink_context",
+    FALLBACK_MODEL: "fallback_model",
+    SKIP_TITLES: "skip_titles",
+    SHED: "shed",
+}
+
+metrics.describe("admission_level", "gauge", "Current degradation level (0 is normal)")
+metrics.describe(
+    "admission_pressure", "gauge", "Highest ratio of a load signal to its limit"
+)
+metrics.describe("admission_in_flight", "gauge", "Generations in flight")
+metrics.describe("admission_ollama_latency_seconds", "gauge", "Smoothed Ollama latency")
+metrics.describe("admission_db_latency_seconds", "gauge", "Smoothed database latency")
+metrics.describe(
+    "admission_requests_total", "counter", "Requests by degradation step applied"
+)
+
+
+def shrink_history(messages: list[BaseMessage], keep: int) -> list[BaseMessage]:
+    """
+    Keeps the leading system messages (the session summary) and the last
+    `keep` messages of a prompt history.
+    """
+    leading = 0
+    while leading < len(messages) and isinstance(messages[leading], SystemMessage):
+        leading += 1
+    return (
+        messages[:leading] + messages[leading:][-keep:] if keep else messages[:leading]
+    )
+
+
+class Admission:
+    """
+    The degradation applied to one request.
+    """
+
+    def __init__(self, level: int, pressure: float):
+        self.level = level
+        self.pressure = pressure
+
+    @property
+    def shrink_context(self) -> bool:
+        return self.level >= SHRINK_CONTEXT
+
+    @property
+    def use_fallback_model(self) -> bool:
+        return self.level >= FALLBACK_MODEL
+
+    @property
+    def skip_titles(self) -> bool:
+        return self.level >= SKIP_TITLES
+
+    @property
+    def shed(self) -> bool:
+        return self.level >= SHED
+
+    def route_model(self, model: str, available: list[str]) -> str:
+        """
+        Returns the fallback model if this request is routed to it and it is
+        available, otherwise the requested model.
+        """
+        if self.use_fallback_model and ADMISSION_FALLBACK_MODEL in available:
+            return ADMISSION_FALLBACK_MODEL
+        return model
+
+
+class _Latency:
+    """
+    Exponentially smoothed latency that fades while nothing is observed.
+    """
+
+    def __init__(self):
+        self.value = 0.0
+        self.updated = time.monotonic()
+
+    def observe(self, seconds: float):
+        self.value = (
+            self.current() * (1 - ADMISSION_LATENCY_ALPHA)
+            + seconds * ADMISSION_LATENCY_ALPHA
+        )
+        self.updated = time.monotonic()
+
+    def current(self) -> float:
+        idle = time.monotonic() - self.updated
+        return self.value * math.exp(-idle / ADMISSION_LATENCY_DECAY)
+
+
+class AdmissionController:
+    """
+    Computes the degradation level from the load signals.
+
+    Requests call `admit` before doing any work, wrap their generation in
+    `in_flight`, and report latencies with `observe_ollama` and `observe_db`.
+    All of these are in-memory updates.
+    """
+
+    def __init__(self, enabled: bool = ADMISSION_ENABLED):
+        self.enabled = enabled
+        self.in_flight_count = 0
+        self.ollama_latency = _Latency()
+        self.db_latency = _Latency()
+        self._lock = threading.Lock()
+
+    def pressure(self) -> float:
+        with self._lock:
+            signals = (
+                self.in_flight_count / ADMISSION_MAX_IN_FLIGHT,
+                self.ollama_latency.current() / ADMISSION_OLLAMA_LATENCY,
+                self.db_latency.current() / ADMISSION_DB_LATENCY,
+            )
+        return max(signals)
+
+    def admit(self) -> Admission:
+        """
+        Decides how the next request is degraded.
+
+        Returns:
+            Admission: The degradation level and the steps it implies.
+        """
+        pressure = self.pressure() if self.enabled else 0.0
+        level = sum(pressure >= threshold for threshold in ADMISSION_THRESHOLDS)
+        metrics.set_gauge("admission_level", level)
+        metrics.set_gauge("admission_pressure", round(pressure, 3))
+        metrics.inc("admission_requests_total", {"step": STEP_NAMES.get(level, "none")})
+        if level:
+            print(
+                f"Admission: pressure {pressure:.2f}, degrading to {STEP_NAMES[level]}"
+            )
+        return Admission(level, pressure)
+
+    @contextmanager
+    def in_flight(self):
+        """
+        Counts a generation as in flight for the duration of the block.
+        """
+        with self._lock:
+            self.in_flight_count += 1
+            metrics.set_gauge("admission_in_flight", self.in_flight_count)
+        try:
+            yield
+        finally:
+            with self._lock:
+                self.in_flight_count -= 1
+                metrics.set_gauge("admission_in_flight", self.in_flight_count)
+
+    def observe_ollama(self, seconds: float):
+        with self._lock:
+            self.ollama_latency.observe(seconds)
+            metrics.set_gauge(
+                "admission_ollama_latency_seconds", round(self.ollama_latency.value, 3)
+            )
+
+    def observe_db(self, seconds: float):
+        with self._lock:
+            self.db_latency.observe(seconds)
+            metrics.set_gauge(
+                "admission_db_latency_seconds", round(self.db_latency.value, 3)
+            )
+
+    def status(self) -> dict:
+        pressure = self.pressure() if self.enabled else 0.0
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "level": sum(
+                    pressure >= threshold for threshold in ADMISSION_THRESHOLDS
+                ),
+                "pressure": round(pressure, 3),
+                "in_flight": self.in_flight_count,
+                "ollama_latency": round(self.ollama_latency.current(), 3),
+                "db_latency": round(self.db_latency.current(), 3),
+                "thresholds": dict(zip(STEP_NAMES.values(), ADMISSION_THRESHOLDS)),
+            }
+
+
+admission_controller = AdmissionController()
@@ -0,0 +1,318 @@
+"""
+This module contains the archival tier for cold sessions.
+
+Sessions without new messages for `ARCHIVE_IDLE_DAYS` have their messages
+moved out of the hot chat history table into `db_session_archive`, as one
+zstd-compressed JSONL blob per session, or into a `.jsonl.zst` file under
+`ARCHIVE_DIR` if it is set. The session itself stays in `db_sessions`, so it
+is still listed. Reading or writing the session through `/session`, `/chat`
+or `/stream` rehydrates it first, with the original message IDs, so summaries
+stay valid. Archived messages are not searched until they are rehydrated.
+
+Usage:
+    python -m lib.archive [--idle-days 30] [--limit 1000]
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import time
+from datetime import datetime
+
+import psycopg
+from psycopg import Connection
+from psycopg.types.json import Jsonb
+
+from lib import metrics
+from lib.database import CONNECTION_STRING, table_name
+from lib.search import vector_index
+from lib.storage import compress_content, decompress_content
+
+# Sessions idle for this many days are archived by the background job (0 disables it)
+ARCHIVE_IDLE_DAYS = float(os.getenv("ARCHIVE_IDLE_DAYS", 0))
+ARCHIVE_INTERVAL = float(os.getenv("ARCHIVE_INTERVAL", 3600))
+ARCHIVE_BATCH_SIZE = int(os.getenv("ARCHIVE_BATCH_SIZE", 100))
+# Archive to files in this directory instead of the database
+ARCHIVE_DIR = os.getenv("ARCHIVE_DIR") or None
+ARCHIVE_ZSTD_LEVEL = 9
+
+metrics.describe("archive_sessions_total", "counter", "Sessions moved to the archive")
+metrics.describe(
+    "archive_reclaimed_bytes_total", "counter", "Hot table bytes freed by archiving"
+)
+metrics.describe(
+    "archive_stored_bytes_total", "counter", "Compressed bytes written to the archive"
+)
+metrics.describe(
+    "archive_rehydrate_seconds",
+    "summary",
+    "Time to move a session back to the hot table",
+)
+
+_ARCHIVE_COLUMNS = (
+    "id, role, name, content, content_zstd, message_id, extra, created_at, parent_id"
+)
+
+
+def _compress(data: bytes) -> bytes:
+    import zstandard
+
+    return zstandard.ZstdCompressor(level=ARCHIVE_ZSTD_LEVEL).compress(data)
+
+
+def _decompress(data: bytes) -> bytes:
+    import zstandard
+
+    return zstandard.ZstdDecompressor().decompress(data)
+
+
+def _archive_path(session_id: str) -> str:
+    return os.path.join(ARCHIVE_DIR, f"{session_id}.jsonl.zst")
+
+
+def _load_records(data: bytes | None, path: str | None) -> list[dict]:
+    if path:
+        with open(path, "rb") as f:
+            data = f.read()
+    return [json.loads(line) for line in _decompress(data).decode("utf-8").splitlines()]
+
+
+def find_idle_sessions(conn: Connection, idle_days: float, limit: int) -> list[str]:
+    """
+    Returns up to `limit` sessions whose last message is older than `idle_days`.
+    Forked sessions are skipped, since their forks share their messages.
+    """
+    with conn.cursor() as cur:
+        cur.execute(
+            f"""
+            SELECT session_id FROM {table_name} h
+            WHERE NOT EXISTS (SELECT FROM db_sessions f WHERE f.forked_from = h.session_id)
+            GROUP BY session_id
+            HAVING max(created_at) < now() - make_interval(secs => %s)
+            LIMIT %s
+            """,
+            (idle_days * 86400, limit),
+        )
+        session_ids = [str(row[0]) for row in cur.fetchall()]
+        conn.commit()
+    return session_ids
+
+
+def archive_session(conn: Connection, session_id: str) -> tuple[int, int, int]:
+    """
+    Moves a session's messages to the archive in one transaction.
+
+    Returns:
+        tuple[int, int, int]: The number of messages, the hot table bytes they
+        used, and the compressed bytes written to the archive.
+    """
+    with conn.transaction(), conn.cursor() as cur:
+        cur.execute(
+            f"""
+            DELETE FROM {table_name} h WHERE session_id = %s
+            RETURNING {_ARCHIVE_COLUMNS}, pg_column_size(h.*)
+            """,
+            (session_id,),
+        )
+        rows = sorted(cur.fetchall())
+        if not rows:
+            return 0, 0, 0
+
+        lines = [
+            json.dumps(
+                {
+                    "id": row[0],
+                    "role": row[1],
+                    "name": row[2],
+                    "content": decompress_content(row[3], row[4]),
+                    "message_id": row[5],
+                    "extra": row[6],
+                    "created_at": row[7].isoformat(),
+                    "parent_id": row[8],
+                },
+                ensure_ascii=False,
+            )
+            for row in rows
+        ]
+        data = _compress("\n".join(lines).encode("utf-8"))
+        hot_bytes = sum(row[9] for row in rows)
+
+        path = None
+        if ARCHIVE_DIR:
+            os.makedirs(ARCHIVE_DIR, exist_ok=True)
+            path = _archive_path(session_id)
+            with open(path, "wb") as f:
+                f.write(data)
+        cur.execute(
+            """
+            INSERT INTO db_session_archive (session_id, data, path, message_count, hot_bytes, archived_bytes)
+            VALUES (%s, %s, %s, %s, %s, %s)
+            """,
+            (session_id, None if path else data, path, len(rows), hot_bytes, len(data)),
+        )
+        cur.execute("SELECT username FROM db_sessions WHERE id = %s", (session_id,))
+        owner = cur.fetchone()
+
+    if not conn.autocommit:
+        # The block is a savepoint if the caller had a transaction open
+        conn.commit()
+    if owner:
+        vector_index.invalidate(owner[0])
+    metrics.inc("archive_sessions_total")
+    metrics.inc("archive_reclaimed_bytes_total", value=hot_bytes)
+    metrics.inc("archive_stored_bytes_total", value=len(data))
+    return len(rows), hot_bytes, len(data)
+
+
+def archive_idle_sessions(
+    conn: Connection, idle_days: float, limit: int = ARCHIVE_BATCH_SIZE
+) -> dict:
+    """
+    Archives up to `limit` sessions idle for more than `idle_days`.
+
+    Returns:
+        dict: The number of sessions and messages archived, the hot table
+        bytes they used and the compressed bytes stored instead.
+    """
+    report = {"sessions": 0, "messages": 0, "hot_bytes": 0, "archived_bytes": 0}
+    for session_id in find_idle_sessions(conn, idle_days, limit):
+        messages, hot_bytes, archived_bytes = archive_session(conn, session_id)
+        if messages:
+            report["sessions"] += 1
+            report["messages"] += messages
+            report["hot_bytes"] += hot_bytes
+            report["archived_bytes"] += archived_bytes
+    return report
+
+
+def rehydrate_session(conn: Connection, session_id: str) -> bool:
+    """
+    Moves an archived session's messages back to the hot table, keeping
+    their IDs. For a session that is not archived, this is a single primary
+    key lookup.
+
+    Returns:
+        bool: True if the session was archived and has been rehydrated.
+    """
+    start = time.perf_counter()
+    # A transaction also on autocommit connections, so no message is lost
+    with conn.transaction(), conn.cursor() as cur:
+        cur.execute(
+            "DELETE FROM db_session_archive WHERE session_id = %s RETURNING data, path",
+            (session_id,),
+        )
+        row = cur.fetchone()
+        if not row:
+            return False
+
+        data, path = row
+        records = _load_records(data, path)
+        with cur.copy(
+            f"COPY {table_name} (session_id, {_ARCHIVE_COLUMNS}) FROM STDIN"
+        ) as copy:
+            for record in records:
+                content, content_zstd = compress_content(record["content"])
+                copy.write_row(
+                    (
+                        session_id,
+                        record["id"],
+                        record["role"],
+                        record["name"],
+                        content,
+                        content_zstd,
+                        record["message_id"],
+                        Jsonb(record["extra"]) if record["extra"] is not None else None,
+                        datetime.fromisoformat(record["created_at"]),
+                        record.get("parent_id"),
+                    )
+                )
+
+    if not conn.autocommit:
+        conn.commit()
+    if path:
+        os.remove(path)
+    elapsed = time.perf_counter() - start
+    metrics.observe("archive_rehydrate_seconds", elapsed)
+    print(
+        f"Rehydrated session #{session_id}: {len(records)} messages in {elapsed * 1000:.1f} ms"
+    )
+    return True
+
+
+def read_archived_messages(conn: Connection, session_id: str) -> list[dict] | None:
+    """
+    Returns an archived session's messages without rehydrating it, as dicts
+    with the message columns, or None if the session is not archived.
+    """
+    with conn.cursor() as cur:
+        cur.execute(
+            "SELECT data, path FROM db_session_archive WHERE session_id = %s",
+            (session_id,),
+        )
+        row = cur.fetchone()
+    return _load_records(*row) if row else None
+
+
+def get_archive_stats(conn: Connection) -> dict:
+    """
+    Returns the number of archived sessions and messages, and the storage
+    they use in the archive compared to the hot table.
+    """
+    with conn.cursor() as cur:
+        cur.execute(
+            """
+            SELECT count(*), coalesce(sum(message_count), 0),
+                coalesce(sum(hot_bytes), 0), coalesce(sum(archived_bytes), 0)
+            FROM db_session_archive
+            """
+        )
+        sessions, messages, hot_bytes, archived_bytes = cur.fetchone()
+        conn.commit()
+    return {
+        "sessions": sessions,
+        "messages": messages,
+        "hot_bytes": hot_bytes,
+        "archived_bytes": archived_bytes,
+        "reclaimed_bytes": hot_bytes - archived_bytes,
+    }
+
+
+def _archive_with_own_connection(idle_days: float) -> dict:
+    with psycopg.connect(CONNECTION_STRING, connect_timeout=5) as conn:
+        return archive_idle_sessions(conn, idle_days)
+
+
+async def run_archiver():
+    """
+    Archives idle sessions every `ARCHIVE_INTERVAL` seconds until cancelled.
+    Does nothing when `ARCHIVE_IDLE_DAYS` is 0.
+    """
+    if ARCHIVE_IDLE_DAYS <= 0:
+        return
+    while True:
+        try:
+            report = await asyncio.to_thread(
+                _archive_with_own_connection, ARCHIVE_IDLE_DAYS
+            )
+            if report["sessions"]:
+                print(f"Archived idle sessions: {report}")
+        except Exception as e:
+            print(f"Error archiving sessions: {str(e)}")
+        await asyncio.sleep(ARCHIVE_INTERVAL)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Archive idle sessions")
+    parser.add_argument("--idle-days", type=float, default=ARCHIVE_IDLE_DAYS or 30)
+    parser.add_argument("--limit", type=int, default=ARCHIVE_BATCH_SIZE)
+    args = parser.parse_args()
+
+    with psycopg.connect(CONNECTION_STRING) as conn:
+        report = archive_idle_sessions(conn, args.idle_days, args.limit)
+        report["total"] = get_archive_stats(conn)
+    print(json.dumps(report))
+
+
+if __name__ == "__main__":
+    main()
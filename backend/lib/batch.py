@@ -0,0 +1,282 @@
+"""
+This module contains the batch completion engine for offline and bulk workloads.
+
+A batch is a JSONL list of prompts. Items run through a bounded worker pool
+(a global limit plus a per-model limit), except that items of the same
+session run one after the other, in input order, so each one sees the turns
+before it. Results are yielded as soon as each item finishes, and every result is checkpointed in `db_batch_results` so a
+crashed batch can be resumed with the same batch ID.
+
+Usage:
+    python -m lib.batch prompts.jsonl --output results.jsonl [--batch-id <uuid>] [--skip-titles]
+"""
+
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import sys
+import time
+import uuid
+from typing import Any, AsyncIterator, Iterable
+
+from langchain_core.messages import AIMessage, HumanMessage
+from psycopg import Connection
+from psycopg.types.json import Jsonb
+from pydantic import ValidationError
+
+from lib.admission import admission_controller
+from lib.archive import rehydrate_session
+from lib.database import (
+    create_session_if_not_exists,
+    get_db_connection,
+    get_chat_history,
+    get_session_by_id,
+    table_name,
+)
+from lib.ollama import get_llm, get_ollama_models_names, get_session_title
+from lib.profiles import resolve_generation
+from lib.prompts import chat_prompt
+from lib.residency import residency_manager
+from lib.summary import get_prompt_history
+from lib.titles import heuristic_title
+from lib.types import BatchItem
+from lib.utils import generate_message_id, is_session_id_valid
+
+BATCH_MAX_CONCURRENCY = int(os.getenv("BATCH_MAX_CONCURRENCY", 4))
+BATCH_MAX_PER_MODEL = int(os.getenv("BATCH_MAX_PER_MODEL", 2))
+# Items accepted in one /batch request
+BATCH_MAX_ITEMS = int(os.getenv("BATCH_MAX_ITEMS", 1000))
+
+
+def parse_batch_items(lines: Iterable[str]) -> list[BatchItem]:
+    """
+    Parses JSONL batch input, skipping blank lines.
+
+    Raises:
+        ValueError: If a line is not valid JSON or not a valid batch item.
+    """
+    items = []
+    for line_number, line in enumerate(lines, start=1):
+        if not line.strip():
+            continue
+        try:
+            item = BatchItem.model_validate_json(line)
+        except ValidationError as e:
+            raise ValueError(f"Invalid batch item on line {line_number}: {e}")
+        if item.session_id is not None and not is_session_id_valid(item.session_id):
+            raise ValueError(f"Invalid session ID on line {line_number}")
+        items.append(item)
+    return items
+
+
+def get_completed_results(conn: Connection, batch_id: str) -> dict[int, dict]:
+    with conn.cursor() as cur:
+        cur.execute(
+            "SELECT item_index, result FROM db_batch_results WHERE batch_id = %s",
+            (batch_id,),
+        )
+        return {row[0]: row[1] for row in cur.fetchall()}
+
+
+def save_result(conn: Connection, batch_id: str, result: dict):
+    with conn.cursor() as cur:
+        cur.execute(
+            """
+            INSERT INTO db_batch_results (batch_id, item_index, result)
+            VALUES (%s, %s, %s)
+            ON CONFLICT (batch_id, item_index) DO NOTHING
+            """,
+            (batch_id, result["index"], Jsonb(result)),
+        )
+
+
+def _prepare_item(
+    conn: Connection, item: BatchItem, skip_titles: bool
+) -> tuple[list, Any]:
+    """
+    Loads the prompt history for an item. Items without a session ID are
+    stateless and do no history I/O.
+    """
+    if item.session_id is None:
+        return [], None
+
+    if get_session_by_id(conn, item.session_id):
+        rehydrate_session(conn, item.session_id)
+    else:
+        title = (
+            heuristic_title(item.content)
+            if skip_titles
+            else get_session_title(item.content)
+        )
+        create_session_if_not_exists(conn, item.session_id, item.name, title)
+
+    history, _ = get_prompt_history(conn, table_name, item.session_id)
+    return history, get_chat_history(conn, item.session_id)
+
+
+async def _run_item(
+    conn: Connection,
+    index: int,
+    item: BatchItem,
+    skip_titles: bool,
+    models: set[str],
+    limit: asyncio.Semaphore,
+    model_limits: dict[str, asyncio.Semaphore],
+    session_locks: dict[str, asyncio.Lock],
+) -> dict:
+    result = {
+        "index": index,
+        "id": item.id,
+        "session_id": item.session_id,
+        "model": item.model,
+    }
+    if item.model not in models:
+        return result | {"error": "Invalid model"}
+    residency_manager.note_request(item.model)
+
+    model_limit = model_limits.setdefault(
+        item.model, asyncio.Semaphore(BATCH_MAX_PER_MODEL)
+    )
+    # Stateless items need no lock. Locks are granted in the order the tasks
+    # wait for them, which is the input order.
+    session_lock = (
+        session_locks.setdefault(item.session_id, asyncio.Lock())
+        if item.session_id is not None
+        else contextlib.nullcontext()
+    )
+    async with session_lock, model_limit, limit:
+        start = time.perf_counter()
+        try:
+            history, chat_history = await asyncio.to_thread(
+                _prepare_item, conn, item, skip_titles
+            )
+            new_usr_msg = HumanMessage(
+                content=item.content, id=generate_message_id(), name=item.name
+            )
+            # Batch items use the default generation profile
+            _, options = resolve_generation(None)
+            llm = get_llm(item.model, **options)
+            # Counted so that bulk load degrades interactive requests too
+            with admission_controller.in_flight():
+                response = await llm.ainvoke(
+                    chat_prompt.render(history + [new_usr_msg])
+                )
+            if chat_history is not None:
+                new_ai_msg = AIMessage(
+                    content=response, id=generate_message_id(), name="Assistant"
+                )
+                await asyncio.to_thread(
+                    chat_history.add_messages, [new_usr_msg, new_ai_msg]
+                )
+            result["response"] = response
+        except Exception as e:
+            print(f"Error in batch item #{index}: {str(e)}")
+            result["error"] = str(e)
+        result["duration_ms"] = round((time.perf_counter() - start) * 1000, 1)
+    return result
+
+
+async def run_batch(
+    batch_id: str,
+    items: list[BatchItem],
+    skip_titles: bool = False,
+    concurrency: int = BATCH_MAX_CONCURRENCY,
+) -> AsyncIterator[dict]:
+    """
+    Runs a batch and yields one result per item as soon as it is available.
+
+    Results checkpointed by an earlier run of the same batch ID are yielded
+    first (marked with `"resumed": true`) and not recomputed.
+
+    Args:
+        batch_id (str): The UUID of the batch, reused to resume it.
+        items (list[BatchItem]): The prompts to run.
+        skip_titles (bool): Use a heuristic title for new sessions instead of an LLM call.
+        concurrency (int): The maximum number of items in flight across all models.
+    """
+    # A dedicated autocommit connection, so concurrent items do not share a transaction
+    # (connected like the store's connections, so the tables exist)
+    conn = await asyncio.to_thread(get_db_connection)
+    conn.autocommit = True
+    try:
+        completed = await asyncio.to_thread(get_completed_results, conn, batch_id)
+        for index in sorted(completed):
+            if index < len(items):
+                yield completed[index] | {"resumed": True}
+
+        models = set(await asyncio.to_thread(get_ollama_models_names))
+        limit = asyncio.Semaphore(concurrency)
+        model_limits: dict[str, asyncio.Semaphore] = {}
+        session_locks: dict[str, asyncio.Lock] = {}
+        tasks = [
+            asyncio.create_task(
+                _run_item(
+                    conn,
+                    index,
+                    item,
+                    skip_titles,
+                    models,
+                    limit,
+                    model_limits,
+                    session_locks,
+                )
+            )
+            for index, item in enumerate(items)
+            if index not in completed
+        ]
+        try:
+            for task in asyncio.as_completed(tasks):
+                result = await task
+                # Failed items are not checkpointed, so resuming retries them
+                if "error" not in result:
+                    await asyncio.to_thread(save_result, conn, batch_id, result)
+                yield result
+        finally:
+            for task in tasks:
+                task.cancel()
+    finally:
+        conn.close()
+
+
+async def _run_cli(args: argparse.Namespace):
+    with open(args.input, encoding="utf-8") as f:
+        items = parse_batch_items(f)
+
+    batch_id = args.batch_id or str(uuid.uuid4())
+    print(f"Batch {batch_id}: {len(items)} items", file=sys.stderr)
+
+    output = open(args.output, "a", encoding="utf-8") if args.output else sys.stdout
+    failed = 0
+    try:
+        async for result in run_batch(
+            batch_id, items, args.skip_titles, args.concurrency
+        ):
+            failed += "error" in result
+            output.write(json.dumps(result, ensure_ascii=False) + "\n")
+            output.flush()
+    finally:
+        if output is not sys.stdout:
+            output.close()
+    print(f"Batch {batch_id}: done, {failed} failed", file=sys.stderr)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a JSONL batch of prompts")
+    parser.add_argument("input", help="JSONL file, one prompt per line")
+    parser.add_argument(
+        "--output", help="JSONL file to append results to (default: stdout)"
+    )
+    parser.add_argument("--batch-id", help="resume the batch with this ID")
+    parser.add_argument("--skip-titles", action="store_true")
+    parser.add_argument("--concurrency", type=int, default=BATCH_MAX_CONCURRENCY)
+    args = parser.parse_args()
+
+    if args.batch_id and not is_session_id_valid(args.batch_id):
+        parser.error("--batch-id must be a UUID")
+    asyncio.run(_run_cli(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,191 @@
+"""
+This module contains the event loop blocking detector.
+
+When enabled, a heartbeat task on each event loop that serves requests
+ticks every quarter of `BLOCKING_THRESHOLD_MS`. A watchdog thread checks
+the heartbeat. When the loop stops ticking for longer than the threshold,
+some synchronous call is blocking it, and the watchdog captures the stack
+of the loop thread while the call is still running. The block is attributed
+to the route whose function (or a function nested in it, like the
+generator of a streaming response) is on that stack.
+
+The detector is meant for debugging and tests: it is enabled with
+`BLOCKING_DETECTOR=true`, and the test suite enables it to fail tests whose
+requests block the loop (see `tests/conftest.py`).
+"""
+
+import asyncio
+import os
+import sys
+import threading
+import time
+import traceback
+import types
+import weakref
+from collections import deque
+
+from lib import metrics
+
+BLOCKING_DETECTOR = os.getenv("BLOCKING_DETECTOR", "false").lower() == "true"
+BLOCKING_THRESHOLD_MS = float(os.getenv("BLOCKING_THRESHOLD_MS", 100))
+# Reports kept for /admin/blocking
+BLOCKING_MAX_REPORTS = 50
+
+metrics.describe("event_loop_blocks_total", "counter", "Event loop blocks per route")
+
+
+def _nested_codes(code: types.CodeType):
+    yield code
+    for const in code.co_consts:
+        if isinstance(const, types.CodeType):
+            yield from _nested_codes(const)
+
+
+def get_route_codes(routes) -> dict[types.CodeType, tuple[str, str]]:
+    """
+    Maps the code of each route function, and of the functions nested in it,
+    to the route's methods and path.
+    """
+    codes = {}
+    for route in routes:
+        endpoint = getattr(route, "endpoint", None)
+        code = getattr(endpoint, "__code__", None)
+        if code is None:
+            continue
+        methods = ",".join(sorted(getattr(route, "methods", None) or ["WS"]))
+        for nested in _nested_codes(code):
+            codes.setdefault(nested, (methods, route.path))
+    return codes
+
+
+class _LoopState:
+    def __init__(self, interval: float, route_codes: dict):
+        self.interval = interval
+        self.route_codes = route_codes
+        self.thread_id: int | None = None
+        self.beat = time.perf_counter()
+        self.report: dict | None = None
+
+
+class BlockingDetector:
+    """
+    Detects synchronous calls that block an event loop for longer than a
+    threshold, and reports their stack and route.
+    """
+
+    def __init__(
+        self,
+        enabled: bool = BLOCKING_DETECTOR,
+        threshold_ms: float = BLOCKING_THRESHOLD_MS,
+    ):
+        self.enabled = enabled
+        self.threshold = threshold_ms / 1000
+        self.reports: deque[dict] = deque(maxlen=BLOCKING_MAX_REPORTS)
+        self._loops: weakref.WeakKeyDictionary = weakref.WeakKeyDictionary()
+        self._lock = threading.Lock()
+
+    def watch(self, loop: asyncio.AbstractEventLoop, routes=()):
+        """
+        Starts watching a loop, unless it is already watched. Must be called
+        from the loop's thread.
+        """
+        with self._lock:
+            if loop in self._loops:
+                return
+            state = _LoopState(self.threshold / 4, get_route_codes(routes))
+            state.thread_id = threading.get_ident()
+            self._loops[loop] = state
+        loop.create_task(self._heartbeat(state))
+        threading.Thread(
+            target=self._watchdog,
+            args=(loop, state),
+            name="blocking-watchdog",
+            daemon=True,
+        ).start()
+
+    async def _heartbeat(self, state: _LoopState):
+        state.beat = time.perf_counter()
+        while True:
+            await asyncio.sleep(state.interval)
+            now = time.perf_counter()
+            lag = now - state.beat - state.interval
+            state.beat = now
+            with self._lock:
+                report, state.report = state.report, None
+            if report is not None:
+                report["seconds"] = round(max(lag, report["seconds"]), 4)
+            elif lag > self.threshold:
+                # Too short for the watchdog to catch it in the act
+                self._report(state, None, lag)
+
+    def _watchdog(self, loop: asyncio.AbstractEventLoop, state: _LoopState):
+        while not loop.is_closed():
+            time.sleep(state.interval)
+            if not loop.is_running():
+                continue
+            beat = state.beat
+            blocked = time.perf_counter() - beat - state.interval
+            report = state.report
+            if report is not None:
+                # Still blocked: the heartbeat finalizes the report once it runs
+                report["seconds"] = round(max(blocked, report["seconds"]), 4)
+                continue
+            if blocked <= self.threshold:
+                continue
+            frame = sys._current_frames().get(state.thread_id)
+            if state.beat != beat:
+                continue
+            report = self._report(state, frame, blocked)
+            with self._lock:
+                state.report = report
+
+    def _find_route(
+        self, state: _LoopState, frame: types.FrameType | None
+    ) -> tuple[str, str] | None:
+        while frame is not None:
+            route = state.route_codes.get(frame.f_code)
+            if route is not None:
+                return route
+            frame = frame.f_back
+        return None
+
+    def _report(
+        self, state: _LoopState, frame: types.FrameType | None, seconds: float
+    ) -> dict:
+        route = self._find_route(state, frame)
+        methods, path = route or ("", None)
+        endpoint = f"{methods} {path}" if route else "unknown"
+        stack = "".join(traceback.format_stack(frame)) if frame is not None else ""
+        report = {
+            "endpoint": endpoint,
+            "path": path,
+            "seconds": round(seconds, 4),
+            "stack": stack,
+        }
+        metrics.inc("event_loop_blocks_total", {"endpoint": endpoint})
+        self.reports.append(report)
+        print(
+            f"⚠️ Event loop blocked for over {self.threshold * 1000:g}ms in {endpoint}:\n{stack}"
+        )
+        return report
+
+    def clear(self):
+        self.reports.clear()
+
+
+class BlockingDetectorMiddleware:
+    """
+    ASGI middleware that makes the blocking detector watch the event loop
+    serving the app, when the detector is enabled.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if blocking_detector.enabled:
+            blocking_detector.watch(asyncio.get_running_loop(), scope["app"].routes)
+        await self.app(scope, receive, send)
+
+
+blocking_detector = BlockingDetector()
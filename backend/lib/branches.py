@@ -0,0 +1,317 @@
+"""
+This module contains the branching conversations: editing a message,
+regenerating an answer and forking a session.
+
+Messages form a tree through their `parent_id`, and a session shows one
+branch of it, from its `head_id` message back to the root. Nothing is
+copied: an edited message or a regenerated answer is a new child of the
+original's parent, and a fork is a new session whose head is a message of
+the source session, so its messages are shared until it diverges.
+
+Sessions that never branched keep `head_id` and `parent_id` NULL: their
+messages are read in ID order, as before, and a NULL `parent_id` means the
+previous message of the session. Once a session branches, every message
+written to it has an explicit parent (`NO_PARENT` for a new first message)
+and the head moves to the last one.
+
+Since a parent is always older than its children, a branch is in ID order,
+and each step up the tree is a primary key or `(session_id, id)` lookup.
+The rolling summary always covers a prefix of the active branch: it is
+dropped when the session switches to a branch that does not include it.
+
+Branches need the Postgres backend. Sessions that were forked are not
+archived, since their forks read their messages.
+"""
+
+from psycopg import Connection
+
+from lib.cache import sessions_cache
+from lib.types import MessageRecord, Session
+
+# The parent of a message written as the first of its branch
+NO_PARENT = 0
+
+
+def create_branch_tables(conn: Connection, table_name: str):
+    """
+    Adds the message tree columns and their indexes.
+    """
+    with conn.cursor() as cur:
+        cur.execute(
+            f"ALTER TABLE {table_name} ADD COLUMN IF NOT EXISTS parent_id INTEGER"
+        )
+        cur.execute(
+            """
+            ALTER TABLE db_sessions
+                ADD COLUMN IF NOT EXISTS head_id INTEGER,
+                ADD COLUMN IF NOT EXISTS forked_from UUID
+            """
+        )
+        # Finds the implicit parent of a message, and the session's messages in order
+        cur.execute(
+            f"""
+            CREATE INDEX IF NOT EXISTS {table_name}_session_id_id_idx
+            ON {table_name} (session_id, id)
+            """
+        )
+        cur.execute(
+            f"""
+            CREATE INDEX IF NOT EXISTS {table_name}_parent_id_idx
+            ON {table_name} (parent_id) WHERE parent_id IS NOT NULL
+            """
+        )
+        cur.execute(
+            """
+            CREATE INDEX IF NOT EXISTS db_sessions_forked_from_idx
+            ON db_sessions (forked_from) WHERE forked_from IS NOT NULL
+            """
+        )
+        conn.commit()
+
+
+def parent_of(table_name: str, alias: str) -> str:
+    """
+    Returns the SQL expression for the parent ID of the message `alias`,
+    `NO_PARENT` for the first message of a branch.
+    """
+    return f"""coalesce(
+        {alias}.parent_id,
+        (
+            SELECT max(p.id) FROM {table_name} p
+            WHERE p.session_id = {alias}.session_id AND p.id < {alias}.id
+        ),
+        {NO_PARENT}
+    )"""
+
+
+def branch_ctes(table_name: str) -> str:
+    """
+    Returns the common table expressions of a session's branch, for a
+    `WITH RECURSIVE` clause:
+
+    - `branch_start`: the last message of the branch, or NULL if the session
+      never branched.
+    - `branch`: the ID, session and parent of each message of the branch.
+    - `branch_messages`: the rows of the branch's messages, or of all the
+      session's messages if it never branched.
+
+    The parameters are `session_id` and `until`, the message ID to end the
+    branch at instead of the session's head (None for the head).
+    """
+    return f"""
+    branch_start AS (
+        SELECT coalesce(
+            %(until)s::integer,
+            (SELECT head_id FROM db_sessions WHERE id = %(session_id)s)
+        ) AS id
+    ),
+    branch (id, session_id, parent_id) AS (
+        SELECT h.id, h.session_id, h.parent_id FROM {table_name} h
+        WHERE h.id = (SELECT id FROM branch_start)
+        UNION ALL
+        SELECT h.id, h.session_id, h.parent_id FROM branch b
+        JOIN {table_name} h ON h.id = {parent_of(table_name, "b")}
+    ),
+    branch_messages AS (
+        SELECT h.* FROM {table_name} h WHERE h.id IN (SELECT id FROM branch)
+        UNION ALL
+        SELECT h.* FROM {table_name} h
+        WHERE h.session_id = %(session_id)s AND (SELECT id FROM branch_start) IS NULL
+    )
+    """
+
+
+def insert_messages_query(table_name: str, columns: str, count: int) -> str:
+    """
+    Returns the statement appending `count` messages to a session, each the
+    child of the previous one, in one round trip.
+
+    The first message is the child of the `parent_id` parameter if given,
+    which branches the session there and drops a summary that goes past it,
+    or else of the session's head. The head then moves to the last message.
+    Sessions that never branched get NULL parents and no head.
+
+    The other parameters are `session_id`, and each column of `columns` for
+    each message, named `<column>_<index>`.
+    """
+    names = [column.strip() for column in columns.split(",")]
+    ctes = [
+        """
+        session AS (
+            SELECT head_id FROM db_sessions WHERE id = %(session_id)s FOR UPDATE
+        )""",
+        """
+        summary AS (
+            DELETE FROM db_session_summaries
+            WHERE session_id = %(session_id)s AND summarized_until > %(parent_id)s::integer
+        )""",
+    ]
+    for index in range(count):
+        values = ", ".join(f"%({name}_{index})s" for name in names)
+        if index == 0:
+            parent, source = (
+                "coalesce(%(parent_id)s::integer, (SELECT head_id FROM session))",
+                "",
+            )
+        else:
+            parent = (
+                f"CASE WHEN m{index - 1}.parent_id IS NOT NULL THEN m{index - 1}.id END"
+            )
+            source = f" FROM m{index - 1}"
+        ctes.append(
+            f"""
+        m{index} AS (
+            INSERT INTO {table_name} (session_id, parent_id, {columns})
+            SELECT %(session_id)s, {parent}, {values}{source}
+            RETURNING id, parent_id
+        )"""
+        )
+    return f"""
+        WITH {",".join(ctes)}
+        UPDATE db_sessions SET head_id = (SELECT id FROM m{count - 1})
+        WHERE id = %(session_id)s AND (SELECT parent_id FROM m0) IS NOT NULL
+    """
+
+
+def find_branch_message(
+    conn: Connection, table_name: str, session_id: str, message_id: str
+) -> tuple[int, int, str] | None:
+    """
+    Finds a message on a session's active branch.
+
+    Returns:
+        tuple[int, int, str] | None: The message's ID, its parent's ID and
+        its role, or None if it is not on the branch.
+    """
+    with conn.cursor() as cur:
+        cur.execute(
+            f"""
+            WITH RECURSIVE {branch_ctes(table_name)}
+            SELECT h.id, {parent_of(table_name, "h")}, h.role
+            FROM branch_messages h WHERE h.message_id = %(message_id)s
+            """,
+            {"session_id": session_id, "until": None, "message_id": message_id},
+        )
+        return cur.fetchone()
+
+
+def fork_session(
+    conn: Connection, table_name: str, session_id: str, message_id: str, fork_id: str
+) -> Session | None:
+    """
+    Forks a session at a message of its active branch, without copying its
+    messages.
+
+    Returns:
+        Session | None: The new session, with the source's owner and title,
+        or None if the message is not on the branch.
+    """
+    message = find_branch_message(conn, table_name, session_id, message_id)
+    if message is None:
+        return None
+    with conn.cursor() as cur:
+        cur.execute(
+            """
+            INSERT INTO db_sessions (id, username, title, head_id, forked_from)
+            SELECT %s, username, title, %s, id FROM db_sessions WHERE id = %s
+            RETURNING id, username, title
+            """,
+            (fork_id, message[0], session_id),
+        )
+        row = cur.fetchone()
+        conn.commit()
+    if row is None:
+        return None
+    sessions_cache.invalidate(row[1])
+    return Session(id=str(row[0]), username=row[1], title=row[2])
+
+
+def get_branch_leaves(
+    conn: Connection, table_name: str, session_id: str
+) -> list[tuple[MessageRecord, bool]]:
+    """
+    Returns the last message of each branch of a session, newest first, and
+    whether it ends the active branch.
+    """
+    from lib.storage import decompress_content
+
+    with conn.cursor() as cur:
+        cur.execute(
+            f"""
+            WITH active AS (
+                SELECT coalesce(
+                    (SELECT head_id FROM db_sessions WHERE id = %(session_id)s),
+                    (SELECT max(id) FROM {table_name} WHERE session_id = %(session_id)s)
+                ) AS id
+            )
+            SELECT h.id, h.session_id, h.message_id, h.role, h.name, h.content,
+                h.content_zstd, h.created_at, h.id = (SELECT id FROM active)
+            FROM {table_name} h
+            WHERE (
+                h.session_id = %(session_id)s
+                AND NOT EXISTS (
+                    SELECT FROM {table_name} c
+                    WHERE c.parent_id = h.id AND c.session_id = h.session_id
+                )
+                AND NOT (
+                    h.parent_id IS NULL
+                    AND EXISTS (
+                        SELECT FROM {table_name} n
+                        WHERE n.session_id = h.session_id AND n.id > h.id AND n.parent_id IS NULL
+                    )
+                )
+            ) OR h.id = (SELECT id FROM active)
+            ORDER BY h.id DESC
+            """,
+            {"session_id": session_id},
+        )
+        rows = cur.fetchall()
+    return [
+        (
+            MessageRecord(
+                id=row[0],
+                session_id=str(row[1]),
+                message_id=row[2],
+                role=row[3],
+                name=row[4],
+                content=decompress_content(row[5], row[6]),
+                created_at=row[7],
+            ),
+            row[8],
+        )
+        for row in rows
+    ]
+
+
+def select_branch(
+    conn: Connection, table_name: str, session_id: str, message_id: str
+) -> bool:
+    """
+    Makes the branch ending at one of the session's messages the active one.
+
+    Returns:
+        bool: False if the session has no such message.
+    """
+    with conn.transaction(), conn.cursor() as cur:
+        cur.execute(
+            f"SELECT id FROM {table_name} WHERE session_id = %s AND message_id = %s",
+            (session_id, message_id),
+        )
+        row = cur.fetchone()
+        if row is None:
+            return False
+        cur.execute(
+            "UPDATE db_sessions SET head_id = %s WHERE id = %s", (row[0], session_id)
+        )
+        cur.execute(
+            f"""
+            WITH RECURSIVE {branch_ctes(table_name)}
+            DELETE FROM db_session_summaries sm
+            WHERE sm.session_id = %(session_id)s
+                AND NOT EXISTS (SELECT FROM branch WHERE id = sm.summarized_until)
+            """,
+            {"session_id": session_id, "until": row[0]},
+        )
+    if not conn.autocommit:
+        conn.commit()
+    return True
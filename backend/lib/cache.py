@@ -0,0 +1,94 @@
+"""
+This module contains small in-process caches used by the API routes.
+"""
+
+import os
+import time
+import threading
+from collections import OrderedDict
+from typing import Any
+
+
+class SessionsCache:
+    """
+    Per-user cache for the `/sessions` listing.
+
+    Each username maps to a version string (derived from the user's latest
+    session change) and the pages that were served for that version. Creating
+    a session invalidates the user's entry, so the next request recomputes the
+    version and the ETag changes. Entries also expire after `ttl` seconds to
+    stay correct when several backend processes write to the same database.
+    """
+
+    def __init__(self, max_users: int = 1024, ttl: float = 30.0):
+        self.max_users = max_users
+        self.ttl = ttl
+        self._entries: OrderedDict[str, dict[str, Any]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _get_entry(self, username: str) -> dict[str, Any] | None:
+        entry = self._entries.get(username)
+        if entry is None:
+            return None
+        if time.monotonic() - entry["created_at"] > self.ttl:
+            del self._entries[username]
+            return None
+        self._entries.move_to_end(username)
+        return entry
+
+    def get_version(self, username: str) -> str | None:
+        """
+        Returns the cached version of a user's session list, if any.
+        """
+        with self._lock:
+            entry = self._get_entry(username)
+            return entry["version"] if entry else None
+
+    def set_version(self, username: str, version: str):
+        """
+        Stores the version of a user's session list, dropping cached pages
+        if the version changed.
+        """
+        with self._lock:
+            entry = self._get_entry(username)
+            if entry and entry["version"] == version:
+                return
+            self._entries[username] = {
+                "version": version,
+                "pages": {},
+                "created_at": time.monotonic(),
+            }
+            self._entries.move_to_end(username)
+            while len(self._entries) > self.max_users:
+                self._entries.popitem(last=False)
+
+    def get_page(self, username: str, key: tuple) -> Any | None:
+        """
+        Returns a cached page for the given user and page key, if any.
+        """
+        with self._lock:
+            entry = self._get_entry(username)
+            return entry["pages"].get(key) if entry else None
+
+    def set_page(self, username: str, key: tuple, page: Any):
+        """
+        Stores a page for the given user. Ignored if the user has no version.
+        """
+        with self._lock:
+            entry = self._get_entry(username)
+            if entry:
+                entry["pages"][key] = page
+
+    def invalidate(self, username: str):
+        """
+        Drops everything cached for a user.
+        """
+        with self._lock:
+            self._entries.pop(username, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+sessions_cache = SessionsCache(ttl=float(os.getenv("SESSIONS_CACHE_TTL", 30)))
@@ -0,0 +1,314 @@
+"""
+This module contains the record and replay layer for Ollama.
+
+When `OLLAMA_CASSETTE` is set to a JSONL file, every HTTP call to Ollama
+goes through a cassette. This covers the API calls in `lib.ollama` and the
+LangChain clients from `get_llm`. There are two modes, set with
+`OLLAMA_CASSETTE_MODE`:
+
+- "record": calls go to Ollama, and each interaction is appended to the
+  file with the time each chunk of the response arrived.
+- "replay": calls are answered from the file without Ollama. Responses
+  are streamed with the recorded timing divided by `OLLAMA_CASSETTE_SPEED`;
+  0 replays without any delay.
+
+A request matches a recorded one with the same method, path and JSON body.
+Repeated requests are answered in recording order, and the last answer
+repeats. Responses that were closed before their end (e.g. a cancelled
+generation) are recorded as incomplete, and only replayed when the request
+has no complete recording.
+
+Usage:
+    OLLAMA_CASSETTE=tests/cassettes/suite.jsonl OLLAMA_CASSETTE_MODE=record python -m pytest
+    OLLAMA_CASSETTE=tests/cassettes/suite.jsonl OLLAMA_CASSETTE_SPEED=0 python -m pytest
+"""
+
+import asyncio
+import codecs
+import json
+import os
+import threading
+import time
+
+import httpx
+
+OLLAMA_CASSETTE = os.getenv("OLLAMA_CASSETTE") or None
+OLLAMA_CASSETTE_MODE = os.getenv("OLLAMA_CASSETTE_MODE", "replay")
+# Replay timing divisor: 1 keeps the recorded timing, 0 removes all delays
+OLLAMA_CASSETTE_SPEED = float(os.getenv("OLLAMA_CASSETTE_SPEED", 1))
+
+
+class CassetteMissError(httpx.TransportError):
+    """
+    A replayed request that the cassette has no recording for. This is a
+    transport error, so callers handle it like an unreachable Ollama.
+    """
+
+
+def request_key(method: str, path: str, body: bytes) -> str:
+    """
+    Returns the key that requests are matched on. JSON bodies are compared
+    regardless of key order and whitespace.
+    """
+    try:
+        canonical = (
+            json.dumps(json.loads(body), sort_keys=True, ensure_ascii=False)
+            if body
+            else ""
+        )
+    except ValueError:
+        canonical = body.decode("utf-8", "replace")
+    return f"{method} {path} {canonical}"
+
+
+class Cassette:
+    """
+    The recorded interactions of a cassette file.
+    """
+
+    def __init__(self, path: str, mode: str = "replay", speed: float = 1):
+        if mode not in ("record", "replay"):
+            raise ValueError(f"Invalid cassette mode: {mode}")
+        self.path = path
+        self.mode = mode
+        self.speed = speed
+        self._interactions: dict[str, list[dict]] = {}
+        self._played: dict[str, int] = {}
+        self._lock = threading.Lock()
+        if mode == "replay" and os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                for line in f:
+                    if line.strip():
+                        interaction = json.loads(line)
+                        self._interactions.setdefault(interaction["key"], []).append(
+                            interaction
+                        )
+            for key, recorded in self._interactions.items():
+                complete = [i for i in recorded if i.get("complete", True)]
+                self._interactions[key] = complete or recorded
+
+    def find(self, key: str) -> dict:
+        """
+        Returns the next recorded interaction for a request.
+
+        Raises:
+            CassetteMissError: If the request was never recorded.
+        """
+        with self._lock:
+            recorded = self._interactions.get(key)
+            if not recorded:
+                raise CassetteMissError(f"No recorded Ollama response for {key[:300]}")
+            index = self._played.get(key, 0)
+            self._played[key] = index + 1
+        return recorded[min(index, len(recorded) - 1)]
+
+    def record(self, interaction: dict):
+        line = json.dumps(interaction, ensure_ascii=False) + "\n"
+        with self._lock:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(line)
+
+    def delays(self, interaction: dict) -> list[tuple[float, bytes]]:
+        """
+        Returns each recorded chunk with the time to wait before sending it.
+        """
+        chunks = []
+        previous = 0.0
+        for offset, text in interaction["chunks"]:
+            delay = (offset - previous) / self.speed if self.speed > 0 else 0.0
+            chunks.append((max(delay, 0.0), text.encode("utf-8")))
+            previous = offset
+        return chunks
+
+
+class _Recording:
+    """
+    Collects the chunks of a response as they arrive, and records the
+    interaction once the response is closed.
+    """
+
+    def __init__(
+        self, cassette: Cassette, key: str, response: httpx.Response, start: float
+    ):
+        self.cassette = cassette
+        self.interaction = {
+            "key": key,
+            "status": response.status_code,
+            "content_type": response.headers.get("content-type", ""),
+            "chunks": [],
+            "complete": False,
+        }
+        self.start = start
+        self._decoder = codecs.getincrementaldecoder("utf-8")("replace")
+        self._recorded = False
+
+    def add(self, chunk: bytes):
+        text = self._decoder.decode(chunk)
+        if text:
+            self.interaction["chunks"].append(
+                [round(time.perf_counter() - self.start, 4), text]
+            )
+
+    def finish(self, complete: bool = False):
+        self.interaction["complete"] = self.interaction["complete"] or complete
+        if not self._recorded:
+            self._recorded = True
+            self.cassette.record(self.interaction)
+
+
+class _RecordingStream(httpx.SyncByteStream):
+    def __init__(self, stream: httpx.SyncByteStream, recording: _Recording):
+        self.stream = stream
+        self.recording = recording
+
+    def __iter__(self):
+        for chunk in self.stream:
+            self.recording.add(chunk)
+            yield chunk
+        self.recording.finish(complete=True)
+
+    def close(self):
+        self.stream.close()
+        self.recording.finish()
+
+
+class _AsyncRecordingStream(httpx.AsyncByteStream):
+    def __init__(self, stream: httpx.AsyncByteStream, recording: _Recording):
+        self.stream = stream
+        self.recording = recording
+
+    async def __aiter__(self):
+        async for chunk in self.stream:
+            self.recording.add(chunk)
+            yield chunk
+        self.recording.finish(complete=True)
+
+    async def aclose(self):
+        await self.stream.aclose()
+        self.recording.finish()
+
+
+class _ReplayStream(httpx.SyncByteStream, httpx.AsyncByteStream):
+    def __init__(self, chunks: list[tuple[float, bytes]]):
+        self.chunks = chunks
+
+    def __iter__(self):
+        for delay, chunk in self.chunks:
+            if delay:
+                time.sleep(delay)
+            yield chunk
+
+    async def __aiter__(self):
+        for delay, chunk in self.chunks:
+            if delay:
+                await asyncio.sleep(delay)
+            yield chunk
+
+
+def _replay(cassette: Cassette, request: httpx.Request) -> httpx.Response:
+    key = request_key(request.method, request.url.path, request.content)
+    interaction = cassette.find(key)
+    return httpx.Response(
+        interaction["status"],
+        headers={"content-type": interaction["content_type"]},
+        stream=_ReplayStream(cassette.delays(interaction)),
+        request=request,
+    )
+
+
+class CassetteTransport(httpx.BaseTransport):
+    """
+    Synchronous httpx transport that records to or replays from a cassette.
+    """
+
+    def __init__(
+        self, cassette: Cassette, transport: httpx.BaseTransport | None = None
+    ):
+        self.cassette = cassette
+        self.transport = transport or httpx.HTTPTransport()
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        request.read()
+        if self.cassette.mode == "replay":
+            return _replay(self.cassette, request)
+        key = request_key(request.method, request.url.path, request.content)
+        start = time.perf_counter()
+        response = self.transport.handle_request(request)
+        recording = _Recording(self.cassette, key, response, start)
+        return httpx.Response(
+            response.status_code,
+            headers=response.headers,
+            stream=_RecordingStream(response.stream, recording),
+            extensions=response.extensions,
+            request=request,
+        )
+
+    def close(self):
+        self.transport.close()
+
+
+class AsyncCassetteTransport(httpx.AsyncBaseTransport):
+    """
+    Asynchronous httpx transport that records to or replays from a cassette.
+    """
+
+    def __init__(
+        self, cassette: Cassette, transport: httpx.AsyncBaseTransport | None = None
+    ):
+        self.cassette = cassette
+        self.transport = transport or httpx.AsyncHTTPTransport()
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        await request.aread()
+        if self.cassette.mode == "replay":
+            return _replay(self.cassette, request)
+        key = request_key(request.method, request.url.path, request.content)
+        start = time.perf_counter()
+        response = await self.transport.handle_async_request(request)
+        recording = _Recording(self.cassette, key, response, start)
+        return httpx.Response(
+            response.status_code,
+            headers=response.headers,
+            stream=_AsyncRecordingStream(response.stream, recording),
+            extensions=response.extensions,
+            request=request,
+        )
+
+    async def aclose(self):
+        await self.transport.aclose()
+
+
+_cassette: Cassette | None = None
+_cassette_lock = threading.Lock()
+
+
+def get_cassette() -> Cassette | None:
+    """
+    Returns the cassette configured by `OLLAMA_CASSETTE`, or None.
+    """
+    global _cassette
+    if OLLAMA_CASSETTE is None:
+        return None
+    with _cassette_lock:
+        if _cassette is None:
+            _cassette = Cassette(
+                OLLAMA_CASSETTE, OLLAMA_CASSETTE_MODE, OLLAMA_CASSETTE_SPEED
+            )
+        return _cassette
+
+
+def cassette_client_kwargs() -> dict:
+    """
+    Returns the `OllamaLLM` keyword arguments that route its clients through
+    the cassette, or nothing when no cassette is configured.
+    """
+    cassette = get_cassette()
+    if cassette is None:
+        return {}
+    return {
+        "sync_client_kwargs": {"transport": CassetteTransport(cassette)},
+        "async_client_kwargs": {"transport": AsyncCassetteTransport(cassette)},
+    }
@@ -0,0 +1,380 @@
+"""
+This module contains the WebSocket chat channel.
+
+Instead of one POST to `/stream` per message, a client can keep one
+WebSocket open on `/ws`. The connection carries several generations at
+once, each tagged with an ID chosen by the client, as well as session
+switches and title updates. It also keeps the state of the sessions it has
+used, so follow-up turns skip the session lookup and the history load.
+
+Frames are JSON objects with a "type":
+
+    client -> server
+        chat     {"id", "session_id", "content", "model", "name", "title_mode"}
+        cancel   {"id"}
+        credit   {"id", "chunks"}
+        session  {"session_id"}
+        title    {"session_id", "title"}
+        ping, pong
+
+    server -> client
+        start    {"id", "session_id", "model", "degradation_level"}
+        chunk    {"id", "content"}
+        done     {"id", "session_id", "message_id", "cancelled"}
+        error    {"id", "status", "detail", "retry_after"}
+        session  {"session", "messages"}
+        title    {"session_id", "title"}
+        ping, pong
+
+Flow control works per generation and is based on credit. A generation
+may send `WS_INITIAL_CREDIT` chunks. After that it waits for "credit"
+frames, and it stops reading from the model while it waits. The server
+pings every `WS_HEARTBEAT_INTERVAL` seconds. It closes a connection (code
+1001) when nothing has been received for `WS_HEARTBEAT_TIMEOUT` seconds.
+"""
+
+import asyncio
+import json
+import os
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable
+
+from fastapi import HTTPException, WebSocket
+from langchain_core.messages import BaseMessage
+from pydantic import ValidationError
+
+from lib import metrics
+from lib.ollama import get_ollama_models_names
+from lib.store import get_store
+from lib.types import ChatRequest, Message, Session
+from lib.utils import is_session_id_valid
+
+WS_HEARTBEAT_INTERVAL = float(os.getenv("WS_HEARTBEAT_INTERVAL", 20))
+WS_HEARTBEAT_TIMEOUT = float(os.getenv("WS_HEARTBEAT_TIMEOUT", 60))
+# Generations running at once on one connection
+WS_MAX_GENERATIONS = int(os.getenv("WS_MAX_GENERATIONS", 4))
+# Chunks a generation may send before the client grants more credit
+WS_INITIAL_CREDIT = int(os.getenv("WS_INITIAL_CREDIT", 64))
+# Sessions whose state a connection keeps
+WS_SESSION_CACHE_SIZE = int(os.getenv("WS_SESSION_CACHE_SIZE", 8))
+
+metrics.describe("ws_connections", "gauge", "Open WebSocket chat connections")
+metrics.describe(
+    "ws_generations_total", "counter", "Generations started over WebSocket"
+)
+metrics.describe(
+    "ws_credit_waits_total", "counter", "Times a generation waited for client credit"
+)
+metrics.describe(
+    "ws_session_cache_hits_total",
+    "counter",
+    "Turns that reused the connection's session state",
+)
+
+_open_channels = 0
+
+
+class SessionState:
+    """
+    What a connection knows about a session: the session and the prompt
+    history, kept up to date with the turns made on this connection.
+    """
+
+    def __init__(self, session: Session, history: list[BaseMessage], unsummarized: int):
+        self.session = session
+        self.history = history
+        self.unsummarized = unsummarized
+
+
+class Generation:
+    """
+    A generation running on a channel, with the chunks it may still send.
+    """
+
+    def __init__(self, generation_id: str, credit: int):
+        self.id = generation_id
+        self.credit = credit
+        self.task: asyncio.Task | None = None
+        self._has_credit = asyncio.Event()
+        if credit > 0:
+            self._has_credit.set()
+
+    def grant(self, chunks: int):
+        self.credit += chunks
+        if self.credit > 0:
+            self._has_credit.set()
+
+    async def acquire(self):
+        """Waits until the generation may send one more chunk."""
+        if not self._has_credit.is_set():
+            metrics.inc("ws_credit_waits_total")
+        await self._has_credit.wait()
+        self.credit -= 1
+        if self.credit <= 0:
+            self._has_credit.clear()
+
+
+RunChat = Callable[["ChatChannel", Generation, ChatRequest], Awaitable[None]]
+
+
+class ChatChannel:
+    """
+    One client's WebSocket connection. Reads frames and dispatches them.
+    Chat frames start a task that runs `run_chat`. The other frames are
+    handled inline.
+    """
+
+    def __init__(self, websocket: WebSocket, run_chat: RunChat):
+        self.websocket = websocket
+        self.run_chat = run_chat
+        self.generations: dict[str, Generation] = {}
+        self.sessions: OrderedDict[str, SessionState] = OrderedDict()
+        self.last_seen = time.monotonic()
+        self.closed = False
+        self._models: list[str] | None = None
+        self._session_locks: dict[str, asyncio.Lock] = {}
+        self._send_lock = asyncio.Lock()
+
+    async def send(self, frame: dict):
+        if self.closed:
+            return
+        async with self._send_lock:
+            await self.websocket.send_text(json.dumps(frame, ensure_ascii=False))
+
+    async def send_chunk(self, generation: Generation, content: str):
+        await generation.acquire()
+        await self.send({"type": "chunk", "id": generation.id, "content": content})
+
+    async def send_error(
+        self,
+        status: int,
+        detail: str,
+        generation_id: str | None = None,
+        retry_after: str | None = None,
+    ):
+        frame = {
+            "type": "error",
+            "id": generation_id,
+            "status": status,
+            "detail": detail,
+        }
+        if retry_after is not None:
+            frame["retry_after"] = int(retry_after)
+        await self.send(frame)
+
+    async def get_models(self, refresh: bool = False) -> list[str]:
+        """Returns the model names, listed once per connection."""
+        if self._models is None or refresh:
+            self._models = await asyncio.to_thread(get_ollama_models_names)
+        return self._models
+
+    def session_lock(self, session_id: str) -> asyncio.Lock:
+        """Serializes the turns of a session on this connection."""
+        return self._session_locks.setdefault(session_id, asyncio.Lock())
+
+    def get_session_state(self, session_id: str) -> SessionState | None:
+        """
+        Returns the connection's state of a session, or None if it is not
+        loaded yet.
+        """
+        state = self.sessions.get(session_id)
+        if state is not None:
+            self.sessions.move_to_end(session_id)
+            metrics.inc("ws_session_cache_hits_total")
+        return state
+
+    async def load_session(self, session_id: str) -> SessionState | None:
+        """
+        Loads a session into the connection's state. Returns None if the
+        session does not exist.
+        """
+        session, history, unsummarized = await asyncio.to_thread(
+            get_store().bootstrap_session, session_id
+        )
+        if session is None:
+            return None
+        return self.remember_session(session, history, unsummarized)
+
+    def remember_session(
+        self, session: Session, history: list[BaseMessage], unsummarized: int
+    ) -> SessionState:
+        state = SessionState(session, history, unsummarized)
+        self.sessions[session.id] = state
+        self.sessions.move_to_end(session.id)
+        while len(self.sessions) > WS_SESSION_CACHE_SIZE:
+            self.sessions.popitem(last=False)
+        return state
+
+    def forget_session(self, session_id: str):
+        """Drops a session's state, e.g. when its history is being summarized."""
+        self.sessions.pop(session_id, None)
+
+    async def serve(self):
+        """
+        Accepts the connection and serves it until the client leaves or
+        stops answering the heartbeat. Running generations are then
+        cancelled.
+        """
+        global _open_channels
+        await self.websocket.accept()
+        _open_channels += 1
+        metrics.set_gauge("ws_connections", _open_channels)
+        heartbeat = asyncio.create_task(self._heartbeat())
+        try:
+            while True:
+                message = await self.websocket.receive()
+                if message["type"] == "websocket.disconnect":
+                    break
+                self.last_seen = time.monotonic()
+                try:
+                    frame = json.loads(
+                        message.get("text") or message.get("bytes") or ""
+                    )
+                except ValueError:
+                    frame = None
+                if not isinstance(frame, dict):
+                    await self.send_error(400, "Invalid frame")
+                    continue
+                await self.dispatch(frame)
+        finally:
+            self.closed = True
+            heartbeat.cancel()
+            tasks = [g.task for g in self.generations.values() if g.task is not None]
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            _open_channels -= 1
+            metrics.set_gauge("ws_connections", _open_channels)
+
+    async def dispatch(self, frame: dict):
+        kind = frame.get("type")
+        if kind == "chat":
+            await self._start_generation(frame)
+        elif kind == "cancel":
+            generation = self.generations.get(frame.get("id"))
+            if generation is not None and generation.task is not None:
+                generation.task.cancel()
+        elif kind == "credit":
+            generation = self.generations.get(frame.get("id"))
+            chunks = frame.get("chunks")
+            if not isinstance(chunks, int) or chunks <= 0:
+                await self.send_error(400, "Invalid credit", frame.get("id"))
+            elif generation is not None:
+                generation.grant(chunks)
+        elif kind == "session":
+            await self._switch_session(frame.get("session_id"))
+        elif kind == "title":
+            await self._update_title(frame.get("session_id"), frame.get("title"))
+        elif kind == "ping":
+            await self.send({"type": "pong"})
+        elif kind != "pong":
+            await self.send_error(400, "Unknown frame type")
+
+    async def _start_generation(self, frame: dict):
+        generation_id = frame.get("id")
+        if not isinstance(generation_id, str) or not generation_id:
+            await self.send_error(400, "Missing generation ID")
+            return
+        if generation_id in self.generations:
+            await self.send_error(409, "Generation ID already in use", generation_id)
+            return
+        if len(self.generations) >= WS_MAX_GENERATIONS:
+            await self.send_error(429, "Too many generations", generation_id)
+            return
+        try:
+            request = ChatRequest.model_validate(frame)
+        except ValidationError:
+            await self.send_error(400, "Invalid chat request", generation_id)
+            return
+        if not is_session_id_valid(request.session_id):
+            await self.send_error(400, "Invalid session ID", generation_id)
+            return
+
+        generation = Generation(generation_id, WS_INITIAL_CREDIT)
+        self.generations[generation_id] = generation
+        generation.task = asyncio.create_task(self._run_generation(generation, request))
+        metrics.inc("ws_generations_total")
+
+    async def _run_generation(self, generation: Generation, request: ChatRequest):
+        try:
+            await self.run_chat(self, generation, request)
+        except asyncio.CancelledError:
+            # Cancelled before streaming started
+            await self.send(
+                {
+                    "type": "done",
+                    "id": generation.id,
+                    "session_id": request.session_id,
+                    "message_id": None,
+                    "cancelled": True,
+                }
+            )
+        except HTTPException as e:
+            retry_after = (e.headers or {}).get("Retry-After")
+            await self.send_error(e.status_code, e.detail, generation.id, retry_after)
+        except Exception as e:
+            print(f"Error in generation {generation.id}: {str(e)}")
+            await self.send_error(500, "Internal server error", generation.id)
+        finally:
+            self.generations.pop(generation.id, None)
+
+    async def _switch_session(self, session_id: str | None):
+        if not is_session_id_valid(session_id):
+            await self.send_error(400, "Invalid session ID")
+            return
+        async with self.session_lock(session_id):
+            state = await self.load_session(session_id)
+            if state is None:
+                await self.send_error(404, "Session not found")
+                return
+            records = await asyncio.to_thread(
+                get_store().get_message_records, session_id
+            )
+        messages = [
+            Message(
+                id=str(record.message_id),
+                role=record.role == "human" and "user" or "assistant",
+                content=record.content,
+                name=record.name,
+                created_at=record.created_at,
+            ).model_dump(mode="json")
+            for record in records
+        ]
+        await self.send(
+            {
+                "type": "session",
+                "session": state.session.model_dump(),
+                "messages": messages,
+            }
+        )
+
+    async def _update_title(self, session_id: str | None, title: str | None):
+        if not is_session_id_valid(session_id):
+            await self.send_error(400, "Invalid session ID")
+            return
+        if not isinstance(title, str) or not title.strip() or len(title) > 255:
+            await self.send_error(400, "Invalid title")
+            return
+        store = get_store()
+        if await asyncio.to_thread(store.get_session, session_id) is None:
+            await self.send_error(404, "Session not found")
+            return
+        await asyncio.to_thread(store.update_session_title, session_id, title)
+        await self.announce_title(session_id, title)
+
+    async def announce_title(self, session_id: str, title: str):
+        state = self.sessions.get(session_id)
+        if state is not None:
+            state.session = state.session.model_copy(update={"title": title})
+        await self.send({"type": "title", "session_id": session_id, "title": title})
+
+    async def _heartbeat(self):
+        while True:
+            await asyncio.sleep(WS_HEARTBEAT_INTERVAL)
+            if time.monotonic() - self.last_seen > WS_HEARTBEAT_TIMEOUT:
+                print("Closing WebSocket chat connection: heartbeat timed out")
+                self.closed = True
+                await self.websocket.close(code=1001)
+                return
+            await self.send({"type": "ping"})
@@ -0,0 +1,196 @@
+"""
+This module contains the multi-model comparison mode.
+
+One prompt is run against several models concurrently. The chunks are
+streamed back interleaved and tagged with their model, followed by a
+result per model with its time to first token (TTFT) and throughput. Each
+model runs under a shared per-model concurrency limit and counts as in
+flight for admission control. The measurements go to the metrics and to
+`model_stats`, so model choices can be made from real traffic.
+"""
+
+import asyncio
+import os
+import threading
+import time
+from typing import AsyncIterator
+
+from langchain_core.messages import HumanMessage
+
+from lib import metrics
+from lib.admission import admission_controller
+from lib.ollama import get_llm
+from lib.profiles import record_generation
+from lib.prompts import chat_prompt
+from lib.residency import residency_manager
+from lib.utils import filter_think_stream
+
+COMPARE_MAX_MODELS = int(os.getenv("COMPARE_MAX_MODELS", 4))
+# Comparison generations running at once per model, across requests
+COMPARE_MAX_PER_MODEL = int(os.getenv("COMPARE_MAX_PER_MODEL", 2))
+# Weight of the latest generation in the smoothed model stats
+MODEL_STATS_ALPHA = 0.2
+
+metrics.describe("model_ttft_seconds", "summary", "Time to first token per model")
+metrics.describe(
+    "model_tokens_per_second", "summary", "Generation throughput per model"
+)
+metrics.describe(
+    "compare_generations_total",
+    "counter",
+    "Comparison generations per model and outcome",
+)
+
+_model_limits: dict[str, asyncio.Semaphore] = {}
+
+
+class ModelStats:
+    """
+    Smoothed TTFT and throughput per model, from the generations measured
+    so far in this process.
+    """
+
+    def __init__(self):
+        self.models: dict[str, dict] = {}
+        self._lock = threading.Lock()
+
+    def record(self, model: str, ttft: float, tokens_per_second: float):
+        metrics.observe("model_ttft_seconds", ttft, {"model": model})
+        metrics.observe("model_tokens_per_second", tokens_per_second, {"model": model})
+        with self._lock:
+            stats = self.models.get(model)
+            if stats is None:
+                self.models[model] = {
+                    "generations": 1,
+                    "ttft": ttft,
+                    "tokens_per_second": tokens_per_second,
+                }
+                return
+            stats["generations"] += 1
+            stats["ttft"] += MODEL_STATS_ALPHA * (ttft - stats["ttft"])
+            stats["tokens_per_second"] += MODEL_STATS_ALPHA * (
+                tokens_per_second - stats["tokens_per_second"]
+            )
+
+    def record_stream(
+        self, model: str, ttft: float, duration: float, tokens: int
+    ) -> float:
+        """
+        Records a streamed generation of `tokens` chunks, which Ollama sends
+        one token at a time. The throughput excludes the wait for the first
+        token.
+
+        Returns:
+            float: The throughput, in tokens per second.
+        """
+        generating = duration - ttft
+        tokens_per_second = (
+            (tokens - 1) / generating if tokens > 1 and generating > 0 else 0.0
+        )
+        self.record(model, ttft, tokens_per_second)
+        return tokens_per_second
+
+    def get(self, model: str) -> dict | None:
+        with self._lock:
+            stats = self.models.get(model)
+            return dict(stats) if stats else None
+
+    def status(self) -> list[dict]:
+        with self._lock:
+            return [
+                {
+                    "model": model,
+                    "generations": stats["generations"],
+                    "ttft_ms": round(stats["ttft"] * 1000, 1),
+                    "tokens_per_second": round(stats["tokens_per_second"], 1),
+                }
+                for model, stats in sorted(self.models.items())
+            ]
+
+
+model_stats = ModelStats()
+
+
+async def _generate(
+    model: str,
+    name: str,
+    content: str,
+    profile: str,
+    options: dict,
+    queue: asyncio.Queue,
+):
+    limit = _model_limits.setdefault(model, asyncio.Semaphore(COMPARE_MAX_PER_MODEL))
+    result = {"model": model, "done": True}
+    async with limit:
+        residency_manager.note_request(model)
+        tokens = 0
+        ttft = None
+
+        async def stream_tokens():
+            nonlocal tokens, ttft
+            async for token in llm.astream(prompt):
+                tokens += 1
+                if ttft is None:
+                    ttft = time.perf_counter() - start
+                    admission_controller.observe_ollama(ttft)
+                yield token
+
+        # Every failure must put an event, or `run_comparison` waits for it forever
+        try:
+            llm = get_llm(model, streaming=True, **options)
+            prompt = chat_prompt.render([HumanMessage(content=content, name=name)])
+            start = time.perf_counter()
+            with admission_controller.in_flight():
+                async for chunk in filter_think_stream(stream_tokens()):
+                    await queue.put({"model": model, "chunk": chunk})
+        except Exception as e:
+            print(f"Error comparing model {model}: {str(e)}")
+            metrics.inc(
+                "compare_generations_total", {"model": model, "status": "error"}
+            )
+            await queue.put({"model": model, "error": str(e)})
+            return
+
+    duration = time.perf_counter() - start
+    ttft = ttft if ttft is not None else duration
+    tokens_per_second = model_stats.record_stream(model, ttft, duration, tokens)
+    record_generation(profile, tokens, duration)
+    metrics.inc("compare_generations_total", {"model": model, "status": "ok"})
+    await queue.put(
+        result
+        | {
+            "tokens": tokens,
+            "ttft_ms": round(ttft * 1000, 1),
+            "duration_ms": round(duration * 1000, 1),
+            "tokens_per_second": round(tokens_per_second, 1),
+        }
+    )
+
+
+async def run_comparison(
+    name: str, content: str, models: list[str], profile: str, options: dict
+) -> AsyncIterator[dict]:
+    """
+    Runs a prompt against several models at once, with the same generation
+    profile and options.
+
+    Yields:
+        dict: `{"model", "chunk"}` as each model streams its answer, then
+        one `{"model", "done", "tokens", "ttft_ms", "duration_ms",
+        "tokens_per_second"}` or `{"model", "error"}` per model.
+    """
+    queue: asyncio.Queue[dict] = asyncio.Queue()
+    tasks = [
+        asyncio.create_task(_generate(model, name, content, profile, options, queue))
+        for model in models
+    ]
+    remaining = len(models)
+    try:
+        while remaining:
+            event = await queue.get()
+            if "chunk" not in event:
+                remaining -= 1
+            yield event
+    finally:
+        for task in tasks:
+            task.cancel()
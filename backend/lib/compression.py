@@ -0,0 +1,268 @@
+"""
+This module contains the opt-in response compression.
+
+With `COMPRESSION_ENABLED=true`, responses on `COMPRESSION_PATHS` are
+compressed with brotli or gzip, whichever the client's `Accept-Encoding`
+prefers. Among equally preferred encodings, complete responses use brotli
+(smaller than gzip for less CPU) and streamed ones use gzip (whose flushes
+cost fewer bytes). Brotli is only offered when the `brotli` package is
+installed.
+
+- Complete responses (`/session`, `/sessions`) are compressed when their
+  body is at least `COMPRESSION_MIN_SIZE` bytes. Smaller ones are sent as
+  is, since the encoding overhead outweighs the savings.
+- Streamed responses (`/stream`) are compressed as they go. Compressed data
+  is flushed to the client at chunk boundaries once
+  `COMPRESSION_STREAM_FLUSH_BYTES` are pending, or after
+  `COMPRESSION_STREAM_FLUSH_MS` at the latest. Flushing every token would
+  make the stream larger than uncompressed, because each flush adds a few
+  bytes and tokens are only a few bytes long.
+
+See `benchmarks/bench_compression.py` for the CPU and size trade-offs.
+"""
+
+import asyncio
+import os
+import zlib
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESSION_ENABLED = os.getenv("COMPRESSION_ENABLED", "false").lower() == "true"
+COMPRESSION_PATHS = {
+    path.strip()
+    for path in os.getenv("COMPRESSION_PATHS", "/session,/sessions,/stream").split(",")
+    if path.strip()
+}
+# Complete responses smaller than this many bytes are not compressed
+COMPRESSION_MIN_SIZE = int(os.getenv("COMPRESSION_MIN_SIZE", 1024))
+COMPRESSION_GZIP_LEVEL = int(os.getenv("COMPRESSION_GZIP_LEVEL", 6))
+COMPRESSION_BROTLI_QUALITY = int(os.getenv("COMPRESSION_BROTLI_QUALITY", 5))
+COMPRESSION_STREAM_FLUSH_BYTES = int(os.getenv("COMPRESSION_STREAM_FLUSH_BYTES", 64))
+COMPRESSION_STREAM_FLUSH_MS = float(os.getenv("COMPRESSION_STREAM_FLUSH_MS", 50))
+
+
+class GzipEncoder:
+    def __init__(self, level: int = COMPRESSION_GZIP_LEVEL):
+        self._compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    def compress(self, data: bytes) -> bytes:
+        return self._compressor.compress(data)
+
+    def flush(self) -> bytes:
+        """Returns the pending data, decodable by the client right away."""
+        return self._compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self) -> bytes:
+        return self._compressor.flush(zlib.Z_FINISH)
+
+
+class BrotliEncoder:
+    def __init__(self, quality: int = COMPRESSION_BROTLI_QUALITY):
+        self._compressor = brotli.Compressor(quality=quality)
+
+    def compress(self, data: bytes) -> bytes:
+        return self._compressor.process(data)
+
+    def flush(self) -> bytes:
+        """Returns the pending data, decodable by the client right away."""
+        return self._compressor.flush()
+
+    def finish(self) -> bytes:
+        return self._compressor.finish()
+
+
+ENCODERS = {"gzip": GzipEncoder}
+if brotli is not None:
+    ENCODERS["br"] = BrotliEncoder
+
+
+def negotiate_encoding(accept_encoding: str, streaming: bool = False) -> str | None:
+    """
+    Picks the encoding for a response from an `Accept-Encoding` header.
+
+    Args:
+        accept_encoding (str): The header's value.
+        streaming (bool): Whether the response is streamed, which makes gzip
+            win ties with brotli instead of the other way around.
+
+    Returns:
+        str | None: "br", "gzip", or None to send the response as is.
+    """
+    weights = {}
+    for entry in accept_encoding.split(","):
+        name, _, params = entry.strip().partition(";")
+        weight = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                weight = float(params[2:])
+            except ValueError:
+                weight = 0.0
+        if name:
+            weights[name.strip().lower()] = weight
+    best, best_weight = None, 0.0
+    preferred = "gzip" if streaming else "br"
+    for encoding in sorted(ENCODERS, key=lambda e: e != preferred):
+        weight = weights.get(encoding, weights.get("*", 0.0))
+        if weight > best_weight:
+            best, best_weight = encoding, weight
+    return best
+
+
+class _StreamCompressor:
+    """
+    Compresses a streamed response body, flushing at chunk boundaries once
+    enough data is pending or the oldest pending chunk is too old.
+    """
+
+    def __init__(self, send, encoder, flush_bytes: int, flush_seconds: float):
+        self.send = send
+        self.encoder = encoder
+        self.flush_bytes = flush_bytes
+        self.flush_seconds = flush_seconds
+        self.pending = 0
+        self.finished = False
+        self._timer: asyncio.Task | None = None
+        self._lock = asyncio.Lock()
+
+    async def body(self, chunk: bytes, more_body: bool):
+        async with self._lock:
+            data = self.encoder.compress(chunk)
+            self.pending += len(chunk)
+            if not more_body:
+                data += self.encoder.finish()
+                self.finished = True
+                self.cancel()
+            elif self.pending >= self.flush_bytes:
+                data += self._flush()
+            elif self.pending and self._timer is None:
+                self._timer = asyncio.create_task(self._flush_later())
+            if data or not more_body:
+                await self.send(
+                    {"type": "http.response.body", "body": data, "more_body": more_body}
+                )
+
+    def _flush(self) -> bytes:
+        self.pending = 0
+        self.cancel()
+        return self.encoder.flush()
+
+    async def _flush_later(self):
+        await asyncio.sleep(self.flush_seconds)
+        async with self._lock:
+            self._timer = None
+            if self.finished or not self.pending:
+                return
+            data = self._flush()
+            await self.send(
+                {"type": "http.response.body", "body": data, "more_body": True}
+            )
+
+    def cancel(self):
+        if self._timer is not None and self._timer is not asyncio.current_task():
+            self._timer.cancel()
+        self._timer = None
+
+
+class _Passthrough:
+    def __init__(self, send):
+        self.send = send
+
+    async def body(self, chunk: bytes, more_body: bool):
+        await self.send(
+            {"type": "http.response.body", "body": chunk, "more_body": more_body}
+        )
+
+    def cancel(self):
+        pass
+
+
+def _with_vary(headers: list[tuple[bytes, bytes]]) -> list[tuple[bytes, bytes]]:
+    vary = [value for name, value in headers if name == b"vary"]
+    return [(name, value) for name, value in headers if name != b"vary"] + [
+        (b"vary", b", ".join(vary + [b"Accept-Encoding"]))
+    ]
+
+
+class CompressionMiddleware:
+    """
+    ASGI middleware compressing the responses on `COMPRESSION_PATHS`.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if (
+            scope["type"] != "http"
+            or not COMPRESSION_ENABLED
+            or scope["path"] not in COMPRESSION_PATHS
+        ):
+            await self.app(scope, receive, send)
+            return
+        accept_encoding = ""
+        for name, value in scope["headers"]:
+            if name == b"accept-encoding":
+                accept_encoding = value.decode("latin-1")
+
+        start = None
+        stream: _StreamCompressor | _Passthrough | None = None
+
+        async def send_compressed(message):
+            nonlocal start, stream
+            if message["type"] == "http.response.start":
+                start = message
+                return
+            if message["type"] != "http.response.body":
+                await send(message)
+                return
+            body = message.get("body", b"")
+            more_body = message.get("more_body", False)
+            if stream is not None:
+                await stream.body(body, more_body)
+                return
+
+            # The first chunk tells whether the response is complete or streamed
+            encoding = negotiate_encoding(accept_encoding, streaming=more_body)
+            already_encoded = any(
+                name == b"content-encoding" for name, _ in start["headers"]
+            )
+            too_small = not more_body and len(body) < COMPRESSION_MIN_SIZE
+            if encoding is None or already_encoded or too_small:
+                await send(start | {"headers": _with_vary(start["headers"])})
+                stream = _Passthrough(send)
+                await stream.body(body, more_body)
+                return
+
+            headers = _with_vary(
+                [
+                    (name, value)
+                    for name, value in start["headers"]
+                    if name != b"content-length"
+                ]
+            )
+            headers.append((b"content-encoding", encoding.encode()))
+            encoder = ENCODERS[encoding]()
+            if not more_body:
+                compressed = encoder.compress(body) + encoder.finish()
+                headers.append((b"content-length", str(len(compressed)).encode()))
+                await send(start | {"headers": headers})
+                await send({"type": "http.response.body", "body": compressed})
+                return
+            await send(start | {"headers": headers})
+            stream = _StreamCompressor(
+                send,
+                encoder,
+                COMPRESSION_STREAM_FLUSH_BYTES,
+                COMPRESSION_STREAM_FLUSH_MS / 1000,
+            )
+            await stream.body(body, more_body)
+
+        try:
+            await self.app(scope, receive, send_compressed)
+        finally:
+            if stream is not None:
+                stream.cancel()
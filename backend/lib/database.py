@@ -1,11 +1,23 @@
 import os
+import tempfile
+import threading
 import psycopg
-from psycopg import Connection
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Iterator
+from psycopg import Connection, pq
 from lib.types import Session
-from langchain_postgres import PostgresChatMessageHistory
+from lib.cache import sessions_cache
+from lib.search import create_search_tables
 
 # Database configuration
 table_name = "bd_chat_history"
+# "postgres", or "sqlite" for single-box and test deployments (see lib/store.py)
+STORAGE_BACKENDS = ("postgres", "sqlite")
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "postgres")
+if STORAGE_BACKEND not in STORAGE_BACKENDS:
+    print(f"Unknown STORAGE_BACKEND {STORAGE_BACKEND}, using postgres")
+    STORAGE_BACKEND = "postgres"
 CONNECTION_STRING = (
     f"postgresql://{os.getenv('POSTGRES_USER', 'myuser')}:{os.getenv('POSTGRES_PASSWORD', 'mypassword')}@{os.getenv('POSTGRES_HOST', 'localhost')}"
     f":{os.getenv('POSTGRES_PORT', 5432)}/{os.getenv('POSTGRES_DB', 'mydatabase')}"
@@ -24,6 +36,99 @@ def create_db_sessions_table(conn: Connection):
             )
             """
         )
+        # Set on each title change, so the sessions version changes with it
+        cur.execute(
+            "ALTER TABLE db_sessions ADD COLUMN IF NOT EXISTS updated_at TIMESTAMPTZ"
+        )
+        # Backs the keyset pagination in `get_sessions_page`
+        cur.execute(
+            """
+            CREATE INDEX IF NOT EXISTS db_sessions_username_created_at_idx
+            ON db_sessions (username, created_at DESC, id DESC)
+            """
+        )
+        conn.commit()
+
+
+def create_db_session_summaries_table(conn: Connection):
+    with conn.cursor() as cur:
+        cur.execute(
+            """
+            CREATE TABLE IF NOT EXISTS db_session_summaries (
+                session_id UUID PRIMARY KEY REFERENCES db_sessions (id) ON DELETE CASCADE,
+                summary TEXT NOT NULL,
+                summarized_until INTEGER NOT NULL,
+                updated_at TIMESTAMPTZ DEFAULT CURRENT_TIMESTAMP
+            )
+            """
+        )
+        conn.commit()
+
+
+def create_db_batch_results_table(conn: Connection):
+    with conn.cursor() as cur:
+        cur.execute(
+            """
+            CREATE TABLE IF NOT EXISTS db_batch_results (
+                batch_id UUID NOT NULL,
+                item_index INTEGER NOT NULL,
+                result JSONB NOT NULL,
+                created_at TIMESTAMPTZ DEFAULT CURRENT_TIMESTAMP,
+                PRIMARY KEY (batch_id, item_index)
+            )
+            """
+        )
+        conn.commit()
+
+
+def create_db_rate_limits_table(conn: Connection):
+    with conn.cursor() as cur:
+        cur.execute(
+            """
+            CREATE TABLE IF NOT EXISTS db_rate_limits (
+                key VARCHAR(255) NOT NULL,
+                budget VARCHAR(32) NOT NULL,
+                tokens DOUBLE PRECISION NOT NULL,
+                updated_at TIMESTAMPTZ NOT NULL DEFAULT clock_timestamp(),
+                PRIMARY KEY (key, budget)
+            )
+            """
+        )
+        conn.commit()
+
+
+def create_db_usage_table(conn: Connection):
+    with conn.cursor() as cur:
+        cur.execute(
+            """
+            CREATE TABLE IF NOT EXISTS db_usage (
+                username VARCHAR(255) NOT NULL,
+                day DATE NOT NULL,
+                requests INTEGER NOT NULL DEFAULT 0,
+                generated_tokens BIGINT NOT NULL DEFAULT 0,
+                rejected INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (username, day)
+            )
+            """
+        )
+        conn.commit()
+
+
+def create_db_session_archive_table(conn: Connection):
+    with conn.cursor() as cur:
+        cur.execute(
+            """
+            CREATE TABLE IF NOT EXISTS db_session_archive (
+                session_id UUID PRIMARY KEY REFERENCES db_sessions (id) ON DELETE CASCADE,
+                data BYTEA,
+                path TEXT,
+                message_count INTEGER NOT NULL,
+                hot_bytes BIGINT NOT NULL,
+                archived_bytes BIGINT NOT NULL,
+                archived_at TIMESTAMPTZ DEFAULT CURRENT_TIMESTAMP
+            )
+            """
+        )
         conn.commit()
 
 
@@ -53,7 +158,7 @@ def get_session_by_id(conn: Connection, session_id: str) -> Session | None:
 
 def create_session_if_not_exists(
     conn: Connection, session_id: str, user_name: str, session_title: str
-):
+) -> Session:
     """
     Create a new session in the database if it does not exist.
 
@@ -62,31 +167,317 @@ def create_session_if_not_exists(
         session_id (str): The UUID of the session to create.
         user_name (str): The username of the user creating the session.
         session_title (str): The title of the session.
+
+    Returns:
+        Session: The stored session, which is the existing one if another
+        request created it first.
     """
     with conn.cursor() as cur:
+        # The no-op update makes RETURNING also return an existing row
         cur.execute(
             """
             INSERT INTO db_sessions (id, username, title)
             VALUES (%s, %s, %s)
-            ON CONFLICT (id) DO NOTHING
+            ON CONFLICT (id) DO UPDATE SET title = db_sessions.title
+            RETURNING id, username, title, xmax = 0
             """,
             (session_id, user_name, session_title),
+            prepare=True,
         )
+        row = cur.fetchone()
         conn.commit()
+    if row[3]:
+        sessions_cache.invalidate(user_name)
+    return Session(id=str(row[0]), title=row[2], username=row[1])
+
+
+def update_session_title(conn: Connection, session_id: str, session_title: str):
+    """
+    Replace the title of an existing session.
+
+    Args:
+        conn (Connection): The active database connection.
+        session_id (str): The UUID of the session to update.
+        session_title (str): The new title of the session.
+    """
+    with conn.cursor() as cur:
+        cur.execute(
+            """
+            UPDATE db_sessions SET title = %s, updated_at = clock_timestamp()
+            WHERE id = %s RETURNING username
+            """,
+            (session_title, session_id),
+        )
+        row = cur.fetchone()
+        conn.commit()
+    if row:
+        sessions_cache.invalidate(row[0])
+
+
+def get_sessions_version(conn: Connection, user_name: str) -> str:
+    """
+    Returns a version string that changes whenever the user's sessions change.
+
+    Args:
+        conn (Connection): The active database connection.
+        user_name (str): The username to compute the version for.
+
+    Returns:
+        str: The version string, built from the session count and latest creation
+        and title change times.
+    """
+    with conn.cursor() as cur:
+        cur.execute(
+            """
+            SELECT COUNT(*), MAX(created_at), MAX(updated_at) FROM db_sessions
+            WHERE username = %s
+            """,
+            (user_name,),
+        )
+        count, created, updated = cur.fetchone()
+        return ":".join(
+            [
+                str(count),
+                *(value.isoformat() if value else "" for value in (created, updated)),
+            ]
+        )
+
+
+def get_sessions_page(
+    conn: Connection,
+    user_name: str,
+    limit: int,
+    after: tuple[datetime, str] | None = None,
+) -> tuple[list[Session], tuple[datetime, str] | None]:
+    """
+    Retrieves one page of a user's sessions, newest first, using keyset pagination.
+
+    Args:
+        conn (Connection): The active database connection.
+        user_name (str): The username to retrieve sessions for.
+        limit (int): The maximum number of sessions to return.
+        after (tuple[datetime, str] | None): The (created_at, id) of the last session on the previous page.
+
+    Returns:
+        tuple[list[Session], tuple[datetime, str] | None]: The sessions and the key of
+        the last one if there are more pages, otherwise None.
+    """
+    with conn.cursor() as cur:
+        if after:
+            cur.execute(
+                """
+                SELECT id, username, title, created_at FROM db_sessions
+                WHERE username = %s AND (created_at, id) < (%s, %s)
+                ORDER BY created_at DESC, id DESC
+                LIMIT %s
+                """,
+                (user_name, after[0], after[1], limit + 1),
+            )
+        else:
+            cur.execute(
+                """
+                SELECT id, username, title, created_at FROM db_sessions
+                WHERE username = %s
+                ORDER BY created_at DESC, id DESC
+                LIMIT %s
+                """,
+                (user_name, limit + 1),
+            )
+        rows = cur.fetchall()
+
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    sessions = [Session(id=str(row[0]), title=row[2], username=row[1]) for row in rows]
+    next_key = (rows[-1][3], str(rows[-1][0])) if has_more else None
+    return sessions, next_key
+
+
+def run_migrations(conn: Connection):
+    """
+    Creates every table and index the backend needs. All statements are
+    idempotent, so this is safe to run on each startup.
+
+    Args:
+        conn (Connection): The active database connection.
+    """
+    # Imported here since langchain_postgres is slow to import
+    from langchain_postgres import PostgresChatMessageHistory
+
+    from lib.branches import create_branch_tables
+    from lib.storage import create_compact_storage, migrate_message_rows
+    from lib.transfer import create_transfer_indexes
+
+    PostgresChatMessageHistory.create_tables(conn, table_name)
+    create_compact_storage(conn, table_name)
+    migrated = migrate_message_rows(conn, table_name)
+    if migrated:
+        print(f"Migrated {migrated} messages to compact storage")
+    create_db_sessions_table(conn)
+    create_db_session_summaries_table(conn)
+    create_db_batch_results_table(conn)
+    create_db_rate_limits_table(conn)
+    create_db_usage_table(conn)
+    create_db_session_archive_table(conn)
+    create_search_tables(conn, table_name)
+    create_transfer_indexes(conn, table_name)
+    create_branch_tables(conn, table_name)
+
+
+_migrations_applied = False
 
 
 def get_db_connection() -> Connection:
     """
-    Creates and returns a database connection, initializing required tables.
+    Creates and returns a database connection, running the migrations the
+    first time a connection is made in this process.
 
     Returns:
         Connection: An active database connection
     """
-    connection = psycopg.connect(CONNECTION_STRING)
-    PostgresChatMessageHistory.create_tables(connection, table_name)
-    create_db_sessions_table(connection)
+    global _migrations_applied
+    connection = psycopg.connect(CONNECTION_STRING, connect_timeout=5)
+    if not _migrations_applied:
+        run_migrations(connection)
+        _migrations_applied = True
     return connection
 
 
-# Initialize the connection
-sync_connection = get_db_connection()
+_sync_connection: Connection | None = None
+_autocommit_connection: Connection | None = None
+_sync_connection_lock = threading.Lock()
+# Held by the thread using the shared connection, see `sync_transaction`
+_sync_transaction_lock = threading.RLock()
+
+
+def get_sync_connection() -> Connection:
+    """
+    Returns the connection shared by the API routes, connecting on first use
+    and reconnecting if the previous connection was closed.
+
+    Returns:
+        Connection: The shared database connection.
+    """
+    global _sync_connection
+    with _sync_connection_lock:
+        if _sync_connection is None or _sync_connection.closed:
+            _sync_connection = get_db_connection()
+        return _sync_connection
+
+
+@contextmanager
+def sync_transaction() -> Iterator[Connection]:
+    """
+    Lends the shared connection for one transaction, committed on success
+    and rolled back on error. Routes use it from worker threads, so it is
+    lent to one thread at a time: otherwise their statements would share a
+    transaction, and one thread's rollback would discard another's work.
+
+    Yields:
+        Connection: The shared database connection.
+    """
+    with _sync_transaction_lock:
+        conn = get_sync_connection()
+        try:
+            yield conn
+            conn.commit()
+        except Exception:
+            if not conn.broken:
+                conn.rollback()
+            raise
+
+
+def get_autocommit_connection() -> Connection:
+    """
+    Returns the autocommit connection shared by the chat path. Each statement
+    is its own transaction, which saves the BEGIN and COMMIT round trips;
+    work spanning several statements must use `conn.transaction()`.
+
+    Returns:
+        Connection: The shared autocommit connection.
+    """
+    global _autocommit_connection
+    with _sync_connection_lock:
+        if _autocommit_connection is None or _autocommit_connection.closed:
+            _autocommit_connection = get_db_connection()
+            _autocommit_connection.autocommit = True
+        return _autocommit_connection
+
+
+def close_sync_connection():
+    global _sync_connection, _autocommit_connection
+    with _sync_connection_lock:
+        for conn in (_sync_connection, _autocommit_connection):
+            if conn is not None:
+                conn.close()
+        _sync_connection = None
+        _autocommit_connection = None
+
+
+class RoundTripCounter:
+    """
+    Counts the client/server round trips made on a connection in a block,
+    from the libpq protocol trace: each time the client sends messages and
+    then waits for the server. Linux only, for benchmarks and tests.
+    """
+
+    def __init__(self, conn: Connection):
+        self.conn = conn
+        self.count = 0
+
+    def __enter__(self) -> "RoundTripCounter":
+        self._trace = tempfile.TemporaryFile()
+        self.conn.pgconn.trace(self._trace.fileno())
+        self.conn.pgconn.set_trace_flags(pq.Trace.SUPPRESS_TIMESTAMPS)
+        return self
+
+    def __exit__(self, *exc_info):
+        # Also flushes the trace
+        self.conn.pgconn.untrace()
+        self._trace.seek(0)
+        previous = None
+        for line in self._trace.read().decode("utf-8", "replace").splitlines():
+            direction = line.split("\t", 1)[0]
+            if direction == "B" and previous == "F":
+                self.count += 1
+            previous = direction
+        self._trace.close()
+
+
+def check_database() -> bool:
+    """
+    Checks that the shared connection can reach the database.
+
+    Returns:
+        bool: True if a trivial query succeeds.
+    """
+    try:
+        with sync_transaction() as conn, conn.cursor() as cur:
+            cur.execute("SELECT 1")
+        return True
+    except Exception as e:
+        print(f"Database check failed: {str(e)}")
+        if _sync_connection is not None and _sync_connection.broken:
+            close_sync_connection()
+        return False
+
+
+def get_chat_history(conn: Connection, session_id: str):
+    """
+    Returns the LangChain message history of a session.
+
+    Args:
+        conn (Connection): The active database connection.
+        session_id (str): The UUID of the session.
+
+    Returns:
+        CompactChatMessageHistory: The session's message history.
+    """
+    from lib.storage import CompactChatMessageHistory
+
+    return CompactChatMessageHistory(table_name, session_id, sync_connection=conn)
+
+
+if __name__ == "__main__":
+    # Apply migrations without starting the API, e.g. from a deploy step
+    get_db_connection().close()
+    print("✅ Migrations applied")
@@ -0,0 +1,128 @@
+"""
+This module contains the long-term memory layer across sessions.
+
+Past turns are embedded asynchronously by a background worker that batches
+writes from many requests. At prompt time, the most relevant snippets from the
+user's other sessions are retrieved and passed to the model as a single system
+message, so answers can use cross-session context without replaying whole
+histories.
+"""
+
+import os
+
+from langchain_core.messages import SystemMessage
+from psycopg import Connection
+
+from lib.database import STORAGE_BACKEND, table_name
+from lib.workers import SessionWorker
+from lib.search import get_embedding_model, index_session_embeddings, vector_index
+from lib.ollama import get_embeddings
+from lib.storage import decompress_content
+
+MEMORY_TOP_K = int(os.getenv("MEMORY_TOP_K", 3))
+MEMORY_MIN_SCORE = float(os.getenv("MEMORY_MIN_SCORE", 0.5))
+MEMORY_SNIPPET_LENGTH = 500
+
+
+def is_memory_enabled() -> bool:
+    return (
+        STORAGE_BACKEND == "postgres"
+        and MEMORY_TOP_K > 0
+        and get_embedding_model() is not None
+    )
+
+
+def retrieve_memories(
+    conn: Connection,
+    username: str,
+    query: str,
+    exclude_session_id: str,
+    query_vector: list[float] | None = None,
+) -> list[str]:
+    """
+    Retrieves the user's past turns most relevant to the query.
+
+    Args:
+        conn (Connection): The active database connection.
+        username (str): The user whose memory is searched.
+        query (str): The new user message.
+        exclude_session_id (str): The current session, whose history is already in the prompt.
+        query_vector (list[float] | None): The query's embedding, computed if not given.
+
+    Returns:
+        list[str]: Up to `MEMORY_TOP_K` formatted snippets, most relevant first.
+    """
+    if query_vector is None:
+        query_vector = get_embeddings([query], get_embedding_model())[0]
+    # Over-fetch since matches from the current session are dropped
+    matches = vector_index.query(
+        conn, table_name, username, query_vector, MEMORY_TOP_K * 4
+    )
+    scores = {id: score for id, score in matches if score >= MEMORY_MIN_SCORE}
+    if not scores:
+        return []
+
+    with conn.cursor() as cur:
+        cur.execute(
+            f"""
+            SELECT id, role, content, content_zstd, created_at
+            FROM {table_name}
+            WHERE id = ANY(%s) AND session_id <> %s
+            """,
+            (list(scores), exclude_session_id),
+        )
+        rows = [
+            (
+                row[0],
+                row[1],
+                decompress_content(row[2], row[3])[:MEMORY_SNIPPET_LENGTH],
+                row[4],
+            )
+            for row in cur.fetchall()
+        ]
+
+    rows.sort(key=lambda row: scores[row[0]], reverse=True)
+    return [
+        f"[{row[3]:%Y-%m-%d}] {row[1] == 'human' and 'User' or 'Assistant'}: {row[2]}"
+        for row in rows[:MEMORY_TOP_K]
+    ]
+
+
+def build_memory_message(memories: list[str]) -> list[SystemMessage]:
+    """
+    Wraps retrieved memories into the system message inserted into the prompt.
+
+    Returns:
+        list[SystemMessage]: A single message, or an empty list if there are no memories.
+    """
+    if not memories:
+        return []
+    return [
+        SystemMessage(
+            content="Relevant excerpts from the user's earlier conversations. "
+            "Use them only if they help answer the current message:\n\n"
+            + "\n\n".join(memories)
+        )
+    ]
+
+
+class EmbeddingWorker(SessionWorker):
+    """
+    Background worker that embeds newly written messages in batches across
+    sessions.
+    """
+
+    name = "embedding-worker"
+
+    def is_enabled(self) -> bool:
+        return get_embedding_model() is not None
+
+    def process(self, conn: Connection, session_ids: list[str]):
+        count = index_session_embeddings(conn, table_name, session_ids, self.batch_size)
+        print(f"Embedded {count} messages from {len(session_ids)} sessions")
+
+
+embedding_worker = EmbeddingWorker(
+    batch_size=int(os.getenv("EMBEDDING_BATCH_SIZE", 32)),
+    max_wait=float(os.getenv("EMBEDDING_BATCH_WAIT", 2.0)),
+)
@@ -0,0 +1,88 @@
+"""
+This module contains a minimal in-process metrics registry.
+
+Metrics are counters, gauges and summaries (count and sum) identified by a name
+and a set of labels, rendered in the Prometheus text format by `/metrics`.
+"""
+
+import threading
+from collections import defaultdict
+
+_HELP: dict[str, tuple[str, str]] = {}
+_values: dict[str, dict[tuple, float]] = defaultdict(dict)
+_lock = threading.Lock()
+
+
+def _key(labels: dict[str, str] | None) -> tuple:
+    return tuple(sorted((labels or {}).items()))
+
+
+def describe(name: str, kind: str, help: str):
+    """
+    Registers a metric's type ("counter", "gauge" or "summary") and help text.
+    """
+    _HELP[name] = (kind, help)
+
+
+def inc(name: str, labels: dict[str, str] | None = None, value: float = 1):
+    with _lock:
+        series = _values[name]
+        key = _key(labels)
+        series[key] = series.get(key, 0) + value
+
+
+def set_gauge(name: str, value: float, labels: dict[str, str] | None = None):
+    with _lock:
+        _values[name][_key(labels)] = value
+
+
+def observe(name: str, value: float, labels: dict[str, str] | None = None):
+    """
+    Records one observation of a summary metric.
+    """
+    with _lock:
+        key = _key(labels)
+        count, total = _values[f"{name}_count"], _values[f"{name}_sum"]
+        count[key] = count.get(key, 0) + 1
+        total[key] = total.get(key, 0) + value
+
+
+def get_value(name: str, labels: dict[str, str] | None = None) -> float:
+    with _lock:
+        return _values.get(name, {}).get(_key(labels), 0)
+
+
+def _family(name: str) -> str:
+    for suffix in ("_count", "_sum"):
+        base = name.removesuffix(suffix)
+        if base != name and _HELP.get(base, ("",))[0] == "summary":
+            return base
+    return name
+
+
+def render() -> str:
+    """
+    Renders every metric in the Prometheus text exposition format.
+    """
+    lines = []
+    with _lock:
+        families: dict[str, list[str]] = defaultdict(list)
+        for name in _values:
+            families[_family(name)].append(name)
+
+        for family in sorted(families):
+            if family in _HELP:
+                kind, help = _HELP[family]
+                lines.append(f"# HELP {family} {help}")
+                lines.append(f"# TYPE {family} {kind}")
+            for name in sorted(families[family]):
+                for key, value in sorted(_values[name].items()):
+                    labels = ",".join(f'{k}="{v}"' for k, v in key)
+                    series = f"{name}{{{labels}}}" if labels else name
+                    lines.append(f"{series} {value:g}")
+    return "\n".join(lines) + "\n"
+
+
+def reset():
+    with _lock:
+        _values.clear()
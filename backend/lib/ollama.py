@@ -1,45 +1,213 @@
 import os
-import requests
+import ssl
+import httpx
 from dotenv import load_dotenv
-from langchain_core.prompts import ChatPromptTemplate
 from langchain_core.messages import HumanMessage
-from langchain_ollama.llms import OllamaLLM
 
-from lib.prompts import title_sys_msg
+from lib.cassette import CassetteTransport, cassette_client_kwargs, get_cassette
+from lib.prompts import summary_prompt, title_prompt
+from lib.utils import strip_think_blocks
 
 load_dotenv()
 
 
+def parse_model_settings(value: str) -> dict[str, str]:
+    """
+    Parses per-model settings of the form "gemma3:1b=24h,qwen3:0.6b=10m".
+
+    Returns:
+        dict[str, str]: The setting for each model.
+    """
+    settings = {}
+    for entry in value.split(","):
+        model, _, setting = entry.strip().rpartition("=")
+        if model and setting:
+            settings[model] = setting
+    return settings
+
+
+MODEL_KEEP_ALIVE = parse_model_settings(os.getenv("MODEL_KEEP_ALIVE", ""))
+TITLE_MODEL = os.getenv("TITLE_MODEL", "gemma3:1b")
+
+
+def get_keep_alive(model: str) -> str | None:
+    """
+    Returns how long Ollama should keep a model loaded after a request, from
+    `MODEL_KEEP_ALIVE` or `DEFAULT_KEEP_ALIVE`. None leaves Ollama's default.
+    """
+    return MODEL_KEEP_ALIVE.get(model) or os.getenv("DEFAULT_KEEP_ALIVE") or None
+
+
+_ssl_context: ssl.SSLContext | None = None
+
+
+def get_ssl_context() -> ssl.SSLContext:
+    global _ssl_context
+    if _ssl_context is None:
+        _ssl_context = httpx.create_ssl_context()
+    return _ssl_context
+
+
+def get_llm(model: str, **kwargs):
+    """
+    Creates an Ollama LLM client for the given model.
+
+    Args:
+        model (str): The name of the model.
+        **kwargs: Extra options passed to `OllamaLLM`, e.g. `streaming=True`.
+
+    Returns:
+        OllamaLLM: The LLM client.
+    """
+    # Imported here since langchain_ollama is slow to import
+    from langchain_ollama.llms import OllamaLLM
+
+    kwargs.setdefault("keep_alive", get_keep_alive(model))
+    # Each client would otherwise load the CA certificates again, blocking
+    # for tens of milliseconds
+    client_kwargs = {"verify": get_ssl_context()}
+    kwargs.setdefault("sync_client_kwargs", client_kwargs)
+    kwargs.setdefault("async_client_kwargs", client_kwargs)
+    for key, value in cassette_client_kwargs().items():
+        kwargs[key] = kwargs[key] | value
+    return OllamaLLM(model=model, base_url=os.getenv("OLLAMA_BASE_URL"), **kwargs)
+
+
+_http_client: httpx.Client | None = None
+
+
+def get_http_client() -> httpx.Client:
+    """
+    Returns the shared HTTP client for Ollama's API. It goes through the
+    Ollama cassette when one is configured.
+    """
+    global _http_client
+    if _http_client is None:
+        cassette = get_cassette()
+        _http_client = httpx.Client(
+            transport=CassetteTransport(cassette) if cassette else None,
+            timeout=None,
+        )
+    return _http_client
+
+
 def get_ollama_models() -> list[dict]:
     """
     Retrieves the list of available models from the Ollama backend.
     This function queries the Ollama API to check which models are available for chat completions and inferences.
     """
-    response = requests.get(
+    response = get_http_client().get(
         f"{os.getenv('OLLAMA_BASE_URL', 'http://localhost:11434')}/api/tags"
     )
     models = response.json()["models"]
     return models
 
 
+def check_ollama() -> bool:
+    """
+    Checks that the Ollama backend is reachable.
+
+    Returns:
+        bool: True if Ollama answers its tags endpoint.
+    """
+    try:
+        response = get_http_client().get(
+            f"{os.getenv('OLLAMA_BASE_URL', 'http://localhost:11434')}/api/tags",
+            timeout=2,
+        )
+        return response.status_code == 200
+    except httpx.HTTPError as e:
+        print(f"Ollama check failed: {str(e)}")
+        return False
+
+
+def get_running_models() -> list[dict]:
+    """
+    Retrieves the models currently loaded in Ollama's memory.
+
+    Returns:
+        list[dict]: One entry per loaded model, as returned by Ollama's ps API.
+    """
+    response = get_http_client().get(
+        f"{os.getenv('OLLAMA_BASE_URL', 'http://localhost:11434')}/api/ps",
+        timeout=5,
+    )
+    response.raise_for_status()
+    return response.json()["models"]
+
+
+def load_model(model: str, keep_alive: str | None = None):
+    """
+    Loads a model into memory without generating anything.
+
+    Args:
+        model (str): The name of the model.
+        keep_alive (str | None): How long Ollama keeps the model loaded, e.g. "30m".
+    """
+    payload = {"model": model, "prompt": ""}
+    if keep_alive:
+        payload["keep_alive"] = keep_alive
+    response = get_http_client().post(
+        f"{os.getenv('OLLAMA_BASE_URL', 'http://localhost:11434')}/api/generate",
+        json=payload,
+        timeout=300,
+    )
+    response.raise_for_status()
+
+
 def get_ollama_models_names() -> list[str]:
     models = get_ollama_models()
     return [model["name"] for model in models]
 
 
-def get_session_title(usr_msg: str) -> str:
-    prompt = ChatPromptTemplate.from_messages(
-        [title_sys_msg, HumanMessage(content=usr_msg)]
-    )
-    model = OllamaLLM(
-        model="gemma3:1b",
-        base_url=os.getenv("OLLAMA_BASE_URL"),
+def get_embeddings(texts: list[str], model: str) -> list[list[float]]:
+    """
+    Computes embeddings for a batch of texts with a single Ollama request.
+
+    Args:
+        texts (list[str]): The texts to embed.
+        model (str): The name of the embedding model.
+
+    Returns:
+        list[list[float]]: One embedding per input text, in order.
+    """
+    if not texts:
+        return []
+    response = get_http_client().post(
+        f"{os.getenv('OLLAMA_BASE_URL', 'http://localhost:11434')}/api/embed",
+        json={"model": model, "input": texts},
     )
-    chain = prompt | model
-    response = chain.invoke({"content": usr_msg})
+    response.raise_for_status()
+    return response.json()["embeddings"]
+
+
+def get_session_title(usr_msg: str, model: str = TITLE_MODEL) -> str:
+    prompt = title_prompt.render([HumanMessage(content=usr_msg)])
+    response = get_llm(model).invoke(prompt)
 
     # Ensure the title never exceeds 255 characters
     if len(response) > 255:
         return response[:200]
 
     return response
+
+
+def summarize_conversation(previous_summary: str, transcript: str, model: str) -> str:
+    """
+    Folds new conversation turns into a running summary.
+
+    Args:
+        previous_summary (str): The current summary, empty for the first run.
+        transcript (str): The new turns, one "Role: content" block per message.
+        model (str): The name of the model used to summarize.
+
+    Returns:
+        str: The updated summary.
+    """
+    content = (
+        f"Current summary:\n{previous_summary or '(empty)'}\n\n"
+        f"New messages:\n{transcript}"
+    )
+    llm = get_llm(model)
+    response = llm.invoke(summary_prompt.render([HumanMessage(content=content)]))
+    return strip_think_blocks(response).strip()
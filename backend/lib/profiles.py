@@ -0,0 +1,121 @@
+"""
+This module contains the generation profiles.
+
+A profile is a named set of Ollama generation options (context size,
+maximum answer length, sampling). The built-in profiles are "fast",
+"balanced" and "long-form". `GENERATION_PROFILES` can add profiles or
+change options, as JSON, e.g. `{"fast": {"num_predict": 128}}`. A chat
+request picks a profile and may override some of its options. The server
+caps the context size and the answer length. The tokens and latency of each
+generation are recorded per profile.
+"""
+
+import json
+import os
+
+from lib import metrics
+from lib.types import GenerationOptions
+
+DEFAULT_PROFILES = {
+    "fast": {"num_ctx": 2048, "num_predict": 256, "temperature": 0.6},
+    "balanced": {"num_ctx": 4096, "num_predict": 1024},
+    "long-form": {"num_ctx": 8192, "num_predict": 4096},
+}
+# Options a profile may set; requests may only override those of GenerationOptions
+PROFILE_OPTIONS = set(GenerationOptions.model_fields) | {
+    "num_thread",
+    "num_gpu",
+    "keep_alive",
+}
+
+GENERATION_PROFILE = os.getenv("GENERATION_PROFILE", "balanced")
+GENERATION_MAX_CTX = int(os.getenv("GENERATION_MAX_CTX", 8192))
+GENERATION_MAX_PREDICT = int(os.getenv("GENERATION_MAX_PREDICT", 4096))
+
+metrics.describe("generation_requests_total", "counter", "Generations per profile")
+metrics.describe("generation_tokens_total", "counter", "Generated tokens per profile")
+metrics.describe("generation_seconds", "summary", "Generation latency per profile")
+
+
+def load_profiles(value: str) -> dict[str, dict]:
+    """
+    Returns the built-in profiles updated with the JSON in `value`.
+
+    Raises:
+        ValueError: If the JSON is invalid or sets an unknown option.
+    """
+    profiles = {name: dict(options) for name, options in DEFAULT_PROFILES.items()}
+    for name, options in (json.loads(value) if value else {}).items():
+        unknown = set(options) - PROFILE_OPTIONS
+        if unknown:
+            raise ValueError(
+                f"Unknown options in profile {name}: {', '.join(sorted(unknown))}"
+            )
+        profiles[name] = profiles.get(name, {}) | options
+    return profiles
+
+
+GENERATION_PROFILES = load_profiles(os.getenv("GENERATION_PROFILES", ""))
+
+
+def resolve_generation(
+    profile: str | None, overrides: GenerationOptions | None = None
+) -> tuple[str, dict]:
+    """
+    Returns the options a generation runs with: the profile's, then the
+    request's overrides, within the server caps. Generations without an
+    answer length limit are capped at `GENERATION_MAX_PREDICT` tokens.
+
+    Args:
+        profile (str | None): The profile name, defaults to `GENERATION_PROFILE`.
+        overrides (GenerationOptions | None): The request's overrides.
+
+    Returns:
+        tuple[str, dict]: The profile name and the options for `get_llm`.
+
+    Raises:
+        ValueError: If the profile is unknown or an option is over its cap.
+    """
+    name = profile or GENERATION_PROFILE
+    if name not in GENERATION_PROFILES:
+        raise ValueError(f"Unknown profile: {name}")
+    options = dict(GENERATION_PROFILES[name])
+    if overrides is not None:
+        options |= overrides.model_dump(exclude_none=True)
+
+    if options.get("num_ctx", 0) > GENERATION_MAX_CTX:
+        raise ValueError(f"num_ctx is capped at {GENERATION_MAX_CTX}")
+    if options.get("num_predict", -1) < 0:
+        options["num_predict"] = GENERATION_MAX_PREDICT
+    if options["num_predict"] > GENERATION_MAX_PREDICT:
+        raise ValueError(f"num_predict is capped at {GENERATION_MAX_PREDICT}")
+    return name, options
+
+
+def record_generation(profile: str, tokens: int, seconds: float):
+    metrics.inc("generation_requests_total", {"profile": profile})
+    metrics.inc("generation_tokens_total", {"profile": profile}, value=tokens)
+    metrics.observe("generation_seconds", seconds, {"profile": profile})
+
+
+def get_profiles_status() -> dict:
+    """
+    Returns the profiles with their options and the generations, tokens and
+    average latency recorded for each.
+    """
+    profiles = {}
+    for name, options in GENERATION_PROFILES.items():
+        labels = {"profile": name}
+        requests = metrics.get_value("generation_requests_total", labels)
+        seconds = metrics.get_value("generation_seconds_sum", labels)
+        profiles[name] = {
+            "options": options,
+            "generations": int(requests),
+            "tokens": int(metrics.get_value("generation_tokens_total", labels)),
+            "avg_seconds": round(seconds / requests, 3) if requests else None,
+        }
+    return {
+        "default": GENERATION_PROFILE,
+        "caps": {"num_ctx": GENERATION_MAX_CTX, "num_predict": GENERATION_MAX_PREDICT},
+        "profiles": profiles,
+    }
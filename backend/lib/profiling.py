@@ -0,0 +1,379 @@
+"""
+This module contains the in-process profiling tools behind the admin routes.
+
+- `SamplingProfiler` samples the stacks of every thread at a fixed interval
+  while it runs. The samples are returned as collapsed stacks (the input
+  format of flamegraph.pl and speedscope) or as an SVG flamegraph.
+- `CPUTimeMiddleware` charges the CPU time the event loop thread spends
+  running each request to its route. Blocking calls made directly in an
+  async route show up there, calls moved to a thread with
+  `asyncio.to_thread` do not.
+- `LoopLagMonitor` measures how late the event loop wakes up a sleeping
+  task, which is how long something blocked the loop.
+
+The admin routes are disabled unless `ADMIN_TOKEN` is set, and then need it
+in the `X-Admin-Token` header.
+"""
+
+import asyncio
+import html
+import os
+import secrets
+import sys
+import threading
+import time
+import types
+import zlib
+from collections import Counter
+
+from lib import metrics
+
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN") or None
+# Seconds between two samples of the profiler
+PROFILER_INTERVAL = float(os.getenv("PROFILER_INTERVAL_MS", 10)) / 1000
+# A profile left running is stopped after this many seconds
+PROFILER_MAX_SECONDS = float(os.getenv("PROFILER_MAX_SECONDS", 300))
+LOOP_LAG_INTERVAL = float(os.getenv("LOOP_LAG_INTERVAL", 0.5))
+# Lag above this many seconds counts as a stall
+LOOP_LAG_THRESHOLD = float(os.getenv("LOOP_LAG_THRESHOLD", 0.1))
+# Leaf frames of threads waiting for work, left out of profiles by default
+IDLE_FRAMES = {
+    ("selectors.py", "select"),
+    ("threading.py", "wait"),
+    ("threading.py", "_wait_for_tstate_lock"),
+    ("queue.py", "get"),
+    ("thread.py", "_worker"),
+    # uvloop waits for events in C, below asyncio.run
+    ("runners.py", "run"),
+}
+
+metrics.describe("endpoint_requests_total", "counter", "Requests per route")
+metrics.describe(
+    "endpoint_cpu_seconds_total", "counter", "Event loop CPU time per route"
+)
+metrics.describe("endpoint_wall_seconds_total", "counter", "Wall time per route")
+metrics.describe("event_loop_lag_seconds", "gauge", "Latest event loop lag")
+metrics.describe(
+    "event_loop_stalls_total", "counter", "Event loop lags above the threshold"
+)
+
+
+def is_admin_token(token: str | None) -> bool:
+    if ADMIN_TOKEN is None or token is None:
+        return False
+    return secrets.compare_digest(token.encode(), ADMIN_TOKEN.encode())
+
+
+def _frame_name(frame: types.FrameType) -> str:
+    code = frame.f_code
+    return (
+        f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+    )
+
+
+class SamplingProfiler:
+    """
+    Samples the Python stacks of all threads from a background thread.
+    """
+
+    def __init__(self):
+        self.stacks: Counter[tuple[str, bool]] = Counter()
+        self.samples = 0
+        self.interval = PROFILER_INTERVAL
+        self.started_at: float | None = None
+        self.duration = 0.0
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+        self._lock = threading.Lock()
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, interval: float | None = None, max_seconds: float | None = None):
+        """
+        Starts a new profile, discarding the previous one.
+
+        Raises:
+            RuntimeError: If a profile is already running.
+        """
+        if self.running:
+            raise RuntimeError("The profiler is already running")
+        with self._lock:
+            self.stacks = Counter()
+            self.samples = 0
+        self.interval = interval or PROFILER_INTERVAL
+        self.started_at = time.perf_counter()
+        self.duration = 0.0
+        self._stop.clear()
+        self._thread = threading.Thread(
+            target=self._run,
+            args=(max_seconds or PROFILER_MAX_SECONDS,),
+            name="sampling-profiler",
+            daemon=True,
+        )
+        self._thread.start()
+
+    def stop(self) -> dict:
+        """
+        Stops the running profile.
+
+        Returns:
+            dict: The profile summary.
+        """
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        return self.status()
+
+    def _run(self, max_seconds: float):
+        own_id = threading.get_ident()
+        deadline = self.started_at + max_seconds
+        while not self._stop.wait(self.interval) and time.perf_counter() < deadline:
+            self.sample(exclude={own_id})
+        self.duration = time.perf_counter() - self.started_at
+
+    def sample(self, exclude: set[int] = frozenset()):
+        """
+        Adds the current stack of every thread to the profile.
+        """
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        stacks = []
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id in exclude:
+                continue
+            leaf = (os.path.basename(frame.f_code.co_filename), frame.f_code.co_name)
+            frames = []
+            while frame is not None:
+                frames.append(_frame_name(frame))
+                frame = frame.f_back
+            frames.append(names.get(thread_id, str(thread_id)))
+            stacks.append((";".join(reversed(frames)), leaf in IDLE_FRAMES))
+        with self._lock:
+            self.samples += 1
+            for stack, idle in stacks:
+                self.stacks[(stack, idle)] += 1
+
+    def collapsed(self, idle: bool = False) -> str:
+        """
+        Returns the profile as collapsed stacks: one `frame;frame;... count`
+        line per distinct stack, root first, with the thread name as root.
+        """
+        with self._lock:
+            items = sorted(
+                (stack, count)
+                for (stack, is_idle), count in self.stacks.items()
+                if idle or not is_idle
+            )
+        return "".join(f"{stack} {count}\n" for stack, count in items)
+
+    def status(self) -> dict:
+        duration = (
+            time.perf_counter() - self.started_at if self.running else self.duration
+        )
+        return {
+            "running": self.running,
+            "samples": self.samples,
+            "interval_ms": round(self.interval * 1000, 3),
+            "seconds": round(duration, 3),
+        }
+
+
+def render_flamegraph(collapsed: str, title: str = "Flamegraph") -> str:
+    """
+    Renders collapsed stacks as a static SVG flamegraph, root at the bottom.
+    Hovering a frame shows its name and share of the samples.
+    """
+    root: dict = {"count": 0, "children": {}}
+    for line in collapsed.splitlines():
+        stack, _, count = line.rpartition(" ")
+        node = root
+        node["count"] += int(count)
+        for name in stack.split(";"):
+            node = node["children"].setdefault(name, {"count": 0, "children": {}})
+            node["count"] += int(count)
+
+    width, row = 1200, 16
+    rects = []
+
+    def depth(node: dict) -> int:
+        return 1 + max((depth(child) for child in node["children"].values()), default=0)
+
+    height = depth(root) * row + row * 2
+    total = root["count"] or 1
+
+    def draw(node: dict, x: float, level: int):
+        for name, child in sorted(node["children"].items()):
+            w = child["count"] / total * width
+            if w >= 0.5:
+                y = height - (level + 1) * row
+                label = html.escape(name)
+                share = child["count"] / total * 100
+                hue = 20 + zlib.crc32(name.encode()) % 40
+                text = html.escape(name[: int(w / 7)]) if w > 21 else ""
+                rects.append(
+                    f"<g><title>{label} ({child['count']} samples, {share:.1f}%)</title>"
+                    f'<rect x="{x:.1f}" y="{y}" width="{w:.1f}" height="{row - 1}" '
+                    f'fill="hsl({hue},90%,60%)"/>'
+                    f'<text x="{x + 3:.1f}" y="{y + row - 4}">{text}</text></g>'
+                )
+                draw(child, x, level + 1)
+            x += w
+
+    draw(root, 0.0, 1)
+    return (
+        f'<svg xmlns="http://www.w3.org/2000/svg" width="{width}" height="{height}" '
+        f'font-family="monospace" font-size="11">'
+        f'<text x="{width / 2}" y="{row}" text-anchor="middle">{html.escape(title)}</text>'
+        + "".join(rects)
+        + "</svg>"
+    )
+
+
+class EndpointTimes:
+    """
+    Requests, event loop CPU time and wall time per route.
+    """
+
+    def __init__(self):
+        self.endpoints: dict[str, list[float]] = {}
+        self._lock = threading.Lock()
+
+    def record(self, endpoint: str, cpu_seconds: float, wall_seconds: float):
+        labels = {"endpoint": endpoint}
+        metrics.inc("endpoint_requests_total", labels)
+        metrics.inc("endpoint_cpu_seconds_total", labels, value=cpu_seconds)
+        metrics.inc("endpoint_wall_seconds_total", labels, value=wall_seconds)
+        with self._lock:
+            totals = self.endpoints.setdefault(endpoint, [0, 0.0, 0.0])
+            totals[0] += 1
+            totals[1] += cpu_seconds
+            totals[2] += wall_seconds
+
+    def status(self) -> list[dict]:
+        """
+        Returns the routes by total CPU time, most expensive first.
+        """
+        with self._lock:
+            items = sorted(
+                self.endpoints.items(), key=lambda item: item[1][1], reverse=True
+            )
+            return [
+                {
+                    "endpoint": endpoint,
+                    "requests": int(requests),
+                    "cpu_seconds": round(cpu, 6),
+                    "avg_cpu_ms": round(cpu / requests * 1000, 3),
+                    "avg_wall_ms": round(wall / requests * 1000, 3),
+                }
+                for endpoint, (requests, cpu, wall) in items
+            ]
+
+
+endpoint_times = EndpointTimes()
+
+
+@types.coroutine
+def _timed_steps(coro, timing: list[float]):
+    """
+    Runs `coro` and adds the thread CPU time of each of its steps to
+    `timing[0]`. Only the time spent running the coroutine is counted, not
+    the time it waits while other tasks run.
+    """
+    value, error = None, None
+    while True:
+        start = time.thread_time()
+        try:
+            if error is not None:
+                awaited = coro.throw(error)
+            else:
+                awaited = coro.send(value)
+        except StopIteration as e:
+            return e.value
+        finally:
+            timing[0] += time.thread_time() - start
+        try:
+            value, error = (yield awaited), None
+        except GeneratorExit:
+            coro.close()
+            raise
+        except BaseException as e:
+            value, error = None, e
+
+
+class CPUTimeMiddleware:
+    """
+    ASGI middleware recording the event loop CPU time and wall time of each
+    HTTP request in `endpoint_times`, by route.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        timing = [0.0]
+        start = time.perf_counter()
+        try:
+            await _timed_steps(self.app(scope, receive, send), timing)
+        finally:
+            route = scope.get("route")
+            path = getattr(route, "path", None) or "unmatched"
+            endpoint_times.record(
+                f"{scope['method']} {path}", timing[0], time.perf_counter() - start
+            )
+
+
+class LoopLagMonitor:
+    """
+    Measures the event loop lag: how much later than asked a sleeping task
+    is woken up.
+    """
+
+    def __init__(
+        self, interval: float = LOOP_LAG_INTERVAL, threshold: float = LOOP_LAG_THRESHOLD
+    ):
+        self.interval = interval
+        self.threshold = threshold
+        self.lag = 0.0
+        self.max_lag = 0.0
+        self.total_lag = 0.0
+        self.checks = 0
+        self.stalls = 0
+
+    def observe(self, lag: float):
+        self.lag = lag
+        self.max_lag = max(self.max_lag, lag)
+        self.total_lag += lag
+        self.checks += 1
+        metrics.set_gauge("event_loop_lag_seconds", lag)
+        if lag > self.threshold:
+            self.stalls += 1
+            metrics.inc("event_loop_stalls_total")
+
+    async def run(self):
+        """
+        Measures the lag every `interval` seconds until cancelled.
+        """
+        while True:
+            start = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            self.observe(max(time.perf_counter() - start - self.interval, 0.0))
+
+    def status(self) -> dict:
+        return {
+            "lag_ms": round(self.lag * 1000, 3),
+            "max_lag_ms": round(self.max_lag * 1000, 3),
+            "avg_lag_ms": round(self.total_lag / self.checks * 1000, 3)
+            if self.checks
+            else None,
+            "checks": self.checks,
+            "stalls": self.stalls,
+            "threshold_ms": round(self.threshold * 1000, 3),
+        }
+
+
+sampling_profiler = SamplingProfiler()
+loop_lag_monitor = LoopLagMonitor()
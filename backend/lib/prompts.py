@@ -1,4 +1,29 @@
-from langchain_core.messages import SystemMessage
+from langchain_core.messages import BaseMessage, SystemMessage, get_buffer_string
+
+
+class CompiledPrompt:
+    """
+    A system prompt compiled once per process into the text the Ollama LLM
+    client sends for it. A prompt is rendered by appending the conversation
+    to that prefix. The messages are passed as literal messages: they are
+    never parsed as templates, so `{` in user content is kept as is.
+
+    The rendered text is the same as what `OllamaLLM` builds from the list of
+    messages, so rendering only skips the per-call conversion work.
+    """
+
+    def __init__(self, system: SystemMessage):
+        self.system = system
+        self.prefix = get_buffer_string([system])
+
+    def render(self, messages: list[BaseMessage]) -> str:
+        """
+        Returns the prompt text for the system prompt followed by `messages`.
+        """
+        if not messages:
+            return self.prefix
+        return f"{self.prefix}\n{get_buffer_string(messages)}"
+
 
 chat_sys_msg = SystemMessage(
     content="""
@@ -11,6 +36,8 @@ clearly, and helpfully while preserving conversation context.
    - Retain user-provided facts (names, preferences, prior topics) for the
      duration of the session.
    - Reference earlier exchanges when relevant to show continuity.
+   - You may be given excerpts from the user's earlier conversations; use
+     them only when they are relevant to the current message.
 
 2. Output Format
    - Wrap ALL private reasoning in a single block exactly once:
@@ -101,3 +128,26 @@ NEVER output these (bad examples):
 CRITICAL: Use exactly one emoji at the start, then only plain text for the title.
 """
 )
+
+summary_sys_msg = SystemMessage(
+    content="""
+/no_think
+You maintain a running summary of a conversation between a user and an assistant.
+You are given the current summary (possibly empty) and the next messages of the
+conversation. Write an updated summary that folds the new messages into it.
+
+Rules:
+1. Keep every fact the user shared about themselves (names, preferences, goals).
+2. Keep decisions, conclusions, open questions and any code or data the
+   conversation depends on, in condensed form.
+3. Drop greetings, filler and repeated information.
+4. Write in the third person ("The user asked...", "The assistant explained...").
+5. Use the same language as the conversation.
+6. Stay under 250 words.
+7. Output ONLY the summary text, without headings, quotes or commentary.
+"""
+)
+
+chat_prompt = CompiledPrompt(chat_sys_msg)
+title_prompt = CompiledPrompt(title_sys_msg)
+summary_prompt = CompiledPrompt(summary_sys_msg)
@@ -0,0 +1,365 @@
+"""
+This module contains the per-user rate limiter and usage accounting.
+
+Each client (by IP by default, see `RATE_LIMIT_KEY`) has two token buckets:
+one for requests and one for generated tokens. A request is admitted if its
+request bucket has a token left and its generated-tokens bucket is not in debt;
+the tokens a response generates are charged once it is complete, so one long
+answer can push the bucket into debt and delay the next request.
+
+Buckets live in a pluggable store: in-process (the default, O(1) per check) or
+Postgres (shared by several backend processes, one statement per check).
+Usage is counted in memory and persisted per user per day by a background task.
+"""
+
+import asyncio
+import math
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable
+from collections import OrderedDict
+from datetime import date
+
+import psycopg
+from psycopg import Connection
+
+from lib import metrics
+from lib.database import CONNECTION_STRING, get_db_connection
+
+# Budgets refill continuously; the per-minute amount is also the burst size (0 disables)
+RATE_LIMIT_REQUESTS_PER_MINUTE = float(os.getenv("RATE_LIMIT_REQUESTS_PER_MINUTE", 30))
+RATE_LIMIT_TOKENS_PER_MINUTE = float(os.getenv("RATE_LIMIT_TOKENS_PER_MINUTE", 20000))
+# "ip", "user+ip" or "user"; the username is chosen by the client, so "user"
+# alone only limits clients that cannot pick it (e.g. behind an authenticating proxy)
+RATE_LIMIT_KEY = os.getenv("RATE_LIMIT_KEY", "ip")
+# "memory" or "postgres"
+RATE_LIMIT_STORE = os.getenv("RATE_LIMIT_STORE", "memory")
+USAGE_FLUSH_INTERVAL = float(os.getenv("USAGE_FLUSH_INTERVAL", 10))
+
+metrics.describe(
+    "rate_limited_requests_total", "counter", "Requests rejected by the rate limiter"
+)
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Estimates the number of tokens in a text, for responses whose token count
+    Ollama does not report (about four characters per token).
+    """
+    return max(1, math.ceil(len(text) / 4))
+
+
+class MemoryBucketStore:
+    """
+    In-process token buckets, bounded to the `max_keys` most recently used.
+    An evicted bucket is simply full again on its next use.
+    """
+
+    def __init__(self, max_keys: int = 100_000):
+        self.max_keys = max_keys
+        self._buckets: OrderedDict[tuple[str, str], list[float]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _level(
+        self, key: str, budget: str, capacity: float, rate: float
+    ) -> list[float]:
+        now = time.monotonic()
+        bucket = self._buckets.get((key, budget))
+        if bucket is None:
+            bucket = self._buckets[(key, budget)] = [capacity, now]
+            if len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end((key, budget))
+            bucket[0] = min(capacity, bucket[0] + (now - bucket[1]) * rate)
+            bucket[1] = now
+        return bucket
+
+    def acquire(
+        self, key: str, budget: str, cost: float, capacity: float, rate: float
+    ) -> float:
+        with self._lock:
+            bucket = self._level(key, budget, capacity, rate)
+            if bucket[0] >= cost:
+                bucket[0] -= cost
+                return 0.0
+            return (cost - bucket[0]) / rate
+
+    def charge(
+        self, key: str, budget: str, amount: float, capacity: float, rate: float
+    ):
+        with self._lock:
+            self._level(key, budget, capacity, rate)[0] -= amount
+
+
+class PostgresBucketStore:
+    """
+    Token buckets in `db_rate_limits`, refilled and debited atomically in SQL,
+    so the limits hold across backend processes.
+
+    The store has its own autocommit connection by default, used by one
+    thread at a time: routes call it from worker threads.
+    """
+
+    # The refilled level of the bucket, reused by every statement
+    LEVEL = "LEAST(%(capacity)s, b.tokens + %(rate)s * EXTRACT(EPOCH FROM clock_timestamp() - b.updated_at))"
+
+    def __init__(self, get_conn: Callable[[], Connection] | None = None):
+        self.get_conn = get_conn or self._connect
+        self._conn: Connection | None = None
+        self._lock = threading.Lock()
+
+    def _connect(self) -> Connection:
+        if self._conn is None or self._conn.closed:
+            self._conn = get_db_connection()
+            self._conn.autocommit = True
+        return self._conn
+
+    @contextmanager
+    def _transaction(self):
+        with self._lock:
+            conn = self.get_conn()
+            try:
+                yield conn
+                conn.commit()
+            except psycopg.Error:
+                if not conn.broken:
+                    conn.rollback()
+                raise
+
+    def acquire(
+        self, key: str, budget: str, cost: float, capacity: float, rate: float
+    ) -> float:
+        params = {
+            "key": key,
+            "budget": budget,
+            "cost": cost,
+            "capacity": capacity,
+            "rate": rate,
+        }
+        with self._transaction() as conn, conn.cursor() as cur:
+            cur.execute(
+                f"""
+                INSERT INTO db_rate_limits AS b (key, budget, tokens)
+                VALUES (%(key)s, %(budget)s, %(capacity)s - %(cost)s)
+                ON CONFLICT (key, budget) DO UPDATE
+                SET tokens = {self.LEVEL} - %(cost)s, updated_at = clock_timestamp()
+                WHERE {self.LEVEL} >= %(cost)s
+                RETURNING tokens
+                """,
+                params,
+            )
+            granted = cur.fetchone() is not None
+            level = None
+            if not granted:
+                cur.execute(
+                    f"SELECT {self.LEVEL} FROM db_rate_limits b WHERE key = %(key)s AND budget = %(budget)s",
+                    params,
+                )
+                level = cur.fetchone()[0]
+        return 0.0 if granted else (cost - level) / rate
+
+    def charge(
+        self, key: str, budget: str, amount: float, capacity: float, rate: float
+    ):
+        params = {
+            "key": key,
+            "budget": budget,
+            "cost": amount,
+            "capacity": capacity,
+            "rate": rate,
+        }
+        with self._transaction() as conn, conn.cursor() as cur:
+            cur.execute(
+                f"""
+                INSERT INTO db_rate_limits AS b (key, budget, tokens)
+                VALUES (%(key)s, %(budget)s, %(capacity)s - %(cost)s)
+                ON CONFLICT (key, budget) DO UPDATE
+                SET tokens = {self.LEVEL} - %(cost)s, updated_at = clock_timestamp()
+                """,
+                params,
+            )
+
+
+class RateLimiter:
+    """
+    Checks and charges the request and generated-tokens budgets of a client.
+    """
+
+    def __init__(
+        self,
+        store,
+        requests_per_minute: float = RATE_LIMIT_REQUESTS_PER_MINUTE,
+        tokens_per_minute: float = RATE_LIMIT_TOKENS_PER_MINUTE,
+    ):
+        self.store = store
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+
+    def check(self, key: str) -> float:
+        """
+        Admits a request if the client has budget left, consuming one request.
+        Fails open if the store is unavailable.
+
+        Args:
+            key (str): The client key, see `get_client_key`.
+
+        Returns:
+            float: 0 if the request is admitted, otherwise the seconds to wait.
+        """
+        try:
+            if self.tokens_per_minute > 0:
+                # Only checks for debt, generated tokens are charged afterwards
+                wait = self.store.acquire(
+                    key,
+                    "tokens",
+                    0,
+                    self.tokens_per_minute,
+                    self.tokens_per_minute / 60,
+                )
+                if wait > 0:
+                    metrics.inc("rate_limited_requests_total", {"budget": "tokens"})
+                    return wait
+            if self.requests_per_minute > 0:
+                wait = self.store.acquire(
+                    key,
+                    "requests",
+                    1,
+                    self.requests_per_minute,
+                    self.requests_per_minute / 60,
+                )
+                if wait > 0:
+                    metrics.inc("rate_limited_requests_total", {"budget": "requests"})
+                    return wait
+        except psycopg.Error as e:
+            print(f"Error checking rate limit: {str(e)}")
+        return 0.0
+
+    def charge_tokens(self, key: str, tokens: int):
+        """
+        Charges the tokens generated for a client's request.
+        """
+        if self.tokens_per_minute <= 0:
+            return
+        try:
+            self.store.charge(
+                key,
+                "tokens",
+                tokens,
+                self.tokens_per_minute,
+                self.tokens_per_minute / 60,
+            )
+        except psycopg.Error as e:
+            print(f"Error charging rate limit: {str(e)}")
+
+
+def get_client_key(username: str, client_ip: str | None) -> str:
+    """
+    Returns the rate limit key of a client, by IP, username and IP, or
+    username depending on `RATE_LIMIT_KEY`. Clients without a known IP are
+    keyed by username.
+    """
+    if RATE_LIMIT_KEY == "user" or not client_ip:
+        return f"user:{username}"
+    if RATE_LIMIT_KEY == "user+ip":
+        return f"user:{username}:ip:{client_ip}"
+    return f"ip:{client_ip}"
+
+
+class UsageRecorder:
+    """
+    Counts requests, generated tokens and rejections per user per day in
+    memory, and periodically adds them to `db_usage`.
+    """
+
+    def __init__(self):
+        self._pending: dict[tuple[str, date], list[int]] = {}
+        self._lock = threading.Lock()
+
+    def add(self, username: str, requests: int = 0, tokens: int = 0, rejected: int = 0):
+        with self._lock:
+            counts = self._pending.setdefault((username, date.today()), [0, 0, 0])
+            counts[0] += requests
+            counts[1] += tokens
+            counts[2] += rejected
+
+    def flush(self, conn: Connection):
+        """
+        Persists the pending counts. Counts that fail to persist are kept for
+        the next flush.
+        """
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return
+        try:
+            with conn.cursor() as cur:
+                cur.executemany(
+                    """
+                    INSERT INTO db_usage (username, day, requests, generated_tokens, rejected)
+                    VALUES (%s, %s, %s, %s, %s)
+                    ON CONFLICT (username, day) DO UPDATE
+                    SET requests = db_usage.requests + EXCLUDED.requests,
+                        generated_tokens = db_usage.generated_tokens + EXCLUDED.generated_tokens,
+                        rejected = db_usage.rejected + EXCLUDED.rejected
+                    """,
+                    [(user, day, *counts) for (user, day), counts in pending.items()],
+                )
+            conn.commit()
+        except psycopg.Error:
+            conn.rollback()
+            for (user, day), counts in pending.items():
+                with self._lock:
+                    merged = self._pending.setdefault((user, day), [0, 0, 0])
+                    for i, value in enumerate(counts):
+                        merged[i] += value
+            raise
+
+    def _flush_with_own_connection(self):
+        with psycopg.connect(CONNECTION_STRING, connect_timeout=5) as conn:
+            self.flush(conn)
+
+    async def run(self):
+        """
+        Flushes the counts every `USAGE_FLUSH_INTERVAL` seconds until cancelled.
+        """
+        while True:
+            await asyncio.sleep(USAGE_FLUSH_INTERVAL)
+            try:
+                await asyncio.to_thread(self._flush_with_own_connection)
+            except Exception as e:
+                print(f"Error flushing usage: {str(e)}")
+
+
+def get_usage(conn: Connection, username: str, days: int) -> list[dict]:
+    """
+    Returns a user's daily usage for the last `days` days, newest first.
+    """
+    with conn.cursor() as cur:
+        cur.execute(
+            """
+            SELECT day, requests, generated_tokens, rejected FROM db_usage
+            WHERE username = %s AND day > CURRENT_DATE - %s
+            ORDER BY day DESC
+            """,
+            (username, days),
+        )
+        rows = cur.fetchall()
+        conn.commit()
+    return [
+        {
+            "day": row[0].isoformat(),
+            "requests": row[1],
+            "generated_tokens": row[2],
+            "rejected": row[3],
+        }
+        for row in rows
+    ]
+
+
+rate_limiter = RateLimiter(
+    PostgresBucketStore() if RATE_LIMIT_STORE == "postgres" else MemoryBucketStore()
+)
+usage_recorder = UsageRecorder()
@@ -0,0 +1,162 @@
+"""
+This module contains the model residency manager.
+
+It tracks which models Ollama has loaded (polling the ps API), forecasts demand
+per model from recent requests, and pre-warms models that are configured in
+`WARM_MODELS` or in demand but not loaded, so users do not pay the cold load on
+their first request. Loads, unloads and cold starts are exported as metrics.
+"""
+
+import asyncio
+import os
+import threading
+
+from lib import metrics
+from lib.ollama import get_keep_alive, get_running_models, load_model
+
+RESIDENCY_POLL_INTERVAL = float(os.getenv("RESIDENCY_POLL_INTERVAL", 30))
+# Requests per poll interval (smoothed) above which a model is kept warm
+RESIDENCY_WARM_THRESHOLD = float(os.getenv("RESIDENCY_WARM_THRESHOLD", 1))
+# Weight of the latest interval in the demand forecast
+RESIDENCY_DEMAND_ALPHA = 0.3
+
+metrics.describe(
+    "ollama_model_loads_total", "counter", "Models that became resident in Ollama"
+)
+metrics.describe(
+    "ollama_model_unloads_total", "counter", "Models that were evicted from Ollama"
+)
+metrics.describe(
+    "ollama_model_cold_starts_total",
+    "counter",
+    "Requests for a model that was not loaded",
+)
+metrics.describe(
+    "ollama_model_warmups_total",
+    "counter",
+    "Models pre-loaded by the residency manager",
+)
+metrics.describe("ollama_model_loaded", "gauge", "Whether a model is currently loaded")
+metrics.describe("ollama_model_demand", "gauge", "Forecast requests per poll interval")
+
+
+class ResidencyManager:
+    """
+    Tracks and manages which models are resident in Ollama.
+
+    The request path only calls `note_request`, which is an in-memory update.
+    Polling and warm-up run in `run`, a background task started by the app.
+    """
+
+    def __init__(self, warm_models: list[str] | None = None):
+        self.warm_models = warm_models or []
+        self.loaded: set[str] = set()
+        self.demand: dict[str, float] = {}
+        self._requests: dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def note_request(self, model: str) -> bool:
+        """
+        Records a request for a model.
+
+        Returns:
+            bool: True if the model was not known to be loaded (a cold start).
+        """
+        with self._lock:
+            self._requests[model] = self._requests.get(model, 0) + 1
+            cold = model not in self.loaded
+            # Ollama loads the model to serve this request
+            self.loaded.add(model)
+        if cold:
+            metrics.inc("ollama_model_cold_starts_total", {"model": model})
+            metrics.inc("ollama_model_loads_total", {"model": model})
+            metrics.set_gauge("ollama_model_loaded", 1, {"model": model})
+            print(f"Cold start: model {model} was not loaded")
+        return cold
+
+    def refresh(self):
+        """
+        Polls Ollama for loaded models, records load and unload events and
+        updates the demand forecast.
+        """
+        running = {model["name"] for model in get_running_models()}
+        with self._lock:
+            for model in running - self.loaded:
+                metrics.inc("ollama_model_loads_total", {"model": model})
+            for model in self.loaded - running:
+                metrics.inc("ollama_model_unloads_total", {"model": model})
+                metrics.set_gauge("ollama_model_loaded", 0, {"model": model})
+            self.loaded = running
+
+            for model in set(self.demand) | set(self._requests):
+                self.demand[model] = RESIDENCY_DEMAND_ALPHA * self._requests.get(
+                    model, 0
+                ) + (1 - RESIDENCY_DEMAND_ALPHA) * self.demand.get(model, 0)
+                metrics.set_gauge(
+                    "ollama_model_demand", self.demand[model], {"model": model}
+                )
+            self._requests.clear()
+
+        for model in running:
+            metrics.set_gauge("ollama_model_loaded", 1, {"model": model})
+
+    def models_to_warm(self) -> list[str]:
+        """
+        Returns the configured or in-demand models that are not loaded, most
+        demanded first.
+        """
+        with self._lock:
+            wanted = set(self.warm_models) | {
+                model
+                for model, demand in self.demand.items()
+                if demand >= RESIDENCY_WARM_THRESHOLD
+            }
+            return sorted(
+                wanted - self.loaded, key=lambda model: -self.demand.get(model, 0)
+            )
+
+    def warm(self):
+        for model in self.models_to_warm():
+            print(f"Warming up model {model}")
+            load_model(model, get_keep_alive(model))
+            metrics.inc("ollama_model_warmups_total", {"model": model})
+            with self._lock:
+                self.loaded.add(model)
+            metrics.inc("ollama_model_loads_total", {"model": model})
+            metrics.set_gauge("ollama_model_loaded", 1, {"model": model})
+
+    def status(self) -> list[dict]:
+        with self._lock:
+            models = set(self.loaded) | set(self.demand) | set(self.warm_models)
+            return [
+                {
+                    "model": model,
+                    "loaded": model in self.loaded,
+                    "pinned": model in self.warm_models,
+                    "demand": round(self.demand.get(model, 0), 3),
+                    "keep_alive": get_keep_alive(model),
+                }
+                for model in sorted(models)
+            ]
+
+    async def run(self):
+        """
+        Polls and warms models every `RESIDENCY_POLL_INTERVAL` seconds until
+        cancelled.
+        """
+        while True:
+            try:
+                await asyncio.to_thread(self.refresh)
+                await asyncio.to_thread(self.warm)
+            except Exception as e:
+                print(f"Error in residency manager: {str(e)}")
+            await asyncio.sleep(RESIDENCY_POLL_INTERVAL)
+
+
+residency_manager = ResidencyManager(
+    warm_models=[
+        model.strip()
+        for model in os.getenv("WARM_MODELS", "").split(",")
+        if model.strip()
+    ]
+)
@@ -0,0 +1,203 @@
+"""
+This module contains the "auto" model router.
+
+A chat request with the model "auto" is routed to the smallest model that
+is adequate for its prompt. A cheap local heuristic scores the complexity
+of the prompt between 0 and 1. It looks at the prompt length, code,
+reasoning requests, non-Latin scripts and the size of the history. The
+chat models are ordered from smallest to largest, and boundaries between
+them map the score to a model.
+
+The boundaries learn from feedback. Bad feedback on a routed answer lowers
+the boundary above its model, so similar prompts go to a larger model.
+Good feedback slowly raises it, so more prompts stay on the smaller model.
+A model whose measured TTFT exceeds `ROUTING_MAX_TTFT` hands its prompts to
+the next smaller model.
+"""
+
+import os
+import re
+import threading
+
+from lib import metrics
+from lib.compare import model_stats
+from lib.ollama import get_ollama_models
+from lib.ratelimit import estimate_tokens
+from lib.search import get_embedding_model
+
+AUTO_MODEL = "auto"
+# Chat models from smallest to largest, defaults to the Ollama models by size
+ROUTING_MODELS = [
+    m.strip() for m in os.getenv("ROUTING_MODELS", "").split(",") if m.strip()
+]
+# Prompts this long (in tokens) get the full length score
+ROUTING_LONG_PROMPT_TOKENS = int(os.getenv("ROUTING_LONG_PROMPT_TOKENS", 400))
+# Seconds of smoothed TTFT above which a model is skipped (0 disables)
+ROUTING_MAX_TTFT = float(os.getenv("ROUTING_MAX_TTFT", 10))
+ROUTING_LEARNING_RATE = float(os.getenv("ROUTING_LEARNING_RATE", 0.1))
+# Boundaries stay within this margin of 0 and 1
+ROUTING_BOUNDARY_MARGIN = 0.05
+
+CODE_PATTERN = re.compile(
+    r"```|\bdef \w+\(|\bclass \w+|\bfunction\b|#include|=>|\bSELECT\b.+\bFROM\b|[{};]\s*$",
+    re.MULTILINE,
+)
+REASONING_WORDS = (
+    "explain",
+    "why",
+    "prove",
+    "derive",
+    "compare",
+    "analyze",
+    "analyse",
+    "design",
+    "step by step",
+    "optimize",
+    "debug",
+    "implement",
+    "algorithm",
+)
+
+metrics.describe("routing_decisions_total", "counter", "Auto requests routed per model")
+metrics.describe(
+    "routing_feedback_total", "counter", "Routing feedback per model and verdict"
+)
+
+
+def score_prompt(content: str, history_messages: int = 0) -> float:
+    """
+    Scores how demanding a prompt is, from 0 (trivial) to 1.
+
+    Args:
+        content (str): The user's message.
+        history_messages (int): The number of messages already in the prompt.
+
+    Returns:
+        float: The complexity score.
+    """
+    score = 0.35 * min(estimate_tokens(content) / ROUTING_LONG_PROMPT_TOKENS, 1.0)
+    if CODE_PATTERN.search(content):
+        score += 0.3
+    lowered = content.lower()
+    if any(word in lowered for word in REASONING_WORDS):
+        score += 0.2
+    # Small models are weaker outside English and other Latin-script languages
+    letters = [c for c in content if c.isalpha()]
+    if letters and sum(not c.isascii() for c in letters) / len(letters) > 0.3:
+        score += 0.15
+    score += 0.15 * min(history_messages / 40, 1.0)
+    return round(min(score, 1.0), 3)
+
+
+class ModelRouter:
+    """
+    Routes prompts to chat models by complexity score, with boundaries that
+    learn from feedback.
+    """
+
+    def __init__(self, models: list[str] | None = None):
+        self.configured = models or []
+        self.boundaries: list[float] = []
+        self._tiers: list[str] = []
+        self._sizes: dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def load_sizes(self, available: list[str]):
+        """
+        Fetches the model sizes from Ollama if an available model is missing
+        from them. This blocks on Ollama, so async callers run it in a worker
+        thread before routing.
+        """
+        if self.configured or all(model in self._sizes for model in available):
+            return
+        self._sizes = {
+            model["name"]: model.get("size", 0) for model in get_ollama_models()
+        }
+
+    def tiers(self, available: list[str]) -> list[str]:
+        """
+        Returns the available chat models, from smallest to largest, by the
+        sizes from `load_sizes`.
+        """
+        if self.configured:
+            return [model for model in self.configured if model in available]
+        embedding_model = get_embedding_model()
+        chat_models = [
+            model
+            for model in available
+            if model != embedding_model and "embed" not in model
+        ]
+        return sorted(chat_models, key=lambda model: self._sizes.get(model, 0))
+
+    def _sync_tiers(self, tiers: list[str]):
+        # The learned boundaries only make sense for the same models
+        if tiers != self._tiers:
+            self._tiers = tiers
+            self.boundaries = [(i + 1) / len(tiers) for i in range(len(tiers) - 1)]
+
+    def route(
+        self, content: str, history_messages: int, available: list[str]
+    ) -> tuple[str, float]:
+        """
+        Picks the smallest adequate model for a prompt.
+
+        Args:
+            content (str): The user's message.
+            history_messages (int): The number of messages already in the prompt.
+            available (list[str]): The models Ollama has.
+
+        Returns:
+            tuple[str, float]: The model and the prompt's complexity score.
+        """
+        tiers = self.tiers(available)
+        if not tiers:
+            raise ValueError("No chat model available for routing")
+        score = score_prompt(content, history_messages)
+        with self._lock:
+            self._sync_tiers(tiers)
+            tier = sum(score >= boundary for boundary in self.boundaries)
+        while tier > 0 and ROUTING_MAX_TTFT > 0:
+            stats = model_stats.get(tiers[tier])
+            if stats is None or stats["ttft"] <= ROUTING_MAX_TTFT:
+                break
+            tier -= 1
+        metrics.inc("routing_decisions_total", {"model": tiers[tier]})
+        return tiers[tier], score
+
+    def feedback(self, model: str, score: float, good: bool):
+        """
+        Moves the boundary above `model` after feedback on an answer it gave
+        to a prompt with the given score.
+        """
+        metrics.inc(
+            "routing_feedback_total", {"model": model, "good": str(good).lower()}
+        )
+        with self._lock:
+            if model not in self._tiers:
+                return
+            tier = self._tiers.index(model)
+            if tier >= len(self.boundaries):
+                # The largest model has nowhere to escalate to
+                return
+            boundary = self.boundaries[tier]
+            if good:
+                boundary += ROUTING_LEARNING_RATE * (1 - boundary) * 0.1
+            else:
+                boundary -= ROUTING_LEARNING_RATE + max(boundary - score, 0) * 0.5
+            lower = self.boundaries[tier - 1] if tier > 0 else ROUTING_BOUNDARY_MARGIN
+            upper = (
+                self.boundaries[tier + 1]
+                if tier + 1 < len(self.boundaries)
+                else 1 - ROUTING_BOUNDARY_MARGIN
+            )
+            self.boundaries[tier] = round(min(max(boundary, lower), upper), 4)
+
+    def status(self) -> dict:
+        with self._lock:
+            return {
+                "models": list(self._tiers),
+                "boundaries": list(self.boundaries),
+            }
+
+
+model_router = ModelRouter(ROUTING_MODELS)
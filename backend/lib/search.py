@@ -0,0 +1,365 @@
+"""
+This module contains the search subsystem over chat history.
+
+Full-text search uses a stored `tsvector` column on the chat history table with
+a GIN index, so new messages are indexed by Postgres as they are written.
+Semantic search is optional: when `EMBEDDING_MODEL` is set, message embeddings
+from Ollama are stored in a side table and queried through an in-process
+per-user vector index.
+"""
+
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+from psycopg import Connection
+
+from lib.ollama import get_embeddings
+from lib.storage import decompress_content
+from lib.types import SearchResult
+
+# Text search configuration. "simple" does no stemming, which keeps search
+# usable for conversations that are not in English.
+TS_CONFIG = "simple"
+SNIPPET_LENGTH = 200
+
+
+def get_embedding_model() -> str | None:
+    """
+    Returns the Ollama model used for message embeddings, or None if semantic
+    search is disabled.
+    """
+    return os.getenv("EMBEDDING_MODEL") or None
+
+
+def create_search_tables(conn: Connection, table_name: str):
+    """
+    Adds the full-text search column and index to the chat history table and
+    creates the message embeddings table.
+
+    Adding the generated column rewrites existing rows once, which also indexes
+    any history written before search existed.
+    """
+    with conn.cursor() as cur:
+        # Before compact storage, the column was generated from the JSON message
+        cur.execute(
+            """
+            SELECT pg_get_expr(d.adbin, d.adrelid) FROM pg_attrdef d
+            JOIN pg_attribute a ON a.attrelid = d.adrelid AND a.attnum = d.adnum
+            WHERE d.adrelid = %s::regclass AND a.attname = 'content_tsv'
+            """,
+            (table_name,),
+        )
+        row = cur.fetchone()
+        if row and "message" in row[0]:
+            cur.execute(f"ALTER TABLE {table_name} DROP COLUMN content_tsv")
+        cur.execute(
+            f"""
+            ALTER TABLE {table_name} ADD COLUMN IF NOT EXISTS content_tsv tsvector
+            GENERATED ALWAYS AS (
+                to_tsvector('{TS_CONFIG}', coalesce(content, ''))
+            ) STORED
+            """
+        )
+        cur.execute(
+            f"""
+            CREATE INDEX IF NOT EXISTS {table_name}_content_tsv_idx
+            ON {table_name} USING GIN (content_tsv)
+            """
+        )
+        cur.execute(
+            f"""
+            CREATE TABLE IF NOT EXISTS {table_name}_embeddings (
+                history_id INTEGER PRIMARY KEY REFERENCES {table_name} (id) ON DELETE CASCADE,
+                username VARCHAR(255) NOT NULL,
+                model VARCHAR(255) NOT NULL,
+                embedding REAL[] NOT NULL
+            )
+            """
+        )
+        cur.execute(
+            f"""
+            CREATE INDEX IF NOT EXISTS {table_name}_embeddings_username_idx
+            ON {table_name}_embeddings (username)
+            """
+        )
+        conn.commit()
+
+
+def search_messages_text(
+    conn: Connection, table_name: str, username: str, query: str, limit: int
+) -> list[SearchResult]:
+    """
+    Ranks a user's messages against a web-style search query.
+
+    Ranking runs over the GIN index matches only, and snippets are built for the
+    top `limit` rows afterwards, since `ts_headline` is the expensive part.
+
+    Args:
+        conn (Connection): The active database connection.
+        table_name (str): The chat history table.
+        username (str): The user whose messages are searched.
+        query (str): The search query, e.g. `python "list comprehension" -java`.
+        limit (int): The maximum number of results.
+
+    Returns:
+        list[SearchResult]: The results, best match first.
+    """
+    with conn.cursor() as cur:
+        cur.execute(
+            f"""
+            WITH q AS (SELECT websearch_to_tsquery('{TS_CONFIG}', %s) AS query),
+            ranked AS (
+                SELECT h.id, ts_rank_cd(h.content_tsv, q.query) AS rank
+                FROM {table_name} h
+                JOIN db_sessions s ON s.id = h.session_id, q
+                WHERE s.username = %s AND h.content_tsv @@ q.query
+                ORDER BY rank DESC, h.id DESC
+                LIMIT %s
+            )
+            SELECT h.session_id, s.title, h.message_id, h.role,
+                ts_headline('{TS_CONFIG}', h.content, q.query,
+                    'MaxFragments=2, MinWords=5, MaxWords=20'),
+                ranked.rank, h.created_at
+            FROM ranked
+            JOIN {table_name} h ON h.id = ranked.id
+            JOIN db_sessions s ON s.id = h.session_id, q
+            ORDER BY ranked.rank DESC, h.id DESC
+            """,
+            (query, username, limit),
+        )
+        rows = cur.fetchall()
+
+    return [_row_to_result(row) for row in rows]
+
+
+def search_messages_semantic(
+    conn: Connection,
+    table_name: str,
+    username: str,
+    query: str,
+    limit: int,
+    query_vector: list[float] | None = None,
+) -> list[SearchResult]:
+    """
+    Ranks a user's messages by cosine similarity to the query embedding.
+
+    Args:
+        conn (Connection): The active database connection.
+        table_name (str): The chat history table.
+        username (str): The user whose messages are searched.
+        query (str): The natural-language query.
+        limit (int): The maximum number of results.
+        query_vector (list[float] | None): The query's embedding, computed if not given.
+
+    Returns:
+        list[SearchResult]: The results, most similar first.
+    """
+    if query_vector is None:
+        query_vector = get_embeddings([query], get_embedding_model())[0]
+    matches = vector_index.query(conn, table_name, username, query_vector, limit)
+    if not matches:
+        return []
+
+    scores = dict(matches)
+    with conn.cursor() as cur:
+        cur.execute(
+            f"""
+            SELECT h.session_id, s.title, h.message_id, h.role,
+                h.content, h.content_zstd, h.id, h.created_at
+            FROM {table_name} h
+            JOIN db_sessions s ON s.id = h.session_id
+            WHERE h.id = ANY(%s)
+            """,
+            (list(scores),),
+        )
+        rows = cur.fetchall()
+
+    rows = [
+        row[:4]
+        + (decompress_content(row[4], row[5])[:SNIPPET_LENGTH], scores[row[6]], row[7])
+        for row in rows
+    ]
+    rows.sort(key=lambda row: row[5], reverse=True)
+    return [_row_to_result(row) for row in rows]
+
+
+def index_session_embeddings(
+    conn: Connection, table_name: str, session_ids: list[str], batch_size: int = 32
+) -> int:
+    """
+    Embeds every message of the given sessions that is not indexed yet.
+
+    Messages are sent to Ollama in batches of `batch_size`. Called off the
+    request path by the embedding worker. Does nothing when semantic search is
+    disabled.
+
+    Returns:
+        int: The number of messages that were embedded.
+    """
+    model = get_embedding_model()
+    if not model or not session_ids:
+        return 0
+
+    with conn.cursor() as cur:
+        cur.execute(
+            f"""
+            SELECT h.id, s.username, h.content, h.content_zstd
+            FROM {table_name} h
+            JOIN db_sessions s ON s.id = h.session_id
+            LEFT JOIN {table_name}_embeddings e ON e.history_id = h.id
+            WHERE h.session_id = ANY(%s::uuid[]) AND e.history_id IS NULL
+            ORDER BY h.id
+            """,
+            (session_ids,),
+        )
+        rows = [
+            (row[0], row[1], decompress_content(row[2], row[3]))
+            for row in cur.fetchall()
+        ]
+        rows = [row for row in rows if row[2]]
+        conn.commit()
+
+    for start in range(0, len(rows), batch_size):
+        batch = rows[start : start + batch_size]
+        vectors = get_embeddings([row[2] for row in batch], model)
+        with conn.cursor() as cur:
+            cur.executemany(
+                f"""
+                INSERT INTO {table_name}_embeddings (history_id, username, model, embedding)
+                VALUES (%s, %s, %s, %s)
+                ON CONFLICT (history_id) DO NOTHING
+                """,
+                [
+                    (row[0], row[1], model, vector)
+                    for row, vector in zip(batch, vectors)
+                ],
+            )
+            conn.commit()
+
+        by_user: dict[str, tuple[list[int], list[list[float]]]] = {}
+        for row, vector in zip(batch, vectors):
+            ids, user_vectors = by_user.setdefault(row[1], ([], []))
+            ids.append(row[0])
+            user_vectors.append(vector)
+        for username, (ids, user_vectors) in by_user.items():
+            vector_index.add(username, ids, user_vectors)
+
+    return len(rows)
+
+
+def _row_to_result(row) -> SearchResult:
+    return SearchResult(
+        session_id=str(row[0]),
+        session_title=row[1],
+        message_id=str(row[2]),
+        role=row[3] == "human" and "user" or "assistant",
+        snippet=row[4] or "",
+        score=float(row[5]),
+        created_at=row[6],
+    )
+
+
+class VectorIndex:
+    """
+    In-process exact nearest-neighbour index over message embeddings.
+
+    Vectors are kept L2-normalized in one matrix per user, so a query is a single
+    matrix-vector product plus a partial sort. Users are loaded from the database
+    on first query, updated in place as new messages are embedded, and evicted
+    least-recently-used beyond `max_users`.
+    """
+
+    def __init__(self, max_users: int = 256):
+        self.max_users = max_users
+        self._users: OrderedDict[str, tuple[np.ndarray, np.ndarray]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _normalize(vectors) -> np.ndarray:
+        matrix = np.asarray(vectors, dtype=np.float32)
+        norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+        return matrix / np.maximum(norms, 1e-12)
+
+    def _load(self, conn: Connection, table_name: str, username: str):
+        with conn.cursor() as cur:
+            cur.execute(
+                f"""
+                SELECT history_id, embedding FROM {table_name}_embeddings
+                WHERE username = %s AND model = %s
+                """,
+                (username, get_embedding_model()),
+            )
+            rows = cur.fetchall()
+            conn.commit()
+
+        if rows:
+            ids = np.array([row[0] for row in rows], dtype=np.int64)
+            matrix = self._normalize([row[1] for row in rows])
+        else:
+            ids = np.empty(0, dtype=np.int64)
+            matrix = None
+        return ids, matrix
+
+    def _store(self, username: str, ids: np.ndarray, matrix):
+        self._users[username] = (ids, matrix)
+        self._users.move_to_end(username)
+        while len(self._users) > self.max_users:
+            self._users.popitem(last=False)
+
+    def add(self, username: str, ids: list[int], vectors: list[list[float]]):
+        """
+        Appends vectors to a user's index if it is loaded. Unloaded users pick
+        the vectors up from the database on their next query.
+        """
+        with self._lock:
+            if username not in self._users or not ids:
+                return
+            current_ids, matrix = self._users[username]
+            new_matrix = self._normalize(vectors)
+            if matrix is not None and matrix.shape[1] != new_matrix.shape[1]:
+                # The embedding model changed; reload from the database
+                del self._users[username]
+                return
+            self._store(
+                username,
+                np.concatenate([current_ids, np.asarray(ids, dtype=np.int64)]),
+                new_matrix if matrix is None else np.vstack([matrix, new_matrix]),
+            )
+
+    def query(
+        self,
+        conn: Connection,
+        table_name: str,
+        username: str,
+        vector: list[float],
+        k: int,
+    ) -> list[tuple[int, float]]:
+        """
+        Returns the `k` most similar (history_id, score) pairs for a user.
+        """
+        with self._lock:
+            entry = self._users.get(username)
+            if entry is None:
+                entry = self._load(conn, table_name, username)
+                self._store(username, *entry)
+            else:
+                self._users.move_to_end(username)
+
+        ids, matrix = entry
+        if matrix is None or matrix.shape[1] != len(vector):
+            return []
+
+        scores = matrix @ self._normalize(vector)
+        k = min(k, len(ids))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(int(ids[i]), float(scores[i])) for i in top]
+
+    def invalidate(self, username: str):
+        with self._lock:
+            self._users.pop(username, None)
+
+
+vector_index = VectorIndex()
@@ -0,0 +1,341 @@
+"""
+This module contains the compact storage of chat messages.
+
+LangChain's Postgres history stores each message as its full JSON
+serialization, including every empty field (`tool_calls`, `usage_metadata`,
+`additional_kwargs`...), which is several times the size of a short message.
+Messages are instead stored in normalized columns:
+
+- role, name, content and message_id
+- extra: the non-empty remaining fields as JSON, usually NULL
+- content_zstd: the zstd-compressed content, used instead of `content` for
+  messages of at least `MESSAGE_ZSTD_THRESHOLD` bytes (0 disables)
+
+Content is also TOAST-compressed by Postgres (`MESSAGE_TOAST_COMPRESSION`).
+zstd-compressed messages are not covered by full-text search, since Postgres
+cannot read their content.
+
+Rows written in the LangChain format (by an older backend or the seed data)
+are normalized by a trigger, and existing rows are rewritten by the migration:
+
+Usage:
+    python -m lib.storage [--batch-size 5000] [--vacuum-full]
+"""
+
+import argparse
+import json
+import os
+from typing import Sequence
+
+import psycopg
+from langchain_core.chat_history import BaseChatMessageHistory
+from langchain_core.messages import BaseMessage, message_to_dict, messages_from_dict
+from psycopg import Connection, sql
+from psycopg.types.json import Jsonb
+
+from lib.branches import branch_ctes, insert_messages_query
+
+MESSAGE_ZSTD_THRESHOLD = int(os.getenv("MESSAGE_ZSTD_THRESHOLD", 0))
+MESSAGE_ZSTD_LEVEL = int(os.getenv("MESSAGE_ZSTD_LEVEL", 3))
+# "lz4" or "pglz"; lz4 needs Postgres 14+ built with lz4
+MESSAGE_TOAST_COMPRESSION = os.getenv("MESSAGE_TOAST_COMPRESSION", "lz4")
+
+# The columns `rows_to_messages` expects, in order
+MESSAGE_COLUMNS = "role, name, content, content_zstd, message_id, extra"
+
+# Fields stored in their own column, or derived from the role
+_COLUMN_FIELDS = ("type", "name", "content", "id")
+
+
+def compress_content(content: str) -> tuple[str | None, bytes | None]:
+    """
+    Returns the values of the `content` and `content_zstd` columns for a
+    message's content.
+    """
+    encoded = content.encode("utf-8")
+    if MESSAGE_ZSTD_THRESHOLD <= 0 or len(encoded) < MESSAGE_ZSTD_THRESHOLD:
+        return content, None
+    import zstandard
+
+    return None, zstandard.ZstdCompressor(level=MESSAGE_ZSTD_LEVEL).compress(encoded)
+
+
+def decompress_content(content: str | None, content_zstd: bytes | None) -> str:
+    """
+    Returns a message's content from its `content` and `content_zstd` columns.
+    """
+    if content_zstd is None:
+        return content or ""
+    import zstandard
+
+    return zstandard.ZstdDecompressor().decompress(content_zstd).decode("utf-8")
+
+
+def message_to_row(message: BaseMessage) -> tuple:
+    """
+    Converts a message to the values of `MESSAGE_COLUMNS`.
+    """
+    data = message_to_dict(message)["data"]
+    extra = {
+        key: value
+        for key, value in data.items()
+        if key not in _COLUMN_FIELDS and value not in (None, False, [], {})
+    }
+    content, content_zstd = None, None
+    if isinstance(data["content"], str):
+        content, content_zstd = compress_content(data["content"])
+    else:
+        # Multimodal content is a list of parts, kept as JSON
+        extra["content"] = data["content"]
+    return (
+        message.type,
+        data.get("name"),
+        content,
+        content_zstd,
+        data.get("id"),
+        Jsonb(extra) if extra else None,
+    )
+
+
+def rows_to_messages(rows: Sequence[tuple]) -> list[BaseMessage]:
+    """
+    Converts rows of `MESSAGE_COLUMNS` back to LangChain messages.
+    """
+    return messages_from_dict(
+        [
+            {
+                "type": role,
+                "data": {
+                    "content": decompress_content(content, content_zstd),
+                    "name": name,
+                    "id": message_id,
+                    **(extra or {}),
+                },
+            }
+            for role, name, content, content_zstd, message_id, extra in rows
+        ]
+    )
+
+
+class CompactChatMessageHistory(BaseChatMessageHistory):
+    """
+    LangChain chat history backed by the compact message columns.
+
+    Drop-in replacement for `PostgresChatMessageHistory` with a sync connection.
+    """
+
+    def __init__(self, table_name: str, session_id: str, sync_connection: Connection):
+        self.table_name = table_name
+        self.session_id = session_id
+        self.conn = sync_connection
+
+    def add_messages(
+        self, messages: Sequence[BaseMessage], parent_id: int | None = None
+    ) -> None:
+        """
+        Appends messages to the session's active branch, or branches the
+        session at `parent_id` (see `lib.branches`).
+        """
+        if not messages:
+            return
+        # One statement for all the messages, so a turn is one round trip
+        params = {"session_id": self.session_id, "parent_id": parent_id}
+        names = [column.strip() for column in MESSAGE_COLUMNS.split(",")]
+        for index, message in enumerate(messages):
+            for name, value in zip(names, message_to_row(message)):
+                params[f"{name}_{index}"] = value
+        with self.conn.cursor() as cur:
+            cur.execute(
+                insert_messages_query(self.table_name, MESSAGE_COLUMNS, len(messages)),
+                params,
+                prepare=True,
+            )
+        self.conn.commit()
+
+    def get_messages(self) -> list[BaseMessage]:
+        with self.conn.cursor() as cur:
+            cur.execute(
+                f"""
+                WITH RECURSIVE {branch_ctes(self.table_name)}
+                SELECT {MESSAGE_COLUMNS} FROM branch_messages ORDER BY id
+                """,
+                {"session_id": self.session_id, "until": None},
+            )
+            rows = cur.fetchall()
+        return rows_to_messages(rows)
+
+    @property
+    def messages(self) -> list[BaseMessage]:
+        return self.get_messages()
+
+    @messages.setter
+    def messages(self, value: list[BaseMessage]) -> None:
+        raise NotImplementedError("Use add_messages instead")
+
+    def clear(self) -> None:
+        with self.conn.cursor() as cur:
+            cur.execute(
+                f"DELETE FROM {self.table_name} WHERE session_id = %s",
+                (self.session_id,),
+            )
+            cur.execute(
+                "UPDATE db_sessions SET head_id = NULL WHERE id = %s",
+                (self.session_id,),
+            )
+        self.conn.commit()
+
+
+def create_compact_storage(conn: Connection, table_name: str):
+    """
+    Adds the compact message columns to the chat history table, and the
+    trigger that normalizes rows written in the LangChain JSON format.
+    """
+    with conn.cursor() as cur:
+        cur.execute(
+            f"""
+            ALTER TABLE {table_name}
+                ADD COLUMN IF NOT EXISTS role VARCHAR(16),
+                ADD COLUMN IF NOT EXISTS name VARCHAR(255),
+                ADD COLUMN IF NOT EXISTS content TEXT,
+                ADD COLUMN IF NOT EXISTS content_zstd BYTEA,
+                ADD COLUMN IF NOT EXISTS message_id VARCHAR(64),
+                ADD COLUMN IF NOT EXISTS extra JSONB,
+                ALTER COLUMN message DROP NOT NULL
+            """
+        )
+        cur.execute(
+            f"""
+            CREATE OR REPLACE FUNCTION {table_name}_normalize_message() RETURNS trigger AS $$
+            DECLARE
+                data JSONB := NEW.message->'data';
+            BEGIN
+                IF NEW.message IS NOT NULL THEN
+                    NEW.role := NEW.message->>'type';
+                    NEW.name := data->>'name';
+                    NEW.message_id := data->>'id';
+                    IF jsonb_typeof(data->'content') = 'string' THEN
+                        NEW.content := data->>'content';
+                        data := data - 'content';
+                    END IF;
+                    SELECT jsonb_object_agg(key, value) INTO NEW.extra
+                    FROM jsonb_each(data - 'type' - 'name' - 'id')
+                    WHERE value NOT IN ('null', 'false', '[]', '{{}}');
+                    NEW.message := NULL;
+                END IF;
+                RETURN NEW;
+            END
+            $$ LANGUAGE plpgsql
+            """
+        )
+        cur.execute(
+            f"DROP TRIGGER IF EXISTS {table_name}_normalize_message ON {table_name}"
+        )
+        cur.execute(
+            f"""
+            CREATE TRIGGER {table_name}_normalize_message
+            BEFORE INSERT OR UPDATE OF message ON {table_name}
+            FOR EACH ROW EXECUTE FUNCTION {table_name}_normalize_message()
+            """
+        )
+        # Finds the rows left to migrate without scanning the table
+        cur.execute(
+            f"""
+            CREATE INDEX IF NOT EXISTS {table_name}_legacy_message_idx
+            ON {table_name} (id) WHERE message IS NOT NULL
+            """
+        )
+        conn.commit()
+
+    if MESSAGE_TOAST_COMPRESSION:
+        try:
+            with conn.cursor() as cur:
+                cur.execute(
+                    sql.SQL(
+                        "ALTER TABLE {} ALTER COLUMN content SET COMPRESSION {}"
+                    ).format(
+                        sql.Identifier(table_name),
+                        sql.Identifier(MESSAGE_TOAST_COMPRESSION),
+                    )
+                )
+            conn.commit()
+        except Exception as e:
+            conn.rollback()
+            print(f"Could not set {MESSAGE_TOAST_COMPRESSION} compression: {str(e)}")
+
+
+def migrate_message_rows(
+    conn: Connection, table_name: str, batch_size: int = 5000
+) -> int:
+    """
+    Rewrites rows stored in the LangChain JSON format into the compact
+    columns, in batches so no long lock is held. Idempotent.
+
+    Returns:
+        int: The number of rows rewritten.
+    """
+    migrated = 0
+    while True:
+        with conn.cursor() as cur:
+            # The trigger does the conversion
+            cur.execute(
+                f"""
+                UPDATE {table_name} SET message = message
+                WHERE id IN (
+                    SELECT id FROM {table_name} WHERE message IS NOT NULL
+                    ORDER BY id LIMIT %s
+                )
+                """,
+                (batch_size,),
+            )
+            count = cur.rowcount
+            conn.commit()
+        migrated += count
+        if count < batch_size:
+            return migrated
+
+
+def get_table_size(conn: Connection, table_name: str) -> int:
+    """
+    Returns the size of a table in bytes, including TOAST and indexes.
+    """
+    with conn.cursor() as cur:
+        cur.execute("SELECT pg_total_relation_size(%s)", (table_name,))
+        size = cur.fetchone()[0]
+        conn.commit()
+    return size
+
+
+def main():
+    from lib.database import CONNECTION_STRING, table_name
+
+    parser = argparse.ArgumentParser(
+        description="Rewrite chat history into compact storage"
+    )
+    parser.add_argument("--batch-size", type=int, default=5000)
+    parser.add_argument(
+        "--vacuum-full",
+        action="store_true",
+        help="rewrite the table afterwards to return the space to the OS (locks the table)",
+    )
+    args = parser.parse_args()
+
+    with psycopg.connect(CONNECTION_STRING) as conn:
+        before = get_table_size(conn, table_name)
+        create_compact_storage(conn, table_name)
+        migrated = migrate_message_rows(conn, table_name, args.batch_size)
+        conn.autocommit = True
+        with conn.cursor() as cur:
+            cur.execute(
+                f"VACUUM {'FULL ' if args.vacuum_full else ''}ANALYZE {table_name}"
+            )
+        after = get_table_size(conn, table_name)
+
+    print(
+        json.dumps(
+            {"migrated_rows": migrated, "size_before": before, "size_after": after}
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
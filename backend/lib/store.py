@@ -0,0 +1,701 @@
+"""
+This module contains the storage backends for sessions and messages.
+
+`ChatStore` is the interface the API routes use for sessions, messages,
+pagination and text search, with two implementations:
+
+- `PostgresStore`: the default, on the shared autocommit connection. It also
+  covers the Postgres-only features: summaries, the archive, memory and
+  semantic search.
+- `SqliteStore`: an embedded database in WAL mode, for single-box and test
+  deployments. Full-text search uses FTS5.
+
+`STORAGE_BACKEND` selects the backend. With SQLite, the features that need
+Postgres (summaries, memory, semantic search, title refinement, the archive,
+batches, export, usage history and branches) are not available.
+"""
+
+import json
+import os
+import re
+import sqlite3
+import threading
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from typing import Callable, Sequence
+
+from langchain_core.messages import BaseMessage
+from psycopg import Connection
+
+from lib.branches import (
+    branch_ctes,
+    find_branch_message,
+    fork_session,
+    get_branch_leaves,
+    select_branch,
+)
+from lib.cache import sessions_cache
+from lib.database import (
+    STORAGE_BACKEND,
+    create_session_if_not_exists,
+    get_autocommit_connection,
+    get_chat_history,
+    get_session_by_id,
+    get_sessions_page,
+    get_sessions_version,
+    table_name,
+    update_session_title,
+)
+from lib.storage import (
+    MESSAGE_COLUMNS,
+    decompress_content,
+    message_to_row,
+    rows_to_messages,
+)
+from lib.types import MessageRecord, SearchResult, Session
+
+SQLITE_PATH = os.getenv("SQLITE_PATH", "bluedrive.db")
+
+SessionKey = tuple[datetime, str]
+
+
+class BranchesNotSupported(Exception):
+    """
+    Raised by the branch methods of a store whose `supports_branches` is False.
+    """
+
+
+class ChatStore(ABC):
+    """
+    Storage for sessions and their messages.
+    """
+
+    name: str
+    # Whether the store keeps message trees, for editing, regenerating and forking
+    supports_branches = False
+
+    @abstractmethod
+    def check(self) -> bool:
+        """Returns True if the storage can serve requests."""
+
+    @abstractmethod
+    def get_session(self, session_id: str) -> Session | None:
+        pass
+
+    @abstractmethod
+    def create_session(self, session_id: str, username: str, title: str) -> Session:
+        """
+        Creates a session, unless one with this ID exists, and returns the
+        stored session.
+        """
+
+    @abstractmethod
+    def update_session_title(self, session_id: str, title: str):
+        pass
+
+    @abstractmethod
+    def get_sessions_version(self, username: str) -> str:
+        """Returns a version string that changes whenever the user's sessions change."""
+
+    @abstractmethod
+    def get_sessions_page(
+        self, username: str, limit: int, after: SessionKey | None = None
+    ) -> tuple[list[Session], SessionKey | None]:
+        """
+        Returns one page of a user's sessions, newest first, and the key of
+        the last one if there are more pages.
+        """
+
+    @abstractmethod
+    def add_messages(
+        self,
+        session_id: str,
+        messages: Sequence[BaseMessage],
+        parent_id: int | None = None,
+    ):
+        """
+        Appends messages to the session's active branch, or starts a new
+        branch after the message `parent_id` (see `lib.branches`).
+        """
+
+    @abstractmethod
+    def get_messages(self, session_id: str) -> list[BaseMessage]:
+        pass
+
+    @abstractmethod
+    def get_message_records(self, session_id: str) -> list[MessageRecord]:
+        pass
+
+    def get_prompt_history(self, session_id: str) -> tuple[list[BaseMessage], int]:
+        """
+        Returns the history to send with the next prompt, and the number of
+        messages not covered by a summary.
+        """
+        messages = self.get_messages(session_id)
+        return messages, len(messages)
+
+    def bootstrap_session(
+        self, session_id: str, until: int | None = None
+    ) -> tuple[Session | None, list[BaseMessage], int]:
+        """
+        Loads what a chat request needs before generating: the session, or
+        None if it does not exist yet, and its prompt history, up to the
+        message `until` of the active branch if given.
+        """
+        if until is not None:
+            raise BranchesNotSupported("Branches need the Postgres backend")
+        session = self.get_session(session_id)
+        if session is None:
+            return None, [], 0
+        return (session, *self.get_prompt_history(session_id))
+
+    @abstractmethod
+    def search_messages(
+        self, username: str, query: str, limit: int
+    ) -> list[SearchResult]:
+        """Ranks a user's messages against a web-style search query."""
+
+    def find_branch_message(
+        self, session_id: str, message_id: str
+    ) -> tuple[int, int, str] | None:
+        """
+        Returns the ID, parent ID and role of a message on the session's
+        active branch, or None if it is not on it.
+        """
+        raise BranchesNotSupported("Branches need the Postgres backend")
+
+    def fork_session(
+        self, session_id: str, message_id: str, fork_id: str
+    ) -> Session | None:
+        """
+        Creates the session `fork_id` from the active branch of a session, up
+        to one of its messages. Returns None if the message is not on it.
+        """
+        raise BranchesNotSupported("Branches need the Postgres backend")
+
+    def get_branch_leaves(self, session_id: str) -> list[tuple[MessageRecord, bool]]:
+        """
+        Returns the last message of each branch of a session, newest first,
+        and whether it ends the active branch.
+        """
+        raise BranchesNotSupported("Branches need the Postgres backend")
+
+    def select_branch(self, session_id: str, message_id: str) -> bool:
+        """
+        Makes the branch ending at a message of the session the active one.
+        Returns False if the session has no such message.
+        """
+        raise BranchesNotSupported("Branches need the Postgres backend")
+
+    def close(self):
+        pass
+
+
+class PostgresStore(ChatStore):
+    """
+    Postgres storage. Archived sessions are rehydrated before their messages
+    are read, and the prompt history starts from the session summary.
+
+    Routes call the store from worker threads; calls are serialized, since
+    they share one connection and a transaction must not take in another
+    thread's statements.
+    """
+
+    name = "postgres"
+    supports_branches = True
+
+    def __init__(
+        self, get_connection: Callable[[], Connection] = get_autocommit_connection
+    ):
+        self.get_connection = get_connection
+        self._lock = threading.RLock()
+
+    @contextmanager
+    def _transaction(self):
+        with self._lock:
+            conn = self.get_connection()
+            try:
+                yield conn
+                conn.commit()
+            except Exception:
+                if not conn.broken:
+                    conn.rollback()
+                raise
+
+    def _rehydrate(self, conn: Connection, session_id: str):
+        from lib.archive import rehydrate_session
+
+        rehydrate_session(conn, session_id)
+
+    def check(self) -> bool:
+        try:
+            with self._transaction() as conn, conn.cursor() as cur:
+                cur.execute("SELECT 1")
+            return True
+        except Exception as e:
+            print(f"Database check failed: {str(e)}")
+            return False
+
+    def get_session(self, session_id: str) -> Session | None:
+        with self._transaction() as conn:
+            return get_session_by_id(conn, session_id)
+
+    def create_session(self, session_id: str, username: str, title: str) -> Session:
+        with self._transaction() as conn:
+            return create_session_if_not_exists(conn, session_id, username, title)
+
+    def update_session_title(self, session_id: str, title: str):
+        with self._transaction() as conn:
+            update_session_title(conn, session_id, title)
+
+    def get_sessions_version(self, username: str) -> str:
+        with self._transaction() as conn:
+            return get_sessions_version(conn, username)
+
+    def get_sessions_page(
+        self, username: str, limit: int, after: SessionKey | None = None
+    ) -> tuple[list[Session], SessionKey | None]:
+        with self._transaction() as conn:
+            return get_sessions_page(conn, username, limit, after)
+
+    def add_messages(
+        self,
+        session_id: str,
+        messages: Sequence[BaseMessage],
+        parent_id: int | None = None,
+    ):
+        with self._transaction() as conn:
+            get_chat_history(conn, session_id).add_messages(messages, parent_id)
+
+    def get_messages(self, session_id: str) -> list[BaseMessage]:
+        with self._transaction() as conn:
+            self._rehydrate(conn, session_id)
+            return get_chat_history(conn, session_id).messages
+
+    def get_message_records(self, session_id: str) -> list[MessageRecord]:
+        with self._transaction() as conn, conn.cursor() as cur:
+            self._rehydrate(conn, session_id)
+            cur.execute(
+                f"""
+                WITH RECURSIVE {branch_ctes(table_name)}
+                SELECT id, session_id, message_id, role, name, content, content_zstd, created_at
+                FROM branch_messages ORDER BY id
+                """,
+                {"session_id": session_id, "until": None},
+            )
+            rows = cur.fetchall()
+        return [
+            MessageRecord(
+                id=row[0],
+                session_id=str(row[1]),
+                message_id=row[2],
+                role=row[3],
+                name=row[4],
+                content=decompress_content(row[5], row[6]),
+                created_at=row[7],
+            )
+            for row in rows
+        ]
+
+    def get_prompt_history(self, session_id: str) -> tuple[list[BaseMessage], int]:
+        from lib.summary import get_prompt_history
+
+        with self._transaction() as conn:
+            self._rehydrate(conn, session_id)
+            return get_prompt_history(conn, table_name, session_id)
+
+    def bootstrap_session(
+        self, session_id: str, until: int | None = None
+    ) -> tuple[Session | None, list[BaseMessage], int]:
+        """
+        One prepared statement, so a single round trip on an autocommit
+        connection. Archived sessions are rehydrated and read again.
+        """
+        from lib.summary import build_summary_message
+
+        params = {"session_id": session_id, "until": until}
+        with self._transaction() as conn, conn.cursor() as cur:
+            cur.execute(BOOTSTRAP_QUERY, params, prepare=True)
+            rows = cur.fetchall()
+            if rows and rows[0][3]:
+                self._rehydrate(conn, session_id)
+                cur.execute(BOOTSTRAP_QUERY, params, prepare=True)
+                rows = cur.fetchall()
+        if not rows:
+            return None, [], 0
+
+        session = Session(id=str(rows[0][0]), username=rows[0][1], title=rows[0][2])
+        messages = rows_to_messages([row[6:] for row in rows if row[5] is not None])
+        return session, build_summary_message(rows[0][4]) + messages, len(messages)
+
+    def search_messages(
+        self, username: str, query: str, limit: int
+    ) -> list[SearchResult]:
+        from lib.search import search_messages_text
+
+        with self._transaction() as conn:
+            return search_messages_text(conn, table_name, username, query, limit)
+
+    def find_branch_message(
+        self, session_id: str, message_id: str
+    ) -> tuple[int, int, str] | None:
+        with self._transaction() as conn:
+            self._rehydrate(conn, session_id)
+            return find_branch_message(conn, table_name, session_id, message_id)
+
+    def fork_session(
+        self, session_id: str, message_id: str, fork_id: str
+    ) -> Session | None:
+        with self._transaction() as conn:
+            self._rehydrate(conn, session_id)
+            return fork_session(conn, table_name, session_id, message_id, fork_id)
+
+    def get_branch_leaves(self, session_id: str) -> list[tuple[MessageRecord, bool]]:
+        with self._transaction() as conn:
+            self._rehydrate(conn, session_id)
+            return get_branch_leaves(conn, table_name, session_id)
+
+    def select_branch(self, session_id: str, message_id: str) -> bool:
+        with self._transaction() as conn:
+            self._rehydrate(conn, session_id)
+            return select_branch(conn, table_name, session_id, message_id)
+
+
+# The session, whether it is archived, its summary and the messages of the
+# active branch after it, in one statement. A branch ending before the end of
+# the summary (`until`) is read without it. Sessions without messages have
+# one row of NULL messages.
+BOOTSTRAP_QUERY = f"""
+    WITH RECURSIVE {branch_ctes(table_name)}
+    SELECT s.id, s.username, s.title,
+        EXISTS (SELECT FROM db_session_archive a WHERE a.session_id = s.id),
+        sm.summary, h.id, h.role, h.name, h.content, h.content_zstd, h.message_id, h.extra
+    FROM db_sessions s
+    LEFT JOIN db_session_summaries sm
+        ON sm.session_id = s.id AND sm.summarized_until < coalesce(%(until)s::integer, 2147483647)
+    LEFT JOIN branch_messages h ON h.id > coalesce(sm.summarized_until, 0)
+    WHERE s.id = %(session_id)s
+    ORDER BY h.id
+"""
+
+
+# Web-style query terms: quoted phrases and words, optionally negated
+QUERY_TERM_PATTERN = re.compile(r'(-?)(?:"([^"]*)"?|(\S+))')
+
+
+def to_fts_query(query: str) -> str | None:
+    """
+    Converts a web-style search query (quoted phrases, `or`, `-exclusions`)
+    to an FTS5 query, or None if it has nothing to match.
+    """
+    included, excluded = [], []
+    for negated, phrase, word in QUERY_TERM_PATTERN.findall(query):
+        term = phrase if phrase else word
+        if not phrase and term.lower() == "or" and not negated:
+            if included and included[-1] != "OR":
+                included.append("OR")
+            continue
+        term = term.strip()
+        if not term:
+            continue
+        quoted = '"' + term.replace('"', '""') + '"'
+        (excluded if negated else included).append(quoted)
+    if included and included[-1] == "OR":
+        included.pop()
+    if not included:
+        return None
+    return " ".join(included) + "".join(f" NOT {term}" for term in excluded)
+
+
+def _now() -> str:
+    # Fixed-width ISO timestamps, so they sort as text
+    return datetime.now(timezone.utc).isoformat(timespec="microseconds")
+
+
+def _timestamp(value: datetime) -> str:
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value.astimezone(timezone.utc).isoformat(timespec="microseconds")
+
+
+class SqliteStore(ChatStore):
+    """
+    Embedded storage in one SQLite file, with the same message columns as
+    Postgres. The connection is shared between threads behind a lock; WAL
+    mode lets other processes read while it writes.
+    """
+
+    name = "sqlite"
+
+    def __init__(self, path: str = SQLITE_PATH):
+        self.path = path
+        self.conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._lock = threading.Lock()
+        self.conn.execute("PRAGMA journal_mode = WAL")
+        self.conn.execute("PRAGMA synchronous = NORMAL")
+        self.conn.execute("PRAGMA busy_timeout = 5000")
+        self.conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS sessions (
+                id TEXT PRIMARY KEY,
+                username TEXT NOT NULL,
+                title TEXT NOT NULL,
+                created_at TEXT NOT NULL,
+                updated_at TEXT
+            );
+            CREATE INDEX IF NOT EXISTS sessions_username_created_at_idx
+            ON sessions (username, created_at DESC, id DESC);
+
+            CREATE TABLE IF NOT EXISTS messages (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                session_id TEXT NOT NULL,
+                role TEXT,
+                name TEXT,
+                content TEXT,
+                content_zstd BLOB,
+                message_id TEXT,
+                extra TEXT,
+                created_at TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS messages_session_id_idx ON messages (session_id, id);
+
+            CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5(
+                content, content='messages', content_rowid='id', tokenize='unicode61'
+            );
+            CREATE TRIGGER IF NOT EXISTS messages_fts_insert AFTER INSERT ON messages BEGIN
+                INSERT INTO messages_fts (rowid, content) VALUES (new.id, new.content);
+            END;
+            CREATE TRIGGER IF NOT EXISTS messages_fts_delete AFTER DELETE ON messages BEGIN
+                INSERT INTO messages_fts (messages_fts, rowid, content)
+                VALUES ('delete', old.id, old.content);
+            END;
+            """
+        )
+        # Files created before sessions had `updated_at`
+        columns = [row[1] for row in self.conn.execute("PRAGMA table_info(sessions)")]
+        if "updated_at" not in columns:
+            self.conn.execute("ALTER TABLE sessions ADD COLUMN updated_at TEXT")
+
+    @contextmanager
+    def _transaction(self):
+        with self._lock:
+            self.conn.execute("BEGIN")
+            try:
+                yield self.conn
+                self.conn.execute("COMMIT")
+            except Exception:
+                self.conn.execute("ROLLBACK")
+                raise
+
+    def check(self) -> bool:
+        try:
+            with self._transaction() as conn:
+                conn.execute("SELECT 1")
+            return True
+        except sqlite3.Error as e:
+            print(f"Database check failed: {str(e)}")
+            return False
+
+    def get_session(self, session_id: str) -> Session | None:
+        with self._transaction() as conn:
+            row = conn.execute(
+                "SELECT id, username, title FROM sessions WHERE id = ?", (session_id,)
+            ).fetchone()
+        return Session(id=row[0], username=row[1], title=row[2]) if row else None
+
+    def create_session(self, session_id: str, username: str, title: str) -> Session:
+        with self._transaction() as conn:
+            existing = conn.execute(
+                "SELECT id, username, title FROM sessions WHERE id = ?", (session_id,)
+            ).fetchone()
+            if existing is None:
+                conn.execute(
+                    "INSERT INTO sessions (id, username, title, created_at) VALUES (?, ?, ?, ?)",
+                    (session_id, username, title, _now()),
+                )
+        if existing:
+            return Session(id=existing[0], username=existing[1], title=existing[2])
+        sessions_cache.invalidate(username)
+        return Session(id=session_id, username=username, title=title)
+
+    def update_session_title(self, session_id: str, title: str):
+        with self._transaction() as conn:
+            row = conn.execute(
+                "UPDATE sessions SET title = ?, updated_at = ? WHERE id = ? RETURNING username",
+                (title, _now(), session_id),
+            ).fetchone()
+        if row:
+            sessions_cache.invalidate(row[0])
+
+    def get_sessions_version(self, username: str) -> str:
+        with self._transaction() as conn:
+            count, created, updated = conn.execute(
+                "SELECT COUNT(*), MAX(created_at), MAX(updated_at) FROM sessions WHERE username = ?",
+                (username,),
+            ).fetchone()
+        return f"{count}:{created or ''}:{updated or ''}"
+
+    def get_sessions_page(
+        self, username: str, limit: int, after: SessionKey | None = None
+    ) -> tuple[list[Session], SessionKey | None]:
+        with self._transaction() as conn:
+            if after:
+                rows = conn.execute(
+                    """
+                    SELECT id, username, title, created_at FROM sessions
+                    WHERE username = ? AND (created_at, id) < (?, ?)
+                    ORDER BY created_at DESC, id DESC
+                    LIMIT ?
+                    """,
+                    (username, _timestamp(after[0]), after[1], limit + 1),
+                ).fetchall()
+            else:
+                rows = conn.execute(
+                    """
+                    SELECT id, username, title, created_at FROM sessions
+                    WHERE username = ?
+                    ORDER BY created_at DESC, id DESC
+                    LIMIT ?
+                    """,
+                    (username, limit + 1),
+                ).fetchall()
+
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        sessions = [Session(id=row[0], username=row[1], title=row[2]) for row in rows]
+        next_key = (
+            (datetime.fromisoformat(rows[-1][3]), rows[-1][0]) if has_more else None
+        )
+        return sessions, next_key
+
+    def add_messages(
+        self,
+        session_id: str,
+        messages: Sequence[BaseMessage],
+        parent_id: int | None = None,
+    ):
+        if parent_id is not None:
+            raise BranchesNotSupported("Branches need the Postgres backend")
+        rows = []
+        for message in messages:
+            role, name, content, content_zstd, message_id, extra = message_to_row(
+                message
+            )
+            rows.append(
+                (
+                    session_id,
+                    role,
+                    name,
+                    content,
+                    content_zstd,
+                    message_id,
+                    json.dumps(extra.obj) if extra is not None else None,
+                    _now(),
+                )
+            )
+        with self._transaction() as conn:
+            conn.executemany(
+                f"""
+                INSERT INTO messages (session_id, {MESSAGE_COLUMNS}, created_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                """,
+                rows,
+            )
+
+    def get_messages(self, session_id: str) -> list[BaseMessage]:
+        with self._transaction() as conn:
+            rows = conn.execute(
+                f"SELECT {MESSAGE_COLUMNS} FROM messages WHERE session_id = ? ORDER BY id",
+                (session_id,),
+            ).fetchall()
+        return rows_to_messages(
+            [row[:5] + (row[5] and json.loads(row[5]),) for row in rows]
+        )
+
+    def get_message_records(self, session_id: str) -> list[MessageRecord]:
+        with self._transaction() as conn:
+            rows = conn.execute(
+                """
+                SELECT id, session_id, message_id, role, name, content, content_zstd, created_at
+                FROM messages WHERE session_id = ? ORDER BY id
+                """,
+                (session_id,),
+            ).fetchall()
+        return [
+            MessageRecord(
+                id=row[0],
+                session_id=row[1],
+                message_id=row[2],
+                role=row[3],
+                name=row[4],
+                content=decompress_content(row[5], row[6]),
+                created_at=datetime.fromisoformat(row[7]),
+            )
+            for row in rows
+        ]
+
+    def search_messages(
+        self, username: str, query: str, limit: int
+    ) -> list[SearchResult]:
+        fts_query = to_fts_query(query)
+        if fts_query is None:
+            return []
+        with self._transaction() as conn:
+            rows = conn.execute(
+                """
+                SELECT m.session_id, s.title, m.message_id, m.role,
+                    snippet(messages_fts, 0, '<b>', '</b>', ' ... ', 20),
+                    -bm25(messages_fts), m.created_at
+                FROM messages_fts
+                JOIN messages m ON m.id = messages_fts.rowid
+                JOIN sessions s ON s.id = m.session_id
+                WHERE messages_fts MATCH ? AND s.username = ?
+                ORDER BY bm25(messages_fts), m.id DESC
+                LIMIT ?
+                """,
+                (fts_query, username, limit),
+            ).fetchall()
+        return [
+            SearchResult(
+                session_id=row[0],
+                session_title=row[1],
+                message_id=str(row[2]),
+                role=row[3] == "human" and "user" or "assistant",
+                snippet=row[4] or "",
+                score=float(row[5]),
+                created_at=datetime.fromisoformat(row[6]),
+            )
+            for row in rows
+        ]
+
+    def close(self):
+        with self._lock:
+            self.conn.close()
+
+
+_store: ChatStore | None = None
+_store_lock = threading.Lock()
+
+
+def create_store(backend: str = STORAGE_BACKEND) -> ChatStore:
+    return SqliteStore() if backend == "sqlite" else PostgresStore()
+
+
+def get_store() -> ChatStore:
+    """
+    Returns the store shared by the API routes, for `STORAGE_BACKEND`.
+    """
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = create_store()
+        return _store
+
+
+def close_store():
+    global _store
+    with _store_lock:
+        if _store is not None:
+            _store.close()
+            _store = None
@@ -0,0 +1,179 @@
+"""
+This module contains the rolling conversation summaries.
+
+Each session can have a summary that covers its history up to a given message.
+Prompts are built from the summary plus the messages written after it, so long
+sessions no longer resend their whole history to Ollama. Summaries are
+refreshed by a background worker once enough new messages have accumulated.
+"""
+
+import os
+
+from langchain_core.messages import BaseMessage, SystemMessage
+from psycopg import Connection
+
+from lib.branches import branch_ctes
+from lib.database import table_name
+from lib.ollama import summarize_conversation
+from lib.storage import MESSAGE_COLUMNS, decompress_content, rows_to_messages
+from lib.utils import strip_think_blocks
+from lib.workers import SessionWorker
+
+# Summarize once this many messages are not covered by the summary (0 disables)
+SUMMARY_TRIGGER_MESSAGES = int(os.getenv("SUMMARY_TRIGGER_MESSAGES", 20))
+# The most recent messages are always sent verbatim
+SUMMARY_KEEP_RECENT = int(os.getenv("SUMMARY_KEEP_RECENT", 6))
+SUMMARY_MODEL = os.getenv("SUMMARY_MODEL", "gemma3:1b")
+
+
+def get_prompt_history(
+    conn: Connection, table_name: str, session_id: str
+) -> tuple[list[BaseMessage], int]:
+    """
+    Loads the history to send with the next prompt: the session summary, if
+    any, followed by the messages of the active branch written after it.
+
+    Args:
+        conn (Connection): The active database connection.
+        table_name (str): The chat history table.
+        session_id (str): The UUID of the session.
+
+    Returns:
+        tuple[list[BaseMessage], int]: The prompt history and the number of
+        messages not covered by the summary.
+    """
+    with conn.cursor() as cur:
+        cur.execute(
+            "SELECT summary, summarized_until FROM db_session_summaries WHERE session_id = %s",
+            (session_id,),
+        )
+        row = cur.fetchone()
+        summary, summarized_until = row if row else (None, 0)
+
+        cur.execute(
+            f"""
+            WITH RECURSIVE {branch_ctes(table_name)}
+            SELECT {MESSAGE_COLUMNS} FROM branch_messages
+            WHERE id > %(summarized_until)s ORDER BY id
+            """,
+            {
+                "session_id": session_id,
+                "until": None,
+                "summarized_until": summarized_until,
+            },
+        )
+        messages = rows_to_messages(cur.fetchall())
+
+    history = build_summary_message(summary) + messages
+    return history, len(messages)
+
+
+def build_summary_message(summary: str | None) -> list[SystemMessage]:
+    if not summary:
+        return []
+    return [
+        SystemMessage(
+            content=f"Summary of the earlier part of this conversation:\n{summary}"
+        )
+    ]
+
+
+def should_summarize(unsummarized_count: int) -> bool:
+    return (
+        SUMMARY_TRIGGER_MESSAGES > 0 and unsummarized_count >= SUMMARY_TRIGGER_MESSAGES
+    )
+
+
+def summarize_session(conn: Connection, table_name: str, session_id: str) -> bool:
+    """
+    Folds the session's unsummarized messages, except the most recent ones,
+    into its summary.
+
+    Idempotent: the summary only advances if nobody else advanced it since it
+    was read, and nothing happens below the trigger threshold.
+
+    Returns:
+        bool: True if the summary was updated.
+    """
+    with conn.cursor() as cur:
+        cur.execute(
+            "SELECT summary, summarized_until FROM db_session_summaries WHERE session_id = %s",
+            (session_id,),
+        )
+        row = cur.fetchone()
+        summary, summarized_until = row if row else ("", 0)
+
+        cur.execute(
+            f"""
+            WITH RECURSIVE {branch_ctes(table_name)}
+            SELECT id, role, content, content_zstd
+            FROM branch_messages
+            WHERE id > %(summarized_until)s
+            ORDER BY id
+            """,
+            {
+                "session_id": session_id,
+                "until": None,
+                "summarized_until": summarized_until,
+            },
+        )
+        rows = [
+            (row[0], row[1], decompress_content(row[2], row[3]))
+            for row in cur.fetchall()
+        ]
+        conn.commit()
+
+    if not should_summarize(len(rows)):
+        return False
+
+    to_fold = rows[: len(rows) - SUMMARY_KEEP_RECENT]
+    if not to_fold:
+        return False
+    transcript = "\n\n".join(
+        f"{row[1] == 'human' and 'User' or 'Assistant'}: {strip_think_blocks(row[2]).strip()}"
+        for row in to_fold
+    )
+    new_summary = summarize_conversation(summary, transcript, SUMMARY_MODEL)
+    if not new_summary:
+        return False
+
+    with conn.cursor() as cur:
+        cur.execute(
+            """
+            INSERT INTO db_session_summaries (session_id, summary, summarized_until)
+            VALUES (%s, %s, %s)
+            ON CONFLICT (session_id) DO UPDATE
+            SET summary = EXCLUDED.summary,
+                summarized_until = EXCLUDED.summarized_until,
+                updated_at = CURRENT_TIMESTAMP
+            WHERE db_session_summaries.summarized_until = %s
+            """,
+            (session_id, new_summary, to_fold[-1][0], summarized_until),
+        )
+        updated = cur.rowcount == 1
+        conn.commit()
+
+    if updated:
+        print(
+            f"Summarized {len(to_fold)} messages of session #{session_id} "
+            f"({len(transcript)} -> {len(new_summary)} chars)"
+        )
+    return updated
+
+
+class SummaryWorker(SessionWorker):
+    """
+    Background worker that refreshes session summaries off the request path.
+    """
+
+    name = "summary-worker"
+
+    def is_enabled(self) -> bool:
+        return SUMMARY_TRIGGER_MESSAGES > 0
+
+    def process(self, conn: Connection, session_ids: list[str]):
+        for session_id in session_ids:
+            summarize_session(conn, table_name, session_id)
+
+
+summary_worker = SummaryWorker(batch_size=8, max_wait=0.5)
@@ -0,0 +1,344 @@
+"""
+This module contains the session title strategies.
+
+- "llm": a separate call to the title model before answering (the default).
+- "heuristic": a local keyword extractor, no inference.
+- "answer": a heuristic placeholder, replaced by a title derived from the
+  main model's own answer once it completes.
+
+With "heuristic" and "answer", the LLM title can still be produced afterwards
+as an asynchronous refinement (`TITLE_REFINE`), off the request path.
+"""
+
+import os
+import re
+
+from psycopg import Connection
+
+from lib.database import table_name, update_session_title
+from lib.ollama import get_session_title
+from lib.storage import decompress_content
+from lib.store import ChatStore
+from lib.utils import strip_think_blocks
+from lib.workers import SessionWorker
+
+TITLE_MODES = ("llm", "heuristic", "answer")
+TITLE_MODE = os.getenv("TITLE_MODE", "llm")
+if TITLE_MODE not in TITLE_MODES:
+    print(f"Unknown TITLE_MODE {TITLE_MODE}, using llm")
+    TITLE_MODE = "llm"
+TITLE_REFINE = os.getenv("TITLE_REFINE", "true").lower() == "true"
+TITLE_MAX_WORDS = 6
+
+# Same topic emojis as the title prompt, first match wins
+TOPIC_EMOJIS = [
+    (
+        "🛠️",
+        {
+            "error",
+            "bug",
+            "fix",
+            "debug",
+            "debugging",
+            "crash",
+            "issue",
+            "broken",
+            "troubleshoot",
+            "failing",
+            "fault",
+            "exception",
+        },
+    ),
+    (
+        "💻",
+        {
+            "code",
+            "python",
+            "javascript",
+            "typescript",
+            "react",
+            "function",
+            "script",
+            "api",
+            "sql",
+            "programming",
+            "java",
+            "rust",
+            "docker",
+            "class",
+            "compile",
+        },
+    ),
+    (
+        "📊",
+        {
+            "data",
+            "analysis",
+            "analyze",
+            "chart",
+            "statistics",
+            "sales",
+            "dataset",
+            "metrics",
+            "excel",
+        },
+    ),
+    (
+        "📝",
+        {
+            "write",
+            "writing",
+            "essay",
+            "story",
+            "email",
+            "letter",
+            "poem",
+            "blog",
+            "draft",
+        },
+    ),
+    ("🔍", {"research", "compare", "find", "investigate", "sources"}),
+    ("💡", {"idea", "ideas", "brainstorm", "creative", "suggest", "suggestions"}),
+    ("🎯", {"plan", "planning", "goal", "goals", "strategy", "roadmap", "schedule"}),
+    (
+        "📚",
+        {
+            "learn",
+            "learning",
+            "explain",
+            "understand",
+            "study",
+            "teach",
+            "tutorial",
+            "what",
+        },
+    ),
+    ("🤔", {"advice", "should", "help", "why", "how"}),
+]
+DEFAULT_EMOJI = "💬"
+
+STOPWORDS = {
+    "a",
+    "about",
+    "all",
+    "also",
+    "am",
+    "an",
+    "and",
+    "any",
+    "are",
+    "as",
+    "at",
+    "be",
+    "been",
+    "but",
+    "by",
+    "can",
+    "could",
+    "do",
+    "does",
+    "for",
+    "from",
+    "get",
+    "give",
+    "had",
+    "has",
+    "have",
+    "hello",
+    "help",
+    "hey",
+    "hi",
+    "how",
+    "i",
+    "i'm",
+    "if",
+    "in",
+    "into",
+    "is",
+    "it",
+    "it's",
+    "its",
+    "just",
+    "know",
+    "like",
+    "me",
+    "my",
+    "need",
+    "of",
+    "on",
+    "or",
+    "our",
+    "please",
+    "should",
+    "so",
+    "some",
+    "tell",
+    "thanks",
+    "that",
+    "the",
+    "their",
+    "them",
+    "there",
+    "these",
+    "this",
+    "to",
+    "us",
+    "want",
+    "was",
+    "we",
+    "what",
+    "when",
+    "where",
+    "which",
+    "who",
+    "why",
+    "will",
+    "with",
+    "would",
+    "you",
+    "your",
+    "having",
+    "trouble",
+    "not",
+    "working",
+    "properly",
+    "what's",
+    "how's",
+    "getting",
+    "between",
+    "can't",
+    "don't",
+}
+
+WORD_PATTERN = re.compile(r"[^\W_][\w'+#.-]*[\w+#]|[^\W_]", re.UNICODE)
+
+
+def _topic_emoji(words: list[str]) -> str:
+    lowered = {word.lower() for word in words}
+    for emoji, keywords in TOPIC_EMOJIS:
+        if lowered & keywords:
+            return emoji
+    return DEFAULT_EMOJI
+
+
+def _format_title(emoji: str, words: list[str]) -> str:
+    title = " ".join(
+        word
+        if word.isupper() or any(c.isupper() for c in word[1:])
+        else word.capitalize()
+        for word in words
+    )
+    return f"{emoji} {title}"[:100]
+
+
+def heuristic_title(content: str) -> str:
+    """
+    Builds a title from the keywords of the user's message, without inference.
+
+    Args:
+        content (str): The user's first message.
+
+    Returns:
+        str: An emoji followed by up to `TITLE_MAX_WORDS` keywords.
+    """
+    words = WORD_PATTERN.findall(content[:1000])
+    keywords, seen = [], set()
+    for word in words:
+        lowered = word.lower()
+        if lowered in STOPWORDS or lowered in seen or len(word) < 2:
+            continue
+        seen.add(lowered)
+        keywords.append(word)
+        if len(keywords) == TITLE_MAX_WORDS:
+            break
+
+    if not keywords:
+        keywords = words[:TITLE_MAX_WORDS] or ["New", "Conversation"]
+    return _format_title(_topic_emoji(words), keywords)
+
+
+def title_from_answer(content: str, answer: str) -> str:
+    """
+    Builds a title from the user's message and the first part of the main
+    model's answer, so no separate title inference is needed.
+
+    Keywords of the question come first; the answer's opening sentence fills
+    in when the question alone is too short to describe the topic.
+
+    Args:
+        content (str): The user's first message.
+        answer (str): The model's answer to it.
+
+    Returns:
+        str: An emoji followed by up to `TITLE_MAX_WORDS` keywords.
+    """
+    answer = strip_think_blocks(answer).strip()
+    first_sentence = re.split(r"(?<=[.!?:])\s|\n", answer, maxsplit=1)[0]
+    first_sentence = re.sub(r"[*_`#>\[\]()]", "", first_sentence)
+    return heuristic_title(f"{content} {first_sentence}")
+
+
+def get_initial_title(content: str, mode: str) -> str:
+    """
+    Returns the title a new session is created with.
+
+    Args:
+        content (str): The user's first message.
+        mode (str): The title mode, "llm", "heuristic" or "answer".
+    """
+    if mode == "llm":
+        return get_session_title(content)
+    return heuristic_title(content)
+
+
+def finalize_title(
+    store: ChatStore,
+    session_id: str,
+    mode: str,
+    content: str,
+    answer: str,
+    refine: bool = True,
+):
+    """
+    Completes the title of a session created in this request, once the answer
+    is stored: derives it from the answer in "answer" mode, and schedules the
+    LLM refinement for provisional titles unless `refine` is False.
+    """
+    if mode == "llm":
+        return
+    if mode == "answer":
+        store.update_session_title(session_id, title_from_answer(content, answer))
+    if refine:
+        title_worker.enqueue(session_id)
+
+
+class TitleWorker(SessionWorker):
+    """
+    Background worker that replaces provisional titles with LLM titles,
+    generated from each session's first user message.
+    """
+
+    name = "title-worker"
+
+    def is_enabled(self) -> bool:
+        return TITLE_REFINE
+
+    def process(self, conn: Connection, session_ids: list[str]):
+        for session_id in session_ids:
+            with conn.cursor() as cur:
+                cur.execute(
+                    f"""
+                    SELECT content, content_zstd FROM {table_name}
+                    WHERE session_id = %s AND role = 'human'
+                    ORDER BY id LIMIT 1
+                    """,
+                    (session_id,),
+                )
+                row = cur.fetchone()
+                conn.commit()
+            content = decompress_content(*row) if row else ""
+            if content:
+                update_session_title(conn, session_id, get_session_title(content))
+
+
+title_worker = TitleWorker(batch_size=8, max_wait=0.5)
@@ -0,0 +1,569 @@
+"""
+This module contains the bulk export and import of sessions as JSONL.
+
+An export is one line per session, followed by one line per message of that
+session, in order:
+
+    {"type": "session", "id": ..., "username": ..., "title": ..., "created_at": ...}
+    {"type": "message", "session_id": ..., "message_id": ..., "role": ..., "name": ...,
+     "content": ..., "extra": ..., "created_at": ...}
+
+Each session is exported as its active branch (see `lib.branches`), the
+messages it shows: other branches are left out, and a fork includes the
+messages it shares with its source. Imported sessions are therefore flat and
+self-contained.
+
+Exports read through a server-side cursor, so memory stays constant whatever
+the number of sessions. Archived sessions are exported from the archive
+without being rehydrated. Imports are loaded in batches of
+`IMPORT_BATCH_SIZE` lines with COPY into temporary tables, then upserted:
+existing sessions are kept, and messages already stored under the same
+session and message ID are skipped, so an import can be repeated or resumed
+safely. Messages without a message ID cannot be deduplicated.
+
+Usage:
+    python -m lib.transfer export [--name John] [--since 2025-01-01] [--until ...] [--output sessions.jsonl]
+    python -m lib.transfer import sessions.jsonl [--batch-size 1000]
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import sys
+from bisect import bisect_left
+from datetime import datetime, timezone
+from typing import AsyncIterator, Iterable, Iterator
+
+import psycopg
+from psycopg import Connection
+from psycopg.types.json import Jsonb
+
+from lib import metrics
+from lib.archive import read_archived_messages, rehydrate_session
+from lib.branches import NO_PARENT, branch_ctes, parent_of
+from lib.cache import sessions_cache
+from lib.database import CONNECTION_STRING, table_name
+from lib.memory import embedding_worker
+from lib.search import vector_index
+from lib.storage import MESSAGE_COLUMNS, compress_content, decompress_content
+from lib.types import ExportedMessage, ExportedSession
+from lib.utils import is_session_id_valid
+
+EXPORT_FETCH_SIZE = int(os.getenv("EXPORT_FETCH_SIZE", 1000))
+IMPORT_BATCH_SIZE = int(os.getenv("IMPORT_BATCH_SIZE", 1000))
+
+metrics.describe(
+    "transfer_exported_messages_total", "counter", "Messages exported as JSONL"
+)
+metrics.describe(
+    "transfer_imported_messages_total", "counter", "Messages inserted by imports"
+)
+
+
+def create_transfer_indexes(conn: Connection, table_name: str):
+    """
+    Adds the unique index imports upsert on. Fails, without stopping the
+    migrations, if a session already has duplicate message IDs.
+    """
+    try:
+        with conn.cursor() as cur:
+            cur.execute(
+                f"""
+                CREATE UNIQUE INDEX IF NOT EXISTS {table_name}_session_message_id_key
+                ON {table_name} (session_id, message_id)
+                """
+            )
+        conn.commit()
+    except psycopg.Error as e:
+        conn.rollback()
+        print(f"Could not create the message ID index, imports will fail: {str(e)}")
+
+
+def _utc(value: datetime | None) -> datetime | None:
+    # Naive times are taken as UTC, for Postgres and the archive alike
+    if value is not None and value.tzinfo is None:
+        return value.replace(tzinfo=timezone.utc)
+    return value
+
+
+def _line(record: dict) -> str:
+    return json.dumps(record, ensure_ascii=False) + "\n"
+
+
+def _message_line(
+    session_id: str,
+    message_id: str | None,
+    role: str,
+    name: str | None,
+    content: str | None,
+    extra: dict | None,
+    created_at: str,
+) -> str:
+    return _line(
+        {
+            "type": "message",
+            "session_id": session_id,
+            "message_id": message_id,
+            "role": role,
+            "name": name,
+            "content": content,
+            "extra": extra,
+            "created_at": created_at,
+        }
+    )
+
+
+def _archived_branch(
+    conn: Connection, session_id: str, records: list[dict], head_id: int | None
+) -> list[dict]:
+    """
+    Returns the archived messages of a session's active branch, oldest first.
+    A fork's branch continues into its source session, which is never
+    archived, so the rest of it is read from the hot table.
+    """
+    if head_id is None:
+        return records
+    by_id = {record["id"]: record for record in records}
+    ids = sorted(by_id)
+    branch = []
+    message_id = head_id
+    while message_id in by_id:
+        record = by_id[message_id]
+        branch.append(record)
+        message_id = record.get("parent_id")
+        if message_id is None:
+            # A NULL parent is the previous message of the session
+            position = bisect_left(ids, record["id"])
+            message_id = ids[position - 1] if position else NO_PARENT
+    if message_id != NO_PARENT:
+        with conn.cursor() as cur:
+            cur.execute(
+                f"""
+                WITH RECURSIVE {branch_ctes(table_name)}
+                SELECT h.id, h.role, h.name, h.content, h.content_zstd, h.message_id,
+                    h.extra, h.created_at
+                FROM branch_messages h
+                ORDER BY h.id DESC
+                """,
+                {"session_id": session_id, "until": message_id},
+            )
+            branch.extend(
+                {
+                    "id": row[0],
+                    "role": row[1],
+                    "name": row[2],
+                    "content": decompress_content(row[3], row[4]),
+                    "message_id": row[5],
+                    "extra": row[6],
+                    "created_at": row[7].isoformat(),
+                }
+                for row in cur.fetchall()
+            )
+    return branch[::-1]
+
+
+def export_sessions(
+    conn: Connection,
+    username: str | None = None,
+    since: datetime | None = None,
+    until: datetime | None = None,
+) -> Iterator[str]:
+    """
+    Yields the JSONL export of sessions, oldest first.
+
+    Args:
+        conn (Connection): A database connection not used by anything else
+            while the export is iterated.
+        username (str | None): Only export this user's sessions.
+        since (datetime | None): Only export messages created at or after this time.
+        until (datetime | None): Only export messages created before this time.
+
+    Returns:
+        Iterator[str]: One JSON line per session and message.
+    """
+    since, until = _utc(since), _utc(until)
+    ranged = since is not None or until is not None
+    message_filter = ""
+    if since is not None:
+        message_filter += " AND h.created_at >= %(since)s"
+    if until is not None:
+        message_filter += " AND h.created_at < %(until)s"
+    conditions = ["TRUE"]
+    if username is not None:
+        conditions.append("s.username = %(username)s")
+    # Only the branches of the exported sessions are walked
+    branched_conditions = " AND ".join(conditions)
+    if ranged:
+        # Skip sessions without messages in the range
+        conditions.append("(h.id IS NOT NULL OR a.session_id IS NOT NULL)")
+
+    exported = 0
+    current = None
+    with conn.cursor(name="export_sessions") as cur:
+        cur.itersize = EXPORT_FETCH_SIZE
+        # A session's messages are those of its branch if it has a head, or
+        # else all of its own
+        cur.execute(
+            f"""
+            WITH RECURSIVE branch (export_id, id, session_id, parent_id) AS (
+                SELECT s.id, h.id, h.session_id, h.parent_id
+                FROM db_sessions s
+                JOIN {table_name} h ON h.id = s.head_id
+                WHERE {branched_conditions}
+                UNION ALL
+                SELECT b.export_id, h.id, h.session_id, h.parent_id FROM branch b
+                JOIN {table_name} h ON h.id = {parent_of(table_name, "b")}
+            ),
+            exported AS (
+                SELECT b.export_id, h.* FROM branch b JOIN {table_name} h ON h.id = b.id
+                UNION ALL
+                SELECT h.session_id, h.* FROM {table_name} h
+                JOIN db_sessions s ON s.id = h.session_id
+                WHERE s.head_id IS NULL
+            )
+            SELECT s.id, s.username, s.title, s.created_at, a.session_id IS NOT NULL,
+                h.id, h.message_id, h.role, h.name, h.content, h.content_zstd, h.extra, h.created_at,
+                s.head_id
+            FROM db_sessions s
+            LEFT JOIN db_session_archive a ON a.session_id = s.id
+            LEFT JOIN exported h ON h.export_id = s.id{message_filter}
+            WHERE {" AND ".join(conditions)}
+            ORDER BY s.created_at, s.id, h.id
+            """,
+            {"username": username, "since": since, "until": until},
+        )
+        for row in cur:
+            session_id = str(row[0])
+            if session_id != current:
+                current = session_id
+                session_line = _line(
+                    {
+                        "type": "session",
+                        "id": session_id,
+                        "username": row[1],
+                        "title": row[2],
+                        "created_at": row[3].isoformat() if row[3] else None,
+                    }
+                )
+                if not row[4]:
+                    yield session_line
+                else:
+                    records = [
+                        record
+                        for record in _archived_branch(
+                            conn,
+                            session_id,
+                            read_archived_messages(conn, session_id) or [],
+                            row[13],
+                        )
+                        if (
+                            since is None
+                            or datetime.fromisoformat(record["created_at"]) >= since
+                        )
+                        and (
+                            until is None
+                            or datetime.fromisoformat(record["created_at"]) < until
+                        )
+                    ]
+                    if records or not ranged:
+                        yield session_line
+                    for record in records:
+                        yield _message_line(
+                            session_id,
+                            record["message_id"],
+                            record["role"],
+                            record["name"],
+                            record["content"],
+                            record["extra"],
+                            record["created_at"],
+                        )
+                    exported += len(records)
+            if row[5] is None:
+                continue
+            yield _message_line(
+                session_id,
+                row[6],
+                row[7],
+                row[8],
+                row[9] if row[10] is None else decompress_content(row[9], row[10]),
+                row[11],
+                row[12].isoformat(),
+            )
+            exported += 1
+    conn.commit()
+    metrics.inc("transfer_exported_messages_total", value=exported)
+
+
+def stream_export(
+    username: str | None = None,
+    since: datetime | None = None,
+    until: datetime | None = None,
+) -> Iterator[str]:
+    """
+    Same as `export_sessions`, on a connection of its own that is closed
+    once the export is consumed or abandoned.
+    """
+    with psycopg.connect(CONNECTION_STRING, connect_timeout=5) as conn:
+        yield from export_sessions(conn, username, since, until)
+
+
+class ImportBatch:
+    """
+    Sessions and messages parsed from import lines, loaded together.
+    """
+
+    def __init__(self):
+        self.sessions: list[ExportedSession] = []
+        self.messages: list[ExportedMessage] = []
+
+    def __len__(self) -> int:
+        return len(self.sessions) + len(self.messages)
+
+    def add(self, line: str, line_number: int):
+        """
+        Parses one JSONL line, skipping blank lines.
+
+        Raises:
+            ValueError: If the line is not a valid session or message.
+        """
+        if not line.strip():
+            return
+        try:
+            data = json.loads(line)
+            record_type = data.pop("type", None) if isinstance(data, dict) else None
+            if record_type == "session":
+                record = ExportedSession.model_validate(data)
+                session_id = record.id
+                self.sessions.append(record)
+            elif record_type == "message":
+                record = ExportedMessage.model_validate(data)
+                session_id = record.session_id
+                self.messages.append(record)
+            else:
+                raise ValueError('"type" must be "session" or "message"')
+        except ValueError as e:
+            raise ValueError(f"Invalid record on line {line_number}: {e}") from e
+        if not is_session_id_valid(session_id):
+            raise ValueError(f"Invalid session ID on line {line_number}")
+
+
+def _new_report() -> dict:
+    return {"sessions": 0, "messages": 0, "skipped": 0}
+
+
+def _merge_report(report: dict, batch_report: dict):
+    for key in report:
+        report[key] += batch_report[key]
+
+
+def import_batch(conn: Connection, batch: ImportBatch) -> dict:
+    """
+    Bulk loads a batch in one transaction. Messages of unknown sessions, and
+    messages already stored with the same message ID, are skipped.
+
+    Returns:
+        dict: The number of sessions and messages inserted, and of messages skipped.
+    """
+    session_ids = sorted(
+        {session.id for session in batch.sessions}
+        | {message.session_id for message in batch.messages}
+    )
+    # Archived messages would not conflict with the imported ones
+    with conn.cursor() as cur:
+        cur.execute(
+            "SELECT session_id FROM db_session_archive WHERE session_id = ANY(%s::uuid[])",
+            (session_ids,),
+        )
+        archived = [str(row[0]) for row in cur.fetchall()]
+    for session_id in archived:
+        rehydrate_session(conn, session_id)
+
+    with conn.transaction(), conn.cursor() as cur:
+        cur.execute(
+            """
+            CREATE TEMP TABLE import_sessions (
+                id UUID, username VARCHAR(255), title VARCHAR(255), created_at TIMESTAMPTZ
+            ) ON COMMIT DROP
+            """
+        )
+        with cur.copy("COPY import_sessions FROM STDIN") as copy:
+            for session in batch.sessions:
+                copy.write_row(
+                    (session.id, session.username, session.title, session.created_at)
+                )
+        cur.execute(
+            """
+            INSERT INTO db_sessions (id, username, title, created_at)
+            SELECT DISTINCT ON (id) id, username, title, coalesce(created_at, now())
+            FROM import_sessions
+            ON CONFLICT (id) DO NOTHING
+            """
+        )
+        sessions = cur.rowcount
+
+        cur.execute(
+            """
+            CREATE TEMP TABLE import_messages (
+                position SERIAL, session_id UUID, role VARCHAR(16), name VARCHAR(255),
+                content TEXT, content_zstd BYTEA, message_id VARCHAR(64), extra JSONB,
+                created_at TIMESTAMPTZ
+            ) ON COMMIT DROP
+            """
+        )
+        with cur.copy(
+            f"COPY import_messages (session_id, {MESSAGE_COLUMNS}, created_at) FROM STDIN"
+        ) as copy:
+            for message in batch.messages:
+                content, content_zstd = (
+                    compress_content(message.content)
+                    if message.content is not None
+                    else (None, None)
+                )
+                copy.write_row(
+                    (
+                        message.session_id,
+                        message.role,
+                        message.name,
+                        content,
+                        content_zstd,
+                        message.message_id,
+                        Jsonb(message.extra) if message.extra is not None else None,
+                        message.created_at,
+                    )
+                )
+        cur.execute(
+            f"""
+            INSERT INTO {table_name} (session_id, {MESSAGE_COLUMNS}, created_at)
+            SELECT t.session_id, t.role, t.name, t.content, t.content_zstd, t.message_id,
+                t.extra, coalesce(t.created_at, now())
+            FROM import_messages t
+            JOIN db_sessions s ON s.id = t.session_id
+            ORDER BY t.position
+            ON CONFLICT (session_id, message_id) DO NOTHING
+            RETURNING session_id
+            """
+        )
+        inserted = cur.fetchall()
+        messages = len(inserted)
+
+        cur.execute(
+            "SELECT DISTINCT username FROM db_sessions WHERE id = ANY(%s::uuid[])",
+            (session_ids,),
+        )
+        usernames = [row[0] for row in cur.fetchall()]
+
+    if not conn.autocommit:
+        conn.commit()
+    for username in usernames:
+        sessions_cache.invalidate(username)
+        vector_index.invalidate(username)
+    for session_id in {str(row[0]) for row in inserted}:
+        embedding_worker.enqueue(session_id)
+    metrics.inc("transfer_imported_messages_total", value=messages)
+    return {
+        "sessions": sessions,
+        "messages": messages,
+        "skipped": len(batch.messages) - messages,
+    }
+
+
+def import_lines(
+    conn: Connection, lines: Iterable[str], batch_size: int = IMPORT_BATCH_SIZE
+) -> dict:
+    """
+    Imports JSONL lines in batches of `batch_size` records. Batches before an
+    invalid line stay imported.
+
+    Raises:
+        ValueError: If a line is not a valid session or message.
+
+    Returns:
+        dict: The number of sessions and messages inserted, and of messages skipped.
+    """
+    report = _new_report()
+    batch = ImportBatch()
+    for line_number, line in enumerate(lines, start=1):
+        batch.add(line, line_number)
+        if len(batch) >= batch_size:
+            _merge_report(report, import_batch(conn, batch))
+            batch = ImportBatch()
+    if len(batch):
+        _merge_report(report, import_batch(conn, batch))
+    return report
+
+
+async def _iter_lines(chunks: AsyncIterator[bytes]) -> AsyncIterator[str]:
+    buffer = b""
+    async for chunk in chunks:
+        buffer += chunk
+        *lines, buffer = buffer.split(b"\n")
+        for line in lines:
+            yield line.decode("utf-8")
+    if buffer:
+        yield buffer.decode("utf-8")
+
+
+async def import_chunks(
+    chunks: AsyncIterator[bytes], batch_size: int = IMPORT_BATCH_SIZE
+) -> dict:
+    """
+    Same as `import_lines` for a streamed request body, on a connection of
+    its own, so only one batch is held in memory.
+    """
+    report = _new_report()
+    conn = await asyncio.to_thread(
+        psycopg.connect, CONNECTION_STRING, connect_timeout=5
+    )
+    try:
+        batch = ImportBatch()
+        line_number = 0
+        async for line in _iter_lines(chunks):
+            line_number += 1
+            batch.add(line, line_number)
+            if len(batch) >= batch_size:
+                _merge_report(
+                    report, await asyncio.to_thread(import_batch, conn, batch)
+                )
+                batch = ImportBatch()
+        if len(batch):
+            _merge_report(report, await asyncio.to_thread(import_batch, conn, batch))
+    finally:
+        conn.close()
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export or import sessions as JSONL")
+    commands = parser.add_subparsers(dest="command", required=True)
+    export_parser = commands.add_parser("export")
+    export_parser.add_argument("--name", help="only export this user's sessions")
+    export_parser.add_argument("--since", type=datetime.fromisoformat)
+    export_parser.add_argument("--until", type=datetime.fromisoformat)
+    export_parser.add_argument("--output", help="defaults to stdout")
+    import_parser = commands.add_parser("import")
+    import_parser.add_argument("input", help="JSONL file, or - for stdin")
+    import_parser.add_argument("--batch-size", type=int, default=IMPORT_BATCH_SIZE)
+    args = parser.parse_args()
+
+    if args.command == "export":
+        output = open(args.output, "w", encoding="utf-8") if args.output else sys.stdout
+        try:
+            output.writelines(stream_export(args.name, args.since, args.until))
+        finally:
+            if args.output:
+                output.close()
+        return
+
+    source = sys.stdin if args.input == "-" else open(args.input, encoding="utf-8")
+    try:
+        with psycopg.connect(CONNECTION_STRING) as conn:
+            report = import_lines(conn, source, args.batch_size)
+    finally:
+        if source is not sys.stdin:
+            source.close()
+    print(json.dumps(report))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,15 +1,88 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, ConfigDict, Field
 from datetime import datetime
-from typing import Dict, Any
+from typing import Literal
+
+
+class GenerationOptions(BaseModel):
+    model_config = ConfigDict(extra="forbid")
+
+    num_ctx: int | None = Field(default=None, ge=256)
+    num_predict: int | None = Field(default=None, ge=1)
+    temperature: float | None = Field(default=None, ge=0, le=2)
+    top_p: float | None = Field(default=None, gt=0, le=1)
+    top_k: int | None = Field(default=None, ge=1)
+    repeat_penalty: float | None = Field(default=None, ge=0)
+    seed: int | None = None
 
 
 class ChatRequest(BaseModel):
     name: str = "User"
     session_id: str
     content: str
+    # "auto" routes the request by prompt complexity
+    model: str = "gemma3:1b"
+    # Overrides TITLE_MODE for a new session
+    title_mode: Literal["llm", "heuristic", "answer"] | None = None
+    # A generation profile, defaults to GENERATION_PROFILE
+    profile: str | None = None
+    options: GenerationOptions | None = None
+    # Replaces this earlier user message: the new one and its answer start a
+    # branch next to it
+    edit_id: str | None = None
+    # Generates this answer again, next to it; `content` is then ignored
+    regenerate_id: str | None = None
+
+
+class ForkRequest(BaseModel):
+    session_id: str
+    # The last message of the session kept in the fork
+    message_id: str
+
+
+class BranchRequest(BaseModel):
+    session_id: str
+    # The last message of the branch to show
+    message_id: str
+
+
+class CompareRequest(BaseModel):
+    name: str = "User"
+    content: str
+    models: list[str]
+    profile: str | None = None
+
+
+class RoutingFeedback(BaseModel):
+    model: str
+    score: float = Field(ge=0, le=1)
+    good: bool
+
+
+class BatchItem(BaseModel):
+    id: str | None = None
+    name: str = "User"
+    session_id: str | None = None
+    content: str
     model: str = "gemma3:1b"
 
 
+class ExportedSession(BaseModel):
+    id: str
+    username: str
+    title: str
+    created_at: datetime | None = None
+
+
+class ExportedMessage(BaseModel):
+    session_id: str
+    message_id: str | None = None
+    role: str
+    name: str | None = None
+    content: str | None = None
+    extra: dict | None = None
+    created_at: datetime | None = None
+
+
 class SessionsRequest(BaseModel):
     name: str = "User"
 
@@ -23,7 +96,10 @@ class Session(BaseModel):
 class MessageRecord(BaseModel):
     id: int
     session_id: str
-    message: Dict[str, Any]
+    message_id: str | None
+    role: str
+    name: str | None
+    content: str
     created_at: datetime
 
 
@@ -33,3 +109,13 @@ class Message(BaseModel):
     content: str
     name: str
     created_at: datetime
+
+
+class SearchResult(BaseModel):
+    session_id: str
+    session_title: str
+    message_id: str
+    role: str
+    snippet: str
+    score: float
+    created_at: datetime
@@ -1,6 +1,11 @@
 import ulid
 import uuid
-from typing import Any
+import json
+import base64
+import hashlib
+import re
+from datetime import datetime
+from typing import Any, AsyncIterator
 
 
 def is_session_id_valid(session_id: Any) -> bool:
@@ -32,3 +37,104 @@ def generate_message_id():
         str: A new ULID string.
     """
     return str(ulid.new())
+
+
+def encode_cursor(created_at: datetime, session_id: str) -> str:
+    """
+    Encodes a keyset pagination cursor for the sessions listing.
+
+    Args:
+        created_at (datetime): The creation time of the last session on the page.
+        session_id (str): The UUID of the last session on the page.
+
+    Returns:
+        str: An opaque, URL-safe cursor string.
+    """
+    raw = json.dumps([created_at.isoformat(), session_id]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> tuple[datetime, str] | None:
+    """
+    Decodes a cursor created by `encode_cursor`.
+
+    Args:
+        cursor (str): The cursor string.
+
+    Returns:
+        tuple[datetime, str] | None: The (created_at, session_id) pair, or None if the cursor is invalid.
+    """
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        created_at, session_id = json.loads(raw)
+        if not is_session_id_valid(session_id):
+            return None
+        return datetime.fromisoformat(created_at), session_id
+    except (ValueError, TypeError):
+        return None
+
+
+def make_etag(*parts: Any) -> str:
+    """
+    Builds a weak ETag from the given parts.
+
+    Returns:
+        str: A quoted weak ETag, e.g. W/"3f2a...".
+    """
+    digest = hashlib.sha1("|".join(str(part) for part in parts).encode()).hexdigest()
+    return f'W/"{digest[:16]}"'
+
+
+THINK_BLOCK_PATTERN = re.compile(r"<think>.*?(</think>|$)", re.DOTALL)
+
+
+def strip_think_blocks(text: str) -> str:
+    """
+    Removes <think>...</think> reasoning blocks from a model response.
+    An unterminated block is removed up to the end of the text.
+
+    Args:
+        text (str): The model response.
+
+    Returns:
+        str: The response without reasoning blocks.
+    """
+    return THINK_BLOCK_PATTERN.sub("", text)
+
+
+async def filter_think_stream(tokens: AsyncIterator[str]) -> AsyncIterator[str]:
+    """
+    Streams a model response without its <think>...</think> blocks, holding
+    text back only while a block is open.
+
+    Args:
+        tokens (AsyncIterator[str]): The streamed response tokens.
+
+    Yields:
+        str: The visible response, in chunks.
+    """
+    buffer = ""
+    in_think_block = False
+    async for token in tokens:
+        buffer += token
+
+        # Check for think tags
+        if "<think>" in buffer and not in_think_block:
+            # Find the start of the think block
+            think_start = buffer.find("<think>")
+            # Output everything before the think block
+            if think_start > 0:
+                yield buffer[:think_start]
+            buffer = buffer[think_start:]
+            in_think_block = True
+
+        # Check for end of think block
+        if "</think>" in buffer and in_think_block:
+            # Remove the think block from buffer
+            buffer = buffer[buffer.find("</think>") + len("</think>") :]
+            in_think_block = False
+
+        # If we're not in a think block and have content, yield it
+        if not in_think_block and buffer:
+            yield buffer
+            buffer = ""
@@ -0,0 +1,112 @@
+"""
+This module contains the base class for background workers that process
+sessions off the request path.
+"""
+
+import queue
+import threading
+import time
+
+import psycopg
+from psycopg import Connection
+
+from lib.database import CONNECTION_STRING, STORAGE_BACKEND
+
+
+class SessionWorker:
+    """
+    Background thread that processes sessions enqueued by requests, in batches.
+
+    Requests enqueue the session they wrote to; the worker waits up to
+    `max_wait` seconds to collect up to `batch_size` distinct sessions, then
+    hands them to `process` on its own database connection. Subclasses
+    implement `process` and, optionally, `is_enabled`.
+    """
+
+    name = "session-worker"
+
+    def __init__(self, batch_size: int = 32, max_wait: float = 2.0):
+        self.batch_size = batch_size
+        self.max_wait = max_wait
+        self._queue: queue.Queue[str | None] = queue.Queue()
+        self._thread: threading.Thread | None = None
+        self._lock = threading.Lock()
+
+    def is_enabled(self) -> bool:
+        return True
+
+    def process(self, conn: Connection, session_ids: list[str]):
+        raise NotImplementedError
+
+    def enqueue(self, session_id: str):
+        """
+        Schedules a session for processing. Does nothing when the worker is
+        disabled, or when sessions are not stored in Postgres.
+        """
+        if STORAGE_BACKEND != "postgres" or not self.is_enabled():
+            return
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(
+                    target=self._run, name=self.name, daemon=True
+                )
+                self._thread.start()
+        self._queue.put(session_id)
+
+    def wait_idle(self):
+        """
+        Blocks until every enqueued session has been processed.
+        """
+        self._queue.join()
+
+    def stop(self):
+        with self._lock:
+            if self._thread and self._thread.is_alive():
+                self._queue.put(None)
+                self._thread.join()
+            self._thread = None
+
+    def _collect_batch(self) -> tuple[set[str], int, bool]:
+        first = self._queue.get()
+        if first is None:
+            return set(), 1, True
+
+        session_ids, taken, stop = {first}, 1, False
+        deadline = time.monotonic() + self.max_wait
+        while len(session_ids) < self.batch_size:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                session_id = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                break
+            taken += 1
+            if session_id is None:
+                stop = True
+                break
+            session_ids.add(session_id)
+        return session_ids, taken, stop
+
+    def _run(self):
+        conn = None
+        while True:
+            session_ids, taken, stop = self._collect_batch()
+            try:
+                if session_ids:
+                    if conn is None or conn.closed:
+                        conn = psycopg.connect(CONNECTION_STRING)
+                    self.process(conn, list(session_ids))
+            except Exception as e:
+                print(f"Error in {self.name}: {str(e)}")
+                if conn is not None:
+                    conn.close()
+                conn = None
+            finally:
+                for _ in range(taken):
+                    self._queue.task_done()
+
+            if stop:
+                if conn is not None:
+                    conn.close()
+                return
@@ -1,23 +1,113 @@
-from fastapi import FastAPI, HTTPException, BackgroundTasks
-import uvicorn
+from fastapi import (
+    FastAPI,
+    HTTPException,
+    BackgroundTasks,
+    Depends,
+    Query,
+    Header,
+    Request,
+    WebSocket,
+)
+from fastapi.requests import HTTPConnection
 from dotenv import load_dotenv
-from langchain_core.prompts import ChatPromptTemplate
 from langchain_core.messages import HumanMessage, AIMessage, SystemMessage
-from langchain_ollama.llms import OllamaLLM
-from langchain_postgres import PostgresChatMessageHistory
 import os
+import json
+import math
+import time
+import uuid
+import asyncio
+import psycopg
+from contextlib import asynccontextmanager
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import StreamingResponse, JSONResponse
+from fastapi.responses import (
+    StreamingResponse,
+    JSONResponse,
+    Response,
+    PlainTextResponse,
+)
 from urllib.parse import unquote
-
-from lib.utils import generate_message_id, is_session_id_valid
-from lib.types import ChatRequest, Session, MessageRecord, Message
-from lib.ollama import get_ollama_models, get_ollama_models_names, get_session_title
-from lib.prompts import chat_sys_msg
+from datetime import datetime
+from typing import Literal
+
+from lib.utils import (
+    generate_message_id,
+    is_session_id_valid,
+    encode_cursor,
+    decode_cursor,
+    make_etag,
+    filter_think_stream,
+)
+from lib.types import (
+    BranchRequest,
+    ChatRequest,
+    CompareRequest,
+    ForkRequest,
+    GenerationOptions,
+    Message,
+    MessageRecord,
+    RoutingFeedback,
+    SearchResult,
+)
+from lib.ollama import (
+    check_ollama,
+    get_embeddings,
+    get_llm,
+    get_ollama_models,
+    get_ollama_models_names,
+)
+from lib.prompts import chat_prompt
+from lib.batch import BATCH_MAX_ITEMS, parse_batch_items, run_batch
+from lib.compare import COMPARE_MAX_MODELS, model_stats, run_comparison
+from lib.routing import AUTO_MODEL, model_router
+from lib.profiles import get_profiles_status, record_generation, resolve_generation
+from lib.memory import (
+    build_memory_message,
+    embedding_worker,
+    is_memory_enabled,
+    retrieve_memories,
+)
+from lib.summary import should_summarize, summary_worker
+from lib.admission import (
+    ADMISSION_CONTEXT_MESSAGES,
+    ADMISSION_RETRY_AFTER,
+    Admission,
+    admission_controller,
+    shrink_history,
+)
+from lib.archive import get_archive_stats, run_archiver
+from lib.channel import ChatChannel, Generation
+from lib.transfer import import_chunks, stream_export
+from lib.ratelimit import (
+    estimate_tokens,
+    get_client_key,
+    get_usage,
+    rate_limiter,
+    usage_recorder,
+)
+from lib.titles import TITLE_MODE, finalize_title, get_initial_title, title_worker
+from lib.search import (
+    get_embedding_model,
+    search_messages_semantic,
+)
+from lib import metrics
+from lib.cache import sessions_cache
+from lib.residency import residency_manager
+from lib.blocking import BlockingDetectorMiddleware, blocking_detector
+from lib.compression import CompressionMiddleware
+from lib.profiling import (
+    CPUTimeMiddleware,
+    endpoint_times,
+    is_admin_token,
+    loop_lag_monitor,
+    render_flamegraph,
+    sampling_profiler,
+)
+from lib.store import BranchesNotSupported, ChatStore, close_store, get_store
 from lib.database import (
-    get_session_by_id,
-    create_session_if_not_exists,
-    sync_connection,
+    STORAGE_BACKEND,
+    close_sync_connection,
+    sync_transaction,
     table_name,
 )
 
@@ -28,14 +118,60 @@ load_dotenv()
 # to specific origins in production for better security. Securing CORS is not
 # part of the current project scope.
 
-app = FastAPI()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    Connects to the database and applies migrations on startup, without
+    failing if Postgres is not up yet: routes reconnect lazily and `/ready`
+    reports whether the backend can serve traffic.
+    """
+    if not await asyncio.to_thread(get_store().check):
+        print("⚠️ Database is not reachable yet, will retry on first request")
+    tasks = [
+        asyncio.create_task(residency_manager.run()),
+        asyncio.create_task(loop_lag_monitor.run()),
+    ]
+    if STORAGE_BACKEND == "postgres":
+        tasks.append(asyncio.create_task(usage_recorder.run()))
+        tasks.append(asyncio.create_task(run_archiver()))
+    yield
+    for task in tasks:
+        task.cancel()
+    if STORAGE_BACKEND == "postgres":
+        try:
+            with sync_transaction() as conn:
+                usage_recorder.flush(conn)
+        except Exception as e:
+            print(f"Error flushing usage: {str(e)}")
+    embedding_worker.stop()
+    summary_worker.stop()
+    title_worker.stop()
+    close_store()
+    close_sync_connection()
+
+
+app = FastAPI(lifespan=lifespan)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=[
+        "ETag",
+        "X-Next-Cursor",
+        "X-Batch-Id",
+        "Retry-After",
+        "X-Model",
+        "X-Degradation-Level",
+        "X-Route-Score",
+        "X-Profile",
+    ],
 )
+app.add_middleware(CompressionMiddleware)
+app.add_middleware(CPUTimeMiddleware)
+app.add_middleware(BlockingDetectorMiddleware)
 
 
 @app.get("/")
@@ -58,6 +194,44 @@ async def health():
     return {"message": "OK!"}
 
 
+@app.get("/ready")
+async def ready():
+    """
+    Readiness probe for Docker and orchestration systems.
+
+    Unlike `/health`, which only reports that the process is up, this checks
+    that the database and Ollama are reachable.
+
+    Returns:
+        JSONResponse: The status of each dependency, with 503 if any is down.
+    """
+    database_ok, ollama_ok = await asyncio.gather(
+        asyncio.to_thread(get_store().check), asyncio.to_thread(check_ollama)
+    )
+    status = {
+        "database": "ok" if database_ok else "unavailable",
+        "ollama": "ok" if ollama_ok else "unavailable",
+    }
+    return JSONResponse(
+        content=status, status_code=200 if database_ok and ollama_ok else 503
+    )
+
+
+@app.exception_handler(psycopg.OperationalError)
+async def database_unavailable(request: Request, exc: psycopg.OperationalError):
+    print(f"Database unavailable: {str(exc)}")
+    return JSONResponse(
+        content={"detail": "Database unavailable"},
+        status_code=503,
+        headers={"Retry-After": "5"},
+    )
+
+
+@app.exception_handler(BranchesNotSupported)
+async def branches_not_supported(request: Request, exc: BranchesNotSupported):
+    return JSONResponse(content={"detail": str(exc)}, status_code=400)
+
+
 @app.get("/models")
 async def get_models():
     """
@@ -67,39 +241,194 @@ async def get_models():
         list[dict]: A list of available model dictionaries.
     """
     try:
-        return get_ollama_models()
+        return await asyncio.to_thread(get_ollama_models)
     except Exception as e:
         print(f"Error in get_models: {str(e)}")
         raise HTTPException(status_code=500, detail="Internal server error")
 
 
+@app.get("/models/residency")
+async def get_models_residency():
+    """
+    Reports which models are loaded in Ollama, their forecast demand and
+    keep-alive settings, as tracked by the residency manager.
+
+    Returns:
+        list[dict]: One entry per known model.
+    """
+    return residency_manager.status()
+
+
+@app.get("/models/stats")
+async def get_models_stats():
+    """
+    Returns the smoothed time to first token and throughput measured per
+    model.
+    """
+    return model_stats.status()
+
+
+@app.get("/metrics")
+async def get_metrics():
+    """
+    Exposes the backend metrics in the Prometheus text format.
+    """
+    return PlainTextResponse(metrics.render())
+
+
+def require_admin(x_admin_token: str | None = Header(default=None)):
+    """
+    Guards the admin routes.
+
+    Raises:
+        HTTPException: 403 if `ADMIN_TOKEN` is not set or the token does not match.
+    """
+    if not is_admin_token(x_admin_token):
+        raise HTTPException(status_code=403, detail="Admin token required")
+
+
+@app.post("/admin/profiler/start", dependencies=[Depends(require_admin)])
+async def start_profiler(
+    interval_ms: float | None = Query(default=None, ge=1, le=1000),
+    max_seconds: float | None = Query(default=None, gt=0, le=3600),
+):
+    """
+    Starts sampling the stacks of every thread, discarding the last profile.
+
+    Args:
+        interval_ms (float | None): Milliseconds between samples.
+        max_seconds (float | None): Seconds after which the profile stops by itself.
+    """
+    try:
+        sampling_profiler.start(
+            interval_ms / 1000 if interval_ms else None, max_seconds
+        )
+    except RuntimeError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return sampling_profiler.status()
+
+
+@app.post("/admin/profiler/stop", dependencies=[Depends(require_admin)])
+async def stop_profiler():
+    return await asyncio.to_thread(sampling_profiler.stop)
+
+
+@app.get("/admin/profiler/profile", dependencies=[Depends(require_admin)])
+async def get_profile(
+    format: Literal["collapsed", "svg"] = "collapsed", idle: bool = False
+):
+    """
+    Returns the last (or running) profile as collapsed stacks, which
+    flamegraph.pl and speedscope read, or as an SVG flamegraph.
+
+    Args:
+        format (str): "collapsed" or "svg".
+        idle (bool): Include the stacks of threads waiting for work.
+    """
+    collapsed = sampling_profiler.collapsed(idle)
+    if format == "svg":
+        status = sampling_profiler.status()
+        title = f"{status['samples']} samples over {status['seconds']}s"
+        return Response(
+            content=render_flamegraph(collapsed, title), media_type="image/svg+xml"
+        )
+    return PlainTextResponse(collapsed)
+
+
+@app.get("/admin/endpoints", dependencies=[Depends(require_admin)])
+async def get_endpoint_times():
+    """
+    Returns the requests, event loop CPU time and wall time of each route,
+    most CPU-expensive first.
+    """
+    return endpoint_times.status()
+
+
+@app.get("/admin/loop", dependencies=[Depends(require_admin)])
+async def get_loop_lag():
+    """
+    Returns the event loop lag measurements.
+    """
+    return loop_lag_monitor.status()
+
+
+@app.get("/admin/blocking", dependencies=[Depends(require_admin)])
+async def get_blocking():
+    """
+    Returns the latest event loop blocks with their route and stack, when
+    the blocking detector is enabled.
+    """
+    return {
+        "enabled": blocking_detector.enabled,
+        "threshold_ms": blocking_detector.threshold * 1000,
+        "blocks": list(blocking_detector.reports),
+    }
+
+
 @app.get("/sessions")
-async def get_sessions(name: str):
+async def get_sessions(
+    name: str,
+    limit: int = Query(default=50, ge=1, le=200),
+    cursor: str | None = None,
+    if_none_match: str | None = Header(default=None),
+):
     """
-    Retrieves the list of sessions for a given user from the database.
+    Retrieves one page of sessions for a given user from the database, newest first.
+
+    Pages are keyed by an opaque cursor: when more sessions exist, the response
+    carries an `X-Next-Cursor` header to pass back as `cursor`. Responses carry an
+    ETag derived from the user's latest session change, so clients that send
+    `If-None-Match` get a 304 until the user creates a session or one of their
+    sessions is renamed.
 
     Args:
         name (str): The username of the user to retrieve sessions for.
+        limit (int): The maximum number of sessions to return.
+        cursor (str | None): The cursor returned with the previous page.
+        if_none_match (str | None): The ETag of the client's cached copy.
 
     Returns:
         list[Session]: A list of Session objects.
     """
     formatted_name = unquote(name)
 
+    after = None
+    if cursor:
+        after = decode_cursor(cursor)
+        if not after:
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+
+    store = get_store()
     try:
-        with sync_connection.cursor() as cur:
-            cur.execute(
-                "SELECT id, username, title FROM db_sessions WHERE username = %s ORDER BY created_at DESC",
-                (formatted_name,),
+        version = sessions_cache.get_version(formatted_name)
+        if version is None:
+            version = await asyncio.to_thread(
+                store.get_sessions_version, formatted_name
+            )
+            sessions_cache.set_version(formatted_name, version)
+
+        etag = make_etag(formatted_name, version, limit, cursor)
+        headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+        if if_none_match == etag:
+            return Response(status_code=304, headers=headers)
+
+        page_key = (limit, cursor)
+        page = sessions_cache.get_page(formatted_name, page_key)
+        if page is None:
+            sessions, next_key = await asyncio.to_thread(
+                store.get_sessions_page, formatted_name, limit, after
+            )
+            page = (
+                [session.model_dump() for session in sessions],
+                encode_cursor(*next_key) if next_key else None,
             )
-            result = cur.fetchall()
-            sync_connection.commit()  # Explicitly commit the transaction
+            sessions_cache.set_page(formatted_name, page_key, page)
 
-            return [
-                Session(id=str(row[0]), title=row[2], username=row[1]) for row in result
-            ]
+        content, next_cursor = page
+        if next_cursor:
+            headers["X-Next-Cursor"] = next_cursor
+        return JSONResponse(content=content, headers=headers)
     except Exception as e:
-        sync_connection.rollback()  # Rollback on error
         print(f"Database error in get_sessions: {str(e)}")
         raise HTTPException(status_code=500, detail="Internal server error")
 
@@ -118,63 +447,454 @@ async def get_session(session_id: str):
     if not is_session_id_valid(session_id):
         raise HTTPException(status_code=400, detail="Invalid session ID")
 
-    with sync_connection.cursor() as cur:
-        cur.execute(
-            "SELECT id, username, title FROM db_sessions WHERE id = %s",
-            (session_id,),
+    store = get_store()
+    session = await asyncio.to_thread(store.get_session, session_id)
+    if not session:
+        raise HTTPException(status_code=404, detail="Session not found")
+
+    messages = await asyncio.to_thread(store.get_message_records, session_id)
+    return {
+        "session": session,
+        "messages": [format_message(message) for message in messages],
+    }
+
+
+def format_message(message: MessageRecord) -> Message:
+    return Message(
+        id=str(message.message_id),
+        role=message.role == "human" and "user" or "assistant",
+        content=message.content,
+        name=message.name,
+        created_at=message.created_at,
+    )
+
+
+def require_postgres(feature: str):
+    """
+    Guards the routes that read tables only the Postgres backend has.
+
+    Raises:
+        HTTPException: 501 if the chats are stored elsewhere.
+    """
+    if STORAGE_BACKEND != "postgres":
+        raise HTTPException(
+            status_code=501, detail=f"{feature} needs the Postgres backend"
         )
-        result = cur.fetchone()
 
-        if not result:
-            raise HTTPException(status_code=404, detail="Session not found")
 
-        session = Session(id=str(result[0]), title=result[2], username=result[1])
+def require_branches():
+    if not get_store().supports_branches:
+        raise HTTPException(
+            status_code=400, detail="Branches need the Postgres backend"
+        )
+
+
+@app.post("/session/fork")
+async def fork_session(request: ForkRequest):
+    """
+    Forks a session at a message of its active branch. The fork shares the
+    session's messages up to that one instead of copying them.
+
+    Args:
+        request (ForkRequest): The session and the last message to keep.
+
+    Returns:
+        dict: The new session.
+    """
+    if not is_session_id_valid(request.session_id):
+        raise HTTPException(status_code=400, detail="Invalid session ID")
+    require_branches()
+
+    session = await asyncio.to_thread(
+        get_store().fork_session,
+        request.session_id,
+        request.message_id,
+        str(uuid.uuid4()),
+    )
+    if session is None:
+        raise HTTPException(status_code=404, detail="Message not found")
+    return {"session": session}
+
+
+@app.get("/session/branches")
+async def get_session_branches(session_id: str):
+    """
+    Lists the branches of a session, created by editing messages and
+    regenerating answers.
+
+    Args:
+        session_id (str): The UUID of the session.
+
+    Returns:
+        dict: The last message of each branch, newest first, and whether
+        it ends the active branch.
+    """
+    if not is_session_id_valid(session_id):
+        raise HTTPException(status_code=400, detail="Invalid session ID")
+    require_branches()
+
+    leaves = await asyncio.to_thread(get_store().get_branch_leaves, session_id)
+    return {
+        "branches": [
+            {"message": format_message(message), "active": active}
+            for message, active in leaves
+        ]
+    }
+
+
+@app.post("/session/branch")
+async def select_session_branch(request: BranchRequest):
+    """
+    Switches a session to the branch ending at one of its messages. Later
+    messages are added to that branch.
+
+    Args:
+        request (BranchRequest): The session and the last message of the branch.
+
+    Returns:
+        dict: The session and the messages of the branch, like `/session`.
+    """
+    if not is_session_id_valid(request.session_id):
+        raise HTTPException(status_code=400, detail="Invalid session ID")
+    require_branches()
+
+    if not await asyncio.to_thread(
+        get_store().select_branch, request.session_id, request.message_id
+    ):
+        raise HTTPException(status_code=404, detail="Message not found")
+    return await get_session(request.session_id)
+
+
+def read_archive_stats() -> dict:
+    with sync_transaction() as conn:
+        return get_archive_stats(conn)
+
+
+@app.get("/archive")
+async def get_archive():
+    """
+    Returns how many sessions are archived and the storage they use in the
+    archive compared to the hot table. Only the Postgres backend archives.
+    """
+    require_postgres("The archive")
+    return await asyncio.to_thread(read_archive_stats)
+
+
+@app.get("/export", dependencies=[Depends(require_admin)])
+async def export(
+    name: str | None = None,
+    since: datetime | None = None,
+    until: datetime | None = None,
+):
+    """
+    Streams sessions and their messages as JSONL, oldest session first.
+
+    Args:
+        name (str | None): Only export this user's sessions.
+        since (datetime | None): Only export messages created at or after this time.
+        until (datetime | None): Only export messages created before this time.
+
+    Returns:
+        StreamingResponse: One JSON line per session, followed by its messages.
+    """
+    # Checked before streaming, since a failure after that can't change the status
+    require_postgres("Export")
+    formatted_name = unquote(name) if name is not None else None
+    return StreamingResponse(
+        stream_export(formatted_name, since, until),
+        media_type="application/x-ndjson",
+    )
+
 
-        cur.execute(
-            "SELECT * FROM bd_chat_history WHERE session_id = %s ORDER BY created_at ASC",
-            (session_id,),
+@app.post("/import", dependencies=[Depends(require_admin)])
+async def import_sessions(request: Request):
+    """
+    Imports a JSONL export, streamed from the request body in batches.
+    Importing the same export again inserts nothing new.
+
+    Args:
+        request (Request): The request whose body is the JSONL export.
+
+    Returns:
+        dict: The number of sessions and messages inserted, and of messages skipped.
+    """
+    require_postgres("Import")
+    try:
+        return await import_chunks(request.stream())
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+def search_semantic(username: str, query: str, limit: int) -> list[SearchResult]:
+    # Embedded first, so the shared connection is not held during the Ollama call
+    query_vector = get_embeddings([query], get_embedding_model())[0]
+    with sync_transaction() as conn:
+        return search_messages_semantic(
+            conn, table_name, username, query, limit, query_vector
         )
-        result = cur.fetchall()
 
-        if not result:
-            return {
-                "session": session,
-                "messages": [],
-            }
 
-        messages = [
-            MessageRecord(
-                id=row[0], session_id=str(row[1]), message=row[2], created_at=row[3]
+@app.get("/search")
+async def search(
+    name: str,
+    q: str = Query(min_length=1, max_length=500),
+    mode: Literal["text", "semantic"] = "text",
+    limit: int = Query(default=20, ge=1, le=100),
+):
+    """
+    Searches a user's chat history and returns ranked snippets.
+
+    Text mode uses the full-text index and supports web-style queries (quoted
+    phrases, `or`, `-exclusions`). Semantic mode ranks messages by embedding
+    similarity and is only available when `EMBEDDING_MODEL` is set.
+
+    Args:
+        name (str): The username whose history is searched.
+        q (str): The search query.
+        mode (str): Either "text" or "semantic".
+        limit (int): The maximum number of results.
+
+    Returns:
+        list[SearchResult]: The results, best match first.
+    """
+    formatted_name = unquote(name)
+
+    if mode == "semantic" and (
+        STORAGE_BACKEND != "postgres" or not get_embedding_model()
+    ):
+        raise HTTPException(status_code=400, detail="Semantic search is not enabled")
+
+    try:
+        if mode == "text":
+            return await asyncio.to_thread(
+                get_store().search_messages, formatted_name, q, limit
             )
-            for row in result
-        ]
+        return await asyncio.to_thread(search_semantic, formatted_name, q, limit)
+    except Exception as e:
+        print(f"Error in search: {str(e)}")
+        raise HTTPException(status_code=500, detail="Internal server error")
 
-        formatted_messages = [
-            Message(
-                id=str(message.message["data"]["id"]),
-                role=message.message["data"]["type"] == "human"
-                and "user"
-                or "assistant",
-                content=message.message["data"]["content"],
-                name=message.message["data"]["name"],
-                created_at=message.created_at,
+
+def get_memory_messages(username: str, request: ChatRequest) -> list[SystemMessage]:
+    """
+    Retrieves relevant turns from the user's other sessions for the prompt.
+
+    Memory is best-effort: any failure is logged and the prompt is built
+    without it.
+    """
+    if not is_memory_enabled():
+        return []
+    try:
+        query_vector = get_embeddings([request.content], get_embedding_model())[0]
+        with sync_transaction() as conn:
+            memories = retrieve_memories(
+                conn, username, request.content, request.session_id, query_vector
             )
-            for message in messages
-        ]
-        return {
-            "session": session,
-            "messages": formatted_messages,
-        }
+        return build_memory_message(memories)
+    except Exception as e:
+        print(f"Error retrieving memories: {str(e)}")
+        return []
+
+
+async def check_rate_limit(http_request: HTTPConnection, username: str) -> str:
+    """
+    Admits a request against the client's rate limits and counts it in the
+    user's usage.
+
+    Returns:
+        str: The client's rate limit key, to charge the generated tokens to.
+
+    Raises:
+        HTTPException: 429 with a Retry-After header if the client is over its limits.
+    """
+    client_ip = http_request.client.host if http_request.client else None
+    key = get_client_key(username, client_ip)
+    # The bucket store may be Postgres
+    retry_after = await asyncio.to_thread(rate_limiter.check, key)
+    if retry_after > 0:
+        usage_recorder.add(username, rejected=1)
+        raise HTTPException(
+            status_code=429,
+            detail="Rate limit exceeded",
+            headers={"Retry-After": str(math.ceil(retry_after))},
+        )
+    usage_recorder.add(username, requests=1)
+    return key
+
+
+def admit_request() -> Admission:
+    """
+    Decides how a chat request is degraded under the current load.
+
+    Raises:
+        HTTPException: 503 with a Retry-After header if the request is shed.
+    """
+    admission = admission_controller.admit()
+    if admission.shed:
+        raise HTTPException(
+            status_code=503,
+            detail="Server overloaded",
+            headers={"Retry-After": str(ADMISSION_RETRY_AFTER)},
+        )
+    return admission
+
+
+@app.get("/admission")
+async def get_admission():
+    """
+    Returns the admission controller's load signals and degradation level.
+    """
+    return admission_controller.status()
+
+
+async def select_model(
+    request: ChatRequest, models: list[str], history_messages: int, admission: Admission
+) -> tuple[str, float | None]:
+    """
+    Picks the model a chat request runs on: routes "auto" requests by prompt
+    complexity, then applies the admission fallback.
+
+    Returns:
+        tuple[str, float | None]: The model, and the complexity score of "auto" requests.
+
+    Raises:
+        HTTPException: 400 if the request is "auto" and no chat model is available.
+    """
+    route_score = None
+    model_name = request.model
+    if model_name == AUTO_MODEL:
+        await asyncio.to_thread(model_router.load_sizes, models)
+        try:
+            model_name, route_score = model_router.route(
+                request.content, history_messages, models
+            )
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+    model_name = admission.route_model(model_name, models)
+    residency_manager.note_request(model_name)
+    return model_name, route_score
+
+
+def get_branch_point(store: ChatStore, request: ChatRequest) -> int | None:
+    """
+    Returns the message a chat request continues from when it edits a
+    message (the message's parent) or regenerates an answer (its question),
+    or None to continue the active branch.
+    """
+    if request.edit_id is None and request.regenerate_id is None:
+        return None
+    if request.edit_id is not None and request.regenerate_id is not None:
+        raise HTTPException(
+            status_code=400, detail="Cannot edit and regenerate at once"
+        )
+    require_branches()
+
+    if request.edit_id is not None:
+        message = store.find_branch_message(request.session_id, request.edit_id)
+        role = "human"
+    else:
+        message = store.find_branch_message(request.session_id, request.regenerate_id)
+        role = "ai"
+    if message is None or message[2] != role:
+        raise HTTPException(status_code=404, detail="Message not found")
+    return message[1]
+
+
+def get_generation_options(
+    profile: str | None, options: GenerationOptions | None = None
+) -> tuple[str, dict]:
+    """
+    Resolves a request's generation profile and option overrides.
+
+    Raises:
+        HTTPException: 400 if the profile is unknown or an option is over its cap.
+    """
+    try:
+        return resolve_generation(profile, options)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+def model_headers(
+    model_name: str, profile: str, admission: Admission, route_score: float | None
+) -> dict[str, str]:
+    headers = {
+        "X-Model": model_name,
+        "X-Profile": profile,
+        "X-Degradation-Level": str(admission.level),
+    }
+    if route_score is not None:
+        headers["X-Route-Score"] = str(route_score)
+    return headers
+
+
+@app.get("/profiles")
+async def get_profiles():
+    """
+    Returns the generation profiles, the server caps on their options, and
+    the generations, tokens and average latency recorded per profile.
+    """
+    return get_profiles_status()
+
+
+@app.get("/routing")
+async def get_routing():
+    """
+    Returns the models "auto" requests are routed between, smallest first,
+    and the learned complexity score boundaries between them.
+    """
+    return model_router.status()
+
+
+@app.post("/routing/feedback", dependencies=[Depends(require_admin)])
+async def routing_feedback(feedback: RoutingFeedback):
+    """
+    Records whether an answer from an "auto" request was good enough, given
+    its model (X-Model) and complexity score (X-Route-Score), so the router
+    adjusts which prompts go to that model. The router is shared by every
+    user, so only admins can train it.
+    """
+    model_router.feedback(feedback.model, feedback.score, feedback.good)
+    return model_router.status()
+
+
+async def record_generated_tokens(key: str, username: str, tokens: int):
+    await asyncio.to_thread(rate_limiter.charge_tokens, key, tokens)
+    usage_recorder.add(username, tokens=tokens)
+
+
+def read_usage(name: str, days: int) -> list[dict]:
+    with sync_transaction() as conn:
+        usage_recorder.flush(conn)
+        return get_usage(conn, name, days)
+
+
+@app.get("/usage", dependencies=[Depends(require_admin)])
+async def usage(name: str, days: int = Query(default=7, ge=1, le=366)):
+    """
+    Returns a user's daily usage: requests, generated tokens and requests
+    rejected by the rate limiter. Usage is kept in Postgres only.
+
+    Args:
+        name (str): The username.
+        days (int): The number of days to return, including today.
+
+    Returns:
+        list[dict]: One entry per day with usage, newest first.
+    """
+    require_postgres("Usage")
+    return await asyncio.to_thread(read_usage, name, days)
 
 
 @app.post("/chat")
-async def chat(request: ChatRequest):
+async def chat(request: ChatRequest, http_request: Request):
     """
     Handles a chat request by validating the session ID, model, and creating a new session if needed.
     It then adds the user's message to the chat history and generates a response using the selected model.
 
     Args:
         request (ChatRequest): The chat request containing session ID, model, and content.
+        http_request (Request): The HTTP request, for the client address.
 
     Returns:
         JSONResponse: A JSON response containing the generated response.
@@ -183,51 +903,213 @@ async def chat(request: ChatRequest):
     if not is_session_id_valid(request.session_id):
         raise HTTPException(status_code=400, detail="Invalid session ID")
 
-    if request.model not in get_ollama_models_names():
+    models = await asyncio.to_thread(get_ollama_models_names)
+    if request.model != AUTO_MODEL and request.model not in models:
         raise HTTPException(status_code=400, detail="Invalid model")
+    profile, options = get_generation_options(request.profile, request.options)
+    admission = admit_request()
+    rate_limit_key = await check_rate_limit(http_request, request.name)
 
     # SESSION HANDLING
-    session = get_session_by_id(sync_connection, request.session_id)
-    if not session:
-        title = get_session_title(request.content)
-        session = Session(id=request.session_id, title=title, username=request.name)
-        create_session_if_not_exists(
-            sync_connection, request.session_id, request.name, title
+    store = get_store()
+    parent_id = await asyncio.to_thread(get_branch_point, store, request)
+    db_start = time.perf_counter()
+    session, prev_messages, unsummarized_count = await asyncio.to_thread(
+        store.bootstrap_session, request.session_id, parent_id
+    )
+    admission_controller.observe_db(time.perf_counter() - db_start)
+    question = None
+    if request.regenerate_id is not None:
+        # The branch ends with the question of the regenerated answer
+        question = prev_messages.pop()
+        unsummarized_count -= 1
+        request.content = question.content
+    is_new_session = session is None
+    title_mode = request.title_mode or TITLE_MODE
+    if admission.skip_titles:
+        title_mode = "heuristic"
+    if is_new_session:
+        title = await asyncio.to_thread(get_initial_title, request.content, title_mode)
+        session = await asyncio.to_thread(
+            store.create_session, request.session_id, request.name, title
         )
-    chat_history = PostgresChatMessageHistory(
-        table_name, request.session_id, sync_connection=sync_connection
+    model_name, route_score = await select_model(
+        request, models, len(prev_messages), admission
     )
-    prev_messages = chat_history.get_messages()
+    if admission.shrink_context:
+        prev_messages = shrink_history(prev_messages, ADMISSION_CONTEXT_MESSAGES)
 
     # CHAT COMPLETION
-    new_usr_msg = HumanMessage(
+    new_usr_msg = question or HumanMessage(
         content=request.content, id=generate_message_id(), name=request.name
     )
-    prompt = ChatPromptTemplate.from_messages(
-        [chat_sys_msg] + prev_messages + [new_usr_msg]
-    )
-    model = OllamaLLM(
-        model=request.model,
-        base_url=os.getenv("OLLAMA_BASE_URL"),
-    )
-    chain = prompt | model
-    response = chain.invoke({"content": request.content})
+    memory_messages = []
+    if not admission.shrink_context:
+        memory_messages = await asyncio.to_thread(
+            get_memory_messages, session.username, request
+        )
+    prompt = chat_prompt.render(memory_messages + prev_messages + [new_usr_msg])
+    model = get_llm(model_name, **options)
+    with admission_controller.in_flight():
+        llm_start = time.perf_counter()
+        # Streamed so the controller sees the time to first token, like the
+        # other paths, and not the time of the whole answer
+        chunks = []
+        async for chunk in model.astream(prompt):
+            if not chunks:
+                admission_controller.observe_ollama(time.perf_counter() - llm_start)
+            chunks.append(chunk)
+        response = "".join(chunks)
+        llm_seconds = time.perf_counter() - llm_start
     new_ai_msg = AIMessage(content=response, id=generate_message_id(), name="Assistant")
+    await record_generated_tokens(
+        rate_limit_key, request.name, estimate_tokens(response)
+    )
+    record_generation(profile, estimate_tokens(response), llm_seconds)
 
     # STORE MESSAGES
-    chat_history.add_messages([new_usr_msg, new_ai_msg])
+    new_messages = [new_ai_msg] if question else [new_usr_msg, new_ai_msg]
+    await asyncio.to_thread(
+        store.add_messages, request.session_id, new_messages, parent_id
+    )
+    if is_new_session:
+        await asyncio.to_thread(
+            finalize_title,
+            store,
+            request.session_id,
+            title_mode,
+            request.content,
+            response,
+            refine=not admission.skip_titles,
+        )
+    embedding_worker.enqueue(request.session_id)
+    if should_summarize(unsummarized_count + 2):
+        summary_worker.enqueue(request.session_id)
+
+    return JSONResponse(
+        content={"message": response},
+        headers=model_headers(model_name, profile, admission, route_score),
+    )
+
+
+@app.post("/batch", dependencies=[Depends(require_admin)])
+async def batch(
+    request: Request,
+    name: str = "User",
+    batch_id: str | None = None,
+    skip_titles: bool = False,
+):
+    """
+    Runs a JSONL batch of prompts and streams the results back as JSONL.
+
+    Each input line is a `BatchItem`. Items without a session ID are stateless;
+    items with one read and extend that session's history. Results are
+    streamed in completion order and carry the item's `index` and `id`.
+    Passing the `batch_id` of an interrupted batch (returned in the
+    `X-Batch-Id` header) resumes it without recomputing finished items.
+
+    The batch is admitted as one request against the rate limits, and the
+    tokens each item generates are charged as it finishes.
+
+    Args:
+        request (Request): The request whose body is the JSONL batch.
+        name (str): The user the batch is charged to.
+        batch_id (str | None): The UUID of a batch to resume.
+        skip_titles (bool): Use a heuristic title for new sessions instead of an LLM call.
+
+    Returns:
+        StreamingResponse: One JSON result per line.
+    """
+    require_postgres("Batches")
+    if batch_id is not None and not is_session_id_valid(batch_id):
+        raise HTTPException(status_code=400, detail="Invalid batch ID")
+    batch_id = batch_id or str(uuid.uuid4())
 
-    return JSONResponse(content={"message": response})
+    body = await request.body()
+    try:
+        items = parse_batch_items(body.decode("utf-8").splitlines())
+    except (ValueError, UnicodeDecodeError) as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if len(items) > BATCH_MAX_ITEMS:
+        raise HTTPException(status_code=400, detail="Too many items")
+    admission = admit_request()
+    rate_limit_key = await check_rate_limit(request, name)
+
+    print(f"Batch Request: #{batch_id} with {len(items)} items from @{name}")
+
+    async def stream_results():
+        async for result in run_batch(
+            batch_id, items, skip_titles or admission.skip_titles
+        ):
+            if "response" in result and not result.get("resumed"):
+                await record_generated_tokens(
+                    rate_limit_key, name, estimate_tokens(result["response"])
+                )
+            yield json.dumps(result, ensure_ascii=False) + "\n"
+
+    return StreamingResponse(
+        stream_results(),
+        media_type="application/x-ndjson",
+        headers={"X-Batch-Id": batch_id},
+    )
+
+
+@app.post("/compare")
+async def compare(request: CompareRequest, http_request: Request):
+    """
+    Runs the same prompt against several models concurrently, without a
+    session, and streams their answers back interleaved as JSONL.
+
+    Args:
+        request (CompareRequest): The prompt and the models to compare.
+        http_request (Request): The HTTP request, for the client address.
+
+    Returns:
+        StreamingResponse: `{"model", "chunk"}` lines as the models answer,
+        then one line per model with its TTFT and throughput, or its error.
+    """
+    models = list(dict.fromkeys(request.models))
+    if len(models) < 2:
+        raise HTTPException(status_code=400, detail="At least two models are required")
+    if len(models) > COMPARE_MAX_MODELS:
+        raise HTTPException(status_code=400, detail="Too many models")
+    available = await asyncio.to_thread(get_ollama_models_names)
+    for model in models:
+        if model not in available:
+            raise HTTPException(status_code=400, detail=f"Invalid model: {model}")
+    profile, options = get_generation_options(request.profile)
+    admission = admit_request()
+    rate_limit_key = await check_rate_limit(http_request, request.name)
+
+    print(f"Compare Request: {', '.join(models)} from @{request.name}")
+
+    async def stream_events():
+        generated_tokens = 0
+        async for event in run_comparison(
+            request.name, request.content, models, profile, options
+        ):
+            generated_tokens += event.get("tokens", 0)
+            yield json.dumps(event, ensure_ascii=False) + "\n"
+        await record_generated_tokens(rate_limit_key, request.name, generated_tokens)
+
+    return StreamingResponse(
+        stream_events(),
+        media_type="application/x-ndjson",
+        headers={"X-Profile": profile, "X-Degradation-Level": str(admission.level)},
+    )
 
 
 @app.post("/stream")
-async def stream(request: ChatRequest, background_tasks: BackgroundTasks):
+async def stream(
+    request: ChatRequest, http_request: Request, background_tasks: BackgroundTasks
+):
     """
     Handles a streaming chat request by validating the session ID, model, and creating a new session if needed.
     It then adds the user's message to the chat history and generates a response using the selected model.
 
     Args:
         request (ChatRequest): The chat request containing session ID, model, and content.
+        http_request (Request): The HTTP request, for the client address.
         background_tasks (BackgroundTasks): The background tasks to handle the streaming response.
 
     Returns:
@@ -241,76 +1123,88 @@ async def stream(request: ChatRequest, background_tasks: BackgroundTasks):
     if not is_session_id_valid(request.session_id):
         raise HTTPException(status_code=400, detail="Invalid session ID")
 
-    if request.model not in get_ollama_models_names():
+    models = await asyncio.to_thread(get_ollama_models_names)
+    if request.model != AUTO_MODEL and request.model not in models:
         raise HTTPException(status_code=400, detail="Invalid model")
+    profile, options = get_generation_options(request.profile, request.options)
+    admission = admit_request()
+    rate_limit_key = await check_rate_limit(http_request, request.name)
 
     # SESSION HANDLING
-    session = get_session_by_id(sync_connection, request.session_id)
-    if not session:
-        title = get_session_title(request.content)
-        session = Session(id=request.session_id, title=title, username=request.name)
-        create_session_if_not_exists(
-            sync_connection, request.session_id, request.name, title
+    store = get_store()
+    parent_id = await asyncio.to_thread(get_branch_point, store, request)
+    db_start = time.perf_counter()
+    session, prev_messages, unsummarized_count = await asyncio.to_thread(
+        store.bootstrap_session, request.session_id, parent_id
+    )
+    admission_controller.observe_db(time.perf_counter() - db_start)
+    question = None
+    if request.regenerate_id is not None:
+        # The branch ends with the question of the regenerated answer
+        question = prev_messages.pop()
+        unsummarized_count -= 1
+        request.content = question.content
+    is_new_session = session is None
+    title_mode = request.title_mode or TITLE_MODE
+    if admission.skip_titles:
+        title_mode = "heuristic"
+    if is_new_session:
+        title = await asyncio.to_thread(get_initial_title, request.content, title_mode)
+        session = await asyncio.to_thread(
+            store.create_session, request.session_id, request.name, title
         )
-
-    chat_history = PostgresChatMessageHistory(
-        table_name, request.session_id, sync_connection=sync_connection
+    model_name, route_score = await select_model(
+        request, models, len(prev_messages), admission
     )
-    prev_messages = chat_history.get_messages()
+
+    if admission.shrink_context:
+        prev_messages = shrink_history(prev_messages, ADMISSION_CONTEXT_MESSAGES)
 
     # CHAT COMPLETION
-    new_usr_msg = HumanMessage(
+    new_usr_msg = question or HumanMessage(
         content=request.content, id=generate_message_id(), name=request.name
     )
 
-    messages = (
-        [SystemMessage(content=chat_sys_msg.content)] + prev_messages + [new_usr_msg]
-    )
+    memory_messages = []
+    if not admission.shrink_context:
+        memory_messages = await asyncio.to_thread(
+            get_memory_messages, session.username, request
+        )
+    prompt = chat_prompt.render(memory_messages + prev_messages + [new_usr_msg])
 
-    print(f"Messages:\n{messages}")
+    print(f"Prompt:\n{prompt}")
 
-    model_with_streaming = OllamaLLM(
-        model=request.model,
-        base_url=os.getenv("OLLAMA_BASE_URL"),
-        streaming=True,
-    )
+    model_with_streaming = get_llm(model_name, streaming=True, **options)
 
     # RESPONSE STREAMING
     full_response = ""
-    buffer = ""
-    in_think_block = False
+    # Ollama streams one token per chunk
+    generated_tokens = 0
 
-    async def stream_response():
-        nonlocal full_response, buffer, in_think_block
-        async for token in model_with_streaming.astream(messages):
-            buffer += token
+    async def stream_tokens():
+        nonlocal full_response, generated_tokens
+        llm_start = time.perf_counter()
+        async for token in model_with_streaming.astream(prompt):
             full_response += token
-
-            # Check for think tags
-            if "<think>" in buffer and not in_think_block:
-                # Find the start of the think block
-                think_start = buffer.find("<think>")
-                # Output everything before the think block
-                if think_start > 0:
-                    yield buffer[:think_start]
-                buffer = buffer[think_start:]
-                in_think_block = True
-
-            # Check for end of think block
-            if "</think>" in buffer and in_think_block:
-                # Find the end of the think block
-                think_end = buffer.find("</think>") + len("</think>")
-                # Remove the think block from buffer
-                buffer = buffer[think_end:]
-                in_think_block = False
-
-            # If we're not in a think block and have content, yield it
-            if not in_think_block and buffer:
-                yield buffer
-                buffer = ""
+            generated_tokens += 1
+            if generated_tokens == 1:
+                ttft = time.perf_counter() - llm_start
+                admission_controller.observe_ollama(ttft)
+            yield token
+        if generated_tokens:
+            llm_seconds = time.perf_counter() - llm_start
+            model_stats.record_stream(model_name, ttft, llm_seconds, generated_tokens)
+            record_generation(profile, generated_tokens, llm_seconds)
+
+    async def stream_in_flight():
+        with admission_controller.in_flight():
+            async for chunk in filter_think_stream(stream_tokens()):
+                yield chunk
 
     response = StreamingResponse(
-        stream_response(), media_type="text/plain; charset=utf-8"
+        stream_in_flight(),
+        media_type="text/plain; charset=utf-8",
+        headers=model_headers(model_name, profile, admission, route_score),
     )
 
     # STORE MESSAGES
@@ -319,13 +1213,204 @@ async def stream(request: ChatRequest, background_tasks: BackgroundTasks):
             content=full_response, id=generate_message_id(), name="Assistant"
         )
         print(f"New AI Message:\n{new_ai_msg}")
-        chat_history.add_messages([new_usr_msg, new_ai_msg])
+        await record_generated_tokens(rate_limit_key, request.name, generated_tokens)
+        new_messages = [new_ai_msg] if question else [new_usr_msg, new_ai_msg]
+        await asyncio.to_thread(
+            store.add_messages, request.session_id, new_messages, parent_id
+        )
+        if is_new_session:
+            await asyncio.to_thread(
+                finalize_title,
+                store,
+                request.session_id,
+                title_mode,
+                request.content,
+                full_response,
+                refine=not admission.skip_titles,
+            )
+        embedding_worker.enqueue(request.session_id)
+        if should_summarize(unsummarized_count + 2):
+            summary_worker.enqueue(request.session_id)
 
     background_tasks.add_task(store_messages)
 
     return response
 
 
+async def run_socket_chat(
+    channel: ChatChannel, generation: Generation, request: ChatRequest
+):
+    """
+    Runs one generation of a WebSocket chat channel, like `/stream`, except
+    that the session state comes from the connection when it has it. A
+    cancelled generation stores the answer generated so far.
+
+    Args:
+        channel (ChatChannel): The client's connection.
+        generation (Generation): The generation, for its ID and flow control.
+        request (ChatRequest): The chat request from the "chat" frame.
+
+    Raises:
+        HTTPException: Sent to the client as an "error" frame.
+    """
+    print(
+        f"Socket Chat Request: #{request.session_id} from @{request.name}\n{request.content}"
+    )
+
+    # INPUT VALIDATION
+    if request.edit_id is not None or request.regenerate_id is not None:
+        raise HTTPException(
+            status_code=400,
+            detail="Editing and regenerating are only available over HTTP",
+        )
+    models = await channel.get_models()
+    if request.model != AUTO_MODEL and request.model not in models:
+        models = await channel.get_models(refresh=True)
+        if request.model not in models:
+            raise HTTPException(status_code=400, detail="Invalid model")
+    profile, options = get_generation_options(request.profile, request.options)
+    admission = admit_request()
+    rate_limit_key = await check_rate_limit(channel.websocket, request.name)
+
+    store = get_store()
+    async with channel.session_lock(request.session_id):
+        # SESSION HANDLING
+        state = channel.get_session_state(request.session_id)
+        if state is None:
+            db_start = time.perf_counter()
+            state = await channel.load_session(request.session_id)
+            admission_controller.observe_db(time.perf_counter() - db_start)
+        is_new_session = state is None
+        title_mode = request.title_mode or TITLE_MODE
+        if admission.skip_titles:
+            title_mode = "heuristic"
+        if is_new_session:
+            title = await asyncio.to_thread(
+                get_initial_title, request.content, title_mode
+            )
+            session = await asyncio.to_thread(
+                store.create_session, request.session_id, request.name, title
+            )
+            state = channel.remember_session(session, [], 0)
+
+        prev_messages = state.history
+        model_name, route_score = await select_model(
+            request, models, len(prev_messages), admission
+        )
+        if admission.shrink_context:
+            prev_messages = shrink_history(prev_messages, ADMISSION_CONTEXT_MESSAGES)
+
+        # CHAT COMPLETION
+        new_usr_msg = HumanMessage(
+            content=request.content, id=generate_message_id(), name=request.name
+        )
+        memory_messages = []
+        if not admission.shrink_context:
+            memory_messages = await asyncio.to_thread(
+                get_memory_messages, state.session.username, request
+            )
+        prompt = chat_prompt.render(memory_messages + prev_messages + [new_usr_msg])
+        model_with_streaming = get_llm(model_name, streaming=True, **options)
+        await channel.send(
+            {
+                "type": "start",
+                "id": generation.id,
+                "session_id": request.session_id,
+                "model": model_name,
+                "profile": profile,
+                "degradation_level": admission.level,
+                "route_score": route_score,
+            }
+        )
+
+        # RESPONSE STREAMING
+        full_response = ""
+        generated_tokens = 0
+        cancelled = False
+
+        async def stream_tokens():
+            nonlocal full_response, generated_tokens
+            llm_start = time.perf_counter()
+            async for token in model_with_streaming.astream(prompt):
+                full_response += token
+                generated_tokens += 1
+                if generated_tokens == 1:
+                    ttft = time.perf_counter() - llm_start
+                    admission_controller.observe_ollama(ttft)
+                yield token
+            if generated_tokens:
+                llm_seconds = time.perf_counter() - llm_start
+                model_stats.record_stream(
+                    model_name, ttft, llm_seconds, generated_tokens
+                )
+                record_generation(profile, generated_tokens, llm_seconds)
+
+        try:
+            with admission_controller.in_flight():
+                async for chunk in filter_think_stream(stream_tokens()):
+                    await channel.send_chunk(generation, chunk)
+        except asyncio.CancelledError:
+            cancelled = True
+        if not full_response:
+            await channel.send(
+                {
+                    "type": "done",
+                    "id": generation.id,
+                    "session_id": request.session_id,
+                    "message_id": None,
+                    "cancelled": cancelled,
+                }
+            )
+            return
+
+        # STORE MESSAGES
+        new_ai_msg = AIMessage(
+            content=full_response, id=generate_message_id(), name="Assistant"
+        )
+        await record_generated_tokens(rate_limit_key, request.name, generated_tokens)
+        await asyncio.to_thread(
+            store.add_messages, request.session_id, [new_usr_msg, new_ai_msg]
+        )
+        state.history = state.history + [new_usr_msg, new_ai_msg]
+        state.unsummarized += 2
+        if is_new_session:
+            await asyncio.to_thread(
+                finalize_title,
+                store,
+                request.session_id,
+                title_mode,
+                request.content,
+                full_response,
+                refine=not admission.skip_titles,
+            )
+            session = await asyncio.to_thread(store.get_session, request.session_id)
+            await channel.announce_title(request.session_id, session.title)
+        embedding_worker.enqueue(request.session_id)
+        if should_summarize(state.unsummarized):
+            summary_worker.enqueue(request.session_id)
+            # The summary replaces part of the history
+            channel.forget_session(request.session_id)
+
+    await channel.send(
+        {
+            "type": "done",
+            "id": generation.id,
+            "session_id": request.session_id,
+            "message_id": new_ai_msg.id,
+            "cancelled": cancelled,
+        }
+    )
+
+
+@app.websocket("/ws")
+async def chat_socket(websocket: WebSocket):
+    """
+    Serves a WebSocket chat channel that multiplexes generations, session
+    switches and title updates. See `lib.channel` for the protocol.
+    """
+    await ChatChannel(websocket, run_socket_chat).serve()
+
+
 def validate_env_vars():
     """
     Validates that all required environment variables are set.
@@ -348,6 +1433,8 @@ def validate_env_vars():
 
 
 def main():
+    import uvicorn
+
     validate_env_vars()
     load_dotenv()
     uvicorn.run(
@@ -0,0 +1,72 @@
+"""
+Fails tests whose requests to the chat and session routes block the event
+loop for longer than the blocking threshold (see `lib.blocking`).
+
+Options:
+    --blocking-threshold=MS  Overrides `BLOCKING_THRESHOLD_MS`.
+    --no-blocking-check      Disables the check.
+
+Tests that block on purpose can be marked with `allow_blocking`.
+
+Each test also starts with full rate limit buckets, since every test client
+request comes from the same address.
+"""
+
+import pytest
+
+from lib.blocking import BLOCKING_THRESHOLD_MS, blocking_detector
+from lib.ratelimit import MemoryBucketStore, rate_limiter
+
+# Requests to these paths may not block the event loop
+BLOCKING_ENFORCED_PATHS = {"/chat", "/stream", "/session", "/sessions", "/search"}
+
+
+def pytest_addoption(parser):
+    group = parser.getgroup("blocking", "event loop blocking detector")
+    group.addoption(
+        "--blocking-threshold",
+        type=float,
+        default=BLOCKING_THRESHOLD_MS,
+        help="milliseconds an enforced route may block the event loop",
+    )
+    group.addoption(
+        "--no-blocking-check",
+        action="store_true",
+        help="do not fail tests that block the event loop",
+    )
+
+
+def pytest_configure(config):
+    config.addinivalue_line(
+        "markers",
+        "allow_blocking: the test may block the event loop on enforced routes",
+    )
+    if not config.getoption("no_blocking_check"):
+        blocking_detector.enabled = True
+        blocking_detector.threshold = config.getoption("blocking_threshold") / 1000
+
+
+@pytest.fixture(autouse=True)
+def reset_rate_limits(monkeypatch):
+    monkeypatch.setattr(rate_limiter, "store", MemoryBucketStore())
+
+
+@pytest.hookimpl(wrapper=True)
+def pytest_runtest_call(item):
+    blocking_detector.clear()
+    result = yield
+    if not blocking_detector.enabled or item.get_closest_marker("allow_blocking"):
+        return result
+    blocks = [
+        report
+        for report in list(blocking_detector.reports)
+        if report["path"] in BLOCKING_ENFORCED_PATHS
+    ]
+    if blocks:
+        details = "\n".join(
+            f"{report['endpoint']} blocked the event loop for {report['seconds'] * 1000:.0f}ms:\n"
+            f"{report['stack']}"
+            for report in blocks
+        )
+        pytest.fail(details, pytrace=False)
+    return result
@@ -0,0 +1,72 @@
+from langchain_core.messages import AIMessage, HumanMessage, SystemMessage
+
+from lib.admission import (
+    ADMISSION_FALLBACK_MODEL,
+    ADMISSION_MAX_IN_FLIGHT,
+    Admission,
+    AdmissionController,
+    shrink_history,
+)
+
+
+def test_shrink_history_keeps_summary():
+    """Test that shrinking keeps the summary and the most recent messages."""
+    messages = [SystemMessage(content="summary")] + [
+        HumanMessage(content=str(i)) if i % 2 == 0 else AIMessage(content=str(i))
+        for i in range(10)
+    ]
+    shrunk = shrink_history(messages, 4)
+    assert [m.content for m in shrunk] == ["summary", "6", "7", "8", "9"]
+    assert shrink_history(messages, 0) == messages[:1]
+
+
+def test_admission_steps():
+    """Test that each level implies the steps below it."""
+    assert not Admission(0, 0).shrink_context
+    admission = Admission(2, 0.8)
+    assert admission.shrink_context and admission.use_fallback_model
+    assert not admission.skip_titles and not admission.shed
+    assert Admission(4, 1.2).shed
+
+
+def test_route_model():
+    """Test that requests are only routed to an available fallback model."""
+    admission = Admission(2, 0.8)
+    assert (
+        admission.route_model("gemma3:1b", ["gemma3:1b", ADMISSION_FALLBACK_MODEL])
+        == ADMISSION_FALLBACK_MODEL
+    )
+    assert admission.route_model("gemma3:1b", ["gemma3:1b"]) == "gemma3:1b"
+    assert (
+        Admission(1, 0.6).route_model("gemma3:1b", [ADMISSION_FALLBACK_MODEL])
+        == "gemma3:1b"
+    )
+
+
+def test_admission_levels_follow_load():
+    """Test that the level rises with generations in flight and latency."""
+    controller = AdmissionController(enabled=True)
+    assert controller.admit().level == 0
+
+    controller.in_flight_count = ADMISSION_MAX_IN_FLIGHT
+    assert controller.admit().shed
+    controller.in_flight_count = 0
+
+    controller.observe_ollama(1000)
+    assert controller.admit().level > 0
+    assert controller.status()["ollama_latency"] > 0
+
+
+def test_admission_disabled():
+    """Test that a disabled controller never degrades."""
+    controller = AdmissionController(enabled=False)
+    controller.in_flight_count = ADMISSION_MAX_IN_FLIGHT * 10
+    assert controller.admit().level == 0
+
+
+def test_in_flight_counter():
+    """Test that generations are counted while in flight."""
+    controller = AdmissionController(enabled=True)
+    with controller.in_flight():
+        assert controller.in_flight_count == 1
+    assert controller.in_flight_count == 0
@@ -0,0 +1,60 @@
+import uuid
+from langchain_core.messages import AIMessage, HumanMessage
+
+from lib.archive import archive_session, get_archive_stats, rehydrate_session
+from lib.database import (
+    create_session_if_not_exists,
+    get_chat_history,
+    get_db_connection,
+    table_name,
+)
+from lib.summary import get_prompt_history
+
+
+def test_archive_and_rehydrate():
+    """Test that an archived session comes back with the same messages and IDs."""
+    conn = get_db_connection()
+    test_id = str(uuid.uuid4())
+    create_session_if_not_exists(conn, test_id, "Test User", "Test Session")
+    history = get_chat_history(conn, test_id)
+    history.add_messages(
+        [
+            HumanMessage(content=f"question {i}", id=f"q{i}", name="Test User")
+            if i % 2 == 0
+            else AIMessage(content=f"answer {i} " * 50, id=f"a{i}", name="Assistant")
+            for i in range(10)
+        ]
+    )
+    with conn.cursor() as cur:
+        cur.execute(
+            f"SELECT id FROM {table_name} WHERE session_id = %s ORDER BY id", (test_id,)
+        )
+        ids = [row[0] for row in cur.fetchall()]
+    before = history.messages
+
+    messages, hot_bytes, archived_bytes = archive_session(conn, test_id)
+    assert messages == 10
+    assert archived_bytes < hot_bytes
+    assert history.messages == []
+    assert get_archive_stats(conn)["sessions"] >= 1
+
+    assert rehydrate_session(conn, test_id) is True
+    assert rehydrate_session(conn, test_id) is False
+    assert history.messages == before
+    with conn.cursor() as cur:
+        cur.execute(
+            f"SELECT id FROM {table_name} WHERE session_id = %s ORDER BY id", (test_id,)
+        )
+        assert [row[0] for row in cur.fetchall()] == ids
+    assert len(get_prompt_history(conn, table_name, test_id)[0]) == 10
+    conn.close()
+
+
+def test_archive_empty_session():
+    """Test that a session without messages is not archived."""
+    conn = get_db_connection()
+    test_id = str(uuid.uuid4())
+    create_session_if_not_exists(conn, test_id, "Test User", "Test Session")
+    assert archive_session(conn, test_id) == (0, 0, 0)
+    assert rehydrate_session(conn, test_id) is False
+    conn.close()
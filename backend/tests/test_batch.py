@@ -0,0 +1,30 @@
+import pytest
+from lib.batch import parse_batch_items
+
+
+def test_parse_batch_items():
+    """Test that JSONL input is parsed with defaults and blank lines skipped."""
+    items = parse_batch_items(
+        [
+            '{"id": "a", "content": "Hello"}',
+            "",
+            '{"content": "Hi", "model": "qwen3:0.6b", "session_id": "123e4567-e89b-12d3-a456-426614174000"}',
+        ]
+    )
+    assert len(items) == 2
+    assert items[0].id == "a"
+    assert items[0].model == "gemma3:1b"
+    assert items[0].session_id is None
+    assert items[1].model == "qwen3:0.6b"
+
+
+def test_parse_batch_items_invalid():
+    """Test that invalid lines are reported with their line number."""
+    with pytest.raises(ValueError, match="line 2"):
+        parse_batch_items(['{"content": "ok"}', "not json"])
+
+    with pytest.raises(ValueError, match="line 1"):
+        parse_batch_items(['{"id": "missing content"}'])
+
+    with pytest.raises(ValueError, match="Invalid session ID"):
+        parse_batch_items(['{"content": "Hi", "session_id": "invalid-uuid"}'])
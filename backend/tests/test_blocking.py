@@ -0,0 +1,70 @@
+import asyncio
+import time
+
+import pytest
+from fastapi import FastAPI
+from fastapi.responses import StreamingResponse
+from fastapi.testclient import TestClient
+
+from lib.blocking import BlockingDetectorMiddleware, blocking_detector
+
+app = FastAPI()
+app.add_middleware(BlockingDetectorMiddleware)
+
+
+def slow_query():
+    time.sleep(0.3)
+
+
+@app.get("/slow")
+async def slow():
+    slow_query()
+    return {}
+
+
+@app.get("/offloaded")
+async def offloaded():
+    await asyncio.to_thread(slow_query)
+    return {}
+
+
+@app.post("/stream")
+async def stream():
+    async def generate():
+        yield "a"
+        slow_query()
+        yield "b"
+
+    return StreamingResponse(generate())
+
+
+client = TestClient(app)
+
+
+@pytest.fixture(autouse=True)
+def enable_detector(monkeypatch):
+    monkeypatch.setattr(blocking_detector, "enabled", True)
+    monkeypatch.setattr(blocking_detector, "threshold", 0.1)
+
+
+def test_blocking_call_reported():
+    """Test that a blocking call is reported with its route, duration and stack."""
+    client.get("/slow")
+    [report] = blocking_detector.reports
+    assert report["endpoint"] == "GET /slow"
+    assert report["seconds"] >= 0.25
+    assert "in slow_query" in report["stack"]
+
+
+def test_offloaded_call_not_reported():
+    """Test that a call moved to a thread does not block the loop."""
+    client.get("/offloaded")
+    assert not blocking_detector.reports
+
+
+@pytest.mark.allow_blocking
+def test_streaming_generator_attributed():
+    """Test that blocking in a streaming response's generator counts for its route."""
+    assert client.post("/stream").text == "ab"
+    [report] = blocking_detector.reports
+    assert report["path"] == "/stream"
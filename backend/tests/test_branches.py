@@ -0,0 +1,237 @@
+import uuid
+
+from fastapi.testclient import TestClient
+from langchain_core.messages import AIMessage, HumanMessage
+
+from lib.archive import archive_session, find_idle_sessions
+from lib.database import RoundTripCounter, get_db_connection, table_name
+from lib.store import PostgresStore
+from lib.utils import generate_message_id
+from main import app
+
+client = TestClient(app)
+
+
+def chat(session_id: str, content: str, **fields) -> dict:
+    response = client.post(
+        "/chat",
+        json={
+            "session_id": session_id,
+            "name": "Branch User",
+            "model": "gemma3:1b",
+            "content": content,
+            **fields,
+        },
+    )
+    assert response.status_code == 200
+    return response.json()
+
+
+def get_messages(session_id: str) -> list[dict]:
+    return client.get(f"/session?session_id={session_id}").json()["messages"]
+
+
+def contents(messages: list[dict]) -> list[str]:
+    return [message["content"] for message in messages if message["role"] == "user"]
+
+
+def test_edit_message():
+    """Test that editing a message starts a branch and that branches can be switched."""
+    session_id = str(uuid.uuid4())
+    chat(session_id, "first")
+    chat(session_id, "second")
+    original = get_messages(session_id)
+
+    chat(session_id, "first, edited", edit_id=original[0]["id"])
+    edited = get_messages(session_id)
+    assert contents(edited) == ["first, edited"]
+    assert len(edited) == 2
+
+    chat(session_id, "third")
+    assert contents(get_messages(session_id)) == ["first, edited", "third"]
+
+    branches = client.get(f"/session/branches?session_id={session_id}").json()[
+        "branches"
+    ]
+    assert len(branches) == 2
+    assert branches[0]["active"] and not branches[1]["active"]
+    assert branches[1]["message"]["id"] == original[-1]["id"]
+
+    response = client.post(
+        "/session/branch",
+        json={"session_id": session_id, "message_id": original[-1]["id"]},
+    )
+    assert response.status_code == 200
+    assert response.json()["messages"] == original
+    chat(session_id, "after switching back")
+    assert contents(get_messages(session_id)) == [
+        "first",
+        "second",
+        "after switching back",
+    ]
+
+
+def test_regenerate_answer():
+    """Test that regenerating an answer adds a sibling answer to the same question."""
+    session_id = str(uuid.uuid4())
+    chat(session_id, "question")
+    chat(session_id, "follow-up")
+    messages = get_messages(session_id)
+
+    chat(session_id, "", regenerate_id=messages[1]["id"])
+    regenerated = get_messages(session_id)
+    assert [message["id"] for message in regenerated[:1]] == [messages[0]["id"]]
+    assert len(regenerated) == 2
+    assert regenerated[1]["id"] != messages[1]["id"]
+    assert regenerated[1]["role"] == "assistant"
+
+
+def test_branch_errors():
+    """Test that only messages of the active branch can be edited or regenerated."""
+    session_id = str(uuid.uuid4())
+    chat(session_id, "question")
+    messages = get_messages(session_id)
+    base = {"session_id": session_id, "name": "Branch User", "content": "x"}
+
+    response = client.post("/chat", json=base | {"edit_id": messages[1]["id"]})
+    assert response.status_code == 404
+    response = client.post("/chat", json=base | {"regenerate_id": messages[0]["id"]})
+    assert response.status_code == 404
+    response = client.post(
+        "/chat",
+        json=base | {"edit_id": messages[0]["id"], "regenerate_id": messages[1]["id"]},
+    )
+    assert response.status_code == 400
+    response = client.post(
+        "/session/branch", json={"session_id": session_id, "message_id": "missing"}
+    )
+    assert response.status_code == 404
+
+
+def test_fork_shares_messages():
+    """Test that a fork reads the source's messages without copying them."""
+    session_id = str(uuid.uuid4())
+    chat(session_id, "first")
+    chat(session_id, "second")
+    messages = get_messages(session_id)
+
+    response = client.post(
+        "/session/fork",
+        json={"session_id": session_id, "message_id": messages[1]["id"]},
+    )
+    assert response.status_code == 200
+    fork_id = response.json()["session"]["id"]
+    assert get_messages(fork_id) == messages[:2]
+
+    chat(fork_id, "in the fork")
+    assert contents(get_messages(fork_id)) == ["first", "in the fork"]
+    assert get_messages(session_id) == messages
+
+    conn = get_db_connection()
+    with conn.cursor() as cur:
+        cur.execute(
+            f"SELECT count(*) FROM {table_name} WHERE session_id = %s", (fork_id,)
+        )
+        assert cur.fetchone()[0] == 2
+    # The source is kept hot for its fork
+    assert session_id not in find_idle_sessions(conn, -1, 10000)
+    conn.close()
+
+
+def test_branch_bootstrap_round_trip():
+    """Test that a chat turn on a branched session still reads its history in one round trip."""
+    conn = get_db_connection()
+    conn.autocommit = True
+    store = PostgresStore(lambda: conn)
+    session_id = str(uuid.uuid4())
+    store.create_session(session_id, "Branch User", "Branches")
+    messages = [
+        HumanMessage(content=f"message {i}", id=generate_message_id())
+        if i % 2 == 0
+        else AIMessage(content=f"reply {i}", id=generate_message_id())
+        for i in range(6)
+    ]
+    store.add_messages(session_id, messages)
+    question_id = store.find_branch_message(session_id, messages[2].id)[0]
+    edit = HumanMessage(content="message 2, edited", id=generate_message_id())
+    parent_id = store.find_branch_message(session_id, messages[2].id)[1]
+    store.add_messages(session_id, [edit], parent_id)
+    store.add_messages(
+        session_id, [AIMessage(content="reply", id=generate_message_id())]
+    )
+
+    store.bootstrap_session(session_id)
+    with RoundTripCounter(conn) as counter:
+        _, history, unsummarized = store.bootstrap_session(session_id)
+    assert counter.count == 1
+    assert [message.content for message in history] == [
+        "message 0",
+        "reply 1",
+        "message 2, edited",
+        "reply",
+    ]
+    assert unsummarized == 4
+
+    _, history, _ = store.bootstrap_session(session_id, question_id)
+    assert [message.content for message in history] == [
+        "message 0",
+        "reply 1",
+        "message 2",
+    ]
+    conn.close()
+
+
+def test_branch_drops_summary():
+    """Test that a summary past the branch point is dropped, and one before it kept."""
+    conn = get_db_connection()
+    conn.autocommit = True
+    store = PostgresStore(lambda: conn)
+    session_id = str(uuid.uuid4())
+    store.create_session(session_id, "Branch User", "Summaries")
+    messages = [
+        HumanMessage(content=f"message {i}", id=generate_message_id()) for i in range(6)
+    ]
+    store.add_messages(session_id, messages)
+    ids = [store.find_branch_message(session_id, message.id)[0] for message in messages]
+    with conn.cursor() as cur:
+        cur.execute(
+            "INSERT INTO db_session_summaries (session_id, summary, summarized_until) VALUES (%s, %s, %s)",
+            (session_id, "Earlier messages.", ids[1]),
+        )
+
+    store.add_messages(session_id, [HumanMessage(content="after 3")], ids[3])
+    _, history, unsummarized = store.bootstrap_session(session_id)
+    assert history[0].content.endswith("Earlier messages.")
+    assert [message.content for message in history[1:]] == [
+        "message 2",
+        "message 3",
+        "after 3",
+    ]
+    assert unsummarized == 3
+
+    store.add_messages(session_id, [HumanMessage(content="after 0")], ids[0])
+    _, history, _ = store.bootstrap_session(session_id)
+    assert [message.content for message in history] == ["message 0", "after 0"]
+    conn.close()
+
+
+def test_archive_keeps_branches():
+    """Test that an archived branched session comes back on the same branch."""
+    conn = get_db_connection()
+    conn.autocommit = True
+    store = PostgresStore(lambda: conn)
+    session_id = str(uuid.uuid4())
+    store.create_session(session_id, "Branch User", "Archive")
+    messages = [
+        HumanMessage(content=f"message {i}", id=generate_message_id()) for i in range(3)
+    ]
+    store.add_messages(session_id, messages)
+    parent_id = store.find_branch_message(session_id, messages[1].id)[1]
+    edit = HumanMessage(content="edited", id=generate_message_id())
+    store.add_messages(session_id, [edit], parent_id)
+    before = store.get_messages(session_id)
+
+    archive_session(conn, session_id)
+    assert store.get_messages(session_id) == before
+    assert [message.content for message in before] == ["message 0", "edited"]
+    conn.close()
@@ -0,0 +1,46 @@
+import time
+from lib.cache import SessionsCache
+
+
+def test_sessions_cache_version_and_pages():
+    """Test that pages are cached per user and version."""
+    cache = SessionsCache()
+    assert cache.get_version("John Doe") is None
+
+    cache.set_version("John Doe", "1:a")
+    cache.set_page("John Doe", (50, None), ["page"])
+    assert cache.get_version("John Doe") == "1:a"
+    assert cache.get_page("John Doe", (50, None)) == ["page"]
+    assert cache.get_page("John Doe", (10, None)) is None
+
+    # Same version keeps the pages, a new version drops them
+    cache.set_version("John Doe", "1:a")
+    assert cache.get_page("John Doe", (50, None)) == ["page"]
+    cache.set_version("John Doe", "2:b")
+    assert cache.get_page("John Doe", (50, None)) is None
+
+
+def test_sessions_cache_invalidate():
+    """Test that invalidating a user does not affect other users."""
+    cache = SessionsCache()
+    cache.set_version("John Doe", "1:a")
+    cache.set_version("Jane Smith", "1:b")
+
+    cache.invalidate("John Doe")
+    assert cache.get_version("John Doe") is None
+    assert cache.get_version("Jane Smith") == "1:b"
+
+
+def test_sessions_cache_eviction_and_ttl():
+    """Test that the cache is bounded in size and entries expire."""
+    cache = SessionsCache(max_users=2)
+    cache.set_version("a", "1")
+    cache.set_version("b", "1")
+    cache.set_version("c", "1")
+    assert cache.get_version("a") is None
+    assert cache.get_version("c") == "1"
+
+    cache = SessionsCache(ttl=0.01)
+    cache.set_version("a", "1")
+    time.sleep(0.02)
+    assert cache.get_version("a") is None
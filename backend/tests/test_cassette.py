@@ -0,0 +1,135 @@
+import asyncio
+import time
+
+import httpx
+import pytest
+
+import lib.cassette
+import lib.ollama
+from lib.cassette import (
+    AsyncCassetteTransport,
+    Cassette,
+    CassetteMissError,
+    CassetteTransport,
+    request_key,
+)
+from lib.ollama import check_ollama, get_llm, get_ollama_models_names
+
+LINES = [b'{"response": "Hel', 'lo ☕"}\n'.encode("utf-8"), b'{"done": true}\n']
+
+
+class SlowStream(httpx.SyncByteStream, httpx.AsyncByteStream):
+    """A streamed response that sends a chunk every 20 ms."""
+
+    def __iter__(self):
+        for line in LINES:
+            time.sleep(0.02)
+            yield line
+
+    async def __aiter__(self):
+        for line in LINES:
+            await asyncio.sleep(0.02)
+            yield line
+
+
+def ollama(request: httpx.Request) -> httpx.Response:
+    return httpx.Response(
+        200, headers={"content-type": "application/x-ndjson"}, stream=SlowStream()
+    )
+
+
+def test_request_key():
+    """Test that JSON bodies match regardless of key order and spacing."""
+    assert request_key("POST", "/api/generate", b'{"b": 1, "a": 2}') == request_key(
+        "POST", "/api/generate", b'{"a":2,"b":1}'
+    )
+    assert request_key("GET", "/api/tags", b"") == "GET /api/tags "
+
+
+def test_record_and_replay(tmp_path):
+    """Test that a streamed response replays with its content and timing."""
+    path = str(tmp_path / "cassette.jsonl")
+    transport = CassetteTransport(Cassette(path, "record"), httpx.MockTransport(ollama))
+    with httpx.Client(transport=transport) as client:
+        # A response closed early, like a cancelled generation
+        with client.stream(
+            "POST", "http://ollama/api/generate", json={"model": "m"}
+        ) as response:
+            next(response.iter_bytes())
+        recorded = client.post(
+            "http://ollama/api/generate", json={"model": "m"}
+        ).content
+
+    for speed, min_seconds, max_seconds in ((1, 0.05, 1), (0, 0, 0.03)):
+        transport = CassetteTransport(Cassette(path, "replay", speed))
+        with httpx.Client(transport=transport) as client:
+            start = time.perf_counter()
+            response = client.post("http://other/api/generate", json={"model": "m"})
+            elapsed = time.perf_counter() - start
+        assert response.content == recorded == b"".join(LINES)
+        assert response.headers["content-type"] == "application/x-ndjson"
+        assert min_seconds <= elapsed < max_seconds
+
+    with pytest.raises(CassetteMissError):
+        with httpx.Client(transport=CassetteTransport(Cassette(path))) as client:
+            client.post("http://ollama/api/generate", json={"model": "other"})
+
+
+def test_async_record_and_replay(tmp_path):
+    """Test the async transport, with repeated requests replayed in order."""
+    path = str(tmp_path / "cassette.jsonl")
+
+    async def run(transport: httpx.AsyncBaseTransport) -> list[bytes]:
+        async with httpx.AsyncClient(transport=transport) as client:
+            return [
+                (await client.get("http://ollama/api/ps")).content,
+                (await client.get("http://ollama/api/ps")).content,
+            ]
+
+    recorded = asyncio.run(
+        run(
+            AsyncCassetteTransport(
+                Cassette(path, "record"), httpx.MockTransport(ollama)
+            )
+        )
+    )
+    replayed = asyncio.run(run(AsyncCassetteTransport(Cassette(path, "replay", 0))))
+    assert replayed == recorded
+    # The last recording repeats
+    assert (
+        asyncio.run(run(AsyncCassetteTransport(Cassette(path, "replay", 0))))[0]
+        == recorded[0]
+    )
+
+
+def test_ollama_calls_replay_offline(tmp_path, monkeypatch):
+    """Test that the Ollama API and LLM calls replay without Ollama."""
+    path = str(tmp_path / "ollama.jsonl")
+
+    def use_cassette(mode: str):
+        monkeypatch.setattr(lib.cassette, "_cassette", Cassette(path, mode, 0))
+        monkeypatch.setattr(lib.cassette, "OLLAMA_CASSETTE", path)
+        monkeypatch.setattr(lib.ollama, "_http_client", None)
+
+    use_cassette("record")
+    if not check_ollama():
+        pytest.skip("Ollama is not reachable")
+    models = get_ollama_models_names()
+    answer = get_llm("gemma3:1b").invoke("Hello")
+    chunks = asyncio.run(
+        _collect(get_llm("gemma3:1b", streaming=True).astream("Hello"))
+    )
+
+    use_cassette("replay")
+    # Nothing listens there
+    monkeypatch.setenv("OLLAMA_BASE_URL", "http://127.0.0.1:9")
+    assert get_ollama_models_names() == models
+    assert get_llm("gemma3:1b").invoke("Hello") == answer
+    assert (
+        asyncio.run(_collect(get_llm("gemma3:1b", streaming=True).astream("Hello")))
+        == chunks
+    )
+
+
+async def _collect(stream) -> list[str]:
+    return [chunk async for chunk in stream]
@@ -0,0 +1,209 @@
+import asyncio
+import uuid
+
+import pytest
+from fastapi.testclient import TestClient
+from starlette.websockets import WebSocketDisconnect
+
+import lib.channel
+from lib import metrics
+from lib.channel import Generation
+from lib.store import get_store
+from main import app
+
+client = TestClient(app)
+TEST_MODEL = "gemma3:1b"
+
+
+def chat_frame(generation_id: str, session_id: str, content: str = "Hello") -> dict:
+    return {
+        "type": "chat",
+        "id": generation_id,
+        "session_id": session_id,
+        "content": content,
+        "model": TEST_MODEL,
+        "name": "Socket User",
+        "title_mode": "heuristic",
+    }
+
+
+def receive_until_done(websocket, generation_ids: set[str]) -> list[dict]:
+    """Receives frames until every generation is done, skipping pings."""
+    frames = []
+    pending = set(generation_ids)
+    while pending:
+        frame = websocket.receive_json()
+        if frame["type"] == "ping":
+            continue
+        frames.append(frame)
+        if frame["type"] in ("done", "error"):
+            pending.discard(frame["id"])
+    return frames
+
+
+def answer(frames: list[dict], generation_id: str) -> str:
+    return "".join(
+        f["content"]
+        for f in frames
+        if f["type"] == "chunk" and f["id"] == generation_id
+    )
+
+
+def test_generation_credit():
+    """Test that a generation waits for credit once it has used it up."""
+
+    async def run():
+        generation = Generation("g", 1)
+        await generation.acquire()
+        waiting = asyncio.create_task(generation.acquire())
+        await asyncio.sleep(0.01)
+        assert not waiting.done()
+        generation.grant(2)
+        await asyncio.wait_for(waiting, 1)
+        assert generation.credit == 1
+
+    asyncio.run(run())
+
+
+def test_models_listed_off_event_loop(monkeypatch):
+    """Test that the model list is fetched in a worker thread."""
+    on_loop = []
+
+    def list_models():
+        try:
+            asyncio.get_running_loop()
+            on_loop.append(True)
+        except RuntimeError:
+            on_loop.append(False)
+        return [TEST_MODEL]
+
+    monkeypatch.setattr(lib.channel, "get_ollama_models_names", list_models)
+    with client.websocket_connect("/ws") as websocket:
+        websocket.send_json(chat_frame("a", str(uuid.uuid4())))
+        frames = receive_until_done(websocket, {"a"})
+    assert frames[-1]["type"] == "done"
+    assert on_loop == [False]
+
+
+def test_multiplexed_generations():
+    """Test that generations for two sessions run on one connection."""
+    first, second = str(uuid.uuid4()), str(uuid.uuid4())
+    with client.websocket_connect("/ws") as websocket:
+        websocket.send_json(chat_frame("a", first))
+        websocket.send_json(chat_frame("b", second, "Tell me about Python"))
+        frames = receive_until_done(websocket, {"a", "b"})
+
+    for generation_id, session_id in (("a", first), ("b", second)):
+        done = next(
+            f for f in frames if f["type"] == "done" and f["id"] == generation_id
+        )
+        assert done["session_id"] == session_id and not done["cancelled"]
+        assert answer(frames, generation_id).startswith("Hello from fake")
+        assert "<think>" not in answer(frames, generation_id)
+        assert any(
+            f["type"] == "title" and f["session_id"] == session_id for f in frames
+        )
+        messages = get_store().get_messages(session_id)
+        assert [m.type for m in messages] == ["human", "ai"]
+        assert messages[1].id == done["message_id"]
+
+
+def test_follow_up_reuses_session_state():
+    """Test that a follow-up turn skips the session lookup and keeps the history."""
+    session_id = str(uuid.uuid4())
+    with client.websocket_connect("/ws") as websocket:
+        websocket.send_json(chat_frame("1", session_id))
+        receive_until_done(websocket, {"1"})
+        hits = metrics.get_value("ws_session_cache_hits_total")
+        websocket.send_json(chat_frame("2", session_id, "And then?"))
+        frames = receive_until_done(websocket, {"2"})
+
+    assert metrics.get_value("ws_session_cache_hits_total") == hits + 1
+    assert not any(f["type"] == "title" for f in frames)
+    contents = [m.content for m in get_store().get_messages(session_id)]
+    assert contents[0] == "Hello" and contents[2] == "And then?"
+
+
+def test_flow_control(monkeypatch):
+    """Test that chunks are only sent against credit, and a stalled generation can be cancelled."""
+    monkeypatch.setattr(lib.channel, "WS_INITIAL_CREDIT", 1)
+    with client.websocket_connect("/ws") as websocket:
+        websocket.send_json(chat_frame("credited", str(uuid.uuid4())))
+        frames = []
+        while not frames or frames[-1]["type"] != "done":
+            frame = websocket.receive_json()
+            frames.append(frame)
+            if frame["type"] == "chunk":
+                websocket.send_json({"type": "credit", "id": "credited", "chunks": 1})
+        assert answer(frames, "credited").startswith("Hello from fake")
+
+        session_id = str(uuid.uuid4())
+        websocket.send_json(chat_frame("stalled", session_id))
+        frame = websocket.receive_json()
+        while frame["type"] != "chunk":
+            frame = websocket.receive_json()
+        websocket.send_json({"type": "cancel", "id": "stalled"})
+        done = receive_until_done(websocket, {"stalled"})[-1]
+
+    assert done["cancelled"]
+    # The answer generated so far is kept
+    assert len(get_store().get_messages(session_id)) == 2
+
+
+def test_session_switch_and_title():
+    """Test loading a session and renaming it over the channel."""
+    session_id = str(uuid.uuid4())
+    with client.websocket_connect("/ws") as websocket:
+        websocket.send_json({"type": "session", "session_id": session_id})
+        assert websocket.receive_json()["status"] == 404
+
+        websocket.send_json(chat_frame("1", session_id))
+        receive_until_done(websocket, {"1"})
+        websocket.send_json(
+            {"type": "title", "session_id": session_id, "title": "Renamed"}
+        )
+        assert websocket.receive_json() == {
+            "type": "title",
+            "session_id": session_id,
+            "title": "Renamed",
+        }
+
+        websocket.send_json({"type": "session", "session_id": session_id})
+        frame = websocket.receive_json()
+    assert frame["type"] == "session"
+    assert frame["session"]["title"] == "Renamed"
+    assert [m["role"] for m in frame["messages"]] == ["user", "assistant"]
+
+
+def test_invalid_frames():
+    """Test that invalid frames get an error frame and keep the connection open."""
+    with client.websocket_connect("/ws") as websocket:
+        websocket.send_text("not json")
+        assert websocket.receive_json()["detail"] == "Invalid frame"
+        websocket.send_json({"type": "unknown"})
+        assert websocket.receive_json()["detail"] == "Unknown frame type"
+        websocket.send_json(chat_frame("bad", "invalid-uuid"))
+        assert websocket.receive_json() == {
+            "type": "error",
+            "id": "bad",
+            "status": 400,
+            "detail": "Invalid session ID",
+        }
+        websocket.send_json(
+            chat_frame("model", str(uuid.uuid4())) | {"model": "missing"}
+        )
+        assert websocket.receive_json()["detail"] == "Invalid model"
+        websocket.send_json({"type": "ping"})
+        assert websocket.receive_json() == {"type": "pong"}
+
+
+def test_heartbeat_timeout(monkeypatch):
+    """Test that a client which sends nothing is pinged, then disconnected."""
+    monkeypatch.setattr(lib.channel, "WS_HEARTBEAT_INTERVAL", 0.05)
+    monkeypatch.setattr(lib.channel, "WS_HEARTBEAT_TIMEOUT", 0.12)
+    with client.websocket_connect("/ws") as websocket:
+        assert websocket.receive_json() == {"type": "ping"}
+        with pytest.raises(WebSocketDisconnect) as e:
+            while True:
+                websocket.receive_json()
+    assert e.value.code == 1001
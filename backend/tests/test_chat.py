@@ -1,9 +1,9 @@
 from lib.database import (
     get_db_connection,
     get_session_by_id,
+    get_chat_history,
     create_session_if_not_exists,
 )
-from langchain_postgres import PostgresChatMessageHistory
 from langchain_core.messages import HumanMessage, AIMessage
 import uuid
 
@@ -70,11 +70,7 @@ def test_message_history_operations():
     create_session_if_not_exists(conn, test_id, "Test User", "Test Session")
 
     # Initialize message history
-    message_history = PostgresChatMessageHistory(
-        "bd_chat_history",
-        test_id,
-        sync_connection=conn,
-    )
+    message_history = get_chat_history(conn, test_id)
 
     # Add some test messages
     test_messages = [
@@ -118,11 +114,7 @@ def test_message_history_persistence():
     create_session_if_not_exists(conn1, test_id, "Test User", "Test Session")
 
     # Initialize message history and add messages
-    message_history1 = PostgresChatMessageHistory(
-        "bd_chat_history",
-        test_id,
-        sync_connection=conn1,
-    )
+    message_history1 = get_chat_history(conn1, test_id)
 
     test_message = HumanMessage(content="This is a test message")
     message_history1.add_message(test_message)
@@ -132,11 +124,7 @@ def test_message_history_persistence():
 
     # Second connection
     conn2 = get_db_connection()
-    message_history2 = PostgresChatMessageHistory(
-        "bd_chat_history",
-        test_id,
-        sync_connection=conn2,
-    )
+    message_history2 = get_chat_history(conn2, test_id)
 
     # Retrieve messages
     retrieved_messages = message_history2.messages
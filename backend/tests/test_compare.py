@@ -0,0 +1,90 @@
+import asyncio
+import json
+
+from fastapi.testclient import TestClient
+
+import lib.compare
+from lib.compare import ModelStats
+from main import app
+
+client = TestClient(app)
+MODELS = ["gemma3:1b", "qwen3:0.6b"]
+
+
+def test_model_stats_smoothing():
+    """Test that model stats start at the first measurement and then move towards new ones."""
+    stats = ModelStats()
+    stats.record("model", 1.0, 10.0)
+    stats.record("model", 2.0, 20.0)
+    assert stats.get("model") == {
+        "generations": 2,
+        "ttft": 1.2,
+        "tokens_per_second": 12.0,
+    }
+    assert stats.get("other") is None
+
+
+def test_compare_streams_tagged_results():
+    """Test that every model streams its answer and reports TTFT and throughput."""
+    response = client.post(
+        "/compare", json={"name": "Compare User", "content": "Hello", "models": MODELS}
+    )
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/x-ndjson"
+    events = [json.loads(line) for line in response.text.splitlines()]
+
+    for model in MODELS:
+        answer = "".join(
+            e["chunk"] for e in events if e["model"] == model and "chunk" in e
+        )
+        assert answer.startswith(f"Hello from fake {model}")
+        result = next(e for e in events if e["model"] == model and e.get("done"))
+        assert result["tokens"] > 0
+        assert result["ttft_ms"] <= result["duration_ms"]
+        assert result["tokens_per_second"] >= 0
+    assert events[-1].get("done")
+
+    stats = {entry["model"]: entry for entry in client.get("/models/stats").json()}
+    assert set(MODELS) <= set(stats)
+    assert stats[MODELS[0]]["generations"] >= 1
+
+
+def test_compare_validation():
+    """Test that comparisons need at least two known models."""
+    response = client.post(
+        "/compare", json={"content": "Hello", "models": ["gemma3:1b"]}
+    )
+    assert response.status_code == 400
+    assert response.json()["detail"] == "At least two models are required"
+
+    response = client.post(
+        "/compare", json={"content": "Hello", "models": ["gemma3:1b", "gemma3:1b"]}
+    )
+    assert response.status_code == 400
+
+    response = client.post(
+        "/compare", json={"content": "Hello", "models": ["gemma3:1b", "missing"]}
+    )
+    assert response.status_code == 400
+    assert response.json()["detail"] == "Invalid model: missing"
+
+
+def test_compare_setup_error(monkeypatch):
+    """Test that a model failing before it streams reports an error instead of hanging."""
+    get_llm = lib.compare.get_llm
+
+    def failing_get_llm(model, **kwargs):
+        if model == MODELS[1]:
+            raise ValueError("no such model")
+        return get_llm(model, **kwargs)
+
+    async def run():
+        comparison = lib.compare.run_comparison(
+            "Compare User", "Hello", MODELS, "balanced", {}
+        )
+        return [event async for event in comparison]
+
+    monkeypatch.setattr(lib.compare, "get_llm", failing_get_llm)
+    events = asyncio.run(asyncio.wait_for(run(), 10))
+    assert {"model": MODELS[1], "error": "no such model"} in events
+    assert any(event.get("done") for event in events if event["model"] == MODELS[0])
@@ -0,0 +1,147 @@
+import asyncio
+import uuid
+import zlib
+
+import brotli
+import pytest
+from fastapi.testclient import TestClient
+
+import lib.compression
+from lib.compression import GzipEncoder, _StreamCompressor, negotiate_encoding
+from main import app
+
+client = TestClient(app)
+
+
+@pytest.fixture(autouse=True)
+def enable_compression(monkeypatch):
+    monkeypatch.setattr(lib.compression, "COMPRESSION_ENABLED", True)
+
+
+def chat(session_id: str, name: str, content: str):
+    response = client.post(
+        "/chat",
+        json={
+            "session_id": session_id,
+            "name": name,
+            "model": "gemma3:1b",
+            "content": content,
+        },
+    )
+    assert response.status_code == 200
+
+
+def test_negotiate_encoding():
+    """Test that brotli is preferred, q-values are honored and identity is the fallback."""
+    assert negotiate_encoding("gzip, deflate, br") == "br"
+    assert negotiate_encoding("gzip;q=1.0, br;q=0.5") == "gzip"
+    assert negotiate_encoding("br;q=0, gzip") == "gzip"
+    assert negotiate_encoding("*") == "br"
+    assert negotiate_encoding("deflate") is None
+    assert negotiate_encoding("") is None
+    assert negotiate_encoding("gzip, br", streaming=True) == "gzip"
+    assert negotiate_encoding("gzip;q=0.5, br", streaming=True) == "br"
+
+
+def test_session_compressed():
+    """Test that large /session responses are compressed and small ones are not."""
+    session_id = str(uuid.uuid4())
+    chat(session_id, "Compression User", "Tell me about compression " * 60)
+
+    for encoding in ("br", "gzip"):
+        response = client.get(
+            f"/session?session_id={session_id}", headers={"Accept-Encoding": encoding}
+        )
+        assert response.headers["content-encoding"] == encoding
+        assert response.headers["vary"] == "Accept-Encoding"
+        assert int(response.headers["content-length"]) < len(response.content)
+        assert response.json()["messages"][0]["content"].startswith("Tell me about")
+
+    response = client.get(
+        "/sessions?name=Compression User", headers={"Accept-Encoding": "gzip"}
+    )
+    assert response.status_code == 200
+    assert "content-encoding" not in response.headers
+    assert response.headers["vary"] == "Accept-Encoding"
+
+    response = client.get(
+        f"/session?session_id={session_id}", headers={"Accept-Encoding": "identity"}
+    )
+    assert "content-encoding" not in response.headers
+
+
+def test_sessions_not_modified_compressed():
+    """Test that the weak ETag of /sessions still answers 304 when compressed."""
+    session_id = str(uuid.uuid4())
+    chat(session_id, "Etag Compression User", "Hello")
+    headers = {"Accept-Encoding": "br"}
+    response = client.get("/sessions?name=Etag Compression User", headers=headers)
+    response = client.get(
+        "/sessions?name=Etag Compression User",
+        headers=headers | {"If-None-Match": response.headers["etag"]},
+    )
+    assert response.status_code == 304
+
+
+def test_stream_compressed():
+    """Test that /stream is compressed as it streams, with gzip when brotli is not preferred."""
+    response = client.post(
+        "/stream",
+        json={
+            "session_id": str(uuid.uuid4()),
+            "name": "Stream Compression User",
+            "model": "gemma3:1b",
+            "content": "Hello",
+        },
+        headers={"Accept-Encoding": "br, gzip"},
+    )
+    assert response.headers["content-encoding"] == "gzip"
+    assert "content-length" not in response.headers
+    assert response.text.startswith("Hello from fake gemma3:1b")
+
+
+def test_stream_flushes():
+    """Test that streamed chunks are flushed once enough is pending or after the delay."""
+    sent = []
+    decoder = zlib.decompressobj(16 + zlib.MAX_WBITS)
+
+    async def send(message):
+        sent.append(message["body"])
+
+    def received() -> bytes:
+        data = decoder.decompress(b"".join(sent))
+        sent.clear()
+        return data
+
+    async def run():
+        stream = _StreamCompressor(
+            send, GzipEncoder(), flush_bytes=16, flush_seconds=0.02
+        )
+        await stream.body(b"Hello ", True)
+        assert received() == b""
+        await asyncio.sleep(0.05)
+        assert received() == b"Hello "
+        await stream.body(b"a chunk longer than sixteen bytes", True)
+        assert received() == b"a chunk longer than sixteen bytes"
+        await stream.body(b"", False)
+        assert received() == b""
+
+    asyncio.run(run())
+    assert decoder.eof
+
+
+def test_brotli_stream_decodes():
+    """Test that a brotli stream decodes to the original body."""
+    sent = []
+
+    async def send(message):
+        sent.append(message["body"])
+
+    async def run():
+        stream = _StreamCompressor(send, lib.compression.BrotliEncoder(), 8, 0.01)
+        for word in ("one ", "two ", "three ", "four"):
+            await stream.body(word.encode(), True)
+        await stream.body(b"", False)
+
+    asyncio.run(run())
+    assert brotli.decompress(b"".join(sent)) == b"one two three four"
@@ -1,5 +1,12 @@
+import threading
+import time
+import uuid
+
+import pytest
+
 from lib.database import (
     get_db_connection,
+    sync_transaction,
 )
 
 
@@ -65,7 +72,7 @@ def test_seed_data_in_chat_history():
 
         # Check specific seed record
         cur.execute("""
-            SELECT message 
+            SELECT role, content 
             FROM bd_chat_history 
             WHERE session_id = '123e4567-e89b-12d3-a456-426614174000'
             ORDER BY created_at
@@ -73,7 +80,42 @@ def test_seed_data_in_chat_history():
         """)
         result = cur.fetchone()
         assert result is not None
-        message = result[0]
-        assert message["type"] == "human"
-        assert "Can you explain what machine learning is?" in message["data"]["content"]
+        assert result[0] == "human"
+        assert "Can you explain what machine learning is?" in result[1]
     conn.close()
+
+
+def test_sync_transaction_isolated():
+    """Test that a rollback on the shared connection only discards its own thread's work."""
+    kept, dropped = str(uuid.uuid4()), str(uuid.uuid4())
+    entered = threading.Event()
+
+    def insert_kept():
+        entered.wait()
+        with sync_transaction() as conn, conn.cursor() as cur:
+            cur.execute(
+                "INSERT INTO db_sessions (id, username, title) VALUES (%s, 'Shared', 'Kept')",
+                (kept,),
+            )
+
+    thread = threading.Thread(target=insert_kept)
+    thread.start()
+    with pytest.raises(RuntimeError):
+        with sync_transaction() as conn, conn.cursor() as cur:
+            cur.execute(
+                "INSERT INTO db_sessions (id, username, title) VALUES (%s, 'Shared', 'Dropped')",
+                (dropped,),
+            )
+            entered.set()
+            # The other thread waits for the connection instead of joining this transaction
+            time.sleep(0.2)
+            raise RuntimeError("rolled back")
+    thread.join()
+
+    with sync_transaction() as conn, conn.cursor() as cur:
+        cur.execute(
+            "SELECT id::text FROM db_sessions WHERE id = ANY(%s::uuid[])",
+            ([kept, dropped],),
+        )
+        assert [row[0] for row in cur.fetchall()] == [kept]
+        cur.execute("DELETE FROM db_sessions WHERE id = %s", (kept,))
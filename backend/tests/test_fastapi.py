@@ -1,10 +1,14 @@
 from fastapi.testclient import TestClient
+import main
 from main import app
+import asyncio
+import json
 import time
 import uuid
 from dotenv import load_dotenv
-from lib.database import sync_connection
+from lib.database import get_sync_connection
 import contextlib
+import pytest
 
 load_dotenv()
 
@@ -22,9 +26,9 @@ def transaction():
     """Context manager for database transactions"""
     try:
         yield
-        sync_connection.commit()
+        get_sync_connection().commit()
     except Exception:
-        sync_connection.rollback()
+        get_sync_connection().rollback()
         raise
 
 
@@ -35,6 +39,12 @@ def test_health_check():
     assert response.json() == {"message": "OK!"}
 
 
+def test_ready_check():
+    response = client.get("/ready")
+    assert response.status_code == 200
+    assert response.json() == {"database": "ok", "ollama": "ok"}
+
+
 def test_root_endpoint():
     response = client.get("/")
     assert response.status_code == 200
@@ -57,6 +67,48 @@ def test_get_sessions():
         assert isinstance(response.json(), list)
 
 
+def test_get_sessions_pagination():
+    with transaction():
+        response = client.get("/sessions?name=John Doe&limit=1")
+        assert response.status_code == 200
+        assert len(response.json()) <= 1
+
+
+def test_get_sessions_not_modified():
+    with transaction():
+        response = client.get(f"/sessions?name={TEST_USERNAME}")
+        etag = response.headers["etag"]
+
+        response = client.get(
+            f"/sessions?name={TEST_USERNAME}", headers={"If-None-Match": etag}
+        )
+        assert response.status_code == 304
+
+
+def test_get_sessions_renamed():
+    """Test that renaming a session changes the ETag of the sessions list."""
+    from lib.store import get_store
+
+    username = f"Rename User {uuid.uuid4().hex[:8]}"
+    session_id = str(uuid.uuid4())
+    store = get_store()
+    store.create_session(session_id, username, "Old title")
+    response = client.get(f"/sessions?name={username}")
+    etag = response.headers["etag"]
+
+    store.update_session_title(session_id, "New title")
+    response = client.get(f"/sessions?name={username}", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.headers["etag"] != etag
+    assert response.json()[0]["title"] == "New title"
+
+
+def test_get_sessions_invalid_cursor():
+    response = client.get(f"/sessions?name={TEST_USERNAME}&cursor=invalid")
+    assert response.status_code == 400
+    assert response.json()["detail"] == "Invalid cursor"
+
+
 def test_get_sessions_invalid_name():
     with transaction():
         response = client.get("/sessions?name=")
@@ -71,6 +123,48 @@ def test_get_session():
         assert response.status_code == 404  # Should be 404 since session doesn't exist
 
 
+def test_get_archived_session():
+    from lib.archive import archive_session
+
+    conn = get_sync_connection()
+    session_id = "123e4567-e89b-12d3-a456-426614174001"
+    before = client.get(f"/session?session_id={session_id}").json()
+    archive_session(conn, session_id)
+    assert client.get("/archive").json()["sessions"] >= 1
+
+    response = client.get(f"/session?session_id={session_id}")
+    assert response.status_code == 200
+    assert response.json() == before
+
+
+def test_export_import(admin_token):
+    assert client.get("/export?name=John Doe").status_code == 403
+    assert client.post("/import", content="").status_code == 403
+
+    session_id = str(uuid.uuid4())
+    response = client.get("/export?name=John Doe", headers=ADMIN_HEADERS)
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/x-ndjson"
+    lines = response.text.replace(
+        "123e4567-e89b-12d3-a456-426614174000", session_id
+    ).replace('"John Doe"', '"Import User"')
+
+    response = client.post("/import", content=lines, headers=ADMIN_HEADERS)
+    assert response.status_code == 200
+    assert response.json()["sessions"] == 1
+    assert response.json()["messages"] > 0
+
+    response = client.post("/import", content=lines, headers=ADMIN_HEADERS)
+    assert response.json()["messages"] == 0
+    assert client.get(f"/session?session_id={session_id}").json()["messages"]
+
+
+def test_import_invalid_line(admin_token):
+    response = client.post("/import", content="not json\n", headers=ADMIN_HEADERS)
+    assert response.status_code == 400
+    assert "line 1" in response.json()["detail"]
+
+
 def test_get_session_invalid_id():
     with transaction():
         response = client.get("/session?session_id=invalid-uuid")
@@ -78,6 +172,20 @@ def test_get_session_invalid_id():
         assert response.json()["detail"] == "Invalid session ID"
 
 
+# Search Endpoint Tests
+def test_search():
+    with transaction():
+        response = client.get("/search?name=John Doe&q=machine learning")
+        assert response.status_code == 200
+        assert len(response.json()) > 0
+        assert "snippet" in response.json()[0]
+
+
+def test_search_empty_query():
+    response = client.get(f"/search?name={TEST_USERNAME}&q=")
+    assert response.status_code == 422
+
+
 # Chat Endpoint Tests
 def test_chat_endpoint():
     with transaction():
@@ -92,6 +200,34 @@ def test_chat_endpoint():
         assert "message" in response.json()
 
 
+def test_chat_endpoint_answer_title():
+    with transaction():
+        session_id = str(uuid.uuid4())
+        chat_request = {
+            "name": TEST_USERNAME,
+            "session_id": session_id,
+            "content": "Hello, this is a test message",
+            "model": TEST_MODEL,
+            "title_mode": "answer",
+        }
+        response = client.post("/chat", json=chat_request)
+        assert response.status_code == 200
+        response = client.get(f"/session?session_id={session_id}")
+        assert len(response.json()["session"]["title"]) > 0
+
+
+def test_chat_endpoint_invalid_title_mode():
+    chat_request = {
+        "name": TEST_USERNAME,
+        "session_id": VALID_SESSION_ID,
+        "content": "Hello, this is a test message",
+        "model": TEST_MODEL,
+        "title_mode": "telepathy",
+    }
+    response = client.post("/chat", json=chat_request)
+    assert response.status_code == 422
+
+
 def test_chat_endpoint_invalid_session():
     with transaction():
         chat_request = {
@@ -118,6 +254,233 @@ def test_chat_endpoint_invalid_model():
         assert response.json()["detail"] == "Invalid model"
 
 
+def test_chat_endpoint_rate_limited(monkeypatch):
+    import lib.profiling
+    from lib.ratelimit import get_client_key, rate_limiter
+
+    username = f"limited-{uuid.uuid4()}"
+    chat_request = {
+        "name": username,
+        "session_id": VALID_SESSION_ID,
+        "content": "Hello, this is a test message",
+        "model": TEST_MODEL,
+    }
+    for _ in range(int(rate_limiter.requests_per_minute)):
+        rate_limiter.check(get_client_key(username, "testclient"))
+    response = client.post("/chat", json=chat_request)
+    assert response.status_code == 429
+    assert int(response.headers["retry-after"]) > 0
+
+    assert client.get(f"/usage?name={username}").status_code == 403
+    monkeypatch.setattr(lib.profiling, "ADMIN_TOKEN", "secret")
+    response = client.get(
+        f"/usage?name={username}", headers={"X-Admin-Token": "secret"}
+    )
+    assert response.status_code == 200
+    assert response.json()[0]["rejected"] == 1
+
+
+def test_chat_endpoint_shed_when_overloaded():
+    from lib.admission import ADMISSION_MAX_IN_FLIGHT, admission_controller
+
+    chat_request = {
+        "name": TEST_USERNAME,
+        "session_id": VALID_SESSION_ID,
+        "content": "Hello, this is a test message",
+        "model": TEST_MODEL,
+    }
+    admission_controller.in_flight_count += ADMISSION_MAX_IN_FLIGHT
+    try:
+        response = client.post("/chat", json=chat_request)
+        assert response.status_code == 503
+        assert "retry-after" in response.headers
+        assert client.get("/admission").json()["level"] == 4
+    finally:
+        admission_controller.in_flight_count -= ADMISSION_MAX_IN_FLIGHT
+
+
+def test_chat_endpoint_observes_first_token(monkeypatch):
+    """A long /chat answer must not count as Ollama latency"""
+    from lib.admission import admission_controller
+
+    class SlowTail:
+        def __init__(self, llm):
+            self.llm = llm
+
+        async def astream(self, prompt):
+            async for chunk in self.llm.astream(prompt):
+                yield chunk
+            await asyncio.sleep(0.5)
+
+    observed = []
+    monkeypatch.setattr(admission_controller, "observe_ollama", observed.append)
+    get_llm = main.get_llm
+    monkeypatch.setattr(
+        main, "get_llm", lambda *args, **kwargs: SlowTail(get_llm(*args, **kwargs))
+    )
+    chat_request = {
+        "name": TEST_USERNAME,
+        "session_id": str(uuid.uuid4()),
+        "content": "Hello, this is a test message",
+        "model": TEST_MODEL,
+    }
+    response = client.post("/chat", json=chat_request)
+    assert response.status_code == 200
+    assert "Hello from fake" in response.json()["message"]
+    assert len(observed) == 1 and observed[0] < 0.5
+
+
+# Batch Endpoint Tests
+ADMIN_HEADERS = {"X-Admin-Token": "secret"}
+
+
+@pytest.fixture
+def admin_token(monkeypatch):
+    import lib.profiling
+
+    monkeypatch.setattr(lib.profiling, "ADMIN_TOKEN", "secret")
+
+
+def test_batch_endpoint(admin_token):
+    batch = "\n".join(
+        [
+            '{"id": "a", "content": "Hello, this is a test message"}',
+            '{"id": "b", "content": "Hello", "model": "non-existent-model"}',
+        ]
+    )
+    assert client.post("/batch", content=batch).status_code == 403
+    response = client.post("/batch", content=batch, headers=ADMIN_HEADERS)
+    assert response.status_code == 200
+    assert "x-batch-id" in response.headers
+
+    results = [json.loads(line) for line in response.text.splitlines()]
+    assert sorted(result["id"] for result in results) == ["a", "b"]
+    assert next(r for r in results if r["id"] == "b")["error"] == "Invalid model"
+
+
+def test_batch_endpoint_resume(admin_token, monkeypatch):
+    import lib.batch
+
+    batch_id = str(uuid.uuid4())
+    first = '{"id": "a", "content": "Hello"}'
+    response = client.post(
+        f"/batch?batch_id={batch_id}", content=first, headers=ADMIN_HEADERS
+    )
+    assert response.headers["x-batch-id"] == batch_id
+    [done] = [json.loads(line) for line in response.text.splitlines()]
+    assert "response" in done
+
+    # Finished items are replayed from the checkpoint, only new ones run
+    def fail(*args, **kwargs):
+        raise RuntimeError("recomputed")
+
+    monkeypatch.setattr(lib.batch, "get_llm", fail)
+    batch = first + '\n{"id": "b", "content": "Hi"}'
+    response = client.post(
+        f"/batch?batch_id={batch_id}", content=batch, headers=ADMIN_HEADERS
+    )
+    results = {
+        result["id"]: result for result in map(json.loads, response.text.splitlines())
+    }
+    assert results["a"] == done | {"resumed": True}
+    assert results["b"]["error"] == "recomputed"
+
+
+def test_batch_endpoint_session(admin_token):
+    session_id = str(uuid.uuid4())
+    batch = json.dumps(
+        {"name": "Batch User", "session_id": session_id, "content": "Hello"}
+    )
+    response = client.post(
+        "/batch?skip_titles=true", content=batch, headers=ADMIN_HEADERS
+    )
+    [result] = [json.loads(line) for line in response.text.splitlines()]
+    assert result["session_id"] == session_id
+
+    messages = client.get(f"/session?session_id={session_id}").json()["messages"]
+    assert [(m["role"], m["content"]) for m in messages] == [
+        ("user", "Hello"),
+        ("assistant", result["response"]),
+    ]
+
+
+def test_batch_endpoint_session_order(admin_token, monkeypatch):
+    import lib.batch
+
+    history_lengths = []
+    get_prompt_history = lib.batch.get_prompt_history
+
+    def recording_get_prompt_history(*args):
+        history, unsummarized = get_prompt_history(*args)
+        history_lengths.append(len(history))
+        return history, unsummarized
+
+    monkeypatch.setattr(lib.batch, "get_prompt_history", recording_get_prompt_history)
+    session_id = str(uuid.uuid4())
+    batch = "\n".join(
+        json.dumps({"session_id": session_id, "content": content})
+        for content in ("one", "two", "three")
+    )
+    response = client.post(
+        "/batch?skip_titles=true", content=batch, headers=ADMIN_HEADERS
+    )
+    assert response.status_code == 200
+
+    # Each turn of a session sees the turns before it
+    assert history_lengths == [0, 2, 4]
+    messages = client.get(f"/session?session_id={session_id}").json()["messages"]
+    assert [m["content"] for m in messages if m["role"] == "user"] == [
+        "one",
+        "two",
+        "three",
+    ]
+
+
+def test_batch_endpoint_in_flight(admin_token, monkeypatch):
+    """Batch generations count towards the admission controller's load"""
+    import lib.batch
+    from lib.admission import admission_controller
+
+    class RecordingLLM:
+        def __init__(self, llm):
+            self.llm = llm
+
+        async def ainvoke(self, prompt):
+            in_flight.append(admission_controller.in_flight_count)
+            return await self.llm.ainvoke(prompt)
+
+    in_flight = []
+    get_llm = lib.batch.get_llm
+    monkeypatch.setattr(
+        lib.batch,
+        "get_llm",
+        lambda *args, **kwargs: RecordingLLM(get_llm(*args, **kwargs)),
+    )
+    response = client.post(
+        "/batch?skip_titles=true", content='{"content": "Hello"}', headers=ADMIN_HEADERS
+    )
+    assert response.status_code == 200
+    assert in_flight == [1]
+    assert admission_controller.in_flight_count == 0
+
+
+def test_batch_endpoint_invalid_input(admin_token, monkeypatch):
+    response = client.post("/batch", content="not json", headers=ADMIN_HEADERS)
+    assert response.status_code == 400
+
+    response = client.post(
+        "/batch?batch_id=invalid-uuid", content="", headers=ADMIN_HEADERS
+    )
+    assert response.status_code == 400
+    assert response.json()["detail"] == "Invalid batch ID"
+
+    monkeypatch.setattr(main, "BATCH_MAX_ITEMS", 1)
+    batch = '{"content": "Hello"}\n{"content": "Hi"}'
+    response = client.post("/batch", content=batch, headers=ADMIN_HEADERS)
+    assert response.status_code == 400
+    assert response.json()["detail"] == "Too many items"
+
+
 # Stream Endpoint Tests
 def test_stream_endpoint():
     with transaction():
@@ -0,0 +1,38 @@
+import uuid
+from lib.memory import build_memory_message, EmbeddingWorker
+
+
+def test_build_memory_message():
+    """Test that memories are wrapped in a single system message."""
+    assert build_memory_message([]) == []
+
+    messages = build_memory_message(
+        ["[2025-06-01] User: My dog is called Rex.", "[2025-06-02] User: I like Go."]
+    )
+    assert len(messages) == 1
+    assert messages[0].type == "system"
+    assert "My dog is called Rex." in messages[0].content
+    assert "I like Go." in messages[0].content
+
+
+def test_embedding_worker_disabled(monkeypatch):
+    """Test that nothing is scheduled when semantic search is disabled."""
+    monkeypatch.delenv("EMBEDDING_MODEL", raising=False)
+    worker = EmbeddingWorker()
+    worker.enqueue(str(uuid.uuid4()))
+    assert worker._thread is None
+
+
+def test_embedding_worker_batches(monkeypatch):
+    """Test that the worker drains queued sessions and stops cleanly."""
+    monkeypatch.setenv("EMBEDDING_MODEL", "nomic-embed-text")
+    worker = EmbeddingWorker(batch_size=4, max_wait=0.05)
+
+    # Sessions without messages need no embedding calls
+    for _ in range(10):
+        worker.enqueue(str(uuid.uuid4()))
+    worker.wait_idle()
+    assert worker._queue.unfinished_tasks == 0
+
+    worker.stop()
+    assert worker._thread is None
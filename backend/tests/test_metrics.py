@@ -0,0 +1,20 @@
+from lib import metrics
+
+
+def test_render_prometheus_format():
+    """Test that metrics render in the Prometheus text format."""
+    metrics.describe("test_requests_total", "counter", "Test requests")
+    metrics.describe("test_latency_seconds", "summary", "Test latency")
+
+    metrics.inc("test_requests_total", {"route": "/chat"})
+    metrics.inc("test_requests_total", {"route": "/chat"})
+    metrics.observe("test_latency_seconds", 0.25, {"route": "/chat"})
+    metrics.set_gauge("test_in_flight", 3)
+
+    output = metrics.render()
+    assert "# TYPE test_requests_total counter" in output
+    assert 'test_requests_total{route="/chat"} 2' in output
+    assert "# TYPE test_latency_seconds summary" in output
+    assert 'test_latency_seconds_count{route="/chat"} 1' in output
+    assert 'test_latency_seconds_sum{route="/chat"} 0.25' in output
+    assert "test_in_flight 3" in output
@@ -1,17 +1,16 @@
 import os
-import requests
-from lib.ollama import get_ollama_models_names
+from lib.ollama import get_http_client, get_ollama_models_names
 
 ollama_base_url = os.getenv("OLLAMA_BASE_URL", "http://localhost:11434")
 
 
 def test_is_ollama_running():
-    response = requests.get(f"{ollama_base_url}/api/tags")
+    response = get_http_client().get(f"{ollama_base_url}/api/tags")
     assert response.status_code == 200, "Ollama is not running"
 
 
 def test_chat_completion():
-    response = requests.post(
+    response = get_http_client().post(
         f"{ollama_base_url}/api/generate",
         json={"model": "gemma3:1b", "prompt": "Hello, how are you?"},
     )
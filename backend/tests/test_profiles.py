@@ -0,0 +1,93 @@
+import uuid
+
+import pytest
+from fastapi.testclient import TestClient
+
+import lib.profiles
+import main
+from lib.profiles import load_profiles, resolve_generation
+from lib.types import GenerationOptions
+
+client = TestClient(main.app)
+
+
+def test_load_profiles():
+    """Test that configured profiles extend the built-in ones, with known options only."""
+    profiles = load_profiles(
+        '{"fast": {"num_predict": 128}, "tiny": {"num_ctx": 1024}}'
+    )
+    assert profiles["fast"]["num_predict"] == 128
+    assert profiles["fast"]["num_ctx"] == 2048
+    assert profiles["tiny"] == {"num_ctx": 1024}
+    with pytest.raises(ValueError):
+        load_profiles('{"fast": {"context": 1024}}')
+
+
+def test_resolve_generation(monkeypatch):
+    """Test that overrides apply on top of the profile, within the caps."""
+    name, options = resolve_generation(
+        "fast", GenerationOptions(temperature=0.1, seed=7)
+    )
+    assert name == "fast"
+    assert options == {
+        "num_ctx": 2048,
+        "num_predict": 256,
+        "temperature": 0.1,
+        "seed": 7,
+    }
+    assert resolve_generation(None)[0] == lib.profiles.GENERATION_PROFILE
+
+    with pytest.raises(ValueError, match="num_ctx is capped"):
+        resolve_generation("fast", GenerationOptions(num_ctx=1_000_000))
+    with pytest.raises(ValueError, match="Unknown profile"):
+        resolve_generation("missing")
+
+    # Profiles without a length limit get the cap
+    monkeypatch.setitem(
+        lib.profiles.GENERATION_PROFILES, "unbounded", {"num_predict": -1}
+    )
+    assert (
+        resolve_generation("unbounded")[1]["num_predict"]
+        == lib.profiles.GENERATION_MAX_PREDICT
+    )
+
+
+def test_profile_api(monkeypatch):
+    """Test that chat requests run with their profile's options and are reported per profile."""
+    calls = []
+    get_llm = main.get_llm
+
+    def recording_get_llm(model, **kwargs):
+        calls.append(kwargs)
+        return get_llm(model, **kwargs)
+
+    monkeypatch.setattr(main, "get_llm", recording_get_llm)
+    before = client.get("/profiles").json()["profiles"]["fast"]["generations"]
+    response = client.post(
+        "/stream",
+        json={
+            "session_id": str(uuid.uuid4()),
+            "content": "Hello",
+            "name": "Profile User",
+            "profile": "fast",
+            "options": {"num_predict": 64},
+        },
+    )
+    assert response.status_code == 200
+    assert response.headers["X-Profile"] == "fast"
+    assert calls[-1]["num_predict"] == 64 and calls[-1]["num_ctx"] == 2048
+
+    status = client.get("/profiles").json()
+    assert status["profiles"]["fast"]["generations"] == before + 1
+    assert status["profiles"]["fast"]["tokens"] > 0
+
+    chat_request = {"session_id": str(uuid.uuid4()), "content": "Hello"}
+    response = client.post(
+        "/chat", json=chat_request | {"options": {"num_predict": 10**6}}
+    )
+    assert response.status_code == 400
+    response = client.post("/chat", json=chat_request | {"profile": "missing"})
+    assert response.status_code == 400
+    # Server-side options cannot be overridden
+    response = client.post("/chat", json=chat_request | {"options": {"num_thread": 64}})
+    assert response.status_code == 422
@@ -0,0 +1,115 @@
+import asyncio
+import threading
+import time
+
+from fastapi.testclient import TestClient
+
+import lib.profiling
+from lib.profiling import LoopLagMonitor, SamplingProfiler, render_flamegraph
+from main import app
+
+client = TestClient(app)
+HEADERS = {"X-Admin-Token": "secret"}
+
+
+def busy_loop(stop: threading.Event):
+    while not stop.is_set():
+        sum(range(1000))
+
+
+def test_admin_token_required(monkeypatch):
+    """Test that the admin routes are disabled without ADMIN_TOKEN and need the token otherwise."""
+    monkeypatch.setattr(lib.profiling, "ADMIN_TOKEN", None)
+    assert client.get("/admin/loop", headers=HEADERS).status_code == 403
+
+    monkeypatch.setattr(lib.profiling, "ADMIN_TOKEN", "secret")
+    assert client.get("/admin/loop").status_code == 403
+    assert (
+        client.get("/admin/loop", headers={"X-Admin-Token": "wrong"}).status_code == 403
+    )
+    assert client.get("/admin/loop", headers=HEADERS).status_code == 200
+
+
+def test_sampling_profiler():
+    """Test that the profiler catches a busy thread and leaves idle threads out."""
+    profiler = SamplingProfiler()
+    stop = threading.Event()
+    busy = threading.Thread(target=busy_loop, args=(stop,), name="busy")
+    idle = threading.Thread(target=stop.wait, name="idle")
+    busy.start()
+    idle.start()
+    try:
+        profiler.start(interval=0.005)
+        time.sleep(0.2)
+        status = profiler.stop()
+    finally:
+        stop.set()
+        busy.join()
+        idle.join()
+
+    assert not status["running"]
+    assert status["samples"] > 5
+    collapsed = profiler.collapsed()
+    busy_stacks = [line for line in collapsed.splitlines() if line.startswith("busy;")]
+    assert busy_stacks and all(
+        "busy_loop (test_profiling.py" in line for line in busy_stacks
+    )
+    assert "\nidle;" not in "\n" + collapsed
+    assert "\nidle;" in "\n" + profiler.collapsed(idle=True)
+
+    svg = render_flamegraph(collapsed)
+    assert svg.startswith("<svg") and "busy_loop" in svg
+
+
+def test_profiler_routes(monkeypatch):
+    """Test starting, stopping and downloading a profile."""
+    monkeypatch.setattr(lib.profiling, "ADMIN_TOKEN", "secret")
+    response = client.post("/admin/profiler/start?interval_ms=5", headers=HEADERS)
+    assert response.status_code == 200
+    assert response.json()["running"]
+    assert client.post("/admin/profiler/start", headers=HEADERS).status_code == 409
+    time.sleep(0.05)
+    assert not client.post("/admin/profiler/stop", headers=HEADERS).json()["running"]
+
+    response = client.get("/admin/profiler/profile?idle=true", headers=HEADERS)
+    assert response.headers["content-type"].startswith("text/plain")
+    assert all(line.rsplit(" ", 1)[1].isdigit() for line in response.text.splitlines())
+    response = client.get("/admin/profiler/profile?format=svg", headers=HEADERS)
+    assert response.headers["content-type"] == "image/svg+xml"
+
+
+def test_endpoint_cpu_time(monkeypatch):
+    """Test that requests are accounted to their route with their CPU time."""
+    monkeypatch.setattr(lib.profiling, "ADMIN_TOKEN", "secret")
+    for _ in range(3):
+        client.get("/health")
+    client.get("/not-a-route")
+
+    endpoints = {
+        e["endpoint"]: e for e in client.get("/admin/endpoints", headers=HEADERS).json()
+    }
+    assert endpoints["GET /health"]["requests"] >= 3
+    assert endpoints["GET /health"]["cpu_seconds"] > 0
+    assert (
+        endpoints["GET /health"]["avg_wall_ms"]
+        >= endpoints["GET /health"]["avg_cpu_ms"]
+    )
+    assert "GET unmatched" in endpoints
+
+
+def test_loop_lag_monitor():
+    """Test that a call blocking the event loop shows up as lag and a stall."""
+    monitor = LoopLagMonitor(interval=0.01, threshold=0.05)
+
+    async def run():
+        task = asyncio.create_task(monitor.run())
+        await asyncio.sleep(0.05)
+        time.sleep(0.15)
+        await asyncio.sleep(0.05)
+        task.cancel()
+
+    asyncio.run(run())
+    status = monitor.status()
+    assert status["checks"] >= 3
+    assert status["max_lag_ms"] >= 100
+    assert status["stalls"] == 1
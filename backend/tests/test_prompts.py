@@ -0,0 +1,43 @@
+import uuid
+
+from fastapi.testclient import TestClient
+from langchain_core.messages import AIMessage, HumanMessage
+from langchain_core.prompt_values import ChatPromptValue
+
+from lib.prompts import chat_prompt, chat_sys_msg
+from main import app
+
+client = TestClient(app)
+
+
+def test_render_matches_message_conversion():
+    """Test that a compiled prompt renders the text the LLM client builds from the messages."""
+    messages = [
+        HumanMessage(content="Hi, I'm {name}", name="User"),
+        AIMessage(content="Hello {name}! {{ }}", name="Assistant"),
+        HumanMessage(content="What's my name?", name="User"),
+    ]
+    expected = ChatPromptValue(messages=[chat_sys_msg] + messages).to_string()
+    assert chat_prompt.render(messages) == expected
+    assert "Hello {name}! {{ }}" in chat_prompt.render(messages)
+    assert (
+        chat_prompt.render([]) == ChatPromptValue(messages=[chat_sys_msg]).to_string()
+    )
+
+
+def test_chat_with_braces():
+    """Test that user content with braces does not break /chat."""
+    session_id = str(uuid.uuid4())
+    for content in ["Format {this} please", "And {0} or {{that}}"]:
+        response = client.post(
+            "/chat",
+            json={
+                "session_id": session_id,
+                "name": "Braces User",
+                "model": "gemma3:1b",
+                "content": content,
+            },
+        )
+        assert response.status_code == 200
+    messages = client.get(f"/session?session_id={session_id}").json()["messages"]
+    assert messages[2]["content"] == "And {0} or {{that}}"
@@ -0,0 +1,133 @@
+import time
+import uuid
+
+from fastapi.testclient import TestClient
+
+import lib.ratelimit
+from lib.database import get_db_connection
+from lib.ratelimit import (
+    MemoryBucketStore,
+    PostgresBucketStore,
+    RateLimiter,
+    UsageRecorder,
+    estimate_tokens,
+    get_client_key,
+    get_usage,
+    rate_limiter,
+)
+from main import app
+
+
+def test_estimate_tokens():
+    """Test the token estimate for responses without a reported count."""
+    assert estimate_tokens("") == 1
+    assert estimate_tokens("a" * 400) == 100
+
+
+def test_request_budget():
+    """Test that requests beyond the burst are rejected with a wait time."""
+    limiter = RateLimiter(
+        MemoryBucketStore(), requests_per_minute=3, tokens_per_minute=0
+    )
+    assert [limiter.check("user:a") for _ in range(3)] == [0, 0, 0]
+    wait = limiter.check("user:a")
+    assert 0 < wait <= 20
+    # Other clients have their own buckets
+    assert limiter.check("user:b") == 0
+
+
+def test_token_budget_debt():
+    """Test that generated tokens are charged after the fact and block while in debt."""
+    limiter = RateLimiter(
+        MemoryBucketStore(), requests_per_minute=0, tokens_per_minute=600
+    )
+    assert limiter.check("user:a") == 0
+    limiter.charge_tokens("user:a", 1200)
+    wait = limiter.check("user:a")
+    assert 55 < wait <= 60
+
+
+def test_memory_store_bounded():
+    """Test that the in-process store keeps only the most recent keys."""
+    store = MemoryBucketStore(max_keys=2)
+    for key in ("a", "b", "c"):
+        store.acquire(key, "requests", 1, 10, 1)
+    assert len(store._buckets) == 2
+
+
+def test_client_key(monkeypatch):
+    """Test that clients are keyed by IP unless the username is asked for."""
+    assert (
+        get_client_key("a", "10.0.0.1")
+        == get_client_key("b", "10.0.0.1")
+        == "ip:10.0.0.1"
+    )
+    assert get_client_key("a", None) == "user:a"
+    monkeypatch.setattr(lib.ratelimit, "RATE_LIMIT_KEY", "user+ip")
+    assert get_client_key("a", "10.0.0.1") != get_client_key("b", "10.0.0.1")
+    monkeypatch.setattr(lib.ratelimit, "RATE_LIMIT_KEY", "user")
+    assert get_client_key("a", "10.0.0.1") == "user:a"
+
+
+def test_postgres_store():
+    """Test the Postgres store against the same budget rules."""
+    conn = get_db_connection()
+    limiter = RateLimiter(
+        PostgresBucketStore(lambda: conn), requests_per_minute=2, tokens_per_minute=60
+    )
+    key = f"user:{uuid.uuid4()}"
+    assert limiter.check(key) == 0
+    assert limiter.check(key) == 0
+    assert limiter.check(key) > 0
+
+    other = f"user:{uuid.uuid4()}"
+    limiter.charge_tokens(other, 120)
+    assert limiter.check(other) > 0
+    conn.close()
+
+
+def test_postgres_store_off_event_loop(monkeypatch):
+    """Test that chat requests use a slow Postgres store without blocking the event loop."""
+
+    class SlowBucketStore(PostgresBucketStore):
+        def acquire(self, *args):
+            time.sleep(0.2)
+            return super().acquire(*args)
+
+        def charge(self, *args):
+            time.sleep(0.2)
+            super().charge(*args)
+
+    store = SlowBucketStore()
+    monkeypatch.setattr(rate_limiter, "store", store)
+    response = TestClient(app).post(
+        "/chat",
+        json={
+            "session_id": str(uuid.uuid4()),
+            "name": "Bucket User",
+            "model": "gemma3:1b",
+            "content": "Hello",
+        },
+    )
+    assert response.status_code == 200
+    store._conn.close()
+
+
+def test_usage_recorder():
+    """Test that usage is accumulated and persisted per user per day."""
+    conn = get_db_connection()
+    username = f"usage-{uuid.uuid4()}"
+    recorder = UsageRecorder()
+    recorder.add(username, requests=1, tokens=10)
+    recorder.add(username, requests=1, tokens=5, rejected=0)
+    recorder.add(username, rejected=1)
+    recorder.flush(conn)
+    recorder.add(username, requests=1)
+    recorder.flush(conn)
+
+    usage = get_usage(conn, username, 1)
+    assert len(usage) == 1
+    assert usage[0]["requests"] == 3
+    assert usage[0]["generated_tokens"] == 15
+    assert usage[0]["rejected"] == 1
+    conn.close()
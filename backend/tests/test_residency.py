@@ -0,0 +1,35 @@
+from lib import metrics
+from lib.ollama import parse_model_settings
+from lib.residency import ResidencyManager
+
+
+def test_parse_model_settings():
+    """Test parsing of per-model settings, including model tags with colons."""
+    assert parse_model_settings("") == {}
+    assert parse_model_settings("gemma3:1b=24h, qwen3:0.6b=10m") == {
+        "gemma3:1b": "24h",
+        "qwen3:0.6b": "10m",
+    }
+
+
+def test_note_request_counts_cold_starts():
+    """Test that only the first request for an unloaded model is a cold start."""
+    manager = ResidencyManager()
+    before = metrics.get_value("ollama_model_cold_starts_total", {"model": "test:cold"})
+
+    assert manager.note_request("test:cold") is True
+    assert manager.note_request("test:cold") is False
+    assert (
+        metrics.get_value("ollama_model_cold_starts_total", {"model": "test:cold"})
+        == before + 1
+    )
+
+
+def test_models_to_warm():
+    """Test that pinned and in-demand models are warmed, loaded ones are not."""
+    manager = ResidencyManager(warm_models=["pinned:1b"])
+    manager.demand = {"busy:1b": 5.0, "idle:1b": 0.01}
+    assert manager.models_to_warm() == ["busy:1b", "pinned:1b"]
+
+    manager.loaded = {"busy:1b"}
+    assert manager.models_to_warm() == ["pinned:1b"]
@@ -0,0 +1,106 @@
+import uuid
+
+from fastapi.testclient import TestClient
+
+import lib.profiling
+import lib.routing
+from lib.compare import ModelStats
+from lib.routing import ModelRouter, score_prompt
+from main import app
+
+client = TestClient(app)
+HEADERS = {"X-Admin-Token": "secret"}
+MODELS = ["qwen3:0.6b", "gemma3:1b"]
+CODE_PROMPT = "Why does this fail?\n```python\ndef f(x):\n    return x[0]\n```"
+
+
+def test_score_prompt():
+    """Test that longer, code and reasoning prompts score higher than small talk."""
+    assert score_prompt("hi") < 0.05
+    assert score_prompt(CODE_PROMPT) > 0.5
+    assert score_prompt("Explain why the sky is blue") > score_prompt("The sky is blue")
+    assert score_prompt("Привет, как дела?") > score_prompt("Hello, how are you?")
+    assert score_prompt("hi", history_messages=40) > score_prompt("hi")
+    assert score_prompt("x " * 10000) <= 1
+
+
+def test_route_by_complexity():
+    """Test that trivial prompts go to the smallest model and code to the largest."""
+    router = ModelRouter(MODELS)
+    assert router.route("hi", 0, MODELS + ["other"])[0] == "qwen3:0.6b"
+    assert router.route(CODE_PROMPT, 0, MODELS)[0] == "gemma3:1b"
+    # Only available models are used
+    assert router.route(CODE_PROMPT, 0, ["qwen3:0.6b"])[0] == "qwen3:0.6b"
+
+
+def test_feedback_moves_boundary():
+    """Test that bad feedback escalates similar prompts and good feedback slowly relaxes."""
+    router = ModelRouter(MODELS)
+    prompt = "Explain recursion"
+    model, score = router.route(prompt, 0, MODELS)
+    assert model == "qwen3:0.6b"
+
+    boundary = router.status()["boundaries"][0]
+    router.feedback(model, score, good=True)
+    assert router.status()["boundaries"][0] > boundary
+    for _ in range(5):
+        router.feedback(model, score, good=False)
+    assert router.route(prompt, 0, MODELS)[0] == "gemma3:1b"
+    assert router.status()["boundaries"][0] >= lib.routing.ROUTING_BOUNDARY_MARGIN
+
+
+def test_slow_model_is_skipped(monkeypatch):
+    """Test that a model with a high measured TTFT hands its prompts down."""
+    stats = ModelStats()
+    stats.record("gemma3:1b", lib.routing.ROUTING_MAX_TTFT + 1, 10)
+    monkeypatch.setattr(lib.routing, "model_stats", stats)
+    assert ModelRouter(MODELS).route(CODE_PROMPT, 0, MODELS)[0] == "qwen3:0.6b"
+
+
+def test_sizes_loaded_separately(monkeypatch):
+    """Test that routing orders models by size without calling Ollama itself."""
+    calls = []
+
+    def get_ollama_models():
+        calls.append(1)
+        return [{"name": "gemma3:1b", "size": 800}, {"name": "qwen3:0.6b", "size": 500}]
+
+    monkeypatch.setattr(lib.routing, "get_ollama_models", get_ollama_models)
+    router = ModelRouter()
+    router.route("hi", 0, MODELS)
+    assert calls == []
+
+    router.load_sizes(MODELS)
+    router.load_sizes(MODELS)
+    assert calls == [1]
+    assert router.tiers(MODELS) == ["qwen3:0.6b", "gemma3:1b"]
+
+
+def test_auto_model_api(monkeypatch):
+    """Test that "auto" chat requests report the routed model and score."""
+    monkeypatch.setattr(lib.profiling, "ADMIN_TOKEN", "secret")
+    response = client.post(
+        "/chat",
+        json={
+            "session_id": str(uuid.uuid4()),
+            "content": "hi",
+            "model": "auto",
+            "name": "Routing User",
+        },
+    )
+    assert response.status_code == 200
+    assert response.headers["X-Model"] in MODELS
+    score = float(response.headers["X-Route-Score"])
+
+    feedback = {"model": response.headers["X-Model"], "score": score, "good": True}
+    assert client.post("/routing/feedback", json=feedback).status_code == 403
+    response = client.post("/routing/feedback", json=feedback, headers=HEADERS)
+    assert response.status_code == 200
+    assert set(response.json()["models"]) == set(MODELS)
+
+    response = client.post(
+        "/routing/feedback",
+        json={"model": "gemma3:1b", "score": 2, "good": True},
+        headers=HEADERS,
+    )
+    assert response.status_code == 422
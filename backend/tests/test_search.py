@@ -0,0 +1,50 @@
+from lib.database import get_db_connection, table_name
+from lib.search import search_messages_text, VectorIndex
+
+
+def test_text_search_seed_data():
+    """Test that full-text search finds seeded messages for their owner only."""
+    conn = get_db_connection()
+
+    results = search_messages_text(conn, table_name, "John Doe", "machine learning", 10)
+    assert len(results) > 0
+    assert all(
+        result.session_id == "123e4567-e89b-12d3-a456-426614174000"
+        for result in results
+    )
+    assert results[0].score >= results[-1].score
+    assert "<b>" in results[0].snippet
+
+    results = search_messages_text(
+        conn, table_name, "Jane Smith", "machine learning", 10
+    )
+    assert all(
+        result.session_id != "123e4567-e89b-12d3-a456-426614174000"
+        for result in results
+    )
+
+    conn.close()
+
+
+def test_text_search_no_match():
+    """Test that a query without matches returns no results."""
+    conn = get_db_connection()
+    results = search_messages_text(conn, table_name, "John Doe", "zzzxqvbnotaword", 10)
+    assert results == []
+    conn.close()
+
+
+def test_vector_index_query():
+    """Test that the vector index ranks by cosine similarity."""
+    conn = get_db_connection()
+    index = VectorIndex()
+
+    # Loads the (empty) index for an unknown user, then adds vectors in place
+    assert index.query(conn, table_name, "Vector Test User", [1.0, 0.0], 3) == []
+    index.add("Vector Test User", [1, 2, 3], [[1.0, 0.0], [0.0, 1.0], [0.7, 0.7]])
+
+    matches = index.query(conn, table_name, "Vector Test User", [1.0, 0.1], 2)
+    assert [match[0] for match in matches] == [1, 3]
+    assert matches[0][1] > matches[1][1]
+
+    conn.close()
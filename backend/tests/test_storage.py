@@ -0,0 +1,92 @@
+import uuid
+from langchain_core.messages import AIMessage, HumanMessage
+from langchain_postgres import PostgresChatMessageHistory
+
+import lib.storage
+from lib.database import (
+    create_session_if_not_exists,
+    get_chat_history,
+    get_db_connection,
+    table_name,
+)
+from lib.storage import (
+    compress_content,
+    decompress_content,
+    message_to_row,
+    migrate_message_rows,
+    rows_to_messages,
+)
+
+
+def test_message_row_roundtrip():
+    """Test that messages survive the compact columns, without empty fields."""
+    messages = [
+        HumanMessage(content="Hello", id="01ABC", name="John"),
+        AIMessage(
+            content="Hi!", id="01ABD", name="Assistant", additional_kwargs={"k": 1}
+        ),
+    ]
+    rows = [message_to_row(message) for message in messages]
+    assert rows[0][0] == "human"
+    assert rows[0][5] is None  # no non-empty extra fields
+    assert rows[1][5].obj == {"additional_kwargs": {"k": 1}}
+
+    restored = rows_to_messages([row[:5] + (row[5] and row[5].obj,) for row in rows])
+    assert restored == messages
+
+
+def test_zstd_compression(monkeypatch):
+    """Test that large content is compressed only above the threshold."""
+    monkeypatch.setattr(lib.storage, "MESSAGE_ZSTD_THRESHOLD", 100)
+    assert compress_content("short") == ("short", None)
+
+    content = "compress me " * 100
+    stored, compressed = compress_content(content)
+    assert stored is None
+    assert len(compressed) < len(content)
+    assert decompress_content(stored, compressed) == content
+
+
+def test_legacy_rows_are_normalized():
+    """Test that rows written in the LangChain format are stored compactly."""
+    conn = get_db_connection()
+    test_id = str(uuid.uuid4())
+    create_session_if_not_exists(conn, test_id, "Test User", "Test Session")
+
+    PostgresChatMessageHistory(table_name, test_id, sync_connection=conn).add_messages(
+        [
+            HumanMessage(content="legacy question", id="01LEGACY"),
+            AIMessage(content="legacy answer"),
+        ]
+    )
+    # Rows left over from before the trigger existed
+    with conn.cursor() as cur:
+        cur.execute(
+            f"ALTER TABLE {table_name} DISABLE TRIGGER {table_name}_normalize_message"
+        )
+        cur.execute(
+            f"""
+            INSERT INTO {table_name} (session_id, message)
+            VALUES (%s, '{{"type": "human", "data": {{"content": "old", "tool_calls": []}}}}')
+            """,
+            (test_id,),
+        )
+        cur.execute(
+            f"ALTER TABLE {table_name} ENABLE TRIGGER {table_name}_normalize_message"
+        )
+        conn.commit()
+    assert migrate_message_rows(conn, table_name) >= 1
+
+    with conn.cursor() as cur:
+        cur.execute(
+            f"SELECT role, content, message_id, message, extra FROM {table_name} WHERE session_id = %s ORDER BY id",
+            (test_id,),
+        )
+        rows = cur.fetchall()
+    assert rows[0] == ("human", "legacy question", "01LEGACY", None, None)
+    assert rows[2] == ("human", "old", None, None, None)
+
+    messages = get_chat_history(conn, test_id).messages
+    assert [m.content for m in messages] == ["legacy question", "legacy answer", "old"]
+    assert messages[0].id == "01LEGACY"
+    conn.close()
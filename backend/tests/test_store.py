@@ -0,0 +1,276 @@
+"""
+Conformance tests run against every storage backend. The SQLite runs need no
+database server; the Postgres runs are skipped when it is not reachable.
+"""
+
+import uuid
+
+import psycopg
+import pytest
+from fastapi.testclient import TestClient
+from langchain_core.messages import AIMessage, HumanMessage
+
+import lib.profiling
+import lib.storage
+import lib.store
+from lib.archive import archive_session
+from lib.database import RoundTripCounter, get_db_connection
+from lib.store import BranchesNotSupported, PostgresStore, SqliteStore, to_fts_query
+from lib.utils import generate_message_id
+
+
+@pytest.fixture(params=["postgres", "sqlite"])
+def store(request, tmp_path):
+    if request.param == "sqlite":
+        store = SqliteStore(str(tmp_path / "test.db"))
+        yield store
+        store.close()
+        return
+    try:
+        conn = get_db_connection()
+    except psycopg.OperationalError:
+        pytest.skip("Postgres is not reachable")
+    yield PostgresStore(lambda: conn)
+    conn.close()
+
+
+def new_user() -> str:
+    return f"Store User {uuid.uuid4().hex[:8]}"
+
+
+def test_sessions(store):
+    """Test that sessions are created once, read back and renamed."""
+    session_id = str(uuid.uuid4())
+    username = new_user()
+    assert store.get_session(session_id) is None
+
+    store.create_session(session_id, username, "First title")
+    store.create_session(session_id, "Someone Else", "Second title")
+    session = store.get_session(session_id)
+    assert (session.id, session.username, session.title) == (
+        session_id,
+        username,
+        "First title",
+    )
+
+    version = store.get_sessions_version(username)
+    store.update_session_title(session_id, "New title")
+    assert store.get_session(session_id).title == "New title"
+    assert store.get_sessions_version(username) != version
+
+
+def test_sessions_pagination(store):
+    """Test that pages cover every session once, newest first."""
+    username = new_user()
+    version = store.get_sessions_version(username)
+    created = [str(uuid.uuid4()) for _ in range(5)]
+    for session_id in created:
+        store.create_session(session_id, username, "Session")
+    assert store.get_sessions_version(username) != version
+
+    seen, after = [], None
+    while True:
+        sessions, after = store.get_sessions_page(username, 2, after)
+        seen.extend(session.id for session in sessions)
+        if after is None:
+            break
+    assert seen == created[::-1]
+
+
+def test_messages(store, monkeypatch):
+    """Test that messages round-trip with their IDs, names and extra fields."""
+    monkeypatch.setattr(lib.storage, "MESSAGE_ZSTD_THRESHOLD", 100)
+    session_id = str(uuid.uuid4())
+    store.create_session(session_id, new_user(), "Session")
+    messages = [
+        HumanMessage(content="Hello", id=generate_message_id(), name="John"),
+        AIMessage(content="Hi! " * 50, id=generate_message_id(), name="Assistant"),
+        AIMessage(content="Done", id=generate_message_id(), additional_kwargs={"k": 1}),
+    ]
+    store.add_messages(session_id, messages[:2])
+    store.add_messages(session_id, messages[2:])
+
+    assert store.get_messages(session_id) == messages
+    history, unsummarized = store.get_prompt_history(session_id)
+    assert history == messages
+    assert unsummarized == 3
+
+    records = store.get_message_records(session_id)
+    assert [record.role for record in records] == ["human", "ai", "ai"]
+    assert [record.content for record in records] == [m.content for m in messages]
+    assert records[0].message_id == messages[0].id
+    assert store.get_messages(str(uuid.uuid4())) == []
+
+
+def test_bootstrap_session(store):
+    """Test that the bootstrap returns the session and its prompt history."""
+    session_id = str(uuid.uuid4())
+    username = new_user()
+    assert store.bootstrap_session(session_id) == (None, [], 0)
+
+    session = store.create_session(session_id, username, "Title")
+    assert session.title == "Title"
+    assert (
+        store.create_session(session_id, "Someone Else", "Other").username == username
+    )
+    assert store.bootstrap_session(session_id) == (session, [], 0)
+
+    messages = [
+        HumanMessage(content="Hello", id=generate_message_id(), name=username),
+        AIMessage(content="Hi!", id=generate_message_id(), name="Assistant"),
+    ]
+    store.add_messages(session_id, messages)
+    assert store.bootstrap_session(session_id) == (session, messages, 2)
+
+
+def chat_turn(store: PostgresStore, session_id: str, username: str) -> list[int]:
+    """Runs the storage steps of a first and a second turn, counting round trips."""
+    steps = [
+        lambda: store.bootstrap_session(session_id),
+        lambda: store.create_session(session_id, username, "Title"),
+        lambda: store.add_messages(
+            session_id,
+            [
+                HumanMessage(content="Hello", id=generate_message_id(), name=username),
+                AIMessage(content="Hi!", id=generate_message_id(), name="Assistant"),
+            ],
+        ),
+        lambda: store.bootstrap_session(session_id),
+    ]
+    counts = []
+    for step in steps:
+        with RoundTripCounter(store.get_connection()) as counter:
+            step()
+        counts.append(counter.count)
+    return counts
+
+
+def test_bootstrap_round_trips():
+    """Test that each storage step of a chat turn is one round trip on Postgres."""
+    try:
+        conn = get_db_connection()
+    except psycopg.OperationalError:
+        pytest.skip("Postgres is not reachable")
+    conn.autocommit = True
+    store = PostgresStore(lambda: conn)
+    username = new_user()
+
+    # The first turn also prepares the statements
+    chat_turn(store, str(uuid.uuid4()), username)
+    session_id = str(uuid.uuid4())
+    assert chat_turn(store, session_id, username) == [1, 1, 1, 1]
+
+    # An archived session is rehydrated on the way
+    session, history, _ = store.bootstrap_session(session_id)
+    archive_session(conn, session_id)
+    assert store.bootstrap_session(session_id) == (session, history, 2)
+    conn.close()
+
+
+def test_search(store):
+    """Test that text search finds the user's matching messages only."""
+    username = new_user()
+    session_id = str(uuid.uuid4())
+    store.create_session(session_id, username, "Physics")
+    store.add_messages(
+        session_id,
+        [
+            HumanMessage(
+                content="Explain quantum entanglement simply", id=generate_message_id()
+            ),
+            AIMessage(
+                content="Quantum particles can share a state", id=generate_message_id()
+            ),
+            HumanMessage(
+                content="What about classical physics?", id=generate_message_id()
+            ),
+        ],
+    )
+    other_session_id = str(uuid.uuid4())
+    store.create_session(other_session_id, new_user(), "Other")
+    store.add_messages(
+        other_session_id,
+        [HumanMessage(content="quantum computing", id=generate_message_id())],
+    )
+
+    results = store.search_messages(username, "quantum", 10)
+    assert len(results) == 2
+    assert all(result.session_id == session_id for result in results)
+    assert all(result.session_title == "Physics" for result in results)
+    assert "<b>" in results[0].snippet
+
+    assert len(store.search_messages(username, "quantum -entanglement", 10)) == 1
+    assert len(store.search_messages(username, "entanglement or classical", 10)) == 2
+    assert store.search_messages(username, "nonexistentword", 10) == []
+
+
+def test_fts_query():
+    """Test the conversion of web-style queries to FTS5."""
+    assert to_fts_query('python "list comprehension" -java') == (
+        '"python" "list comprehension" NOT "java"'
+    )
+    assert to_fts_query("a or b") == '"a" OR "b"'
+    assert to_fts_query("-only") is None
+
+
+def test_branches_unsupported(tmp_path):
+    """Test that a store without branches rejects them with a domain error."""
+    store = SqliteStore(str(tmp_path / "branches.db"))
+    session_id = str(uuid.uuid4())
+    store.create_session(session_id, new_user(), "Session")
+    assert not store.supports_branches and PostgresStore.supports_branches
+    with pytest.raises(BranchesNotSupported):
+        store.add_messages(session_id, [HumanMessage(content="Hello")], parent_id=1)
+    with pytest.raises(BranchesNotSupported):
+        store.bootstrap_session(session_id, until=1)
+    with pytest.raises(BranchesNotSupported):
+        store.get_branch_leaves(session_id)
+    store.close()
+
+
+def test_api_on_sqlite(tmp_path, monkeypatch):
+    """Test that the session routes read from the configured store."""
+    import main
+    from main import app
+
+    store = SqliteStore(str(tmp_path / "api.db"))
+    monkeypatch.setattr(lib.store, "_store", store)
+    session_id = str(uuid.uuid4())
+    username = new_user()
+    store.create_session(session_id, username, "SQLite session")
+    store.add_messages(
+        session_id,
+        [
+            HumanMessage(
+                content="stored in sqlite", id=generate_message_id(), name=username
+            )
+        ],
+    )
+
+    client = TestClient(app)
+    response = client.get(f"/sessions?name={username}")
+    assert [session["id"] for session in response.json()] == [session_id]
+    response = client.get(f"/session?session_id={session_id}")
+    assert response.json()["messages"][0]["content"] == "stored in sqlite"
+    response = client.get(f"/search?name={username}&q=sqlite")
+    assert response.json()[0]["session_id"] == session_id
+    monkeypatch.setattr(main, "STORAGE_BACKEND", "sqlite")
+    assert client.get("/archive").status_code == 501
+    monkeypatch.setattr(lib.profiling, "ADMIN_TOKEN", "secret")
+    response = client.post(
+        "/batch", content='{"content": "Hi"}', headers={"X-Admin-Token": "secret"}
+    )
+    assert response.status_code == 501
+    response = client.get("/export", headers={"X-Admin-Token": "secret"})
+    assert response.status_code == 501
+    response = client.post("/import", content="", headers={"X-Admin-Token": "secret"})
+    assert response.status_code == 501
+
+    response = client.get(f"/session/branches?session_id={session_id}")
+    assert response.status_code == 400
+    # A route that misses the check still answers 400
+    monkeypatch.setattr(main, "require_branches", lambda: None)
+    response = client.get(f"/session/branches?session_id={session_id}")
+    assert response.status_code == 400
+    assert response.json()["detail"] == "Branches need the Postgres backend"
+    store.close()
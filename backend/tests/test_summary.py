@@ -0,0 +1,73 @@
+import uuid
+from langchain_core.messages import HumanMessage, AIMessage
+from langchain_postgres import PostgresChatMessageHistory
+
+from lib.database import get_db_connection, create_session_if_not_exists, table_name
+from lib.summary import (
+    SUMMARY_KEEP_RECENT,
+    build_summary_message,
+    get_prompt_history,
+    should_summarize,
+)
+
+
+def test_should_summarize():
+    """Test the summarization threshold."""
+    assert should_summarize(0) is False
+    assert should_summarize(1000) is True
+
+
+def test_build_summary_message():
+    """Test that a summary is wrapped in a single system message."""
+    assert build_summary_message(None) == []
+    messages = build_summary_message("The user is learning Rust.")
+    assert len(messages) == 1
+    assert "The user is learning Rust." in messages[0].content
+
+
+def test_prompt_history_uses_summary():
+    """Test that summarized messages are replaced by the summary in the prompt."""
+    conn = get_db_connection()
+    test_id = str(uuid.uuid4())
+    create_session_if_not_exists(conn, test_id, "Test User", "Test Session")
+
+    history = PostgresChatMessageHistory(table_name, test_id, sync_connection=conn)
+    history.add_messages(
+        [
+            HumanMessage(content=f"message {i}")
+            if i % 2 == 0
+            else AIMessage(content=f"reply {i}")
+            for i in range(10)
+        ]
+    )
+
+    # Without a summary, the whole history is sent
+    messages, unsummarized = get_prompt_history(conn, table_name, test_id)
+    assert len(messages) == 10
+    assert unsummarized == 10
+
+    with conn.cursor() as cur:
+        cur.execute(
+            f"SELECT id FROM {table_name} WHERE session_id = %s ORDER BY id",
+            (test_id,),
+        )
+        ids = [row[0] for row in cur.fetchall()]
+        cur.execute(
+            "INSERT INTO db_session_summaries (session_id, summary, summarized_until) VALUES (%s, %s, %s)",
+            (test_id, "The user counted messages.", ids[10 - SUMMARY_KEEP_RECENT - 1]),
+        )
+        conn.commit()
+
+    messages, unsummarized = get_prompt_history(conn, table_name, test_id)
+    assert unsummarized == SUMMARY_KEEP_RECENT
+    assert messages[0].type == "system"
+    assert "The user counted messages." in messages[0].content
+    assert messages[-1].content == "reply 9"
+
+    # Clean up
+    with conn.cursor() as cur:
+        cur.execute("DELETE FROM db_sessions WHERE id = %s", (test_id,))
+        cur.execute(f"DELETE FROM {table_name} WHERE session_id = %s", (test_id,))
+        conn.commit()
+
+    conn.close()
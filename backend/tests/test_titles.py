@@ -0,0 +1,63 @@
+import uuid
+from langchain_core.messages import HumanMessage, AIMessage
+from langchain_postgres import PostgresChatMessageHistory
+
+from lib.database import (
+    create_session_if_not_exists,
+    get_db_connection,
+    get_session_by_id,
+    table_name,
+    update_session_title,
+)
+from lib.titles import TitleWorker, heuristic_title, title_from_answer
+
+
+def test_heuristic_title_keywords():
+    """Test that the heuristic title keeps keywords and drops filler words."""
+    title = heuristic_title("Can you help me write a Python script to rename files?")
+    assert title.startswith("💻 ")
+    assert "Python" in title
+    assert "Script" in title
+    assert "Can" not in title.split()
+    assert len(title.split()) <= 7
+
+
+def test_heuristic_title_format():
+    """Test that heuristic titles follow the LLM title format."""
+    for message in ["hi", "???", "", "I need advice on choosing a career path"]:
+        title = heuristic_title(message)
+        assert title[1] == " " or title[2] == " ", (
+            "There should be a space after the emoji"
+        )
+        assert len(title) <= 100
+        assert not any(char in title for char in ['"', "`"])
+
+
+def test_title_from_answer():
+    """Test that a short question borrows keywords from the answer."""
+    title = title_from_answer(
+        "What is it?",
+        "<think>hmm</think>Photosynthesis converts sunlight into chemical energy.\nMore details follow.",
+    )
+    assert "Photosynthesis" in title
+    assert "hmm" not in title
+    assert "Details" not in title
+
+
+def test_title_worker_refines_title():
+    """Test that the title worker replaces a provisional title."""
+    conn = get_db_connection()
+    test_id = str(uuid.uuid4())
+    create_session_if_not_exists(conn, test_id, "Test User", "💬 Provisional")
+    PostgresChatMessageHistory(table_name, test_id, sync_connection=conn).add_messages(
+        [HumanMessage(content="Explain black holes"), AIMessage(content="Sure.")]
+    )
+
+    TitleWorker().process(conn, [test_id])
+    session = get_session_by_id(conn, test_id)
+    assert session.title != "💬 Provisional"
+    assert len(session.title) > 0
+
+    update_session_title(conn, test_id, "📚 Black Holes")
+    assert get_session_by_id(conn, test_id).title == "📚 Black Holes"
+    conn.close()
@@ -0,0 +1,166 @@
+import json
+import uuid
+from datetime import datetime
+
+import pytest
+from langchain_core.messages import AIMessage, HumanMessage
+
+import lib.storage
+from lib.archive import archive_session, read_archived_messages
+from lib.database import (
+    create_session_if_not_exists,
+    get_chat_history,
+    get_db_connection,
+)
+from lib.store import PostgresStore
+from lib.transfer import export_sessions, import_lines
+from lib.utils import generate_message_id
+
+SEED_SESSION_ID = "123e4567-e89b-12d3-a456-426614174000"
+
+
+def export_as(conn, session_id: str) -> list[str]:
+    """Exports the seed session under another session ID and user."""
+    return [
+        line.replace(SEED_SESSION_ID, session_id).replace('"John Doe"', '"Import User"')
+        for line in export_sessions(conn, "John Doe")
+        if SEED_SESSION_ID in line
+    ]
+
+
+def test_export_format():
+    """Test that a session line is followed by its messages in order."""
+    conn = get_db_connection()
+    records = [json.loads(line) for line in export_sessions(conn, "Jane Smith")]
+    assert records[0]["type"] == "session"
+    assert records[0]["username"] == "Jane Smith"
+    assert all(record["type"] == "message" for record in records[1:])
+    assert all(record["session_id"] == records[0]["id"] for record in records[1:])
+
+    assert list(export_sessions(conn, since=datetime(2099, 1, 1))) == []
+    conn.close()
+
+
+def test_import_is_idempotent(monkeypatch):
+    """Test that importing the same export twice inserts its messages once."""
+    monkeypatch.setattr(lib.storage, "MESSAGE_ZSTD_THRESHOLD", 16)
+    conn = get_db_connection()
+    session_id = str(uuid.uuid4())
+    lines = export_as(conn, session_id)
+
+    assert import_lines(conn, lines, batch_size=2) == {
+        "sessions": 1,
+        "messages": 2,
+        "skipped": 0,
+    }
+    assert import_lines(conn, lines) == {"sessions": 0, "messages": 0, "skipped": 2}
+
+    messages = get_chat_history(conn, session_id).messages
+    assert [message.content for message in messages] == [
+        json.loads(line)["content"] for line in lines[1:]
+    ]
+    assert messages[0].id == json.loads(lines[1])["message_id"]
+    conn.close()
+
+
+def test_export_archived_session():
+    """Test that archived sessions are exported without being rehydrated."""
+    conn = get_db_connection()
+    session_id = str(uuid.uuid4())
+    create_session_if_not_exists(conn, session_id, "Archived User", "Archived Session")
+    get_chat_history(conn, session_id).add_messages(
+        [
+            HumanMessage(
+                content="cold question", id=generate_message_id(), name="Archived User"
+            ),
+            AIMessage(
+                content="cold answer", id=generate_message_id(), name="Assistant"
+            ),
+        ]
+    )
+    archive_session(conn, session_id)
+
+    lines = list(export_sessions(conn, "Archived User"))
+    assert [json.loads(line).get("content") for line in lines[1:]] == [
+        "cold question",
+        "cold answer",
+    ]
+    assert get_chat_history(conn, session_id).messages == []
+
+    # Importing into an archived session rehydrates it first
+    assert import_lines(conn, lines)["messages"] == 0
+    assert len(get_chat_history(conn, session_id).messages) == 2
+    conn.close()
+
+
+def test_export_branches_round_trip():
+    """Test that edited sessions and forks import as the messages they show."""
+    conn = get_db_connection()
+    conn.autocommit = True
+    store = PostgresStore(lambda: conn)
+    username = f"Branch Export {uuid.uuid4()}"
+    session_id, fork_id = str(uuid.uuid4()), str(uuid.uuid4())
+    store.create_session(session_id, username, "Branches")
+    messages = [
+        HumanMessage(content=f"message {i}", id=generate_message_id())
+        if i % 2 == 0
+        else AIMessage(content=f"reply {i}", id=generate_message_id())
+        for i in range(4)
+    ]
+    store.add_messages(session_id, messages)
+    parent_id = store.find_branch_message(session_id, messages[2].id)[1]
+    edit = HumanMessage(content="message 2, edited", id=generate_message_id())
+    store.add_messages(session_id, [edit], parent_id)
+    # Regenerated answers are new children of the question
+    question_id = store.find_branch_message(session_id, edit.id)[0]
+    for content in ("first answer", "regenerated answer"):
+        store.add_messages(
+            session_id,
+            [AIMessage(content=content, id=generate_message_id())],
+            question_id,
+        )
+    store.fork_session(session_id, messages[1].id, fork_id)
+    store.add_messages(
+        fork_id, [HumanMessage(content="in the fork", id=generate_message_id())]
+    )
+    expected = {
+        sid: [(m.type, m.id, m.content) for m in store.get_messages(sid)]
+        for sid in (session_id, fork_id)
+    }
+    assert [content for _, _, content in expected[session_id]] == [
+        "message 0",
+        "reply 1",
+        "message 2, edited",
+        "regenerated answer",
+    ]
+    # A fork shares the source's messages even once archived
+    archive_session(conn, fork_id)
+
+    imported_ids = {session_id: str(uuid.uuid4()), fork_id: str(uuid.uuid4())}
+    lines = []
+    # Exports need a connection outside autocommit
+    export_conn = get_db_connection()
+    for line in export_sessions(export_conn, username):
+        for old_id, new_id in imported_ids.items():
+            line = line.replace(old_id, new_id)
+        lines.append(line)
+    export_conn.close()
+    assert read_archived_messages(conn, fork_id) is not None
+
+    assert import_lines(conn, lines)["sessions"] == 2
+    for old_id, new_id in imported_ids.items():
+        imported = [(m.type, m.id, m.content) for m in store.get_messages(new_id)]
+        assert imported == expected[old_id]
+    conn.close()
+
+
+def test_import_invalid_lines():
+    """Test that invalid records are reported with their line number."""
+    conn = get_db_connection()
+    with pytest.raises(ValueError, match="line 2"):
+        import_lines(conn, ["", '{"type": "unknown"}'])
+    with pytest.raises(ValueError, match="Invalid session ID on line 1"):
+        import_lines(
+            conn, ['{"type": "session", "id": "x", "username": "u", "title": "t"}']
+        )
+    conn.close()
@@ -1,4 +1,5 @@
-from lib.utils import is_session_id_valid
+from datetime import datetime, timezone
+from lib.utils import is_session_id_valid, encode_cursor, decode_cursor, make_etag
 
 
 def test_valid_uuid():
@@ -40,3 +41,32 @@ def test_uuid_without_hyphens():
     """Test that UUIDs without hyphens are rejected."""
     uuid_str = "123e4567e89b12d3a456426614174000"
     assert is_session_id_valid(uuid_str) is False
+
+
+def test_cursor_round_trip():
+    """Test that a pagination cursor decodes to what was encoded."""
+    created_at = datetime(2025, 6, 1, 12, 30, 45, 123456, tzinfo=timezone.utc)
+    session_id = "123e4567-e89b-12d3-a456-426614174000"
+
+    cursor = encode_cursor(created_at, session_id)
+    assert decode_cursor(cursor) == (created_at, session_id)
+
+
+def test_invalid_cursor():
+    """Test that malformed cursors are rejected."""
+    invalid_cursors = [
+        "",
+        "not-a-cursor",
+        encode_cursor(datetime.now(), "not-a-uuid"),
+    ]
+
+    for cursor in invalid_cursors:
+        assert decode_cursor(cursor) is None
+
+
+def test_make_etag():
+    """Test that ETags are weak, stable and change with their inputs."""
+    etag = make_etag("John Doe", "3:2025-06-01T12:30:45")
+    assert etag.startswith('W/"')
+    assert etag == make_etag("John Doe", "3:2025-06-01T12:30:45")
+    assert etag != make_etag("John Doe", "4:2025-06-01T12:31:00")
@@ -5,6 +5,8 @@ CREATE TABLE IF NOT EXISTS db_sessions (
     created_at TIMESTAMPTZ DEFAULT CURRENT_TIMESTAMP
 );
 
+CREATE INDEX IF NOT EXISTS db_sessions_username_created_at_idx ON db_sessions (username, created_at DESC, id DESC);
+
 INSERT INTO db_sessions (id, username, title) VALUES ('123e4567-e89b-12d3-a456-426614174000', 'John Doe', '🤖 Exploring AI and Machine Learning');
 INSERT INTO db_sessions (id, username, title) VALUES ('123e4567-e89b-12d3-a456-426614174001', 'Jane Smith', '🌐 Web Development Best Practices');
 INSERT INTO db_sessions (id, username, title) VALUES ('123e4567-e89b-12d3-a456-426614174002', 'Alice Johnson', '☁️ Cloud Architecture Discussion');
@@ -12,7 +12,7 @@ export const getSessions = createServerFn({
   }
 }).handler(async ({ data }) => {
   try {
-    const url = `${process.env.BACKEND_BASE_URL}/sessions?name=${data.name}`
+    const url = `${process.env.BACKEND_BASE_URL}/sessions?name=${data.name}&limit=10`
   
     const response: AxiosResponse<SessionData[]> = await axios.get(url)
 